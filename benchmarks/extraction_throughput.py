@@ -0,0 +1,82 @@
+"""
+Throughput benchmark of the local text extraction stage.
+
+Extracts every PDF of a local corpus serially and then on TextExtractor process pools of increasing size,
+and reports documents, pages and megabytes processed per second.
+
+Usage:
+    python benchmarks/extraction_throughput.py --corpus ./corpus --workers 1 2 4 8
+    python benchmarks/extraction_throughput.py --generate 40 --pages 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+import pymupdf  # noqa: E402
+
+from src.TextExtraction import TextExtractor, extract_to_file, is_extractable  # noqa: E402
+
+
+def generate_corpus(directory: str, documents: int, pages: int) -> None:
+    """
+    Writes synthetic text heavy PDFs, for machines without a real corpus.
+    """
+    paragraph = ("Employees are entitled to annual leave in accordance with the policy described in this "
+                 "section. Requests must be submitted through the HR portal at least two weeks in advance. ") * 12
+    for i in range(documents):
+        with pymupdf.open() as doc:
+            for p in range(pages):
+                page = doc.new_page()
+                page.insert_textbox(pymupdf.Rect(40, 40, 560, 800), f"Document {i} page {p}\n{paragraph}",
+                                    fontsize=9)
+            doc.save(os.path.join(directory, f"doc-{i:04d}.pdf"))
+
+
+def report(label: str, results: list, elapsed: float, total_bytes: int) -> None:
+    pages = sum(r.Pages for r in results)
+    print(f"{label:>12}: {len(results)} docs, {pages} pages in {elapsed:.2f}s -> "
+          f"{len(results) / elapsed:.1f} docs/s, {pages / elapsed:.1f} pages/s, "
+          f"{total_bytes / 1024 ** 2 / elapsed:.1f} MB/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="directory with the documents to extract")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--generate", type=int, default=0, help="generate N synthetic PDFs instead of --corpus")
+    parser.add_argument("--pages", type=int, default=30, help="pages per generated PDF")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus = args.corpus
+        if args.generate:
+            corpus = tmp_dir
+            generate_corpus(corpus, args.generate, args.pages)
+        if not corpus:
+            parser.error("either --corpus or --generate is required")
+
+        files = [str(p) for p in sorted(Path(corpus).rglob("*")) if p.is_file() and is_extractable(p.name)]
+        total_bytes = sum(os.path.getsize(f) for f in files)
+        print(f"corpus: {len(files)} documents, {total_bytes / 1024 ** 2:.1f} MB, {os.cpu_count()} cores")
+
+        start = time.perf_counter()
+        results = [extract_to_file(f, os.path.join(tmp_dir, f"serial-{i}.jsonl")) for i, f in enumerate(files)]
+        report("serial", results, time.perf_counter() - start, total_bytes)
+
+        for workers in sorted(set(args.workers)):
+            extractor = TextExtractor(max_workers=workers)
+            # warm up the pool so process start-up is not measured
+            list(extractor.map(files[:workers], output_dir=tmp_dir))
+            start = time.perf_counter()
+            results = list(extractor.map(files, output_dir=tmp_dir))
+            report(f"{workers} workers", results, time.perf_counter() - start, total_bytes)
+            extractor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+"""
+Local stand-ins for Microsoft Graph, Azure AI Search and Azure Blob Storage used by the offline benchmarks.
+
+Each fake is a small ASGI app speaking the subset of the REST API the backend calls, with injected latency
+and throttling. Run one by hand from the benchmarks directory, e.g. `python -m fakes.graph --port 9001`.
+"""
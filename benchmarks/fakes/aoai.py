@@ -0,0 +1,121 @@
+"""
+Fake Azure OpenAI service: the embeddings and the chat completions of a deployment, addressed like
+http://127.0.0.1:<port>/openai/deployments/<deployment>/embeddings?api-version=...
+http://127.0.0.1:<port>/openai/deployments/<deployment>/chat/completions?api-version=...
+
+Embeddings are pseudo random unit vectors seeded by the input text, so equal texts get equal vectors. Both the
+float and the base64 encoding formats are supported. GET /_fake/embedding-stats returns the number of embeddings
+requests and of inputs received, to measure batching.
+
+Chat completions answer with --completion-tokens words taken from the last message, after --first-token-ms, one
+word every --token-ms; with "stream": true they are sent as server-sent events chunks like Azure OpenAI, after a
+first chunk with the prompt filter results and no choice.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import random
+import re
+import struct
+import zlib
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from .common import serve
+
+EMBEDDINGS_PATH = re.compile(r"^/openai/deployments/([^/]+)/embeddings$")
+CHAT_PATH = re.compile(r"^/openai/deployments/([^/]+)/chat/completions$")
+
+
+def embedding(text: str, dimensions: int) -> list[float]:
+    rnd = random.Random(zlib.crc32(text.encode()))
+    vector = [rnd.gauss(0, 1) for _ in range(dimensions)]
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector]
+
+
+def create_app(args: argparse.Namespace) -> Starlette:
+    stats = {"requests": 0, "inputs": 0}
+
+    async def route(request: Request):
+        if CHAT_PATH.match(request.scope["path"]):
+            return await chat_completions(request)
+        if EMBEDDINGS_PATH.match(request.scope["path"]):
+            return await embeddings(request)
+        return JSONResponse({"error": {"code": "404", "message": "Resource not found"}}, status_code=404)
+
+    async def chat_completions(request: Request):
+        model = CHAT_PATH.match(request.scope["path"]).group(1)
+        body = await request.json()
+        words = body["messages"][-1]["content"].split() or ["answer"]
+        tokens = [("" if i == 0 else " ") + words[i % len(words)] for i in range(args.completion_tokens)]
+        usage = {"prompt_tokens": sum(len(m["content"].split()) for m in body["messages"]),
+                 "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        created = 1700000000
+
+        if not body.get("stream"):
+            await asyncio.sleep((args.first_token_ms + args.token_ms * len(tokens)) / 1000)
+            return JSONResponse({"id": "chatcmpl-fake", "object": "chat.completion", "created": created,
+                                 "model": model, "usage": usage,
+                                 "choices": [{"index": 0, "finish_reason": "stop",
+                                              "message": {"role": "assistant", "content": "".join(tokens)}}]})
+
+        def chunk(delta: dict, finish_reason: str | None = None) -> str:
+            return "data: " + json.dumps({"id": "chatcmpl-fake", "object": "chat.completion.chunk",
+                                          "created": created, "model": model,
+                                          "choices": [{"index": 0, "delta": delta,
+                                                       "finish_reason": finish_reason}]}) + "\n\n"
+
+        async def events():
+            yield "data: " + json.dumps({"id": "", "object": "", "created": 0, "model": "", "choices": [],
+                                         "prompt_filter_results": [{"prompt_index": 0,
+                                                                    "content_filter_results": {}}]}) + "\n\n"
+            await asyncio.sleep(args.first_token_ms / 1000)
+            yield chunk({"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(args.token_ms / 1000)
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def embeddings(request: Request) -> JSONResponse:
+        match = EMBEDDINGS_PATH.match(request.scope["path"])
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        stats["requests"] += 1
+        stats["inputs"] += len(inputs)
+        data = []
+        for i, text in enumerate(inputs):
+            vector = embedding(text, args.dimensions)
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode()
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        tokens = sum(len(text.split()) for text in inputs)
+        return JSONResponse({"object": "list", "data": data, "model": match.group(1),
+                             "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    async def embedding_stats(request: Request) -> JSONResponse:
+        return JSONResponse(stats)
+
+    return Starlette(routes=[Route("/_fake/embedding-stats", embedding_stats, methods=["GET"]),
+                             Route("/{path:path}", route, methods=["POST"])])
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--dimensions", type=int, default=1536, help="size of the embeddings")
+    parser.add_argument("--completion-tokens", type=int, default=50, help="tokens of every chat completion")
+    parser.add_argument("--first-token-ms", type=float, default=200, help="delay before the first completion token")
+    parser.add_argument("--token-ms", type=float, default=10, help="delay between two completion tokens")
+
+
+if __name__ == '__main__':
+    serve("Azure OpenAI", create_app, add_arguments)
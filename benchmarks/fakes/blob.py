@@ -0,0 +1,222 @@
+"""
+Fake Azure Blob Storage, addressed like Azurite: http://127.0.0.1:<port>/<account>/<container>/<blob>.
+
+Supports the operations of the storage handlers: container create / properties, put blob, put block /
+block list, blob properties, set metadata, list blobs and Blob Batch delete. Request signatures are not checked,
+so the Azurite connection string below works as is, and the backend can be pointed at a real Azurite instead by
+changing the BlobEndpoint.
+"""
+import argparse
+import base64
+import hashlib
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from urllib.parse import unquote
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+from .common import serve
+
+ACCOUNT_NAME = "devstoreaccount1"
+ACCOUNT_KEY = "Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=="
+
+
+def connection_string(port: int, host: str = "127.0.0.1") -> str:
+    return (f"DefaultEndpointsProtocol=http;AccountName={ACCOUNT_NAME};AccountKey={ACCOUNT_KEY};"
+            f"BlobEndpoint=http://{host}:{port}/{ACCOUNT_NAME};")
+
+
+def _now() -> str:
+    return format_datetime(datetime.now(timezone.utc), usegmt=True)
+
+
+def _headers(etag: str = None, last_modified: str = None, **extra) -> dict:
+    headers = {"x-ms-request-id": str(uuid.uuid4()), "x-ms-version": "2023-11-03", "Date": _now()}
+    if etag:
+        headers["ETag"] = etag
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+    headers.update({k.replace("_", "-"): v for k, v in extra.items()})
+    return headers
+
+
+def error(status: int, code: str, message: str) -> Response:
+    body = f'<?xml version="1.0" encoding="utf-8"?><Error><Code>{code}</Code><Message>{message}</Message></Error>'
+    return Response(body, status_code=status, media_type="application/xml",
+                    headers=_headers(**{"x-ms-error-code": code}))
+
+
+class BlobStore:
+    """
+    The containers and blobs of the fake account.
+    """
+
+    def __init__(self, keep_content: bool) -> None:
+        self.keep_content = keep_content
+        self.containers: dict[str, dict[str, dict]] = {}
+        self.blocks: dict[tuple[str, str], dict[str, bytes]] = {}
+
+    def put(self, container: str, name: str, content: bytes, size: int = None, metadata: dict = None) -> dict:
+        blob = {
+            "content": content if self.keep_content else b"",
+            "size": len(content) if size is None else size,
+            "etag": f'"0x{uuid.uuid4().hex[:16].upper()}"',
+            "last_modified": _now(),
+            "content_md5": base64.b64encode(hashlib.md5(content).digest()).decode(),
+            "metadata": metadata or {},
+        }
+        self.containers[container][name] = blob
+        return blob
+
+
+def create_app(args: argparse.Namespace) -> Starlette:
+    store = BlobStore(keep_content=args.keep_content)
+
+    async def container_operation(request: Request, container: str) -> Response:
+        params = request.query_params
+        comp = params.get("comp")
+        if request.method == "PUT" and comp is None:
+            if container in store.containers:
+                return error(409, "ContainerAlreadyExists", "The specified container already exists.")
+            store.containers[container] = {}
+            return Response(status_code=201, headers=_headers(etag='"0x1"', last_modified=_now()))
+        if container not in store.containers:
+            return error(404, "ContainerNotFound", "The specified container does not exist.")
+        if request.method in ("GET", "HEAD") and comp is None:
+            return Response(status_code=200, headers=_headers(etag='"0x1"', last_modified=_now()))
+        if request.method == "DELETE":
+            del store.containers[container]
+            return Response(status_code=202, headers=_headers())
+        if comp == "list":
+            return list_blobs(request, container)
+        if comp == "batch":
+            return await batch(request, container)
+        return error(400, "UnsupportedQueryParameter", f"comp={comp}")
+
+    def list_blobs(request: Request, container: str) -> Response:
+        params = request.query_params
+        prefix = params.get("prefix", "")
+        max_results = int(params.get("maxresults", 5000))
+        marker = params.get("marker", "")
+        names = sorted(name for name in store.containers[container] if name.startswith(prefix) and name > marker)
+        page, next_marker = names[:max_results], names[max_results - 1] if len(names) > max_results else ""
+        items = []
+        for name in page:
+            blob = store.containers[container][name]
+            metadata = "".join(f"<{k}>{escape(v)}</{k}>" for k, v in blob["metadata"].items())
+            items.append(f"<Blob><Name>{escape(name)}</Name><Properties>"
+                         f"<Last-Modified>{blob['last_modified']}</Last-Modified><Etag>{blob['etag']}</Etag>"
+                         f"<Content-Length>{blob['size']}</Content-Length>"
+                         f"<Content-Type>application/octet-stream</Content-Type>"
+                         f"<Content-MD5>{blob['content_md5']}</Content-MD5><BlobType>BlockBlob</BlobType>"
+                         f"<LeaseStatus>unlocked</LeaseStatus><LeaseState>available</LeaseState>"
+                         f"</Properties><Metadata>{metadata}</Metadata></Blob>")
+        body = (f'<?xml version="1.0" encoding="utf-8"?><EnumerationResults '
+                f'ServiceEndpoint="{request.base_url}{ACCOUNT_NAME}" ContainerName="{escape(container)}">'
+                f'<Prefix>{escape(prefix)}</Prefix><MaxResults>{max_results}</MaxResults>'
+                f'<Blobs>{"".join(items)}</Blobs><NextMarker>{escape(next_marker)}</NextMarker>'
+                f'</EnumerationResults>')
+        return Response(body, media_type="application/xml", headers=_headers())
+
+    async def batch(request: Request, container: str) -> Response:
+        """
+        Runs the DELETE sub-requests of a Blob Batch, answering with a multipart/mixed response in order.
+        """
+        content_type = request.headers["content-type"]
+        request_boundary = content_type.split("boundary=")[1].strip('"')
+        body = (await request.body()).decode()
+        response_boundary = f"batchresponse_{uuid.uuid4()}"
+        parts = []
+        for index, part in enumerate(p for p in body.split(f"--{request_boundary}")[1:] if p.strip() != "--"):
+            request_line = next(line for line in part.split("\r\n") if line.startswith(("DELETE ", "PUT ")))
+            path = request_line.split(" ")[1].split("?")[0]
+            blob_name = unquote(path.split("/", 3)[3]) if path.count("/") >= 3 else ""
+            if blob_name in store.containers[container]:
+                del store.containers[container][blob_name]
+                status, headers = "202 Accepted", ["x-ms-delete-type-permanent: true"]
+            else:
+                status, headers = "404 The specified blob does not exist.", ["x-ms-error-code: BlobNotFound"]
+            parts.append("\r\n".join([
+                f"--{response_boundary}", "Content-Type: application/http", f"Content-ID: {index}", "",
+                f"HTTP/1.1 {status}", *headers, f"x-ms-request-id: {uuid.uuid4()}", "x-ms-version: 2023-11-03",
+                "Content-Length: 0", "", ""]))
+        payload = "".join(parts) + f"--{response_boundary}--\r\n"
+        return Response(payload, status_code=202, media_type=f"multipart/mixed; boundary={response_boundary}",
+                        headers=_headers())
+
+    async def blob_operation(request: Request, container: str, name: str) -> Response:
+        if container not in store.containers:
+            return error(404, "ContainerNotFound", "The specified container does not exist.")
+        blobs = store.containers[container]
+        comp = request.query_params.get("comp")
+        if request.method == "PUT" and comp == "block":
+            data = await request.body()
+            store.blocks.setdefault((container, name), {})[request.query_params["blockid"]] = \
+                data if store.keep_content else len(data).to_bytes(8, "big")
+            return Response(status_code=201, headers=_headers(**{"x-ms-request-server-encrypted": "true"}))
+        if request.method == "PUT" and comp == "blocklist":
+            staged = store.blocks.pop((container, name), {})
+            block_ids = [element.text for element in ElementTree.fromstring(await request.body())]
+            if store.keep_content:
+                content = b"".join(staged[block_id] for block_id in block_ids)
+                blob = store.put(container, name, content, metadata=_metadata(request))
+            else:
+                size = sum(int.from_bytes(staged[block_id], "big") for block_id in block_ids)
+                blob = store.put(container, name, b"", size=size, metadata=_metadata(request))
+            return Response(status_code=201, headers=_headers(blob["etag"], blob["last_modified"],
+                                                              **{"x-ms-request-server-encrypted": "true"}))
+        if request.method == "PUT" and comp == "metadata":
+            if name not in blobs:
+                return error(404, "BlobNotFound", "The specified blob does not exist.")
+            blobs[name]["metadata"] = _metadata(request)
+            return Response(status_code=200, headers=_headers(blobs[name]["etag"], blobs[name]["last_modified"]))
+        if request.method == "PUT" and comp is None:
+            if request.headers.get("if-none-match") == "*" and name in blobs:
+                return error(409, "BlobAlreadyExists", "The specified blob already exists.")
+            content = await request.body()
+            blob = store.put(container, name, content, metadata=_metadata(request))
+            return Response(status_code=201, headers=_headers(blob["etag"], blob["last_modified"],
+                                                              **{"Content-MD5": blob["content_md5"],
+                                                                 "x-ms-request-server-encrypted": "true"}))
+        if name not in blobs:
+            return error(404, "BlobNotFound", "The specified blob does not exist.")
+        blob = blobs[name]
+        if request.method in ("GET", "HEAD"):
+            headers = _headers(blob["etag"], blob["last_modified"], **{
+                "x-ms-blob-type": "BlockBlob", "Content-Type": "application/octet-stream",
+                "Content-Length": str(blob["size"]), "Content-MD5": blob["content_md5"],
+                **{f"x-ms-meta-{k}": v for k, v in blob["metadata"].items()}})
+            content = blob["content"] if request.method == "GET" else b""
+            return Response(content, status_code=200, headers=headers)
+        if request.method == "DELETE":
+            del blobs[name]
+            return Response(status_code=202, headers=_headers(**{"x-ms-delete-type-permanent": "true"}))
+        return error(400, "UnsupportedHttpVerb", request.method)
+
+    def _metadata(request: Request) -> dict:
+        return {k[len("x-ms-meta-"):]: v for k, v in request.headers.items() if k.startswith("x-ms-meta-")}
+
+    async def dispatch(request: Request) -> Response:
+        segments = request.scope["path"].lstrip("/").split("/", 2)
+        if len(segments) < 2 or segments[0] != ACCOUNT_NAME:
+            return error(400, "InvalidUri", "Expected /<account>/<container>[/<blob>]")
+        if len(segments) == 2 or segments[2] == "":
+            return await container_operation(request, segments[1])
+        return await blob_operation(request, segments[1], segments[2])
+
+    return Starlette(routes=[Route("/{path:path}", dispatch, methods=["GET", "HEAD", "PUT", "POST", "DELETE"])])
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--keep-content", action="store_true",
+                        help="keep the blob content in memory, otherwise only the size is kept")
+
+
+if __name__ == '__main__':
+    serve("Blob Storage", create_app, add_arguments, throttle_status=503)
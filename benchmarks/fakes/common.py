@@ -0,0 +1,148 @@
+"""
+Latency and throttling injection shared by the fakes, and the command line to serve them.
+"""
+import argparse
+import asyncio
+import datetime
+import ipaddress
+import os
+import random
+from dataclasses import dataclass
+from typing import Callable
+
+import uvicorn
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+@dataclass
+class Behaviour:
+    """
+    How a fake misbehaves.
+
+    Attributes:
+        latency_ms (float): The delay added to every request.
+        jitter_ms (float): A uniformly distributed extra delay between 0 and jitter_ms.
+        throttle_rate (float): The fraction of requests rejected with throttle_status, between 0 and 1.
+        throttle_status (int): 429 like Graph and Search, or 503 like Blob Storage when it is busy.
+        retry_after (int): The Retry-After header of the throttled responses, in seconds.
+        seed (int): The seed of the random generator, so that runs are comparable.
+    """
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    throttle_rate: float = 0.0
+    throttle_status: int = 429
+    retry_after: int = 1
+    seed: int = 0
+
+
+class BehaviourMiddleware:
+    """
+    ASGI middleware delaying every request and rejecting a fraction of them as throttled.
+    """
+
+    def __init__(self, app: ASGIApp, behaviour: Behaviour) -> None:
+        self.app = app
+        self.behaviour = behaviour
+        self.random = random.Random(behaviour.seed)
+        self.requests = 0
+        self.throttled = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if scope["path"] == "/_fake/stats":
+            return await self._send(send, 200, f'{{"requests": {self.requests}, "throttled": {self.throttled}}}'
+                                    .encode(), [(b"content-type", b"application/json")])
+        self.requests += 1
+        delay = self.behaviour.latency_ms + self.random.uniform(0, self.behaviour.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if self.behaviour.throttle_rate and self.random.random() < self.behaviour.throttle_rate:
+            self.throttled += 1
+            body = b'{"error": {"code": "TooManyRequests", "message": "Throttled by the fake server"}}'
+            return await self._send(send, self.behaviour.throttle_status, body,
+                                    [(b"content-type", b"application/json"),
+                                     (b"retry-after", str(self.behaviour.retry_after).encode()),
+                                     (b"x-ms-error-code", b"ServerBusy")])
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _send(send: Send, status: int, body: bytes, headers: list[tuple[bytes, bytes]]) -> None:
+        await send({"type": "http.response.start", "status": status,
+                    "headers": headers + [(b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def create_tls_certificate(directory: str, host: str = "127.0.0.1") -> tuple[str, str]:
+    """
+    Writes a self-signed certificate for host, for the fakes whose SDK refuses plain http (Azure AI Search).
+
+    The clients trust it through REQUESTS_CA_BUNDLE (requests transport) and SSL_CERT_FILE (aiohttp transport).
+
+    Args:
+        directory (str): Where the certificate and its key are written.
+        host (str, optional): The IP address the certificate is valid for. Defaults to "127.0.0.1".
+
+    Returns:
+        tuple[str, str]: The paths of the certificate and of the private key.
+    """
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, host)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address(host)),
+                                                    x509.DNSName("localhost")]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = os.path.join(directory, "fake-cert.pem"), os.path.join(directory, "fake-key.pem")
+    with open(cert_path, "wb") as file:
+        file.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as file:
+        file.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                     serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+def serve(name: str, create_app: Callable[[argparse.Namespace], ASGIApp], add_arguments: Callable = None,
+          throttle_status: int = 429) -> None:
+    """
+    Parses the command line and serves a fake with uvicorn.
+
+    Args:
+        name (str): The name of the fake, for the help message.
+        create_app (Callable): Builds the app from the parsed arguments.
+        add_arguments (Callable, optional): Adds the fake specific arguments to the parser.
+        throttle_status (int, optional): The default status of the throttled responses.
+    """
+    parser = argparse.ArgumentParser(description=f"Fake {name} server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-status", type=int, default=throttle_status)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tls-cert", default=None, help="serve https with this certificate")
+    parser.add_argument("--tls-key", default=None)
+    if add_arguments is not None:
+        add_arguments(parser)
+    args = parser.parse_args()
+    behaviour = Behaviour(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, throttle_rate=args.throttle_rate,
+                          throttle_status=args.throttle_status, retry_after=args.retry_after, seed=args.seed)
+    app = BehaviourMiddleware(create_app(args), behaviour)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False,
+                ssl_certfile=args.tls_cert, ssl_keyfile=args.tls_key)
@@ -0,0 +1,84 @@
+"""
+Deterministic tenant shared by the Graph and Search fakes: SharePoint sites, their groups, and the groups of each
+user.
+"""
+import hashlib
+import uuid
+
+DOMAIN = "contoso"
+TENANT_ID = "00000000-0000-0000-0000-000000000001"
+_NAMESPACE = uuid.UUID("6f1c2a3e-51a9-4b7e-9d0c-1d2e3f405162")
+
+
+def site_name(index: int) -> str:
+    return f"site{index:05d}"
+
+
+def site(index: int) -> dict:
+    """
+    Returns the Graph representation of site number `index`.
+    """
+    name = site_name(index)
+    site_id1 = str(uuid.uuid5(_NAMESPACE, f"{name}/site"))
+    site_id2 = str(uuid.uuid5(_NAMESPACE, f"{name}/web"))
+    return {
+        "id": f"{DOMAIN}.sharepoint.com,{site_id1},{site_id2}",
+        "name": name,
+        "displayName": f"Site {index}",
+        "webUrl": f"https://{DOMAIN}.sharepoint.com/sites/{name}",
+    }
+
+
+def sites(count: int) -> list[dict]:
+    return [site(i) for i in range(count)]
+
+
+def user_principal_name(index: int) -> str:
+    return f"user{index:05d}@{DOMAIN}.com"
+
+
+def user_object_id(user_principal_name: str) -> str:
+    return str(uuid.uuid5(_NAMESPACE, f"user/{user_principal_name.lower()}"))
+
+
+def site_group(index: int) -> dict:
+    """
+    Returns the Microsoft 365 group of site number `index`, whose SPO proxy address holds the site id.
+    """
+    site_id1 = site(index)["id"].split(",")[1]
+    return {
+        "id": str(uuid.uuid5(_NAMESPACE, f"group/{index}")),
+        "displayName": f"Site {index} Members",
+        "proxyAddresses": [f"SPO:SPO_{site_id1}@SPO_{TENANT_ID}",
+                           f"SMTP:{site_name(index)}@{DOMAIN}.onmicrosoft.com"],
+    }
+
+
+def user_site_indexes(user_id: str, site_count: int, sites_per_user: int) -> list[int]:
+    """
+    Returns the sites the user belongs to, a stable pseudo-random subset of the tenant.
+    """
+    digest = int(hashlib.sha256(user_id.encode()).hexdigest(), 16)
+    if site_count == 0:
+        return []
+    return sorted({(digest // (i + 1) + i * 7919) % site_count for i in range(sites_per_user)})
+
+
+def user_groups(user_id: str, site_count: int, sites_per_user: int, other_groups: int) -> list[dict]:
+    """
+    Returns the transitiveMemberOf of a user: one Microsoft 365 group per site, whose SPO proxy address holds
+    the site id, plus groups without SharePoint site.
+    """
+    groups = []
+    for index in user_site_indexes(user_id, site_count, sites_per_user):
+        groups.append({"@odata.type": "#microsoft.graph.group", **site_group(index)})
+    for index in range(other_groups):
+        groups.append({
+            "@odata.type": "#microsoft.graph.group",
+            "id": str(uuid.uuid5(_NAMESPACE, f"other-group/{user_id}/{index}")),
+            "displayName": f"Security group {index}",
+            "proxyAddresses": [],
+        })
+    groups.append({"@odata.type": "#microsoft.graph.directoryRole", "id": str(uuid.uuid5(_NAMESPACE, "role")),
+                   "displayName": "Directory Readers"})
+    return groups
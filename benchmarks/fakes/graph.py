@@ -0,0 +1,88 @@
+"""
+Fake Microsoft Graph and Microsoft identity platform: token, site search, transitiveMemberOf, and the groups
+delta and transitive members used by the site access map.
+
+Point the backend at it with GRAPH_ENDPOINT and GRAPH_LOGIN_ENDPOINT.
+"""
+import argparse
+import uuid
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from . import dataset
+from .common import serve
+
+
+def create_app(args: argparse.Namespace) -> Starlette:
+    sites = dataset.sites(args.sites)
+    groups = [dataset.site_group(i) for i in range(args.sites)]
+    group_members: dict[str, list[dict]] = {group["id"]: [] for group in groups}
+    for i in range(args.users):
+        upn = dataset.user_principal_name(i)
+        for index in dataset.user_site_indexes(upn, args.sites, args.sites_per_user):
+            group_members[groups[index]["id"]].append({"@odata.type": "#microsoft.graph.user",
+                                                       "id": dataset.user_object_id(upn), "userPrincipalName": upn})
+
+    def page(request: Request, items: list[dict], page_size: int) -> dict:
+        skip = int(request.query_params.get("$skiptoken", 0))
+        body = {"value": items[skip:skip + page_size]}
+        if skip + page_size < len(items):
+            body["@odata.nextLink"] = str(request.url.include_query_params(**{"$skiptoken": skip + page_size}))
+        return body
+
+    async def token(request: Request) -> JSONResponse:
+        return JSONResponse({"token_type": "Bearer", "expires_in": args.token_ttl, "ext_expires_in": args.token_ttl,
+                             "access_token": f"fake-{uuid.uuid4()}"})
+
+    async def list_sites(request: Request) -> JSONResponse:
+        search = request.query_params.get("search", "*")
+        if search == "*":
+            return JSONResponse({"value": sites})
+        # like Graph, the site named exactly like the search term comes first
+        matches = [s for s in sites if search.lower() in s["name"]]
+        matches.sort(key=lambda s: s["name"] != search.lower())
+        return JSONResponse({"value": matches})
+
+    async def transitive_member_of(request: Request) -> JSONResponse:
+        user_id = request.path_params["user_id"]
+        return JSONResponse({"value": dataset.user_groups(user_id, args.sites, args.sites_per_user,
+                                                          args.other_groups)})
+
+    async def groups_delta(request: Request) -> JSONResponse:
+        # the tenant never changes: the first round returns every group, the next ones nothing
+        items = [] if "$deltatoken" in request.query_params else \
+            [{**group, "members@delta": [{"@odata.type": m["@odata.type"], "id": m["id"]}
+                                         for m in group_members[group["id"]]]} for group in groups]
+        body = page(request, items, 100)
+        if "@odata.nextLink" not in body:
+            body["@odata.deltaLink"] = str(request.url.replace_query_params(**{"$deltatoken": "latest"}))
+        return JSONResponse(body)
+
+    async def transitive_members(request: Request) -> JSONResponse:
+        members = group_members.get(request.path_params["group_id"])
+        if members is None:
+            return JSONResponse({"error": {"code": "Request_ResourceNotFound"}}, status_code=404)
+        return JSONResponse(page(request, members, int(request.query_params.get("$top", 100))))
+
+    return Starlette(routes=[
+        Route("/{tenant_id}/oauth2/v2.0/token", token, methods=["GET", "POST"]),
+        Route("/v1.0/sites", list_sites),
+        Route("/v1.0/users/{user_id}/transitiveMemberOf", transitive_member_of),
+        Route("/v1.0/groups/delta", groups_delta),
+        Route("/v1.0/groups/{group_id}/transitiveMembers/microsoft.graph.user", transitive_members),
+    ])
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--sites", type=int, default=200, help="number of sites in the tenant")
+    parser.add_argument("--sites-per-user", type=int, default=10)
+    parser.add_argument("--users", type=int, default=100, help="users of the tenant, user00000@... and up")
+    parser.add_argument("--other-groups", type=int, default=20, help="groups of each user without a site")
+    parser.add_argument("--token-ttl", type=int, default=3599)
+
+
+if __name__ == '__main__':
+    serve("Graph", create_app, add_arguments)
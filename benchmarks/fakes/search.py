@@ -0,0 +1,322 @@
+"""
+Fake Azure AI Search service: indexes, datasources, skillsets, indexers and documents, kept in memory.
+
+Use an api-key credential (AZURE_SEARCH_KEY) with it, bearer tokens are refused over plain http by the SDK.
+Filters support `field eq|gt|ge|lt|le 'value'`, `field eq null`, `search.in(field, 'a|b', '|')` and, on collections,
+`field/any()`, `field/any(x: x eq 'value')` and `field/any(x: search.in(x, 'a|b', '|'))` clauses, negated by
+`not`, combined with `or` / `and`, results can be sorted by one `orderby` field, and facets `field,count:N` count
+the values of a field over the matching documents. The index created at startup has the schema of SearchHandler.create_index, and its
+documents get a pseudo random chunkVector of --vector-dimensions (none when 0); the first --shared-docs documents
+of every site are copies of the same documents, with the same chunks and vectors.
+An indexer run lasts --run-seconds, and processes items for the --changing-percent of the indexers whose site
+changes, none for the others; a run requested while one is in progress is refused with 409.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+from . import dataset
+from .common import serve
+
+RESOURCE_PATH = re.compile(r"^/(indexes|datasources|skillsets|indexers)(?:\('([^']*)'\))?(?:/(.*))?$")
+COMPARISON_CLAUSE = re.compile(r"^(\w+) (eq|gt|ge|lt|le) '((?:[^']|'')*)'$")
+SEARCH_IN_CLAUSE = re.compile(r"^search\.in\((\w+),\s*'((?:[^']|'')*)'(?:,\s*'([^']*)')?\)$")
+NULL_CLAUSE = re.compile(r"^(\w+) (eq|ne) null$")
+ANY_CLAUSE = re.compile(r"^(\w+)/any\((?:(\w+):\s*(.*))?\)$")
+DOCUMENT_PATH = re.compile(r"^docs\('([^']*)'\)$")
+COLLECTION_NAMES = {"indexes": "index", "datasources": "data source", "skillsets": "skillset",
+                    "indexers": "indexer"}
+COMPARISONS = {"eq": lambda a, b: a == b, "gt": lambda a, b: a > b, "ge": lambda a, b: a >= b,
+               "lt": lambda a, b: a < b, "le": lambda a, b: a <= b}
+
+
+def error(status: int, message: str, code: str = "") -> JSONResponse:
+    return JSONResponse({"error": {"code": code, "message": message}}, status_code=status)
+
+
+def parse_filter(expression: str):
+    """
+    Compiles an OData filter into a predicate on documents. Unsupported clauses match every document.
+    """
+    if not expression:
+        return lambda doc: True
+    disjunction = []
+    for or_part in _split(_unwrap(expression), "or"):
+        conjunction = []
+        for clause in _split(_unwrap(or_part), "and"):
+            clause = _unwrap(clause)
+            if len(_split(clause, "or")) > 1 or len(_split(clause, "and")) > 1:
+                conjunction.append(parse_filter(clause))
+            elif clause.startswith("not "):
+                conjunction.append(lambda doc, p=parse_filter(clause[4:]): not p(doc))
+            elif match := COMPARISON_CLAUSE.match(clause):
+                field, compare, value = match.group(1), COMPARISONS[match.group(2)], match.group(3).replace("''", "'")
+                conjunction.append(lambda doc, f=field, c=compare, v=value:
+                                   any(x is not None and c(x, v) for x in _field_values(doc, f)))
+            elif match := SEARCH_IN_CLAUSE.match(clause):
+                field, values, separator = match.group(1), match.group(2), match.group(3)
+                if separator:
+                    value_set = set(values.split(separator))
+                else:
+                    value_set = {v.strip() for v in re.split(r"[ ,]", values) if v.strip()}
+                conjunction.append(lambda doc, f=field, vs=value_set: _field_values(doc, f) & vs)
+            elif match := NULL_CLAUSE.match(clause):
+                conjunction.append(lambda doc, f=match.group(1), eq=match.group(2) == "eq":
+                                   (doc.get(f) is None) == eq)
+            elif match := ANY_CLAUSE.match(clause):
+                field, variable, condition = match.groups()
+                if variable is None:
+                    conjunction.append(lambda doc, f=field: bool(doc.get(f)))
+                else:
+                    # the lambda variable stands for each item, as a document with a single field
+                    item_predicate = parse_filter(re.sub(rf"\b{variable}\b(?=[ ,)])", "item", condition))
+                    conjunction.append(lambda doc, f=field, p=item_predicate:
+                                       any(p({"item": item}) for item in doc.get(f) or []))
+        disjunction.append(conjunction)
+    return lambda doc: any(all(bool(c(doc)) for c in conjunction) for conjunction in disjunction)
+
+
+def _split(expression: str, operator: str) -> list[str]:
+    """
+    Splits an expression on a logical operator outside parentheses and quotes.
+    """
+    parts, depth, quoted, start = [], 0, False, 0
+    for match in re.finditer(rf"[()']|\s+{operator}\s+", expression):
+        token = match.group(0)
+        if token == "'":
+            quoted = not quoted
+        elif not quoted and token in "()":
+            depth += 1 if token == "(" else -1
+        elif not quoted and depth == 0 and token not in "()'":
+            parts.append(expression[start:match.start()])
+            start = match.end()
+    return parts + [expression[start:]]
+
+
+def _unwrap(expression: str) -> str:
+    """
+    Removes the parentheses enclosing the whole expression.
+    """
+    expression = expression.strip()
+    while expression.startswith("(") and expression.endswith(")"):
+        depth = 0
+        for position, char in enumerate(expression):
+            depth += {"(": 1, ")": -1}.get(char, 0)
+            if depth == 0 and position < len(expression) - 1:
+                return expression
+        expression = expression[1:-1].strip()
+    return expression
+
+
+def _field_values(doc: dict, field: str) -> set:
+    value = doc.get(field)
+    if isinstance(value, list):
+        return set(value)
+    return {value}
+
+
+def create_app(args: argparse.Namespace) -> Starlette:
+    store = {"indexes": {}, "datasources": {}, "skillsets": {}, "indexers": {}}
+    documents: dict[str, dict[str, dict]] = {}
+    runs: dict[str, dict] = {}
+
+    # the sites that are already integrated when the benchmark starts
+    index_name = args.index
+    fields = [{"name": "id", "type": "Edm.String", "key": True, "sortable": True, "filterable": True},
+              {"name": "parent_id", "type": "Edm.String", "filterable": True},
+              {"name": "title", "type": "Edm.String", "searchable": True},
+              {"name": "location", "type": "Edm.String"},
+              {"name": "chunk", "type": "Edm.String", "searchable": True},
+              {"name": "metadata_spo_site_id", "type": "Edm.String", "filterable": True, "facetable": True}]
+    if args.vector_dimensions:
+        fields.append({"name": "chunkVector", "type": "Collection(Edm.Single)", "searchable": True,
+                       "dimensions": args.vector_dimensions, "vectorSearchProfile": "myHnswProfile"})
+    store["indexes"][index_name] = {"name": index_name, "fields": fields}
+    documents[index_name] = {}
+    for i in range(args.indexed_sites):
+        site = dataset.site(i)
+        name = f"{site['name']}-sharepoint"
+        store["datasources"][f"{name}-datasource"] = {"name": f"{name}-datasource", "type": "sharepoint",
+                                                      "credentials": {"connectionString": None},
+                                                      "container": {"name": "allSiteLibraries"}}
+        store["indexers"][f"{name}-indexer"] = {"name": f"{name}-indexer", "dataSourceName": f"{name}-datasource",
+                                                "skillsetName": f"{index_name}-skillset",
+                                                "targetIndexName": index_name}
+        for d in range(args.docs_per_site):
+            doc_id = f"{site['name']}-{d}"
+            shared = d < args.shared_docs
+            documents[index_name][doc_id] = {"id": doc_id, "parent_id": f"{site['name']}-parent-{d // 4}",
+                                             "title": f"Document {d} of {site['displayName']}",
+                                             "location": f"{site['webUrl']}/Shared Documents/doc{d}.pdf",
+                                             "chunk": f"Policy chunk {d}" if shared
+                                             else f"Chunk {d} of {site['displayName']}",
+                                             "metadata_spo_site_id": site["id"]}
+            if args.vector_dimensions:
+                rnd = random.Random(zlib.crc32((f"policy-{d}" if shared else doc_id).encode()))
+                vector = [rnd.gauss(0, 1) for _ in range(args.vector_dimensions)]
+                norm = math.sqrt(sum(x * x for x in vector))
+                documents[index_name][doc_id]["chunkVector"] = [x / norm for x in vector]
+
+    def created(collection: str, body: dict, status: int) -> JSONResponse:
+        body = {**body, "@odata.etag": f'"0x{abs(hash(str(body))):X}"'}
+        store[collection][body["name"]] = body
+        if collection == "indexes":
+            documents.setdefault(body["name"], {})
+        return JSONResponse(body, status_code=status)
+
+    def search_documents(name: str, body: dict) -> JSONResponse:
+        predicate = parse_filter(body.get("filter"))
+        hits = [doc for doc in documents.get(name, {}).values() if predicate(doc)]
+        if body.get("orderby"):
+            field, _, direction = body["orderby"].split(",")[0].strip().partition(" ")
+            hits.sort(key=lambda doc: (doc.get(field) is not None, doc.get(field) or ""), reverse=direction == "desc")
+        skip, top = body.get("skip") or 0, 50 if body.get("top") is None else body["top"]
+        select = body.get("select")
+        page = []
+        for doc in hits[skip:skip + top]:
+            if select:
+                doc = {field: doc.get(field) for field in select.split(",")}
+            page.append({"@search.score": 1.0, **doc})
+        result = {"value": page}
+        if body.get("count"):
+            result["@odata.count"] = len(hits)
+        facets = body.get("facets") or []
+        if facets:
+            result["@search.facets"] = {}
+        for facet in facets:
+            field, _, options = facet.partition(",")
+            count = int(dict(option.split(":") for option in options.split(",") if option).get("count", 10))
+            counts: dict = {}
+            for doc in hits:
+                for value in _field_values(doc, field) - {None}:
+                    counts[value] = counts.get(value, 0) + 1
+            ranked = sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))[:count]
+            result["@search.facets"][field] = [{"value": value, "count": n} for value, n in ranked]
+        return JSONResponse(result)
+
+    def index_documents(name: str, body: dict) -> JSONResponse:
+        index_docs = documents.setdefault(name, {})
+        results = []
+        for action in body.get("value", []):
+            kind = action.pop("@search.action", "upload")
+            key = action.get("id")
+            if kind == "delete":
+                index_docs.pop(key, None)
+            elif kind in ("merge", "mergeOrUpload") and key in index_docs:
+                index_docs[key].update(action)
+            else:
+                index_docs[key] = action
+            results.append({"key": key, "status": True, "errorMessage": None, "statusCode": 200})
+        return JSONResponse({"value": results})
+
+    def run_indexer(name: str) -> Response:
+        now = datetime.now(timezone.utc)
+        if name in runs and runs[name]["end"] > now:
+            return error(409, "Another indexer invocation is currently in progress; concurrent invocations are "
+                              "not allowed.")
+        changing = zlib.crc32(name.encode()) % 100 < args.changing_percent
+        runs[name] = {"start": now, "end": now + timedelta(seconds=args.run_seconds), "items": 5 if changing else 0}
+        return Response(status_code=202)
+
+    def indexer_status(name: str) -> JSONResponse:
+        now = datetime.now(timezone.utc)
+        run = runs.get(name) or {"start": now, "end": now, "items": 0}
+        done = run["end"] <= now
+        return JSONResponse({
+            "name": name, "status": "running",
+            "lastResult": {"status": "success" if done else "inProgress", "errorMessage": None,
+                           "startTime": run["start"].isoformat(), "endTime": run["end"].isoformat() if done else None,
+                           "itemsProcessed": run["items"] if done else 0, "itemsFailed": 0, "errors": [],
+                           "warnings": []},
+            "executionHistory": [], "limits": {}
+        })
+
+    async def dispatch(request: Request) -> Response:
+        match = RESOURCE_PATH.match(request.scope["path"])
+        if match is None:
+            return error(404, f"Unknown path {request.scope['path']}")
+        collection, name, action = match.groups()
+        method = request.method
+        body = await request.json() if method in ("POST", "PUT") and await request.body() else {}
+
+        if name is None:
+            if method == "GET":
+                return JSONResponse({"value": list(store[collection].values())})
+            if method == "POST":
+                if body["name"] in store[collection]:
+                    kind = COLLECTION_NAMES[collection]
+                    article = "an" if kind[0] in "aeiou" else "a"
+                    return error(400, f"Cannot create {kind} '{body['name']}' because {article} {kind} "
+                                      f"with that name already exists.")
+                return created(collection, body, 201)
+        elif action is None:
+            if method == "GET":
+                if name not in store[collection]:
+                    return error(404, f"No {COLLECTION_NAMES[collection]} with the name '{name}' was found.")
+                return JSONResponse(store[collection][name])
+            if method == "PUT":
+                return created(collection, {**body, "name": name}, 200 if name in store[collection] else 201)
+            if method == "DELETE":
+                if store[collection].pop(name, None) is None:
+                    return error(404, f"No {COLLECTION_NAMES[collection]} with the name '{name}' was found.")
+                if collection == "indexes":
+                    documents.pop(name, None)
+                return Response(status_code=204)
+        elif collection == "indexes":
+            if action in ("docs/search.post.search", "docs/search"):
+                return search_documents(name, body or dict(request.query_params))
+            if action == "docs/search.index":
+                return index_documents(name, body)
+            if action == "docs/$count":
+                return PlainTextResponse(str(len(documents.get(name, {}))))
+            if action == "search.stats":
+                docs = documents.get(name, {}).values()
+                vectors = sum(len(doc.get("chunkVector") or []) for doc in docs)
+                storage = sum(len(json.dumps({k: v for k, v in doc.items() if k != "chunkVector"})) for doc in docs)
+                return JSONResponse({"documentCount": len(docs), "storageSize": storage + vectors * 4,
+                                     "vectorIndexSize": vectors * 4})
+            if (match := DOCUMENT_PATH.match(action or "")) and method == "GET":
+                doc = documents.get(name, {}).get(match.group(1))
+                if doc is None:
+                    return error(404, "Document not found")
+                select = request.query_params.get("$select")
+                return JSONResponse({field: doc.get(field) for field in select.split(",")} if select else doc)
+        elif collection == "indexers":
+            if name not in store["indexers"]:
+                return error(404, f"No indexer with the name '{name}' was found.")
+            if action == "search.status":
+                return indexer_status(name)
+            if action == "search.run":
+                return run_indexer(name)
+            if action == "search.reset":
+                return Response(status_code=204)
+        return error(400, f"Unsupported request {method} {request.scope['path']}")
+
+    return Starlette(routes=[Route("/{path:path}", dispatch, methods=["GET", "POST", "PUT", "DELETE"])])
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--index", default="bench-index", help="name of the index created at startup")
+    parser.add_argument("--indexed-sites", type=int, default=50,
+                        help="number of sites that already have a datasource and an indexer")
+    parser.add_argument("--docs-per-site", type=int, default=0)
+    parser.add_argument("--shared-docs", type=int, default=0,
+                        help="documents of every site that are copies of the same documents")
+    parser.add_argument("--vector-dimensions", type=int, default=0,
+                        help="dimensions of the chunkVector of the documents created at startup, 0 for none")
+    parser.add_argument("--run-seconds", type=float, default=1.0, help="duration of an indexer run")
+    parser.add_argument("--changing-percent", type=int, default=10,
+                        help="percentage of the indexers whose runs find changed items")
+
+
+if __name__ == '__main__':
+    serve("Azure AI Search", create_app, add_arguments)
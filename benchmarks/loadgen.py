@@ -0,0 +1,99 @@
+"""
+Closed-loop HTTP load generator shared by the benchmarks.
+"""
+import asyncio
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+import httpx
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+@dataclass
+class LoadResult:
+    name: str
+    latencies_ms: list[float] = field(default_factory=list)
+    errors: int = 0
+    elapsed_s: float = 0.0
+    # time to the first streamed event, for streaming scenarios
+    first_event_ms: list[float] = field(default_factory=list)
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies_ms)
+
+    @property
+    def throughput(self) -> float:
+        return self.requests / self.elapsed_s if self.elapsed_s else 0.0
+
+    def summary(self) -> dict:
+        return {
+            "name": self.name,
+            "requests": self.requests,
+            "errors": self.errors,
+            "elapsed_s": round(self.elapsed_s, 3),
+            "throughput_rps": round(self.throughput, 2),
+            "mean_ms": round(statistics.mean(self.latencies_ms), 2) if self.latencies_ms else 0.0,
+            "p50_ms": round(percentile(self.latencies_ms, 50), 2),
+            "p99_ms": round(percentile(self.latencies_ms, 99), 2),
+            **({"p50_first_event_ms": round(percentile(self.first_event_ms, 50), 2),
+                "p99_first_event_ms": round(percentile(self.first_event_ms, 99), 2)} if self.first_event_ms else {}),
+        }
+
+    def __str__(self) -> str:
+        s = self.summary()
+        return (f"{s['name']}: {s['requests']} req, {s['errors']} errors, {s['throughput_rps']} req/s, "
+                f"p50 {s['p50_ms']}ms, p99 {s['p99_ms']}ms" +
+                (f", first event p50 {s['p50_first_event_ms']}ms" if self.first_event_ms else ""))
+
+
+async def run_load(name: str, send: Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]],
+                   client: httpx.AsyncClient, concurrency: int, requests: int = None,
+                   duration: float = None) -> LoadResult:
+    """
+    Runs `concurrency` virtual users that send requests back to back until `requests` requests were sent
+    or `duration` seconds elapsed.
+
+    Args:
+        name (str): The name of the scenario.
+        send (Callable): Sends request number i with the client and returns the response.
+        client (httpx.AsyncClient): The HTTP client.
+        concurrency (int): The number of virtual users.
+        requests (int, optional): The total number of requests.
+        duration (float, optional): The duration of the run in seconds.
+
+    Returns:
+        LoadResult: The latency of each request and the number of errors.
+    """
+    if requests is None and duration is None:
+        raise ValueError("Please provide either requests or duration")
+    result = LoadResult(name=name)
+    counter = iter(range(requests if requests is not None else 2 ** 62))
+    start = time.perf_counter()
+    deadline = start + duration if duration is not None else None
+
+    async def user() -> None:
+        for i in counter:
+            if deadline is not None and time.perf_counter() > deadline:
+                return
+            sent = time.perf_counter()
+            try:
+                res = await send(client, i)
+                if res.status_code >= 400:
+                    result.errors += 1
+            except httpx.HTTPError:
+                result.errors += 1
+            result.latencies_ms.append((time.perf_counter() - sent) * 1000)
+
+    await asyncio.gather(*[user() for _ in range(concurrency)])
+    result.elapsed_s = time.perf_counter() - start
+    return result
@@ -0,0 +1,104 @@
+"""
+Latency benchmark of the local vector tier (src/LocalVectorTier.py).
+
+Writes synthetic sites in the layout of the tier (normalized vectors.npy and documents.parquet per site), loads them
+like a worker does, memory-mapped, and measures LocalVectorTier.search for a user of --sites-per-user sites with a
+total of N vectors, in float32 and float16:
+    p50 / p99    search time, scoring, top-k selection and result documents included
+    memory       size of the mapped vectors
+
+Compare with the p50 of the search scenario of offline_suite.py, with and without --local-vectors, for the
+service round trip it replaces.
+
+Usage:
+    python benchmarks/local_vectors.py
+    python benchmarks/local_vectors.py --vectors 10000 100000 400000 --dimensions 1536 --top 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loadgen import percentile
+from src.IndexSnapshot import DOCUMENTS_FILE
+from src.LocalVectorTier import VECTORS_FILE, LocalVectorTier
+from src.SemanticCache import SiteGenerations
+from src.StateBackend import MemoryStateBackend
+from src.model.common import LocalVectorSite
+from src.model.config import LocalVectorTierConfig, SearchConfig
+
+
+def write_site(path: str, site_id: str, rows: int, dimensions: int, float16: bool,
+               rng: np.random.Generator) -> LocalVectorSite:
+    os.makedirs(path)
+    vectors = np.lib.format.open_memmap(os.path.join(path, VECTORS_FILE), mode="w+",
+                                        dtype=np.float16 if float16 else np.float32, shape=(rows, dimensions))
+    for i in range(0, rows, 8192):
+        block = rng.normal(size=(min(8192, rows - i), dimensions)).astype(np.float32)
+        vectors[i:i + len(block)] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    vectors.flush()
+    ids = [f"{site_id}-{i}" for i in range(rows)]
+    pq.write_table(pa.table({"id": ids, "title": ids, "location": ids, "chunk": ids,
+                             "metadata_spo_site_id": [site_id] * rows}), os.path.join(path, DOCUMENTS_FILE))
+    return LocalVectorSite(SiteId=site_id, Path=path, Rows=rows, FetchedAt=datetime.now(timezone.utc))
+
+
+def run(total: int, args: argparse.Namespace, float16: bool, work_dir: str) -> dict:
+    rng = np.random.default_rng(args.seed)
+    state = MemoryStateBackend()
+    search_config = SearchConfig(Endpoint="https://localhost", IndexName="bench-index",
+                                 AoaiEndpoint="https://localhost", AoaiKey="", AoaiEmbedDeployment="")
+    config = LocalVectorTierConfig(Enabled=True, Path=work_dir, Float16=float16)
+    tier = LocalVectorTier(config, search_config, state, SiteGenerations(state, search_config.IndexName))
+    site_ids = [f"site{i:03d}" for i in range(args.sites_per_user)]
+    kind = "float16" if float16 else "float32"
+    entries = [write_site(os.path.join(work_dir, f"{total}-{kind}-{site_id}"), site_id, total // len(site_ids),
+                          args.dimensions, float16, rng) for site_id in site_ids]
+    state.set(f"local-vectors:{search_config.IndexName}", {entry.SiteId: entry.model_dump(mode="json")
+                                                          for entry in entries})
+    tier.load()
+
+    queries = rng.normal(size=(args.queries, args.dimensions)).astype(np.float32).tolist()
+    for query in queries[:10]:
+        tier.search(query, site_ids, args.top)
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        tier.search(query, site_ids, args.top)
+        latencies.append((time.perf_counter() - start) * 1000)
+    memory = sum(entry.Rows for entry in entries) * args.dimensions * (2 if float16 else 4)
+    return {"vectors": total, "dtype": kind, "p50_ms": round(percentile(latencies, 50), 3),
+            "p99_ms": round(percentile(latencies, 99), 3), "memory_mb": round(memory / 2 ** 20, 1)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, nargs="+", default=[10000, 50000, 200000],
+                        help="total vectors of the sites of the user")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--sites-per-user", type=int, default=10)
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("| vectors | dtype | p50 (ms) | p99 (ms) | memory (MB) |")
+    print("| --- " * 5 + "|")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for total in args.vectors:
+            for float16 in (False, True):
+                result = run(total, args, float16, work_dir)
+                print(f"| {result['vectors']} | {result['dtype']} | {result['p50_ms']} | {result['p99_ms']} | "
+                      f"{result['memory_mb']} |", flush=True)
+
+
+if __name__ == '__main__':
+    main()
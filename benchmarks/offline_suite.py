@@ -0,0 +1,343 @@
+"""
+Offline benchmark suite: the backend against local fakes of Graph, Azure AI Search, Blob Storage and Azure OpenAI.
+
+Starts the fakes (see benchmarks/fakes) with the requested latency and throttling, starts `uvicorn main:app`
+pointed at them, drives every scenario with the closed-loop load generator and writes the results as JSON, so
+two runs can be compared for regression tracking. No Azure resource or network access is needed.
+
+Scenarios:
+    sharepoint_sites     GET /api/sharepoint/sites
+    list_user_site       GET /api/sharepoint/list-user-site, with a different user on each request
+    search               POST /api/search, cycling through --users users and --queries queries
+    chat                 POST /api/chat, reading the whole event stream; also reports the time to the first token
+    files_upload         POST /api/files/
+    files_list           GET /api/files/
+    files_delete         DELETE /api/files/, removing the uploaded files in batches
+    indexer_provisioning POST /api/sharepoint/indexer, integrating the sites of the tenant in batches
+
+Usage:
+    python benchmarks/offline_suite.py --latency-ms 30 --duration 10
+    python benchmarks/offline_suite.py --scenarios list_user_site --throttle-rate 0.02 --workers 2
+    python benchmarks/offline_suite.py --compare benchmarks/results/offline-20240101-120000.json
+    python benchmarks/offline_suite.py --scenarios search --docs-per-site 20 --local-vectors
+    python benchmarks/offline_suite.py --serve --capture .traffic/requests.jsonl   # for benchmarks/replay.py
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+from fakes import dataset
+from fakes.blob import connection_string
+from fakes.common import create_tls_certificate
+from loadgen import LoadResult, run_load
+
+BENCHMARKS_DIR = Path(__file__).parent
+REPO_DIR = BENCHMARKS_DIR.parent
+RESULTS_VERSION = 1
+SCENARIOS = ["sharepoint_sites", "list_user_site", "search", "chat", "files_upload", "files_list", "files_delete",
+             "indexer_provisioning"]
+# the metrics compared between two runs and whether higher is better
+COMPARED_METRICS = {"throughput_rps": True, "p50_ms": False, "p99_ms": False}
+LOCAL_VECTOR_REFRESH_INTERVAL = 2
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url: str, path: str = "/_fake/stats", timeout: float = 60, verify=True) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}{path}", timeout=2, verify=verify).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"{url} did not start")
+
+
+def start(stack: ExitStack, args: list[str], cwd: Path, env: dict = None) -> subprocess.Popen:
+    process = subprocess.Popen([sys.executable, *args], cwd=cwd, env=env)
+
+    def stop():
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    stack.callback(stop)
+    return process
+
+
+def start_environment(stack: ExitStack, args: argparse.Namespace, work_dir: str) -> str:
+    """
+    Starts the fakes and the backend, and returns the URL of the backend.
+    """
+    behaviour = ["--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+                 "--throttle-rate", str(args.throttle_rate), "--seed", str(args.seed)]
+    cert_path, key_path = create_tls_certificate(work_dir)
+    ports = {name: free_port() for name in ("graph", "search", "blob", "aoai", "backend")}
+
+    start(stack, ["-m", "fakes.graph", "--port", str(ports["graph"]), "--sites", str(args.sites),
+                  "--sites-per-user", str(args.sites_per_user), "--users", str(args.users), *behaviour],
+          BENCHMARKS_DIR)
+    vectors = ["--vector-dimensions", "1536"] if args.local_vectors else []
+    start(stack, ["-m", "fakes.search", "--port", str(ports["search"]), "--indexed-sites", str(args.indexed_sites),
+                  "--docs-per-site", str(args.docs_per_site), "--tls-cert", cert_path, "--tls-key", key_path,
+                  *vectors, *behaviour], BENCHMARKS_DIR)
+    start(stack, ["-m", "fakes.blob", "--port", str(ports["blob"]), *behaviour], BENCHMARKS_DIR)
+    start(stack, ["-m", "fakes.aoai", "--port", str(ports["aoai"]), *behaviour], BENCHMARKS_DIR)
+    wait_ready(f"http://127.0.0.1:{ports['graph']}")
+    wait_ready(f"https://127.0.0.1:{ports['search']}", verify=cert_path)
+    wait_ready(f"http://127.0.0.1:{ports['blob']}")
+    wait_ready(f"http://127.0.0.1:{ports['aoai']}")
+
+    env = {
+        **os.environ,
+        "AZURE_SEARCH_ENDPOINT": f"https://127.0.0.1:{ports['search']}",
+        "AZURE_SEARCH_KEY": "fake-key",
+        "AZURE_SEARCH_INDEX": "bench-index",
+        "AZURE_OPENAI_ENDPOINT": f"http://127.0.0.1:{ports['aoai']}",
+        "AZURE_OPENAI_KEY": "fake-key",
+        "AZURE_OPENAI_EMBED_DEPLOYMENT": "text-embedding-ada-002",
+        "AZURE_OPENAI_CHAT_DEPLOYMENT": "gpt-35-turbo",
+        "AZURE_SA": "devstoreaccount1",
+        "AZURE_SA_CONTAINER": "bench",
+        "AZURE_SA_CONN_STR": connection_string(ports["blob"]),
+        "SHAREPOINT_CLIENT_ID": "fake-client",
+        "SHAREPOINT_CLIENT_SECRET": "fake-secret",
+        "SHAREPOINT_TENANT_ID": dataset.TENANT_ID,
+        "SHAREPOINT_DOMAIN": dataset.DOMAIN,
+        "GRAPH_ENDPOINT": f"http://127.0.0.1:{ports['graph']}",
+        "GRAPH_LOGIN_ENDPOINT": f"http://127.0.0.1:{ports['graph']}",
+        "REQUESTS_CA_BUNDLE": cert_path,
+        "SSL_CERT_FILE": cert_path,
+        "STATE_BACKEND": "sqlite" if args.workers > 1 else "memory",
+        "STATE_SQLITE_PATH": os.path.join(work_dir, "state.sqlite3"),
+        "WEB_CONCURRENCY": str(args.workers),
+        "TEXT_EXTRACTION_ENABLED": "false",
+        "OTEL_EXPORTER": "none",
+        "APPLICATIONINSIGHTS_CONNECTION_STRING": "",
+        "TRAFFIC_CAPTURE_PATH": os.path.abspath(args.capture) if args.capture else "",
+        "TRAFFIC_CAPTURE_SALT": "offline-suite",
+        # every indexed site can be local, so the searches of every user are local once the tier is loaded
+        "LOCAL_VECTOR_TIER_ENABLED": str(args.local_vectors).lower(),
+        "LOCAL_VECTOR_PATH": os.path.join(work_dir, "vectors"),
+        "LOCAL_VECTOR_MAX_SITES": str(args.indexed_sites),
+        "LOCAL_VECTOR_REFRESH_INTERVAL": str(LOCAL_VECTOR_REFRESH_INTERVAL),
+    }
+    start(stack, ["-m", "uvicorn", "main:app", "--port", str(ports["backend"]), "--workers", str(args.workers),
+                  "--log-level", "warning", "--no-access-log"], REPO_DIR, env)
+    backend_url = f"http://127.0.0.1:{ports['backend']}"
+    wait_ready(backend_url, path="/openapi.json")
+    return backend_url
+
+
+async def run_scenarios(url: str, args: argparse.Namespace) -> dict[str, LoadResult]:
+    results: dict[str, LoadResult] = {}
+    payload = os.urandom(args.file_size)
+    sites = dataset.sites(args.sites)
+    not_indexed = sites[args.indexed_sites:]
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    async def list_sites(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        return await client.get("/api/sharepoint/sites")
+
+    async def list_user_site(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        return await client.request("GET", "/api/sharepoint/list-user-site",
+                                    json={"userId": f"user{i % args.users:05d}@{dataset.DOMAIN}.com"})
+
+    async def search(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        return await client.post("/api/search", json={"userId": f"user{i % args.users:05d}@{dataset.DOMAIN}.com",
+                                                      "query": f"quarterly report {i % args.queries}"})
+
+    first_tokens: list[float] = []
+
+    async def chat(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        start = time.perf_counter()
+        body = {"userId": f"user{i % args.users:05d}@{dataset.DOMAIN}.com",
+                "query": f"quarterly report {i % args.queries}"}
+        first_token = None
+        async with client.stream("POST", "/api/chat", json=body) as response:
+            async for line in response.aiter_lines():
+                if line == "event: token" and first_token is None:
+                    first_token = (time.perf_counter() - start) * 1000
+                elif line == "event: error":
+                    # the stream starts with a 200, a failed answer is counted as an error
+                    response.status_code = 502
+        if first_token is not None:
+            first_tokens.append(first_token)
+        return response
+
+    async def upload(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        return await client.post("/api/files/", files={"file": (f"bench-{i:06d}.pdf", payload)})
+
+    async def list_files(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        return await client.get("/api/files/")
+
+    async def delete(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        names = [f"bench-{n:06d}.pdf" for n in range(i * args.delete_batch, (i + 1) * args.delete_batch)]
+        return await client.request("DELETE", "/api/files/",
+                                    json={"Value": [{"Name": name, "BlobUrl": ""} for name in names]})
+
+    async def provision(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        batch = not_indexed[i * args.provision_batch:(i + 1) * args.provision_batch]
+        body = {"Value": [{**site, "companyId": site["id"].split(",")[0], "siteId1": site["id"].split(",")[1],
+                           "siteId2": site["id"].split(",")[2]} for site in batch]}
+        return await client.post("/api/sharepoint/indexer", json=body)
+
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        async def scenario(name: str, send, requests: int = None, duration: float = None,
+                           concurrency: int = args.concurrency, first_events: list[float] = None,
+                           settle: float = 0) -> None:
+            if name not in args.scenarios:
+                return
+            # warm up the token and the caches, the warmup is not measured
+            if args.warmup and requests is None:
+                await run_load(f"{name}-warmup", send, client, concurrency, requests=args.warmup)
+            await asyncio.sleep(settle)
+            if first_events is not None:
+                first_events.clear()
+            results[name] = await run_load(name, send, client, concurrency, requests=requests, duration=duration)
+            results[name].first_event_ms = list(first_events or [])
+            print(results[name], flush=True)
+
+        await scenario("sharepoint_sites", list_sites, duration=args.duration)
+        await scenario("list_user_site", list_user_site, duration=args.duration)
+        # the local vector tier selects the sites searched during the warmup at its next refresh
+        await scenario("search", search, duration=args.duration,
+                       settle=2.5 * LOCAL_VECTOR_REFRESH_INTERVAL if args.local_vectors else 0)
+        await scenario("chat", chat, duration=args.duration, first_events=first_tokens)
+        await scenario("files_upload", upload, requests=args.uploads)
+        await scenario("files_list", list_files, duration=args.duration)
+        if "files_upload" in args.scenarios:
+            await scenario("files_delete", delete, requests=max(1, args.uploads // args.delete_batch))
+        provision_requests = max(1, len(not_indexed) // args.provision_batch)
+        await scenario("indexer_provisioning", provision, requests=provision_requests,
+                       concurrency=min(args.concurrency, provision_requests))
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> bool:
+    """
+    Prints the change of every metric against a baseline run and returns False on a regression.
+    """
+    print(f"\nComparison against {baseline.get('commit')} ({baseline.get('timestamp')}), tolerance {tolerance:.0%}")
+    print("| scenario | metric | baseline | current | change |")
+    print("| --- | --- | --- | --- | --- |")
+    regressed = False
+    for name, summary in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if not base[metric]:
+                continue
+            change = (summary[metric] - base[metric]) / base[metric]
+            worse = -change if higher_is_better else change
+            flag = " REGRESSION" if worse > tolerance else ""
+            regressed |= bool(flag)
+            print(f"| {name} | {metric} | {base[metric]} | {summary[metric]} | {change:+.1%}{flag} |")
+    return not regressed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--latency-ms", type=float, default=20, help="latency added by every fake")
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="fraction of the upstream requests answered with 429 / 503")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sites", type=int, default=200, help="sites in the fake tenant")
+    parser.add_argument("--indexed-sites", type=int, default=50, help="sites that already have an indexer")
+    parser.add_argument("--docs-per-site", type=int, default=0, help="documents indexed for each indexed site")
+    parser.add_argument("--sites-per-user", type=int, default=10)
+    parser.add_argument("--users", type=int, default=100, help="distinct users of list_user_site and search")
+    parser.add_argument("--queries", type=int, default=500, help="distinct queries of search")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the backend")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10, help="seconds of each duration based scenario")
+    parser.add_argument("--warmup", type=int, default=32, help="unmeasured requests before each scenario")
+    parser.add_argument("--uploads", type=int, default=500)
+    parser.add_argument("--file-size", type=int, default=64 * 1024)
+    parser.add_argument("--delete-batch", type=int, default=50)
+    parser.add_argument("--provision-batch", type=int, default=5)
+    parser.add_argument("--output", default=str(BENCHMARKS_DIR / "results"), help="directory of the result files")
+    parser.add_argument("--compare", default=None, help="result file of a baseline run")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="relative degradation reported as a regression by --compare")
+    parser.add_argument("--capture", default=None, help="record the traffic of the backend to this file")
+    parser.add_argument("--local-vectors", action="store_true",
+                        help="answers the searches from the local vector tier, with vectors in the fake index")
+    parser.add_argument("--serve", action="store_true",
+                        help="only start the fakes and the backend, until interrupted")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir, ExitStack() as stack:
+        url = start_environment(stack, args, work_dir)
+        if args.serve:
+            print(f"Backend listening on {url}, press Ctrl+C to stop", flush=True)
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                return
+        results = asyncio.run(run_scenarios(url, args))
+
+    params = {key: value for key, value in vars(args).items()
+              if key not in ("output", "compare", "tolerance", "capture", "serve")}
+    report = {
+        "version": RESULTS_VERSION,
+        "suite": "offline",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "params": params,
+        "scenarios": {name: result.summary() for name, result in results.items()},
+    }
+    os.makedirs(args.output, exist_ok=True)
+    output_path = Path(args.output) / f"offline-{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(output_path, "w") as file:
+        json.dump(report, file, indent=2)
+
+    print("\n| scenario | requests | errors | req/s | p50 (ms) | p99 (ms) |")
+    print("| --- | --- | --- | --- | --- | --- |")
+    for name, s in report["scenarios"].items():
+        print(f"| {name} | {s['requests']} | {s['errors']} | {s['throughput_rps']} | {s['p50_ms']} | {s['p99_ms']} |")
+    print(f"\nResults written to {output_path}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline.get("params") != params:
+            print("warning: the baseline was run with different parameters")
+        if not compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Replays a traffic capture against a running backend.
+
+The capture is the JSON lines file written by the backend when TRAFFIC_CAPTURE_PATH is set (see
+src/TrafficCapture.py). Requests are sent open-loop at their captured times divided by --speed, so --speed 4
+replays the same traffic four times faster; --closed-loop ignores the timestamps and sends back to back instead.
+--concurrency caps the requests in flight, a request that waits for a slot is counted as late.
+
+Uploaded files are replaced by random content of the captured size. The pseudonymized bodies are sent as is,
+which suits the offline fakes (benchmarks/offline_suite.py) that accept any user or site name.
+
+Usage:
+    python benchmarks/replay.py .traffic/requests.jsonl --url http://127.0.0.1:8501 --speed 2
+    python benchmarks/replay.py .traffic/requests.jsonl --closed-loop --concurrency 64 --paths /api/sharepoint/
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+
+import httpx
+
+from loadgen import LoadResult, percentile
+
+
+def load_capture(path: str, paths: list[str] = None, limit: int = None) -> list[dict]:
+    records = []
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if paths and not any(record["path"].startswith(prefix) for prefix in paths):
+                continue
+            records.append(record)
+    records.sort(key=lambda r: r["ts"])
+    return records[:limit] if limit else records
+
+
+def build_request(client: httpx.AsyncClient, record: dict, index: int, payload: bytes) -> httpx.Request:
+    kwargs = {"params": record.get("query") or None}
+    if record.get("content_type") == "multipart/form-data":
+        # the multipart envelope is ~200 bytes per file
+        files = record.get("files") or [{"ext": ""}]
+        size = max(0, record["body_bytes"] // len(files) - 200)
+        kwargs["files"] = [("file", (f"replay-{index:06d}-{n}{f['ext']}", payload[:size]))
+                           for n, f in enumerate(files)]
+    elif record.get("body") is not None:
+        kwargs["json"] = record["body"]
+    return client.build_request(record["method"], record["path"], **kwargs)
+
+
+async def replay(records: list[dict], url: str, speed: float, concurrency: int, closed_loop: bool,
+                 repeat: int) -> tuple[dict[str, LoadResult], LoadResult, list[float]]:
+    results: dict[str, LoadResult] = {}
+    overall = LoadResult(name="all")
+    lags_ms: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    largest = max((r["body_bytes"] for r in records), default=0)
+    payload = os.urandom(largest)
+    duration = (records[-1]["ts"] - records[0]["ts"]) if records else 0
+
+    async with httpx.AsyncClient(base_url=url, timeout=120,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def send(record: dict, index: int, scheduled: float) -> None:
+            async with semaphore:
+                sent = time.perf_counter()
+                if not closed_loop:
+                    lags_ms.append(max(0.0, sent - scheduled) * 1000)
+                name = f"{record['method']} {record['path']}"
+                result = results.setdefault(name, LoadResult(name=name))
+                try:
+                    res = await client.send(build_request(client, record, index, payload))
+                    failed = res.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                latency = (time.perf_counter() - sent) * 1000
+                for r in (result, overall):
+                    r.latencies_ms.append(latency)
+                    r.errors += failed
+
+        start = time.perf_counter()
+        tasks = []
+        for iteration in range(repeat):
+            offset = iteration * duration
+            for index, record in enumerate(records):
+                scheduled = start + (offset + record["ts"] - records[0]["ts"]) / speed
+                if not closed_loop:
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(send(record, iteration * len(records) + index, scheduled)))
+                if closed_loop and len(tasks) >= concurrency * 4:
+                    # keep the number of pending tasks bounded
+                    await asyncio.gather(*tasks)
+                    tasks = []
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    overall.elapsed_s = elapsed
+    for result in results.values():
+        result.elapsed_s = elapsed
+    return results, overall, lags_ms
+
+
+def captured_summary(records: list[dict]) -> dict[str, dict]:
+    """
+    Summarizes the latency and outbound calls of the captured requests, per endpoint.
+    """
+    by_endpoint: dict[str, list[dict]] = {}
+    for record in records:
+        by_endpoint.setdefault(f"{record['method']} {record['path']}", []).append(record)
+    summary = {}
+    for name, endpoint_records in by_endpoint.items():
+        durations = [r["duration_ms"] for r in endpoint_records]
+        upstream = [len(r.get("upstream") or []) for r in endpoint_records]
+        summary[name] = {"requests": len(endpoint_records),
+                         "p50_ms": round(percentile(durations, 50), 2),
+                         "p99_ms": round(percentile(durations, 99), 2),
+                         "upstream_calls_per_request": round(sum(upstream) / len(upstream), 2)}
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="the JSON lines capture file")
+    parser.add_argument("--url", default="http://127.0.0.1:8501")
+    parser.add_argument("--speed", type=float, default=1.0, help="time scale, 2 replays twice as fast")
+    parser.add_argument("--concurrency", type=int, default=64, help="maximum requests in flight")
+    parser.add_argument("--closed-loop", action="store_true", help="ignore the timestamps, send back to back")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the capture this many times")
+    parser.add_argument("--paths", nargs="+", default=None, help="only replay the paths with these prefixes")
+    parser.add_argument("--limit", type=int, default=None, help="only replay the first requests")
+    parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    records = load_capture(args.capture, args.paths, args.limit)
+    if not records:
+        raise SystemExit(f"No request to replay in {args.capture}")
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"Replaying {len(records)} requests captured over {span:.1f}s "
+          f"({'closed loop' if args.closed_loop else f'speed x{args.speed}'}, concurrency {args.concurrency}, "
+          f"repeat {args.repeat})")
+    results, overall, lags_ms = asyncio.run(replay(records, args.url, args.speed, args.concurrency,
+                                                   args.closed_loop, args.repeat))
+    captured = captured_summary(records)
+
+    print("\n| endpoint | requests | errors | p50 (ms) | p99 (ms) | captured p50 | captured p99 | upstream/req |")
+    print("| --- | --- | --- | --- | --- | --- | --- | --- |")
+    for name, result in sorted(results.items()):
+        s, c = result.summary(), captured.get(name, {})
+        print(f"| {name} | {s['requests']} | {s['errors']} | {s['p50_ms']} | {s['p99_ms']} | "
+              f"{c.get('p50_ms')} | {c.get('p99_ms')} | {c.get('upstream_calls_per_request')} |")
+    print(f"\n{overall}")
+    if lags_ms:
+        late = sum(1 for lag in lags_ms if lag > 10)
+        print(f"schedule lag: p50 {percentile(lags_ms, 50):.1f}ms, p99 {percentile(lags_ms, 99):.1f}ms, "
+              f"{late} requests more than 10ms late")
+
+    if args.output:
+        report = {
+            "version": 1,
+            "suite": "replay",
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "params": {key: value for key, value in vars(args).items() if key != "output"},
+            "overall": overall.summary(),
+            "schedule_lag_p99_ms": round(percentile(lags_ms, 99), 2),
+            "endpoints": {name: result.summary() for name, result in results.items()},
+            "captured": captured,
+        }
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Serialization micro-benchmark of the list endpoints.
+
+Compares, for growing list sizes, the response paths used before and after the typed output models:
+    blob_list        BlobPropertiesApiOut with `Value: any` through jsonable_encoder + json.dumps,
+                     against the typed model dumped by pydantic-core (FastAPI's response model fast path)
+    site_list        a SharepointSiteList from another module (the sys.path import of the Graph helper)
+                     re-validated by attributes, against the same class passed through as is
+    blob_records     a BlobClient per blob to get its URL and validated records, against blob_url + model_construct
+    site_membership  the nested group / proxy address / site loop, against the set lookup
+
+Usage:
+    python benchmarks/serialization.py --sizes 100 1000 10000
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from azure.storage.blob import ContainerClient
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, ConfigDict, TypeAdapter
+
+from src.StorageHandler import blob_url
+from src.model.common import AzureADGroupList, BlobProperties, SharepointSiteList
+from src.model.output import BlobPropertiesApiOut
+from src.sharepoint.SharepointHelpers import SharepointHelper
+
+
+class LegacyBlobPropertiesApiOut(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    Value: any
+
+
+class ForeignSharepointSite(BaseModel):
+    displayName: str
+    name: str
+    webUrl: str
+    id: str
+    companyId: str
+    siteId1: str
+    siteId2: str
+
+
+class ForeignSharepointSiteList(BaseModel):
+    Value: list[ForeignSharepointSite]
+
+
+def make_sites(count: int) -> list[dict]:
+    sites = []
+    for i in range(count):
+        site_id1, site_id2 = str(uuid.uuid4()), str(uuid.uuid4())
+        sites.append({"displayName": f"Site {i}", "name": f"site{i}",
+                      "webUrl": f"https://contoso.sharepoint.com/sites/site{i}",
+                      "id": f"contoso.sharepoint.com,{site_id1},{site_id2}", "companyId": "contoso.sharepoint.com",
+                      "siteId1": site_id1, "siteId2": site_id2})
+    return sites
+
+
+def make_groups(sites: list[dict], count: int) -> AzureADGroupList:
+    groups = []
+    for i in range(count):
+        addresses = [f"SMTP:group{i}@contoso.com"]
+        if i % 2 == 0 and sites:
+            addresses.insert(0, f"SPO:SPO_{sites[(i * 7) % len(sites)]['siteId1']}@SPO_tenant")
+        groups.append({"displayName": f"Group {i}", "id": str(uuid.uuid4()), "proxyAddresses": addresses})
+    return AzureADGroupList(Value=groups)
+
+
+def legacy_membership(user_group_list: AzureADGroupList, site_list: SharepointSiteList) -> SharepointSiteList:
+    user_site_belong_list = []
+    for site in site_list.Value:
+        for group in user_group_list.Value:
+            for g in group.proxyAddresses:
+                if g.__contains__("SPO") and site.siteId1 in g:
+                    user_site_belong_list.append(site)
+    return SharepointSiteList(Value=user_site_belong_list)
+
+
+def bench(statement, number: int) -> float:
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--groups", type=int, default=200, help="groups of the user in site_membership")
+    args = parser.parse_args()
+
+    blob_adapter = TypeAdapter(BlobPropertiesApiOut)
+    site_adapter = TypeAdapter(SharepointSiteList)
+    container_client = ContainerClient("https://account.blob.core.windows.net", "container", credential="a2V5")
+    print("| case | size | before (ms) | after (ms) | speedup |")
+    print("| --- | --- | --- | --- | --- |")
+    for size in args.sizes:
+        number = max(1, 20000 // size)
+        names = [f"folder/document {i}.pdf" for i in range(size)]
+        blobs = [BlobProperties(Name=name, BlobUrl=blob_url(container_client.url, name)) for name in names]
+        legacy_blobs = LegacyBlobPropertiesApiOut(Value=blobs)
+        typed_blobs = BlobPropertiesApiOut(Value=blobs)
+        sites = make_sites(size)
+        foreign_sites = ForeignSharepointSiteList(Value=sites)
+        typed_sites = SharepointSiteList(Value=sites)
+        groups = make_groups(sites, args.groups)
+
+        cases = {
+            "blob_list": (
+                lambda: json.dumps(jsonable_encoder(legacy_blobs)).encode(),
+                lambda: blob_adapter.dump_json(blob_adapter.validate_python(typed_blobs, from_attributes=True)),
+            ),
+            "site_list": (
+                lambda: site_adapter.dump_json(site_adapter.validate_python(foreign_sites, from_attributes=True)),
+                lambda: site_adapter.dump_json(site_adapter.validate_python(typed_sites, from_attributes=True)),
+            ),
+            "blob_records": (
+                lambda: [BlobProperties(Name=name, BlobUrl=container_client.get_blob_client(name).url)
+                         for name in names],
+                lambda: [BlobProperties.model_construct(Name=name, BlobUrl=blob_url(container_client.url, name))
+                         for name in names],
+            ),
+            "site_membership": (
+                lambda: legacy_membership(groups, typed_sites),
+                lambda: SharepointHelper.check_user_belong_to_site(groups, typed_sites),
+            ),
+        }
+        for name, (before, after) in cases.items():
+            before_ms, after_ms = bench(before, number), bench(after, number)
+            print(f"| {name} | {size} | {before_ms:.3f} | {after_ms:.3f} | x{before_ms / after_ms:.1f} |", flush=True)
+
+
+if __name__ == '__main__':
+    main()
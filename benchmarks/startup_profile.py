@@ -0,0 +1,105 @@
+"""
+Import-time and startup profile of the backend.
+
+Measures, in fresh interpreters, how long `import main` takes and how long the FastAPI lifespan takes to
+start, then lists the modules with the highest cumulative import time (python -X importtime). Dummy
+credentials are used so the profile runs offline; no Azure or Graph endpoint is contacted because every
+client is created on first use.
+
+Usage:
+    python benchmarks/startup_profile.py --runs 5 --output startup-report.md
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_DIR = Path(__file__).parent.parent
+
+OFFLINE_ENV = {
+    "AZURE_SEARCH_ENDPOINT": "https://example.search.windows.net",
+    "AZURE_SEARCH_INDEX": "index",
+    "AZURE_SEARCH_KEY": "key",
+    "AZURE_OPENAI_ENDPOINT": "https://example.openai.azure.com",
+    "AZURE_OPENAI_KEY": "key",
+    "AZURE_OPENAI_EMBED_DEPLOYMENT": "embedding",
+    "AZURE_SA": "example",
+    "AZURE_SA_CONTAINER": "container",
+    "AZURE_SA_KEY": "a2V5",
+    "SHAREPOINT_CLIENT_ID": "client",
+    "SHAREPOINT_CLIENT_SECRET": "secret",
+    "SHAREPOINT_TENANT_ID": "tenant",
+    "SHAREPOINT_DOMAIN": "example",
+    "STARTUP_WARMUP": "false",
+}
+
+TIMING_SNIPPET = """
+import time, warnings
+warnings.simplefilter("ignore")
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app):
+    started = time.perf_counter()
+print(imported - start, started - imported)
+"""
+
+
+def run_python(args: list[str], env: dict) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args], cwd=REPO_DIR, env=env, capture_output=True, text=True,
+                          check=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="number of modules listed in the import profile")
+    parser.add_argument("--output", help="write the markdown report to this file")
+    args = parser.parse_args()
+
+    env = {**os.environ, **OFFLINE_ENV}
+    import_times, startup_times = [], []
+    for _ in range(args.runs):
+        imported, started = run_python(["-c", TIMING_SNIPPET], env).stdout.split()
+        import_times.append(float(imported) * 1000)
+        startup_times.append(float(started) * 1000)
+
+    profile = run_python(["-X", "importtime", "-c", "import warnings; warnings.simplefilter('ignore'); import main"],
+                         env).stderr
+    modules = []
+    for line in profile.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        if cumulative.strip().isdigit():
+            modules.append((int(cumulative) / 1000, name.strip()))
+    modules.sort(reverse=True)
+
+    lines = [
+        "# Backend startup profile",
+        "",
+        f"{args.runs} runs, fresh interpreter each, offline credentials.",
+        "",
+        "| phase | median (ms) | min (ms) | max (ms) |",
+        "| --- | --- | --- | --- |",
+        f"| import main | {statistics.median(import_times):.0f} | {min(import_times):.0f} | {max(import_times):.0f} |",
+        f"| lifespan startup | {statistics.median(startup_times):.0f} | {min(startup_times):.0f} "
+        f"| {max(startup_times):.0f} |",
+        "",
+        f"## Top {args.top} cumulative imports",
+        "",
+        "| cumulative (ms) | module |",
+        "| --- | --- |",
+    ]
+    lines += [f"| {cumulative:.1f} | `{name}` |" for cumulative, name in modules[:args.top]]
+    report = "\n".join(lines)
+    print(report)
+    if args.output:
+        Path(args.output).write_text(report + "\n")
+
+
+if __name__ == '__main__':
+    main()
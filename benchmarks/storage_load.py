@@ -0,0 +1,73 @@
+"""
+Load test for the storage endpoints.
+
+Fires many concurrent uploads and listings against a running backend and reports the request throughput
+and latency percentiles of each endpoint.
+
+Usage:
+    python benchmarks/storage_load.py --url http://127.0.0.1:8501 --uploads 200 --lists 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+
+from loadgen import percentile
+
+
+async def timed(semaphore: asyncio.Semaphore, coro_factory) -> tuple[float, int]:
+    async with semaphore:
+        start = time.perf_counter()
+        res = await coro_factory()
+        return time.perf_counter() - start, res.status_code
+
+
+async def run(url: str, uploads: int, lists: int, concurrency: int, file_size: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    payload = os.urandom(file_size)
+    async with httpx.AsyncClient(base_url=url, timeout=120) as client:
+        def upload(i: int):
+            return lambda: client.post("/api/files/", files={"file": (f"loadtest-{i}.pdf", payload)})
+
+        def listing():
+            return lambda: client.get("/api/files/")
+
+        tasks = {"upload": [], "list": []}
+        start = time.perf_counter()
+        for i in range(max(uploads, lists)):
+            if i < uploads:
+                tasks["upload"].append(asyncio.create_task(timed(semaphore, upload(i))))
+            if i < lists:
+                tasks["list"].append(asyncio.create_task(timed(semaphore, listing())))
+        await asyncio.gather(*tasks["upload"], *tasks["list"])
+        elapsed = time.perf_counter() - start
+
+        print(f"total: {uploads + lists} requests in {elapsed:.2f}s "
+              f"({(uploads + lists) / elapsed:.1f} req/s, concurrency {concurrency})")
+        for name, endpoint_tasks in tasks.items():
+            results = [t.result() for t in endpoint_tasks]
+            latencies = [r[0] * 1000 for r in results]
+            errors = sum(1 for r in results if r[1] >= 400)
+            if not latencies:
+                continue
+            print(f"{name:>6}: n={len(latencies)} errors={errors} "
+                  f"mean={statistics.mean(latencies):.1f}ms p50={percentile(latencies, 50):.1f}ms "
+                  f"p99={percentile(latencies, 99):.1f}ms")
+
+        # cleanup the uploaded blobs in one batched request
+        body = {"Value": [{"Name": f"loadtest-{i}.pdf", "BlobUrl": ""} for i in range(uploads)]}
+        await client.request("DELETE", "/api/files/", json=body)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8501")
+    parser.add_argument("--uploads", type=int, default=200)
+    parser.add_argument("--lists", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--file-size", type=int, default=256 * 1024, help="size of each uploaded file in bytes")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.uploads, args.lists, args.concurrency, args.file_size))
@@ -0,0 +1,186 @@
+"""
+Recall / latency / memory benchmark of the vector search profiles (src/VectorProfiles.py).
+
+Rebuilds every candidate profile locally with hnswlib over a sample of the vectors of an index and measures, against
+the exact nearest neighbours of held-out sample vectors:
+    recall@k     the fraction of the exact k nearest neighbours found
+    latency      single-query search time, p50 and p99
+    memory       vectors plus graph, as hnswlib stores them
+    build        the time to build the graph
+
+A candidate is a profile name, optionally with narrower dimensions and scalar quantization, e.g. "balanced@768+int8":
+@<dims> keeps the first dims of every vector (only meaningful for models trained for it, such as
+text-embedding-3-*) and +int8 quantizes each dimension to 8 bits. The service API version used by the backend has
+neither, so these only tell whether an upgrade is worth it.
+
+Usage:
+    pip install hnswlib
+    python benchmarks/vector_profiles.py --export sample.npy --sample-size 20000    # from AZURE_SEARCH_INDEX
+    python benchmarks/vector_profiles.py --vectors sample.npy --k 5 10
+    python benchmarks/vector_profiles.py --synthetic 20000 --candidates default balanced balanced+int8
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loadgen import percentile
+from src.VectorProfiles import VECTOR_PROFILES, vector_profile
+
+CANDIDATE = re.compile(r"^(?P<name>[a-zA-Z]+)(@(?P<dims>\d+))?(?P<int8>\+int8)?$")
+
+
+def export_sample(path: str, size: int) -> np.ndarray:
+    """
+    Exports the chunkVector of the first `size` documents of AZURE_SEARCH_INDEX to a .npy file.
+    """
+    from azure.core.credentials import AzureKeyCredential
+    from azure.identity import DefaultAzureCredential
+    from azure.search.documents import SearchClient
+
+    key = os.environ.get("AZURE_SEARCH_KEY")
+    client = SearchClient(os.environ["AZURE_SEARCH_ENDPOINT"], os.environ["AZURE_SEARCH_INDEX"],
+                          AzureKeyCredential(key) if key else DefaultAzureCredential())
+    vectors = [doc["chunkVector"] for doc in client.search(search_text="*", select=["chunkVector"], top=size)
+               if doc.get("chunkVector")]
+    sample = np.asarray(vectors, dtype=np.float32)
+    np.save(path, sample)
+    print(f"Exported {len(sample)} vectors of {sample.shape[1]} dimensions to {path}", flush=True)
+    return sample
+
+
+def synthetic_sample(size: int, dimensions: int, seed: int) -> np.ndarray:
+    # clustered like the chunks of a few hundred documents, uniform random vectors are unrealistically hard
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, size // 50), dimensions))
+    vectors = centers[rng.integers(0, len(centers), size)] + 0.6 * rng.normal(size=(size, dimensions))
+    return vectors.astype(np.float32)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def quantize_int8(vectors: np.ndarray) -> np.ndarray:
+    # per-dimension min/max scalar quantization, returned dequantized to measure its effect on recall
+    low, high = vectors.min(axis=0), vectors.max(axis=0)
+    scale = np.maximum(high - low, 1e-12) / 255
+    codes = np.round((vectors - low) / scale).astype(np.uint8)
+    return codes.astype(np.float32) * scale + low
+
+
+def exact_neighbours(base: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ base.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def run_candidate(spec: str, base: np.ndarray, queries: np.ndarray, truth: dict[int, np.ndarray],
+                  threads: int) -> dict:
+    match = CANDIDATE.match(spec)
+    if match is None:
+        raise ValueError(f"Invalid candidate {spec}, expected <profile>[@<dims>][+int8]")
+    profile = vector_profile(match["name"])
+    dims = int(match["dims"] or base.shape[1])
+    vectors, query_vectors = normalize(base[:, :dims]), normalize(queries[:, :dims])
+    if match["int8"]:
+        vectors = normalize(quantize_int8(vectors))
+    vector_bytes = len(vectors) * dims * (1 if match["int8"] else 4)
+    max_k = max(truth)
+
+    start = time.perf_counter()
+    if profile.Kind == "hnsw":
+        try:
+            import hnswlib
+        except ImportError:
+            raise SystemExit("hnswlib is required for the HNSW profiles: pip install hnswlib")
+        index = hnswlib.Index(space="cosine", dim=dims)
+        index.init_index(max_elements=len(vectors), ef_construction=profile.EfConstruction, M=profile.M)
+        index.add_items(vectors, np.arange(len(vectors)), num_threads=threads)
+        index.set_ef(max(profile.EfSearch, max_k))
+        index.set_num_threads(1)
+        with tempfile.TemporaryDirectory() as work_dir:
+            path = os.path.join(work_dir, "index.bin")
+            index.save_index(path)
+            graph_bytes = os.path.getsize(path) - len(vectors) * dims * 4
+
+        def search(query: np.ndarray) -> np.ndarray:
+            return index.knn_query(query, k=max_k)[0][0]
+    else:
+        graph_bytes = 0
+
+        def search(query: np.ndarray) -> np.ndarray:
+            return exact_neighbours(vectors, query[None, :], max_k)[0]
+    build_s = time.perf_counter() - start
+
+    latencies, found = [], []
+    for query in query_vectors:
+        start = time.perf_counter()
+        found.append(search(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    result = {"candidate": spec, "m": profile.M if profile.Kind == "hnsw" else None,
+              "ef_construction": profile.EfConstruction if profile.Kind == "hnsw" else None,
+              "ef_search": profile.EfSearch if profile.Kind == "hnsw" else None, "dimensions": dims,
+              "build_s": round(build_s, 2), "memory_mb": round((vector_bytes + graph_bytes) / 2 ** 20, 1),
+              "p50_ms": round(percentile(latencies, 50), 3), "p99_ms": round(percentile(latencies, 99), 3)}
+    for k, expected in truth.items():
+        hits = sum(len(set(row[:k].tolist()) & set(exact[:k].tolist())) for row, exact in zip(found, expected))
+        result[f"recall@{k}"] = round(hits / (k * len(expected)), 4)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--vectors", help=".npy file of the sample vectors, one per row")
+    source.add_argument("--export", help="exports a sample of the index to this .npy file and benchmarks it")
+    source.add_argument("--synthetic", type=int, help="benchmarks this many clustered random vectors")
+    parser.add_argument("--sample-size", type=int, default=20000, help="vectors exported by --export")
+    parser.add_argument("--dimensions", type=int, default=1536, help="dimensions of the --synthetic vectors")
+    parser.add_argument("--queries", type=int, default=500, help="sample vectors held out as queries")
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 10, 50])
+    parser.add_argument("--candidates", nargs="+",
+                        default=[*VECTOR_PROFILES, "balanced+int8", "balanced@768", "balanced@768+int8"])
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="threads building the graphs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also writes the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.vectors:
+        sample = np.load(args.vectors).astype(np.float32)
+    elif args.export:
+        sample = export_sample(args.export, args.sample_size)
+    else:
+        sample = synthetic_sample(args.synthetic, args.dimensions, args.seed)
+    order = np.random.default_rng(args.seed).permutation(len(sample))
+    queries, base = sample[order[:args.queries]], sample[order[args.queries:]]
+    print(f"{len(base)} vectors of {base.shape[1]} dimensions, {len(queries)} queries", flush=True)
+
+    # the exact neighbours at full precision and dimensions are the reference of every candidate
+    truth_all = exact_neighbours(normalize(base), normalize(queries), max(args.k))
+    truth = {k: truth_all[:, :k] for k in sorted(args.k)}
+    results = []
+    recall_columns = [f"recall@{k}" for k in truth]
+    print(f"| candidate | dims | {' | '.join(recall_columns)} | p50 (ms) | p99 (ms) | memory (MB) | build (s) |")
+    print("| --- " * (6 + len(recall_columns)) + "|")
+    for spec in args.candidates:
+        result = run_candidate(spec, base, queries, truth, args.threads)
+        results.append(result)
+        print(f"| {spec} | {result['dimensions']} | {' | '.join(str(result[c]) for c in recall_columns)} | "
+              f"{result['p50_ms']} | {result['p99_ms']} | {result['memory_mb']} | {result['build_s']} |", flush=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"vectors": len(base), "dimensions": int(base.shape[1]), "queries": len(queries),
+                       "results": results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
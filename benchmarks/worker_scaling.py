@@ -0,0 +1,94 @@
+"""
+Request throughput of the backend against the number of uvicorn workers.
+
+For each worker count, starts `uvicorn main:app --workers N` with the SQLite state backend, drives the
+endpoint with a closed-loop load and reports throughput and latency percentiles. The backend uses the Azure,
+Graph and OpenAI settings of the current environment (.env included).
+
+Usage:
+    python benchmarks/worker_scaling.py --workers 1 2 4 --path /api/sharepoint/sites --duration 20
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from loadgen import run_load
+
+REPO_DIR = Path(__file__).parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/openapi.json", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"backend at {url} did not start")
+
+
+async def drive(url: str, method: str, path: str, body: str, concurrency: int, duration: float):
+    async with httpx.AsyncClient(base_url=url, timeout=60,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def send(c: httpx.AsyncClient, i: int) -> httpx.Response:
+            return await c.request(method, path, content=body, headers={"Content-Type": "application/json"})
+
+        # warm up the token and caches of every worker
+        await run_load("warmup", send, client, concurrency, requests=concurrency * 4)
+        return await run_load(path, send, client, concurrency, duration=duration)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--path", default="/api/sharepoint/sites")
+    parser.add_argument("--body", default=None, help="JSON request body")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20)
+    args = parser.parse_args()
+
+    rows = []
+    for workers in args.workers:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        with tempfile.TemporaryDirectory() as state_dir:
+            env = {**os.environ, "STATE_BACKEND": "sqlite", "WEB_CONCURRENCY": str(workers),
+                   "STATE_SQLITE_PATH": os.path.join(state_dir, "state.sqlite3")}
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers),
+                 "--log-level", "warning"],
+                cwd=REPO_DIR, env=env)
+            try:
+                wait_ready(url)
+                result = asyncio.run(drive(url, args.method, args.path, args.body, args.concurrency, args.duration))
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+        print(f"{workers} workers -> {result}")
+        rows.append((workers, result.summary()))
+
+    print("\n| workers | req/s | p50 (ms) | p99 (ms) | errors |")
+    print("| --- | --- | --- | --- | --- |")
+    for workers, s in rows:
+        print(f"| {workers} | {s['throughput_rps']} | {s['p50_ms']} | {s['p99_ms']} | {s['errors']} |")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,168 +1,149 @@
+import asyncio
+import logging
 import os
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile
-
-from src.LocalFileAndFolderOps import write_to_file
-from src.StorageHandler import StorageHandler
-from src.model.common import SharepointSiteList
-from src.model.config import (
-    SharepointSearchConfig,
-    SharepointHelperConfig,
-    StorageConfig,
-    StorageSearchConfig,
-    SearchConfig
-)
+from fastapi import FastAPI, HTTPException, UploadFile, BackgroundTasks, Request, Response
+from fastapi.responses import StreamingResponse
+
+from src.AppServices import AppServices, load_app_config
+from src.HttpCaching import CompressionMiddleware, conditional_response
+from src.LocalFileAndFolderOps import iter_upload_file, iter_local_file, write_to_file
+from src.SingleFlight import configure_single_flight
+from src.Telemetry import configure_telemetry
+from src.TextExtraction import EXTRACTED_TEXT_PREFIX, extracted_text_blob_name
+from src.TrafficCapture import TrafficCaptureMiddleware
+from src.sharepoint.SiteReconciler import SiteSetReconciler
+from src.model.common import (SharepointSiteList, BlobHandlerUploadBlob, IndexerList, IndexedSite, SiteReconcilePlan,
+                              IndexerSchedule)
 from src.model.input import (
     ListUserSiteApiIn,
+    SearchApiIn,
+    ChatApiIn,
     BlobPropertiesApiIn
 )
-from src.sharepoint.SharepointHelpers import SharepointHelper
-from src.sharepoint.SharepointSearchHandler import SharepointSearchHandler
-from src.StorageSearchHandler import StorageSearchHandler
-from src.SearchHandler import SearchHandler
+from src.model.output import BlobDeleteApiOut, BlobPropertiesApiOut, SearchApiOut
 
-app = FastAPI(debug=True)
 load_dotenv()
 
-# env configuration
-try:
-    AZURE_STORAGE_ENV = {
-        "StorageName": os.environ["AZURE_SA"],
-        "StorageConnStr": os.environ["AZURE_SA_CONN_STR"],
-        "ContainerName": os.environ["AZURE_SA_CONTAINER"],
-    }
-except KeyError as kerr:
-    AZURE_STORAGE_ENV = {
-        "StorageName": "",
-        "StorageConnStr": "",
-        "ContainerName": "",
-    }
-
-try:
-    SHAREPOINT_ENV = {
-        "ClientId": os.environ["SHAREPOINT_CLIENT_ID"],
-        "ClientSecret": os.environ["SHAREPOINT_CLIENT_SECRET"],
-        "TenantId": os.environ["SHAREPOINT_TENANT_ID"],
-        "Domain": os.environ["SHAREPOINT_DOMAIN"]
-    }
-except KeyError as kerr:
-    SHAREPOINT_ENV = {
-        "ClientId": "",
-        "ClientSecret": "",
-        "TenantId": "",
-        "Domain": ""
-    }
-
-AZURE_SEARCH_ENV = {
-    "Endpoint": os.environ["AZURE_SEARCH_ENDPOINT"],
-    "IndexName": os.environ["AZURE_SEARCH_INDEX"]
-}
-AZURE_OPENAI_ENV = {
-    "Endpoint": os.environ["AZURE_OPENAI_ENDPOINT"],
-    "Key": os.environ["AZURE_OPENAI_KEY"],
-    "EmbedDeployment": os.environ["AZURE_OPENAI_EMBED_DEPLOYMENT"]
-}
-
-# Initiate configuration
-STORAGE_ENABLED = False
-if AZURE_STORAGE_ENV["StorageName"] and AZURE_STORAGE_ENV["ContainerName"]:
-    STORAGE_ENABLED = True
-    STORAGE_CONFIG = StorageConfig(
-        StorageName=AZURE_STORAGE_ENV["StorageName"],
-        ContainerName=AZURE_STORAGE_ENV["ContainerName"]
-    )
-    STORAGE_SEARCH_CONFIG = StorageSearchConfig(
-        Endpoint=AZURE_SEARCH_ENV["Endpoint"],
-        IndexName=AZURE_SEARCH_ENV["IndexName"],
-        AoaiEndpoint=AZURE_OPENAI_ENV["Endpoint"],
-        AoaiKey=AZURE_OPENAI_ENV["Key"],
-        AoaiEmbedDeployment=AZURE_OPENAI_ENV["EmbedDeployment"],
-        StorageName=AZURE_STORAGE_ENV["StorageName"],
-        ContainerName=AZURE_STORAGE_ENV["ContainerName"],
-    )
-    if AZURE_STORAGE_ENV["StorageConnStr"]:
-        STORAGE_CONFIG.StorageConnStr = AZURE_STORAGE_ENV["StorageConnStr"]
-        STORAGE_SEARCH_CONFIG.StorageConnStr = AZURE_STORAGE_ENV["StorageConnStr"]
-
-SHAREPOINT_ENABLED = False
-if SHAREPOINT_ENV["ClientId"] and SHAREPOINT_ENV["ClientSecret"] and SHAREPOINT_ENV["TenantId"] and SHAREPOINT_ENV["Domain"]:
-    SHAREPOINT_ENABLED = True
-    SHAREPOINT_HELPER_CONFIG = SharepointHelperConfig(
-        ClientId=SHAREPOINT_ENV["ClientId"],
-        ClientSecret=SHAREPOINT_ENV["ClientSecret"],
-        TenantId=SHAREPOINT_ENV["TenantId"]
-    )
-    SHAREPOINT_SEARCH_CONFIG = SharepointSearchConfig(
-        Endpoint=AZURE_SEARCH_ENV["Endpoint"],
-        IndexName=AZURE_SEARCH_ENV["IndexName"],
-        AoaiEndpoint=AZURE_OPENAI_ENV["Endpoint"],
-        AoaiKey=AZURE_OPENAI_ENV["Key"],
-        AoaiEmbedDeployment=AZURE_OPENAI_ENV["EmbedDeployment"],
-        SharepointClientId=SHAREPOINT_ENV["ClientId"],
-        SharepointClientSecret=SHAREPOINT_ENV["ClientSecret"],
-        SharepointTenantId=SHAREPOINT_ENV["TenantId"],
-        SharepointDomain=SHAREPOINT_ENV["Domain"]
-    )
-
-if STORAGE_ENABLED or SHAREPOINT_ENABLED:
-    SEARCH_CONFIG = SearchConfig(
-        Endpoint=AZURE_SEARCH_ENV["Endpoint"],
-        IndexName=AZURE_SEARCH_ENV["IndexName"],
-        AoaiEndpoint=AZURE_OPENAI_ENV["Endpoint"],
-        AoaiKey=AZURE_OPENAI_ENV["Key"],
-        AoaiEmbedDeployment=AZURE_OPENAI_ENV["EmbedDeployment"]
-    )
-else:
-    raise SystemExit("No Azure Search configuration found")
+# env configuration, the Azure and Graph clients are created on first use by AppServices
+APP_CONFIG = load_app_config()
+STORAGE_ENABLED = APP_CONFIG.StorageEnabled
+SHAREPOINT_ENABLED = APP_CONFIG.SharepointEnabled
+services = AppServices(APP_CONFIG)
+configure_single_flight(APP_CONFIG.SingleFlight)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not (STORAGE_ENABLED or SHAREPOINT_ENABLED):
+        raise RuntimeError("No Azure Search configuration found")
+    if int(os.environ.get("WEB_CONCURRENCY", 1)) > 1 and APP_CONFIG.State.Backend == "memory":
+        logging.warning("Running several workers with STATE_BACKEND=memory, tokens and caches are not shared")
+    tasks = []
+    if APP_CONFIG.StartupWarmup:
+        tasks.append(asyncio.create_task(services.warm_up()))
+    if SHAREPOINT_ENABLED and APP_CONFIG.State.IndexedSitesReconcileInterval > 0:
+        tasks.append(asyncio.create_task(services.reconcile_indexed_sites()))
+    if services.site_access_map is not None:
+        tasks.append(asyncio.create_task(services.materialize_site_access()))
+    if services.indexer_scheduler is not None:
+        tasks.append(asyncio.create_task(services.schedule_indexers()))
+    elif SHAREPOINT_ENABLED:
+        tasks.append(asyncio.create_task(services.restore_indexer_schedules()))
+    if services.chunk_deduplicators is not None:
+        tasks.append(asyncio.create_task(services.deduplicate_chunks()))
+    if services.orphan_collector is not None:
+        tasks.append(asyncio.create_task(services.collect_orphans()))
+    if services.local_vector_tier is not None:
+        tasks.append(asyncio.create_task(services.refresh_local_vectors()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await services.close()
+
+
+app = FastAPI(debug=True, lifespan=lifespan)
+configure_telemetry(app)
+app.add_middleware(CompressionMiddleware)
+if APP_CONFIG.TrafficCapture.Enabled:
+    app.add_middleware(TrafficCaptureMiddleware, config=APP_CONFIG.TrafficCapture)
 
 # Storage APIs
 if STORAGE_ENABLED:
+    async def extract_uploaded_text(file_path: str, blob_name: str) -> None:
+        """
+        Extracts the text of an uploaded document on the process pool and stores it next to its blob.
+
+        Args:
+            file_path (str): The local copy of the uploaded document, removed once extracted.
+            blob_name (str): The name of the document blob.
+        """
+        try:
+            result = await services.text_extractor.extract(file_path)
+            await services.storage_handler.upload_stream(extracted_text_blob_name(blob_name), iter_local_file(result.OutputPath))
+            os.remove(result.OutputPath)
+        except Exception as err:
+            logging.error(f"Text extraction failed for {blob_name}: {err}")
+        finally:
+            os.remove(file_path)
+
     @app.post('/api/files/')
-    def upload_file(file: UploadFile):
+    async def upload_file(file: UploadFile, background_tasks: BackgroundTasks) -> BlobHandlerUploadBlob:
         """
         Uploads a file to the Azure Blob Storage container.
 
+        The file is streamed to the blob in chunks, the request never blocks a threadpool worker.
+        When text extraction is enabled, the text of supported documents is extracted after the response
+        is sent and stored as a JSON lines blob under EXTRACTED_TEXT_PREFIX.
+
         Args:
             file (UploadFile): The file to be uploaded.
 
         Returns:
             BlobHandlerUploadBlob: An object containing the upload status and blob URL.
         """
-        storage_helper = StorageHandler(STORAGE_CONFIG)
-        file_path = write_to_file(file.filename, file)
-        return storage_helper.upload_blob(file_path)
+        text_extractor = services.text_extractor
+        if text_extractor is None or not text_extractor.is_extractable(file.filename):
+            return await services.storage_handler.upload_stream(file.filename, iter_upload_file(file))
+        file_path = await asyncio.to_thread(write_to_file, file.filename, file)
+        result = await services.storage_handler.upload_stream(file.filename, iter_local_file(file_path))
+        background_tasks.add_task(extract_uploaded_text, file_path, file.filename)
+        return result
 
     @app.delete('/api/files/')
-    def delete_file(file_list: BlobPropertiesApiIn):
+    async def delete_file(file_list: BlobPropertiesApiIn, soft_delete: bool = False) -> BlobDeleteApiOut:
         """
         Deletes multiple blobs from the Azure Blob Storage container.
 
         Args:
             file_list (BlobPropertiesApiIn): A BlobPropertiesApiIn object containing a list of BlobProperties objects, each representing a blob to be deleted.
+            soft_delete (bool, optional): Mark the blobs with the IsDeleted metadata instead of deleting them,
+                so the indexer removes their documents from the index. Defaults to False.
 
         Returns:
-            bool: True if all blobs are successfully deleted, False otherwise.
-
-        Raises:
-            HttpResponseError: If there is an error while deleting a blob.
+            BlobDeleteApiOut: A BlobDeleteApiOut object with the outcome of each blob.
         """
-        storage_helper = StorageHandler(STORAGE_CONFIG)
-        for file in file_list.Value:
-            storage_helper.delete_blob(file.Name)
-        return True
-
-    @app.get('/api/files/')
-    def list_blob():
+        blob_names = [file.Name for file in file_list.Value]
+        result = await services.storage_handler.delete_blobs(blob_names, soft_delete=soft_delete)
+        if services.text_extractor is not None and not soft_delete:
+            await services.storage_handler.delete_blobs([extracted_text_blob_name(name) for name in blob_names])
+        return result
+
+    @app.get('/api/files/', response_model=BlobPropertiesApiOut)
+    async def list_blob(request: Request) -> Response:
         """
             Retrieves a list of blobs from the Azure Blob Storage container.
 
+            The response carries an ETag, a request with a matching If-None-Match header gets 304 Not Modified.
+
             Returns:
                 BlobPropertiesApiOut: A BlobPropertiesApiOut object containing a list of BlobProperties objects.
                     Each BlobProperties object contains the name and URL of a blob.
         """
-        storage_helper = StorageHandler(STORAGE_CONFIG)
-        return storage_helper.list_blobs()
+        blob_list = await services.storage_handler.list_blobs(exclude_prefix=EXTRACTED_TEXT_PREFIX)
+        return conditional_response(request, blob_list)
 
     @app.post('/api/files/indexer')
     def create_storage_indexer():
@@ -175,21 +156,18 @@ if STORAGE_ENABLED:
         Raises:
             Exception: If there is an error while creating the storage indexer.
         """
-        cognitive_search = StorageSearchHandler(config=STORAGE_SEARCH_CONFIG)
-        cognitive_search.create_indexer_flow()
+        services.storage_search_handler.create_indexer_flow()
         return "200"
 
 # Sharepoint APIs
-
-SHAREPOINT_ACCESS_TOKEN = None
-sharepoint_helper = SharepointHelper(config=SHAREPOINT_HELPER_CONFIG)
-
 if SHAREPOINT_ENABLED:
-    @app.get('/api/sharepoint/sites')
-    def list_sharepoint_site() -> SharepointSiteList:
+    @app.get('/api/sharepoint/sites', response_model=SharepointSiteList)
+    def list_sharepoint_site(request: Request) -> Response:
         """
         Retrieves a list of SharePoint sites.
 
+        The response carries an ETag, a request with a matching If-None-Match header gets 304 Not Modified.
+
         Returns:
             SharepointSiteList: A SharepointSiteList object containing a list of SharePoint sites.
                 Each SharePoint site object contains the display name, ID, name, and web URL of a site.
@@ -197,7 +175,7 @@ if SHAREPOINT_ENABLED:
         Raises:
             requests.HTTPError: If there is an error while making the API request to retrieve the site list.
         """
-        return sharepoint_helper.list_sites()
+        return conditional_response(request, services.sharepoint_helper.list_sites())
 
     @app.post('/api/sharepoint/indexer')
     def create_sharepoint_indexer(body: SharepointSiteList):
@@ -214,10 +192,11 @@ if SHAREPOINT_ENABLED:
         Raises:
             Exception: If there is an error while creating the SharePoint indexer.
         """
-        cognitive_search = SharepointSearchHandler(config=SHAREPOINT_SEARCH_CONFIG)
+        cognitive_search = services.sharepoint_search_handler
         for sharepoint_site in body.Value:
             site_name = sharepoint_site.name
-            cognitive_search.create_indexer_flow(spo_name=site_name.lower())
+            indexer = cognitive_search.for_site(sharepoint_site.id).create_indexer_flow(spo_name=site_name.lower())
+            services.indexed_sites.add(sharepoint_site, indexer.name)
         return "200"
 
     @app.delete('/api/sharepoint/indexer')
@@ -235,16 +214,51 @@ if SHAREPOINT_ENABLED:
         Raises:
             HttpResponseError: If there is an error while deleting the SharePoint indexer.
         """
-        cognitive_search = SharepointSearchHandler(config=SHAREPOINT_SEARCH_CONFIG)
+        cognitive_search = services.sharepoint_search_handler
         for sharepoint_site in body.Value:
             cognitive_search.delete_indexer_and_stuff(sharepointsite=sharepoint_site)
+            services.indexed_sites.remove(sharepoint_site)
         return "200"
 
-    @app.get('/api/sharepoint/list-indexer')
-    def list_sharepoint_indexer():
+    @app.post('/api/sharepoint/reconcile')
+    def reconcile_sharepoint_sites(body: SharepointSiteList, dry_run: bool = False) -> SiteReconcilePlan:
+        """
+        Brings the SharePoint sites integrated with Azure Cognitive Search to the given set of sites.
+
+        The indexers, data sources and indexed sites are listed once and compared with the body: the missing
+        data sources and indexers are created, and the ones of the sites left out are deleted along with their
+        documents, concurrently.
+
+        Args:
+            body (SharepointSiteList): The sites that should be integrated, every other site is removed.
+            dry_run (bool, optional): Only return the planned changes. Defaults to False.
+
+        Returns:
+            SiteReconcilePlan: The planned or applied changes, with the ones that failed in Errors.
+
+        Raises:
+            HttpResponseError: If the search resources cannot be listed.
+        """
+        reconciler = SiteSetReconciler(services.sharepoint_search_handler)
+        plan = reconciler.plan(body)
+        if dry_run:
+            return plan
+        plan = reconciler.apply(body, plan)
+        created = set(plan.CreateIndexers)
+        services.indexed_sites.apply_changes(
+            added=[IndexedSite(Site=site, IndexerName=name) for site in body.Value
+                   if (name := services.sharepoint_search_handler.spo_indexer_name(site.name)) in created],
+            removed_indexers=plan.DeleteIndexers
+        )
+        return plan
+
+    @app.get('/api/sharepoint/list-indexer', response_model=IndexerList)
+    def list_sharepoint_indexer(request: Request) -> Response:
         """
         Retrieves a list of SharePoint indexers for Azure Cognitive Search.
 
+        The response carries an ETag, a request with a matching If-None-Match header gets 304 Not Modified.
+
         Returns:
             List[SearchIndexer]: A list of SearchIndexer objects representing the SharePoint indexers.
                 Each SearchIndexer object contains information about the indexer, such as its name, data source name, and skillset name.
@@ -252,13 +266,28 @@ if SHAREPOINT_ENABLED:
         Raises:
             Exception: If there is an error while retrieving the SharePoint indexers.
         """
-        cognitive_search = SharepointSearchHandler(config=SHAREPOINT_SEARCH_CONFIG)
-        return cognitive_search.list_indexer()
+        cognitive_search = services.sharepoint_search_handler
+        return conditional_response(request, cognitive_search.list_indexer())
+
+    @app.get('/api/sharepoint/indexer-schedule')
+    def indexer_schedule() -> IndexerSchedule:
+        """
+        Reports the indexer scheduler state and the freshness lag of every SharePoint indexer.
+
+        Returns:
+            IndexerSchedule: The indexers, the least fresh first. Empty when the scheduler is disabled.
+        """
+        if services.indexer_scheduler is None:
+            return IndexerSchedule(MaxConcurrentRuns=0, Running=0, Value=[])
+        return services.indexer_scheduler.schedule()
 
     @app.get('/api/sharepoint/list-user-site')
     def list_user_site(body: ListUserSiteApiIn) -> SharepointSiteList:
         """
-        Retrieve the list of SharePoint sites that a user belongs to.
+        Retrieve the list of indexed SharePoint sites that a user belongs to.
+
+        The user's groups are matched against the indexed-site index, no indexer or site is fetched. When the
+        site access map is enabled and up to date, the user's sites are read from it instead of querying Graph.
 
         Parameters:
         - body (ListUserSiteApiIn): The request body containing the user ID.
@@ -266,14 +295,53 @@ if SHAREPOINT_ENABLED:
         Returns:
         - SharepointSiteList: The list of SharePoint sites that the user belongs to.
         """
-        cognitive_search = SharepointSearchHandler(config=SHAREPOINT_SEARCH_CONFIG)
-        indexer_list = cognitive_search.list_indexer()
-        site_name_list = []
-        for indexer in indexer_list.Value:
-            site_name = indexer.DataSourceName.removesuffix("-datasource")
-            site_name = site_name.removesuffix("-sharepoint")
-            site_name_list.append(site_name)
-        return sharepoint_helper.check_user_belong_to_site_flow(body.userId, site_name_list)
+        return services.sites_of_user(body.userId)
+
+    @app.post('/api/search')
+    async def search(body: SearchApiIn) -> SearchApiOut:
+        """
+        Searches the indexed SharePoint documents that a user can access.
+
+        Runs a hybrid keyword and vector search reranked by the semantic configuration of the index, filtered on
+        the sites of the user as returned by /api/sharepoint/list-user-site, so the caller needs a single request.
+        Results are cached for SEARCH_CACHE_TTL seconds by query and set of sites.
+
+        Parameters:
+        - body (SearchApiIn): The user ID, the query and the number of results.
+
+        Returns:
+        - SearchApiOut: The matching chunks, best first.
+        """
+        user_sites = await asyncio.to_thread(services.sites_of_user, body.userId)
+        top = min(max(body.top, 1), APP_CONFIG.SearchApi.MaxTop)
+        return await services.search_query_handler.search(body.query, [site.id for site in user_sites.Value], top)
+
+    @app.post('/api/chat')
+    async def chat(body: ChatApiIn) -> StreamingResponse:
+        """
+        Answers a question about the indexed SharePoint documents that a user can access, streamed as server-sent
+        events.
+
+        The sources are searched like /api/search while the prompt is assembled, then the completion of
+        AZURE_OPENAI_CHAT_DEPLOYMENT is streamed: a "sources" event, a "token" event per chunk of the answer and a
+        "done" event with the time to first token and the total duration, or an "error" event.
+
+        Parameters:
+        - body (ChatApiIn): The user ID, the question, the previous messages and the number of sources.
+
+        Returns:
+        - StreamingResponse: The text/event-stream of the answer.
+        """
+        if services.chat_handler is None:
+            raise HTTPException(status_code=404, detail="AZURE_OPENAI_CHAT_DEPLOYMENT is not configured")
+
+        async def site_ids() -> list[str]:
+            user_sites = await asyncio.to_thread(services.sites_of_user, body.userId)
+            return [site.id for site in user_sites.Value]
+
+        top = min(max(body.top, 1), APP_CONFIG.SearchApi.MaxTop)
+        return StreamingResponse(services.chat_handler.stream(body.query, body.history, site_ids(), top),
+                                 media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,711 @@
+import asyncio
+import logging
+import os
+import threading
+
+from src.model.config import (
+    AppConfig,
+    ChunkDedupConfig,
+    ChatConfig,
+    SharepointSearchConfig,
+    SharepointHelperConfig,
+    StorageConfig,
+    StorageSearchConfig,
+    SearchConfig,
+    SingleFlightConfig,
+    IndexerSchedulerConfig,
+    LocalVectorTierConfig,
+    OrphanCollectorConfig,
+    QueryEmbeddingConfig,
+    SearchApiConfig,
+    SearchShard,
+    SemanticCacheConfig,
+    ShardingConfig,
+    SiteAccessMapConfig,
+    StateConfig,
+    TextExtractionConfig,
+    TrafficCaptureConfig
+)
+from src.StateBackend import StateBackend, create_state_backend
+from src.VectorProfiles import vector_profile
+
+
+def load_app_config() -> AppConfig:
+    """
+    Reads the application configuration from the environment.
+
+    Only environment variables are read, no client is created and no network call is made, so this is safe to
+    call at import time.
+
+    Returns:
+        AppConfig: The configuration of every enabled integration. Disabled integrations are left to None.
+    """
+    azure_storage_env = {
+        "StorageName": os.environ.get("AZURE_SA", ""),
+        "StorageConnStr": os.environ.get("AZURE_SA_CONN_STR", ""),
+        "ContainerName": os.environ.get("AZURE_SA_CONTAINER", ""),
+    }
+    sharepoint_env = {
+        "ClientId": os.environ.get("SHAREPOINT_CLIENT_ID", ""),
+        "ClientSecret": os.environ.get("SHAREPOINT_CLIENT_SECRET", ""),
+        "TenantId": os.environ.get("SHAREPOINT_TENANT_ID", ""),
+        "Domain": os.environ.get("SHAREPOINT_DOMAIN", ""),
+        "GraphEndpoint": os.environ.get("GRAPH_ENDPOINT", "https://graph.microsoft.com"),
+        "LoginEndpoint": os.environ.get("GRAPH_LOGIN_ENDPOINT", "https://login.microsoftonline.com")
+    }
+    azure_search_env = {
+        "Endpoint": os.environ.get("AZURE_SEARCH_ENDPOINT", ""),
+        "IndexName": os.environ.get("AZURE_SEARCH_INDEX", "")
+    }
+    azure_openai_env = {
+        "Endpoint": os.environ.get("AZURE_OPENAI_ENDPOINT", ""),
+        "Key": os.environ.get("AZURE_OPENAI_KEY", ""),
+        "EmbedDeployment": os.environ.get("AZURE_OPENAI_EMBED_DEPLOYMENT", "")
+    }
+    search_params = {
+        "Endpoint": azure_search_env["Endpoint"],
+        "IndexName": azure_search_env["IndexName"],
+        "AoaiEndpoint": azure_openai_env["Endpoint"],
+        "AoaiKey": azure_openai_env["Key"],
+        "AoaiEmbedDeployment": azure_openai_env["EmbedDeployment"],
+        "VectorProfile": os.environ.get("VECTOR_PROFILE", "default").lower(),
+        "VectorDimensions": int(os.environ.get("VECTOR_DIMENSIONS", 1536)),
+        "SharedChunks": os.environ.get("CHUNK_DEDUP_ENABLED", "false").lower() == "true",
+    }
+
+    config = AppConfig(
+        StorageMaxConcurrency=int(os.environ.get("AZURE_SA_MAX_CONCURRENCY", 16)),
+        TextExtraction=TextExtractionConfig(
+            Enabled=os.environ.get("TEXT_EXTRACTION_ENABLED", "false").lower() == "true",
+            Workers=int(os.environ.get("TEXT_EXTRACTION_WORKERS") or 0) or None,
+            IncludeOffice=os.environ.get("TEXT_EXTRACTION_OFFICE", "false").lower() == "true"
+        ),
+        StartupWarmup=os.environ.get("STARTUP_WARMUP", "false").lower() == "true",
+        State=StateConfig(
+            Backend=os.environ.get("STATE_BACKEND", "memory").lower(),
+            SqlitePath=os.environ.get("STATE_SQLITE_PATH", ".state/state.sqlite3"),
+            SiteCatalogTtl=int(os.environ.get("SITE_CATALOG_TTL", 300)),
+            MembershipTtl=int(os.environ.get("MEMBERSHIP_CACHE_TTL", 300)),
+            IndexedSitesReconcileInterval=int(os.environ.get("INDEXED_SITES_RECONCILE_INTERVAL", 600))
+        ),
+        SiteAccessMap=SiteAccessMapConfig(
+            Enabled=os.environ.get("SITE_ACCESS_MAP_ENABLED", "false").lower() == "true",
+            SqlitePath=os.environ.get("SITE_ACCESS_MAP_PATH", ".state/site-access.sqlite3"),
+            Interval=int(os.environ.get("SITE_ACCESS_MAP_INTERVAL", 300)),
+            MaxAge=int(os.environ.get("SITE_ACCESS_MAP_MAX_AGE", 86400))
+        ),
+        IndexerScheduler=IndexerSchedulerConfig(
+            Enabled=os.environ.get("INDEXER_SCHEDULER_ENABLED", "false").lower() == "true",
+            Interval=int(os.environ.get("INDEXER_SCHEDULER_INTERVAL", 30)),
+            MaxConcurrentRuns=int(os.environ.get("INDEXER_SCHEDULER_MAX_CONCURRENT_RUNS", 3)),
+            MinInterval=int(os.environ.get("INDEXER_SCHEDULER_MIN_INTERVAL", 300)),
+            MaxInterval=int(os.environ.get("INDEXER_SCHEDULER_MAX_INTERVAL", 21600))
+        ),
+        SearchApi=SearchApiConfig(
+            CacheTtl=int(os.environ.get("SEARCH_CACHE_TTL", 30)),
+            Semantic=os.environ.get("SEARCH_SEMANTIC_ENABLED", "true").lower() == "true"
+        ),
+        QueryEmbedding=QueryEmbeddingConfig(
+            ClientSide=os.environ.get("QUERY_EMBEDDING_CLIENT_SIDE", "true").lower() == "true",
+            CacheSize=int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 4096)),
+            MaxBatchSize=int(os.environ.get("QUERY_EMBEDDING_MAX_BATCH_SIZE", 16)),
+            MaxWaitMs=float(os.environ.get("QUERY_EMBEDDING_MAX_WAIT_MS", 5)),
+            ApiVersion=os.environ.get("AZURE_OPENAI_API_VERSION", "2023-05-15")
+        ),
+        SemanticCache=SemanticCacheConfig(
+            Enabled=os.environ.get("SEMANTIC_CACHE_ENABLED", "false").lower() == "true",
+            Threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.95)),
+            MaxEntries=int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 2000)),
+            Ttl=int(os.environ.get("SEMANTIC_CACHE_TTL", 3600))
+        ),
+        ChunkDedup=ChunkDedupConfig(
+            Enabled=os.environ.get("CHUNK_DEDUP_ENABLED", "false").lower() == "true",
+            Interval=int(os.environ.get("CHUNK_DEDUP_INTERVAL", 300)),
+            MaxParents=int(os.environ.get("CHUNK_DEDUP_MAX_PARENTS", 200))
+        ),
+        OrphanCollector=OrphanCollectorConfig(
+            Enabled=os.environ.get("ORPHAN_GC_ENABLED", "false").lower() == "true",
+            Interval=int(os.environ.get("ORPHAN_GC_INTERVAL", 3600)),
+            GracePeriod=int(os.environ.get("ORPHAN_GC_GRACE_PERIOD", 86400)),
+            MaxWorkers=int(os.environ.get("ORPHAN_GC_MAX_WORKERS", 4)),
+            BatchesPerSecond=float(os.environ.get("ORPHAN_GC_BATCHES_PER_SECOND", 2.0))
+        ),
+        LocalVectorTier=LocalVectorTierConfig(
+            Enabled=os.environ.get("LOCAL_VECTOR_TIER_ENABLED", "false").lower() == "true",
+            Path=os.environ.get("LOCAL_VECTOR_PATH") or ".state/vectors",
+            MaxSites=int(os.environ.get("LOCAL_VECTOR_MAX_SITES", 10)),
+            MaxVectors=int(os.environ.get("LOCAL_VECTOR_MAX_VECTORS", 200000)),
+            Float16=os.environ.get("LOCAL_VECTOR_FLOAT16", "false").lower() == "true",
+            RefreshInterval=int(os.environ.get("LOCAL_VECTOR_REFRESH_INTERVAL", 60)),
+            MaxAge=int(os.environ.get("LOCAL_VECTOR_MAX_AGE", 3600))
+        ),
+        TrafficCapture=TrafficCaptureConfig(
+            Enabled=bool(os.environ.get("TRAFFIC_CAPTURE_PATH")),
+            Path=os.environ.get("TRAFFIC_CAPTURE_PATH") or ".traffic/requests.jsonl",
+            SampleRate=float(os.environ.get("TRAFFIC_CAPTURE_SAMPLE_RATE", 1.0)),
+            Salt=os.environ.get("TRAFFIC_CAPTURE_SALT") or None
+        ),
+        SingleFlight=SingleFlightConfig(
+            Enabled=os.environ.get("SINGLE_FLIGHT_ENABLED", "true").lower() == "true",
+            Disabled=[name.strip() for name in os.environ.get("SINGLE_FLIGHT_DISABLED", "").split(",") if name.strip()]
+        )
+    )
+    if not (azure_search_env["Endpoint"] and azure_search_env["IndexName"]):
+        return config
+    # fail at startup on a misspelled profile rather than on the first indexer creation
+    vector_profile(search_params["VectorProfile"])
+    config.Search = SearchConfig(**search_params)
+    shard_entries = [entry.strip() for entry in os.environ.get("SEARCH_SHARDS", "").split(",") if entry.strip()]
+    if shard_entries:
+        # the shards of the index of AZURE_SEARCH_INDEX, the first one whether listed or not, are other indexes of
+        # its service or https://<service>/<index> entries of other services
+        shards = [SearchShard(Name=azure_search_env["IndexName"], Endpoint=azure_search_env["Endpoint"],
+                              IndexName=azure_search_env["IndexName"])]
+        for entry in shard_entries:
+            endpoint, _, index_name = entry.rpartition("/")
+            endpoint = endpoint or azure_search_env["Endpoint"]
+            if (endpoint.rstrip("/"), index_name) == (azure_search_env["Endpoint"].rstrip("/"), shards[0].IndexName):
+                continue
+            shards.append(SearchShard(Name=entry.removeprefix("https://"), Endpoint=endpoint, IndexName=index_name))
+        if len({shard.Name for shard in shards}) < len(shards):
+            raise ValueError(f"SEARCH_SHARDS lists an index twice: {shard_entries}")
+        config.Sharding = ShardingConfig(
+            Shards=shards,
+            Placement=os.environ.get("SEARCH_SHARD_PLACEMENT", "hash").lower()
+        )
+    if os.environ.get("AZURE_OPENAI_CHAT_DEPLOYMENT"):
+        config.Chat = ChatConfig(
+            Deployment=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT"],
+            MaxTokens=int(os.environ.get("CHAT_MAX_TOKENS", 800)),
+            Temperature=float(os.environ.get("CHAT_TEMPERATURE", 0.0)),
+            MaxHistoryChars=int(os.environ.get("CHAT_MAX_HISTORY_CHARS", 8000)),
+            ApiVersion=os.environ.get("AZURE_OPENAI_API_VERSION", "2023-05-15")
+        )
+
+    if azure_storage_env["StorageName"] and azure_storage_env["ContainerName"]:
+        config.Storage = StorageConfig(
+            StorageName=azure_storage_env["StorageName"],
+            ContainerName=azure_storage_env["ContainerName"]
+        )
+        config.StorageSearch = StorageSearchConfig(
+            **search_params,
+            StorageName=azure_storage_env["StorageName"],
+            ContainerName=azure_storage_env["ContainerName"],
+        )
+        if azure_storage_env["StorageConnStr"]:
+            config.Storage.StorageConnStr = azure_storage_env["StorageConnStr"]
+            config.StorageSearch.StorageConnStr = azure_storage_env["StorageConnStr"]
+
+    if sharepoint_env["ClientId"] and sharepoint_env["ClientSecret"] and sharepoint_env["TenantId"] \
+            and sharepoint_env["Domain"]:
+        config.SharepointHelper = SharepointHelperConfig(
+            ClientId=sharepoint_env["ClientId"],
+            ClientSecret=sharepoint_env["ClientSecret"],
+            TenantId=sharepoint_env["TenantId"],
+            GraphEndpoint=sharepoint_env["GraphEndpoint"].rstrip("/"),
+            LoginEndpoint=sharepoint_env["LoginEndpoint"].rstrip("/")
+        )
+        config.SharepointSearch = SharepointSearchConfig(
+            **search_params,
+            SharepointClientId=sharepoint_env["ClientId"],
+            SharepointClientSecret=sharepoint_env["ClientSecret"],
+            SharepointTenantId=sharepoint_env["TenantId"],
+            SharepointDomain=sharepoint_env["Domain"],
+            # the scheduler runs the indexers on demand, they get no schedule of their own
+            IndexerScheduleInterval=None if config.IndexerScheduler.Enabled else 300
+        )
+    return config
+
+
+class AppServices:
+    """
+    Holds the Azure, Graph and OpenAI dependencies of the API and creates each of them on first use.
+
+    The handler modules are imported inside the accessors, so importing the application neither loads the
+    Azure SDKs nor opens a connection. Every accessor is safe to call from the threadpool and the event loop.
+
+    Args:
+        config (AppConfig): The application configuration.
+
+    Attributes:
+        config (AppConfig): The application configuration.
+    """
+
+    def __init__(self, config: AppConfig) -> None:
+        self.config = config
+        self._lock = threading.Lock()
+        self._state = None
+        self._sharepoint_helper = None
+        self._sharepoint_search_handler = None
+        self._site_shards = None
+        self._indexed_sites = None
+        self._site_access_map = None
+        self._indexer_scheduler = None
+        self._search_query_handler = None
+        self._chat_handler = None
+        self._site_generations = None
+        self._local_vector_tier = None
+        self._chunk_deduplicators = None
+        self._orphan_collector = None
+        self._storage_search_handler = None
+        self._storage_handler = None
+        self._text_extractor = None
+        self._shared_chunks_checked = False
+
+    def _check_shared_chunks(self) -> None:
+        # the handlers filter on the sites of the shared chunks whenever the index holds some, even with
+        # CHUNK_DEDUP_ENABLED turned off since, or they would only be returned to the first of their sites
+        if self._shared_chunks_checked:
+            return
+        with self._lock:
+            if self._shared_chunks_checked:
+                return
+            if self.config.SharepointEnabled and not self.config.SharepointSearch.SharedChunks:
+                from src.sharepoint.SharepointSearchHandler import SharepointSearchHandler
+                if SharepointSearchHandler(config=self.config.SharepointSearch).has_shared_chunks():
+                    logging.warning("The index holds shared chunks, they are searched and released by the purges "
+                                    "although CHUNK_DEDUP_ENABLED is off")
+                    self.config.Search.SharedChunks = True
+                    self.config.SharepointSearch.SharedChunks = True
+            self._shared_chunks_checked = True
+
+    @property
+    def state(self) -> StateBackend:
+        """
+        StateBackend: The state shared by the workers, selected by STATE_BACKEND.
+        """
+        if self._state is None:
+            with self._lock:
+                if self._state is None:
+                    self._state = create_state_backend(self.config.State)
+        return self._state
+
+    @property
+    def sharepoint_helper(self):
+        """
+        SharepointHelper: The Graph helper. The access token is requested by the first Graph call.
+        """
+        if self._sharepoint_helper is None:
+            state = self.state
+            with self._lock:
+                if self._sharepoint_helper is None:
+                    from src.sharepoint.SharepointHelpers import SharepointHelper
+                    self._sharepoint_helper = SharepointHelper(config=self.config.SharepointHelper, state=state,
+                                                               state_config=self.config.State)
+        return self._sharepoint_helper
+
+    @property
+    def site_shards(self):
+        """
+        SiteShardMap: The placement of the SharePoint sites on the shards of the index, None unless SEARCH_SHARDS
+            is set.
+        """
+        if not (self.config.SharepointEnabled and self.config.Sharding.Enabled):
+            return None
+        if self._site_shards is None:
+            self._check_shared_chunks()
+            state = self.state
+            with self._lock:
+                if self._site_shards is None:
+                    from src.sharepoint.SiteShards import SiteShardMap
+                    self._site_shards = SiteShardMap(self.config.Sharding, self.config.SharepointSearch, state)
+        return self._site_shards
+
+    @property
+    def sharepoint_search_handler(self):
+        """
+        SharepointSearchHandler: The search handler provisioning SharePoint datasources and indexers, routing them
+            to the shards of the sites when SEARCH_SHARDS is set.
+        """
+        if self._sharepoint_search_handler is None:
+            self._check_shared_chunks()
+            site_shards = self.site_shards
+            with self._lock:
+                if self._sharepoint_search_handler is None:
+                    if site_shards is not None:
+                        from src.sharepoint.SiteShards import ShardedSharepointSearchHandler
+                        self._sharepoint_search_handler = ShardedSharepointSearchHandler(
+                            config=self.config.SharepointSearch, shards=site_shards)
+                    else:
+                        from src.sharepoint.SharepointSearchHandler import SharepointSearchHandler
+                        self._sharepoint_search_handler = SharepointSearchHandler(
+                            config=self.config.SharepointSearch)
+        return self._sharepoint_search_handler
+
+    @property
+    def indexed_sites(self):
+        """
+        IndexedSiteIndex: The index of the SharePoint sites that have an indexer.
+        """
+        if self._indexed_sites is None:
+            sharepoint_helper, search_handler, state = \
+                self.sharepoint_helper, self.sharepoint_search_handler, self.state
+            with self._lock:
+                if self._indexed_sites is None:
+                    from src.sharepoint.IndexedSites import IndexedSiteIndex
+                    self._indexed_sites = IndexedSiteIndex(sharepoint_helper, search_handler, state)
+        return self._indexed_sites
+
+    @property
+    def site_access_map(self):
+        """
+        SiteAccessMap: The materialized user -> indexed sites map, None when SITE_ACCESS_MAP_ENABLED is not set.
+        """
+        if not (self.config.SharepointEnabled and self.config.SiteAccessMap.Enabled):
+            return None
+        if self._site_access_map is None:
+            sharepoint_helper = self.sharepoint_helper
+            with self._lock:
+                if self._site_access_map is None:
+                    from src.sharepoint.SiteAccessMap import SiteAccessMap
+                    self._site_access_map = SiteAccessMap(self.config.SiteAccessMap, sharepoint_helper)
+        return self._site_access_map
+
+    @property
+    def indexer_scheduler(self):
+        """
+        IndexerScheduler: The scheduler running the SharePoint indexers, None when INDEXER_SCHEDULER_ENABLED is not set.
+        """
+        if not (self.config.SharepointEnabled and self.config.IndexerScheduler.Enabled):
+            return None
+        if self._indexer_scheduler is None:
+            search_handler, state = self.sharepoint_search_handler, self.state
+            with self._lock:
+                if self._indexer_scheduler is None:
+                    from src.sharepoint.IndexerScheduler import IndexerScheduler
+                    self._indexer_scheduler = IndexerScheduler(self.config.IndexerScheduler, search_handler, state,
+                                                               on_changes=self.indexers_changed)
+        return self._indexer_scheduler
+
+    @property
+    def chunk_deduplicators(self):
+        """
+        list[ChunkDeduplicator]: The deduplicators of the chunks copied across sites, one per shard of the index,
+            None unless CHUNK_DEDUP_ENABLED is set.
+        """
+        if not (self.config.SharepointEnabled and self.config.ChunkDedup.Enabled):
+            return None
+        if self._chunk_deduplicators is None:
+            search_handler = self.sharepoint_search_handler
+            with self._lock:
+                if self._chunk_deduplicators is None:
+                    from src.sharepoint.ChunkDeduplicator import ChunkDeduplicator
+                    self._chunk_deduplicators = [ChunkDeduplicator(handler)
+                                                 for handler in search_handler.shard_handlers()]
+        return self._chunk_deduplicators
+
+    @property
+    def orphan_collector(self):
+        """
+        OrphanedDocumentCollector: The collector of the documents of orphaned sites, None unless ORPHAN_GC_ENABLED
+            is set.
+        """
+        if not (self.config.SharepointEnabled and self.config.OrphanCollector.Enabled):
+            return None
+        if self._orphan_collector is None:
+            search_handler, indexed_sites, state = self.sharepoint_search_handler, self.indexed_sites, self.state
+            with self._lock:
+                if self._orphan_collector is None:
+                    from src.sharepoint.OrphanCollector import OrphanedDocumentCollector
+                    self._orphan_collector = OrphanedDocumentCollector(search_handler, indexed_sites, state,
+                                                                       self.config.OrphanCollector)
+        return self._orphan_collector
+
+    @property
+    def site_generations(self):
+        """
+        SiteGenerations: The generations of the indexed sites, bumped when their documents change.
+        """
+        if self._site_generations is None:
+            state = self.state
+            with self._lock:
+                if self._site_generations is None:
+                    from src.SemanticCache import SiteGenerations
+                    self._site_generations = SiteGenerations(state, self.config.Search.IndexName)
+        return self._site_generations
+
+    @property
+    def local_vector_tier(self):
+        """
+        LocalVectorTier: The local copy of the vectors of the hot sites, None unless LOCAL_VECTOR_TIER_ENABLED is
+            set and the queries are vectorized client-side.
+        """
+        if not (self.config.LocalVectorTier.Enabled and self.config.QueryEmbedding.ClientSide):
+            return None
+        if self._local_vector_tier is None:
+            self._check_shared_chunks()
+            state, site_generations, site_shards = self.state, self.site_generations, self.site_shards
+            with self._lock:
+                if self._local_vector_tier is None:
+                    from src.LocalVectorTier import LocalVectorTier
+                    self._local_vector_tier = LocalVectorTier(self.config.LocalVectorTier, self.config.Search, state,
+                                                              site_generations, site_shards)
+        return self._local_vector_tier
+
+    @property
+    def search_query_handler(self):
+        """
+        AsyncSearchHandler: The handler running the searches of /api/search and /api/chat.
+        """
+        if self._search_query_handler is None:
+            self._check_shared_chunks()
+            state = self.state
+            site_generations = self.site_generations if self.config.SemanticCache.Enabled else None
+            local_tier, site_shards = self.local_vector_tier, self.site_shards
+            with self._lock:
+                if self._search_query_handler is None:
+                    from src.AsyncSearchHandler import AsyncSearchHandler
+                    embedder, semantic_cache = None, None
+                    if self.config.QueryEmbedding.ClientSide:
+                        from src.QueryEmbedder import QueryEmbedder
+                        embedder = QueryEmbedder(self.config.Search, self.config.QueryEmbedding)
+                        if site_generations is not None:
+                            from src.SemanticCache import SemanticCache
+                            semantic_cache = SemanticCache(self.config.SemanticCache, site_generations)
+                    self._search_query_handler = AsyncSearchHandler(self.config.Search, self.config.SearchApi, state,
+                                                                    embedder, semantic_cache, local_tier,
+                                                                    site_shards)
+        return self._search_query_handler
+
+    @property
+    def chat_handler(self):
+        """
+        ChatHandler: The handler answering /api/chat, None when AZURE_OPENAI_CHAT_DEPLOYMENT is not set.
+        """
+        if self.config.Chat is None:
+            return None
+        if self._chat_handler is None:
+            search_handler = self.search_query_handler
+            with self._lock:
+                if self._chat_handler is None:
+                    from src.ChatHandler import ChatHandler
+                    self._chat_handler = ChatHandler(self.config.Search, self.config.Chat, search_handler)
+        return self._chat_handler
+
+    @property
+    def storage_search_handler(self):
+        """
+        StorageSearchHandler: The search handler provisioning the blob storage datasource and indexer.
+        """
+        if self._storage_search_handler is None:
+            with self._lock:
+                if self._storage_search_handler is None:
+                    from src.StorageSearchHandler import StorageSearchHandler
+                    self._storage_search_handler = StorageSearchHandler(config=self.config.StorageSearch)
+        return self._storage_search_handler
+
+    @property
+    def storage_handler(self):
+        """
+        AsyncStorageHandler: The aio blob handler shared by every storage request of the process.
+        """
+        if self._storage_handler is None:
+            with self._lock:
+                if self._storage_handler is None:
+                    from src.AsyncStorageHandler import AsyncStorageHandler
+                    self._storage_handler = AsyncStorageHandler(self.config.Storage,
+                                                                max_concurrency=self.config.StorageMaxConcurrency)
+        return self._storage_handler
+
+    @property
+    def text_extractor(self):
+        """
+        TextExtractor: The text extraction process pool, None when text extraction is disabled.
+        """
+        if not (self.config.StorageEnabled and self.config.TextExtraction.Enabled):
+            return None
+        if self._text_extractor is None:
+            with self._lock:
+                if self._text_extractor is None:
+                    from src.TextExtraction import TextExtractor
+                    self._text_extractor = TextExtractor(max_workers=self.config.TextExtraction.Workers,
+                                                         include_office=self.config.TextExtraction.IncludeOffice)
+        return self._text_extractor
+
+    def sites_of_user(self, user_id: str):
+        """
+        Returns the indexed SharePoint sites that a user belongs to.
+
+        The site access map is read when it is enabled and up to date, otherwise the groups of the user are
+        fetched from Graph and matched against the indexed-site index.
+
+        Args:
+            user_id (str): The object id or the user principal name of the user.
+
+        Returns:
+            SharepointSiteList: The indexed sites of the user.
+        """
+        indexed_sites = self.indexed_sites
+        if self.site_access_map is not None:
+            indexed_sites.refresh()
+            site_ids = self.site_access_map.site_ids_of_user(user_id, indexed_sites.version)
+            if site_ids is not None:
+                return indexed_sites.sites_with_ids(site_ids)
+        user_group_membership = self.sharepoint_helper.get_user_group_membership(user_id=user_id)
+        return indexed_sites.sites_of_user(user_group_membership)
+
+    def indexers_changed(self, indexer_names: list[str]) -> None:
+        """
+        Bumps the generation of the sites of some SharePoint indexers, dropping the cached answers built from
+        their documents.
+
+        Args:
+            indexer_names (list[str]): The names of the indexers whose runs processed items.
+        """
+        names = set(indexer_names)
+        self.site_generations.bump(indexed_site.Site.id for indexed_site in self.indexed_sites.sites().Value
+                                   if indexed_site.IndexerName in names)
+
+    async def warm_up(self) -> None:
+        """
+        Creates the enabled dependencies and opens their connections ahead of the first request.
+
+        Meant to run as a background task: failures are logged and the dependency is created again on demand.
+        """
+        if self.config.SharepointEnabled:
+            try:
+                await asyncio.to_thread(self.sharepoint_helper._get_token)
+                await asyncio.to_thread(lambda: self.sharepoint_search_handler)
+                await asyncio.to_thread(self.indexed_sites.refresh)
+            except Exception as err:
+                logging.warning(f"SharePoint warm-up failed: {err}")
+        if self.config.StorageEnabled:
+            try:
+                await self.storage_handler._ensure_container()
+                await asyncio.to_thread(lambda: self.storage_search_handler)
+            except Exception as err:
+                logging.warning(f"Storage warm-up failed: {err}")
+
+    async def reconcile_indexed_sites(self) -> None:
+        """
+        Rebuilds the indexed-site index every IndexedSitesReconcileInterval seconds, until cancelled, and places the
+        sites found in the shards without a placement when the index is sharded.
+
+        Meant to run as a background task. A lease in the state backend lets a single worker reconcile per interval.
+        """
+        interval = self.config.State.IndexedSitesReconcileInterval
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await asyncio.to_thread(self.state.add, "indexed-sites:reconcile-lease", True, interval * 0.9):
+                    await asyncio.to_thread(self.indexed_sites.reconcile)
+                    if self.site_shards is not None:
+                        await asyncio.to_thread(self.site_shards.reconcile)
+            except Exception as err:
+                logging.warning(f"Indexed sites reconciliation failed: {err}")
+
+    async def materialize_site_access(self) -> None:
+        """
+        Syncs the site access map now and then every SiteAccessMap.Interval seconds, until cancelled.
+
+        Meant to run as a background task. A lease in the state backend lets a single worker sync per interval.
+        """
+        interval = self.config.SiteAccessMap.Interval
+        while True:
+            try:
+                if await asyncio.to_thread(self.state.add, "site-access:sync-lease", True, interval * 0.9):
+                    indexed_sites = await asyncio.to_thread(self.indexed_sites.sites)
+                    await asyncio.to_thread(self.site_access_map.sync, indexed_sites)
+            except Exception as err:
+                logging.warning(f"Site access map sync failed: {err}")
+            await asyncio.sleep(interval)
+
+    async def schedule_indexers(self) -> None:
+        """
+        Runs a tick of the indexer scheduler every IndexerScheduler.Interval seconds, until cancelled.
+
+        Meant to run as a background task. A lease in the state backend lets a single worker tick per interval,
+        and a lock held for the whole tick keeps a tick longer than the interval from overlapping the next one,
+        which would start more than MaxConcurrentRuns runs.
+        """
+        from src.sharepoint.IndexerScheduler import TICK_LEASE
+        interval = self.config.IndexerScheduler.Interval
+
+        def tick() -> None:
+            with self.state.lock("indexer-schedule:tick", timeout=0, lease=TICK_LEASE):
+                self.indexer_scheduler.tick()
+
+        while True:
+            try:
+                if await asyncio.to_thread(self.state.add, "indexer-schedule:tick-lease", True, interval * 0.9):
+                    await asyncio.to_thread(tick)
+            except Exception as err:
+                logging.warning(f"Indexer scheduler tick failed: {err}")
+            await asyncio.sleep(interval)
+
+    async def restore_indexer_schedules(self) -> None:
+        """
+        Gives their service schedule back to the SharePoint indexers left without one by the indexer scheduler, once
+        at startup while INDEXER_SCHEDULER_ENABLED is not set.
+
+        Meant to run as a background task. A lease in the state backend lets a single worker restore them.
+        """
+        from src.sharepoint.IndexerScheduler import restore_schedules
+        try:
+            if await asyncio.to_thread(self.state.add, "indexer-schedule:restore-lease", True, 600):
+                await asyncio.to_thread(restore_schedules, self.sharepoint_search_handler, self.state)
+        except Exception as err:
+            logging.warning(f"Schedules of the SharePoint indexers not restored: {err}")
+
+    async def deduplicate_chunks(self) -> None:
+        """
+        Runs the chunk deduplicator every ChunkDedup.Interval seconds, until cancelled.
+
+        Meant to run as a background task. A lease in the state backend lets a single worker run it per interval.
+        """
+        interval = self.config.ChunkDedup.Interval
+        while True:
+            try:
+                if await asyncio.to_thread(self.state.add, "chunk-dedup:run-lease", True, interval * 0.9):
+                    for deduplicator in self.chunk_deduplicators:
+                        await asyncio.to_thread(deduplicator.run, self.config.ChunkDedup.MaxParents)
+            except Exception as err:
+                logging.warning(f"Chunk deduplication failed: {err}")
+            await asyncio.sleep(interval)
+
+    async def collect_orphans(self) -> None:
+        """
+        Runs the orphaned-document collector every OrphanCollector.Interval seconds, until cancelled.
+
+        Meant to run as a background task. A lease in the state backend lets a single worker run it per interval.
+        """
+        interval = self.config.OrphanCollector.Interval
+        while True:
+            try:
+                if await asyncio.to_thread(self.state.add, "orphan-gc:run-lease", True, interval * 0.9):
+                    await asyncio.to_thread(self.orphan_collector.collect)
+            except Exception as err:
+                logging.warning(f"Orphan collection failed: {err}")
+            await asyncio.sleep(interval)
+
+    async def refresh_local_vectors(self) -> None:
+        """
+        Refreshes the local vector tier every LocalVectorTier.RefreshInterval seconds, until cancelled.
+
+        Meant to run as a background task. Every worker adds its query counts to the state backend, a lease lets a
+        single worker select and fetch the hot sites per interval, then every worker maps the files of the current
+        selection.
+        """
+        interval = self.config.LocalVectorTier.RefreshInterval
+        while True:
+            try:
+                await asyncio.to_thread(self.local_vector_tier.flush)
+                if await asyncio.to_thread(self.state.add, "local-vectors:refresh-lease", True, interval * 0.9):
+                    await asyncio.to_thread(self.local_vector_tier.update)
+                await asyncio.to_thread(self.local_vector_tier.load)
+            except Exception as err:
+                logging.warning(f"Local vector tier refresh failed: {err}")
+            await asyncio.sleep(interval)
+
+    async def close(self) -> None:
+        """
+        Releases the connections and worker processes of the dependencies created so far.
+        """
+        if self._storage_handler is not None:
+            await self._storage_handler.close()
+        if self._search_query_handler is not None:
+            await self._search_query_handler.close()
+        if self._chat_handler is not None:
+            await self._chat_handler.close()
+        if self._text_extractor is not None:
+            self._text_extractor.shutdown()
@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import os
+import re
+from typing import TYPE_CHECKING
+
+from azure.core.credentials import AzureKeyCredential
+from azure.identity.aio import DefaultAzureCredential
+from azure.search.documents.aio import SearchClient
+from azure.search.documents.models import RawVectorQuery, VectorizableTextQuery
+
+from src.QueryEmbedder import QueryEmbedder
+from src.SearchRequests import search_documents
+from src.SemanticCache import SemanticCache
+from src.SingleFlight import single_flight
+from src.StateBackend import StateBackend
+from src.Telemetry import traced, set_span_attributes
+from src.model.common import SearchDocument
+from src.model.config import SearchApiConfig, SearchConfig
+from src.model.output import SearchApiOut
+from src.sharepoint.ChunkDeduplicator import HASH_FIELD, SITE_IDS_FIELD, SOURCES_FIELD, shared_chunk_source
+
+if TYPE_CHECKING:
+    from src.LocalVectorTier import LocalVectorTier
+    from src.sharepoint.SiteShards import SiteShardMap
+
+SELECT_FIELDS = ["id", "title", "location", "chunk", "metadata_spo_site_id"]
+SEMANTIC_CONFIGURATION = "my-semantic-config"
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a query for caching: case and whitespace do not change the results of a search.
+
+    Args:
+        query (str): The query text.
+
+    Returns:
+        str: The lowercase query with single spaces.
+    """
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+def site_filter(site_ids: list[str], shared_chunks: bool = False) -> str:
+    """
+    Builds the security filter restricting a search to the documents of some SharePoint sites.
+
+    Site ids contain commas, so the values are delimited by '|'.
+
+    Args:
+        site_ids (list[str]): The full ids of the sites, as stored in metadata_spo_site_id.
+        shared_chunks (bool, optional): Matches the deduplicated chunks through metadata_spo_site_ids, which
+            lists the sites of the shared chunks and is empty for the anchor chunks (see ChunkDeduplicator), and
+            the others through metadata_spo_site_id. Defaults to False.
+
+    Returns:
+        str: The OData search.in filter.
+    """
+    values = "|".join(site_id.replace("'", "''") for site_id in site_ids)
+    if shared_chunks:
+        return f"(search.in(metadata_spo_site_id, '{values}', '|') and {HASH_FIELD} eq null) or " \
+               f"{SITE_IDS_FIELD}/any(s: search.in(s, '{values}', '|'))"
+    return f"search.in(metadata_spo_site_id, '{values}', '|')"
+
+
+def search_document(doc: dict, site_ids: list[str], **scores) -> SearchDocument:
+    """
+    Builds a search result from the fields of a chunk, with the title and location of the copy of a shared chunk
+    in a site of the user.
+
+    Args:
+        doc (dict): The fields of SELECT_FIELDS, and dedup_sources for the shared chunks.
+        site_ids (list[str]): The full ids of the sites of the user.
+        **scores: The Score and RerankerScore of the result.
+
+    Returns:
+        SearchDocument: The result.
+    """
+    source = shared_chunk_source(doc, site_ids)
+    if source is not None:
+        return SearchDocument(Id=doc["id"], Title=source.get("title"), Location=source.get("location"),
+                              Chunk=doc.get("chunk"), SiteId=source["site_id"], **scores)
+    return SearchDocument(Id=doc["id"], Title=doc.get("title"), Location=doc.get("location"),
+                          Chunk=doc.get("chunk"), SiteId=doc.get("metadata_spo_site_id"), **scores)
+
+
+def _search_key(handler: "AsyncSearchHandler", query: str, site_ids: list[str], top: int):
+    return handler._cache_key(query, site_ids, top)
+
+
+class AsyncSearchHandler:
+    """
+    An asyncio query handler for the search index built on the azure.search.documents.aio SDK.
+
+    Runs hybrid searches, keyword and vector over chunkVector, reranked by the semantic configuration of the
+    index, trimmed to the documents of the sites a user can access. Results are cached in the state backend for
+    CacheTtl seconds, keyed by the normalized query, the number of results and the set of sites, and identical
+    concurrent searches are merged. Queries are vectorized by the QueryEmbedder when one is given, with its cache
+    and batching, otherwise by the vectorizer of the index. With a SemanticCache as well, the results of a query
+    are also reused for similar queries of users with the same sites, and with a LocalVectorTier the searches of
+    users whose sites are all local are answered in process, by vector similarity only.
+
+    With a SiteShardMap, the sites of a user are grouped by the shard holding them and every shard is searched
+    for its sites concurrently, with the same query vector. The results of the shards are merged by reranker
+    score, which the semantic ranker calibrates the same way in every index, or by search score without
+    semantic ranking, and the best top results are kept.
+
+    One instance is meant to be shared by the whole process: the aio SearchClient is created on first use and
+    reused until close() is called.
+
+    Args:
+        config (SearchConfig): The search configuration.
+        api_config (SearchApiConfig): The search API configuration.
+        state (StateBackend): The state holding the result cache.
+        embedder (QueryEmbedder, optional): Vectorizes the queries client-side. Defaults to None.
+        semantic_cache (SemanticCache, optional): Caches the results by query embedding, only used with an
+            embedder. Defaults to None.
+        local_tier (LocalVectorTier, optional): Searches the vectors of the hot sites locally, only used with an
+            embedder. Defaults to None.
+        shards (SiteShardMap, optional): The shards of the index holding the sites, when the index is sharded.
+            Defaults to None.
+    """
+
+    def __init__(self, config: SearchConfig, api_config: SearchApiConfig, state: StateBackend,
+                 embedder: QueryEmbedder = None, semantic_cache: SemanticCache = None,
+                 local_tier: "LocalVectorTier" = None, shards: "SiteShardMap" = None) -> None:
+        self.config = config
+        self.api_config = api_config
+        self.state = state
+        self.embedder = embedder
+        self.semantic_cache = semantic_cache if embedder is not None else None
+        self.local_tier = local_tier if embedder is not None else None
+        self.shards = shards
+        # the clients of the shards by shard name, None for the index of the configuration
+        self._search_clients: dict[str | None, SearchClient] = {}
+        self._credential = None
+
+    def _init_search_client(self, shard_name: str = None) -> SearchClient:
+        search_client = self._search_clients.get(shard_name)
+        if search_client is not None:
+            return search_client
+        if self._credential is None:
+            if os.environ.get("AZURE_SEARCH_KEY") is not None:
+                self._credential = AzureKeyCredential(os.environ.get("AZURE_SEARCH_KEY"))
+            else:
+                self._credential = DefaultAzureCredential()
+        config = self.config if shard_name is None else self.shards.shard_config(self.config, shard_name)
+        search_client = SearchClient(endpoint=config.Endpoint, index_name=config.IndexName,
+                                     credential=self._credential)
+        self._search_clients[shard_name] = search_client
+        return search_client
+
+    def _cache_key(self, query: str, site_ids: list[str], top: int) -> str:
+        scope = "\n".join([normalize_query(query), str(top), *sorted(set(site_ids))])
+        return f"search:{self.config.IndexName}:{hashlib.blake2b(scope.encode(), digest_size=16).hexdigest()}"
+
+    @traced("search.query")
+    async def search(self, query: str, site_ids: list[str], top: int = 5) -> SearchApiOut:
+        """
+        Searches the documents of some SharePoint sites, from the cache when the same search ran recently.
+
+        Args:
+            query (str): The query text.
+            site_ids (list[str]): The full ids of the sites the user can access.
+            top (int, optional): The number of results. Defaults to 5.
+
+        Returns:
+            SearchApiOut: The matching chunks, best first.
+        """
+        if not site_ids:
+            return SearchApiOut(Value=[])
+        key = self._cache_key(query, site_ids, top)
+        cached = await asyncio.to_thread(self.state.get, key) if self.api_config.CacheTtl > 0 else None
+        set_span_attributes({"search.cache_hit": cached is not None, "search.sites.count": len(site_ids)})
+        if cached is not None:
+            return SearchApiOut(**cached)
+        vector, result = None, None
+        if self.semantic_cache is not None:
+            if self.semantic_cache.refresh_due:
+                await asyncio.to_thread(self.semantic_cache.refresh)
+            version = self.semantic_cache.version
+            scope = SemanticCache.scope_key(f"search:{top}", site_ids)
+            vector = await self.embedder.embed(query)
+            result = self.semantic_cache.lookup(scope, vector)
+            set_span_attributes({"search.semantic_cache_hit": result is not None})
+            if result is not None:
+                return result
+        if self.local_tier is not None:
+            self.local_tier.record(site_ids)
+            if vector is None:
+                vector = await self.embedder.embed(query)
+            documents = await asyncio.to_thread(self.local_tier.search, vector, site_ids, top)
+            set_span_attributes({"search.local_tier_hit": documents is not None})
+            if documents is not None:
+                result = SearchApiOut(Value=documents)
+        if result is None:
+            result = await self._search(query, site_ids, top)
+        if self.semantic_cache is not None:
+            self.semantic_cache.put(scope, site_ids, vector, result, version)
+        if self.api_config.CacheTtl > 0:
+            await asyncio.to_thread(self.state.set, key, result.model_dump(), self.api_config.CacheTtl)
+        return result
+
+    @single_flight("search.hybrid_query", key=_search_key)
+    @traced("search.hybrid_query", peer_service="azure-search")
+    async def _search(self, query: str, site_ids: list[str], top: int) -> SearchApiOut:
+        vector = await self.embedder.embed(query) if self.embedder is not None else None
+        if self.shards is None:
+            documents = await self._search_index(None, query, site_ids, site_ids, top, vector)
+        else:
+            groups = await asyncio.to_thread(self.shards.group, site_ids)
+            results = await asyncio.gather(*(self._search_index(shard_name, query, shard_site_ids, site_ids, top,
+                                                                vector)
+                                             for shard_name, shard_site_ids in groups.items()))
+            documents = [document for shard_documents in results for document in shard_documents]
+            if len(results) > 1:
+                documents.sort(key=self._rank, reverse=True)
+                documents = documents[:top]
+            set_span_attributes({"search.shards.count": len(groups)})
+        set_span_attributes({"search.results.count": len(documents)})
+        return SearchApiOut(Value=documents)
+
+    def _rank(self, document: SearchDocument) -> float:
+        score = document.RerankerScore if self.api_config.Semantic else document.Score
+        return score if score is not None else float("-inf")
+
+    async def _search_index(self, shard_name: str | None, query: str, index_site_ids: list[str],
+                            site_ids: list[str], top: int, vector: list[float] | None) -> list[SearchDocument]:
+        # searches an index, or a shard, for the sites it holds among the sites of the user
+        search_client = self._init_search_client(shard_name)
+        if vector is not None:
+            vector_query = RawVectorQuery(vector=[], k=self.api_config.VectorK, fields="chunkVector")
+        else:
+            vector_query = VectorizableTextQuery(text=query, k=self.api_config.VectorK, fields="chunkVector")
+        select = SELECT_FIELDS + [SOURCES_FIELD] if self.config.SharedChunks else SELECT_FIELDS
+        results = await search_documents(search_client, query, vector_query, vector,
+                                          site_filter(index_site_ids, self.config.SharedChunks), select, top,
+                                          SEMANTIC_CONFIGURATION if self.api_config.Semantic else None)
+        return [search_document(item, site_ids, Score=item["@search.score"],
+                                RerankerScore=item["@search.reranker_score"]) for item in results]
+
+    async def close(self) -> None:
+        """
+        Closes the search client and the credential, releasing the connection pool.
+        """
+        for search_client in self._search_clients.values():
+            await search_client.close()
+        self._search_clients = {}
+        if self.embedder is not None:
+            await self.embedder.close()
+        if isinstance(self._credential, DefaultAzureCredential):
+            await self._credential.close()
+            self._credential = None
@@ -0,0 +1,203 @@
+import asyncio
+import os
+from typing import AsyncIterable
+
+from azure.core.exceptions import HttpResponseError
+from azure.identity.aio import DefaultAzureCredential
+from azure.storage.blob.aio import ContainerClient
+
+from src.StorageHandler import BLOB_BATCH_MAX_SIZE, SOFT_DELETE_METADATA, blob_url
+from src.SingleFlight import single_flight
+from src.Telemetry import traced, set_span_attributes
+from src.model.common import (
+    BlobHandlerUploadBlob,
+    BlobProperties,
+    BlobDeleteResult
+)
+from src.model.config import StorageConfig
+from src.model.output import BlobPropertiesApiOut, BlobDeleteApiOut
+
+
+class AsyncStorageHandler:
+    """
+    An asyncio variant of StorageHandler built on the azure.storage.blob.aio SDK.
+
+    One instance is meant to be shared by the whole process: the aio ContainerClient (and its connection pool)
+    is created on first use and reused by every request until close() is called. The number of concurrent
+    blob operations is bounded by a semaphore so a burst of uploads cannot exhaust the connection pool.
+
+    Args:
+        config (StorageConfig): A StorageConfig object containing the storage name and container name.
+        max_concurrency (int, optional): The maximum number of blob operations in flight. Defaults to 16.
+
+    Attributes:
+        config (StorageConfig): A StorageConfig object containing the storage name and container name.
+        _container_client (ContainerClient): The aio container client, created lazily.
+        _credential (str | DefaultAzureCredential): The credential used by the container client.
+    """
+
+    def __init__(self, config: StorageConfig, max_concurrency: int = 16) -> None:
+        self.config = config
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._container_client = None
+        self._credential = None
+        self._container_ready = False
+        self._container_lock = asyncio.Lock()
+
+    def _init_container_client(self) -> ContainerClient:
+        """
+        Initializes the aio container client from the connection string if any,
+        otherwise from the storage name and the storage credential.
+        """
+        if self._container_client is not None:
+            return self._container_client
+        try:
+            if self.config.StorageConnStr:
+                self._container_client = ContainerClient.from_connection_string(
+                    conn_str=self.config.StorageConnStr,
+                    container_name=self.config.ContainerName)
+            else:
+                if os.environ.get("AZURE_SA_KEY") is not None:
+                    self._credential = str(os.environ.get("AZURE_SA_KEY"))
+                else:
+                    self._credential = DefaultAzureCredential()
+                self._container_client = ContainerClient(
+                    account_url=f'https://{self.config.StorageName}.blob.core.windows.net/',
+                    container_name=self.config.ContainerName,
+                    credential=self._credential)
+        except Exception as err:
+            raise err
+        return self._container_client
+
+    async def _ensure_container(self) -> None:
+        """
+        Creates the container if it does not exist. The check runs once per process.
+        """
+        if self._container_ready:
+            return
+        async with self._container_lock:
+            if self._container_ready:
+                return
+            await self._create_container_if_missing()
+            self._container_ready = True
+
+    @traced("blob.ensure_container", peer_service="blob-storage")
+    async def _create_container_if_missing(self) -> None:
+        container_client = self._init_container_client()
+        if not await container_client.exists():
+            await container_client.create_container()
+
+    @traced("blob.upload", peer_service="blob-storage")
+    async def upload_stream(self, blob_name: str, data: AsyncIterable[bytes] | bytes) -> BlobHandlerUploadBlob:
+        """
+        Uploads data as a blob to the container without buffering it to a local file.
+
+        Args:
+            blob_name (str): The name of the blob.
+            data (AsyncIterable[bytes] | bytes): The blob content, either as bytes or as an async iterable of chunks.
+
+        Returns:
+            BlobHandlerUploadBlob: A BlobHandlerUploadBlob object with the upload status and blob URL.
+        """
+        await self._ensure_container()
+        async with self._semaphore:
+            try:
+                blob_client = await self._container_client.upload_blob(name=blob_name, data=data, overwrite=True)
+            except Exception as err:
+                raise err
+        return BlobHandlerUploadBlob(Status=True, BlobUrl=blob_client.url)
+
+    @single_flight("blob.list")
+    @traced("blob.list", peer_service="blob-storage")
+    async def list_blobs(self, exclude_prefix: str = None) -> BlobPropertiesApiOut:
+        """
+        Lists all blobs in the container.
+
+        Args:
+            exclude_prefix (str, optional): Skip the blobs whose name starts with this prefix. Defaults to None.
+
+        Returns:
+            BlobPropertiesApiOut: A BlobPropertiesApiOut object
+            with a list of BlobProperties objects containing the blob name and URL.
+        """
+        container_client = self._init_container_client()
+        container_url = container_client.url
+        result: list[BlobProperties] = []
+        async with self._semaphore:
+            async for b in container_client.list_blobs():
+                if exclude_prefix and b.name.startswith(exclude_prefix):
+                    continue
+                # names and URLs are strings from the SDK, no need to validate each record
+                result.append(BlobProperties.model_construct(Name=b.name, BlobUrl=blob_url(container_url, b.name)))
+        set_span_attributes({"blob.count": len(result)})
+        return BlobPropertiesApiOut.model_construct(Value=result)
+
+    @traced("blob.delete_batch", peer_service="blob-storage")
+    async def delete_blobs(self, blob_names: list[str], soft_delete: bool = False) -> BlobDeleteApiOut:
+        """
+        Deletes multiple blobs from the container using concurrent Blob Batch requests.
+
+        Args:
+            blob_names (list[str]): The names of the blobs to be deleted.
+            soft_delete (bool, optional): Mark the blobs with the IsDeleted metadata instead of deleting them.
+            Defaults to False.
+
+        Returns:
+            BlobDeleteApiOut: A BlobDeleteApiOut object with one BlobDeleteResult per blob, in request order.
+        """
+        self._init_container_client()
+        if soft_delete:
+            results = await asyncio.gather(*[self._mark_blob_deleted(name) for name in blob_names])
+            result = list(results)
+        else:
+            batches = [blob_names[i:i + BLOB_BATCH_MAX_SIZE]
+                       for i in range(0, len(blob_names), BLOB_BATCH_MAX_SIZE)]
+            batch_results = await asyncio.gather(*[self._delete_blob_batch(batch) for batch in batches])
+            result = [res for batch_result in batch_results for res in batch_result]
+        set_span_attributes({"blob.count": len(result), "blob.deleted": sum(1 for r in result if r.Status)})
+        return BlobDeleteApiOut(Value=result)
+
+    async def _delete_blob_batch(self, blob_names: list[str]) -> list[BlobDeleteResult]:
+        """
+        Deletes up to BLOB_BATCH_MAX_SIZE blobs with a single Blob Batch request.
+        """
+        async with self._semaphore:
+            try:
+                responses = await self._container_client.delete_blobs(*blob_names, raise_on_any_failure=False)
+                result = []
+                index = 0
+                async for response in responses:
+                    success = 200 <= response.status_code < 300
+                    result.append(BlobDeleteResult(Name=blob_names[index], Status=success,
+                                                   StatusCode=response.status_code,
+                                                   Error=None if success else response.reason))
+                    index += 1
+                return result
+            except HttpResponseError as err:
+                return [BlobDeleteResult(Name=name, Status=False, StatusCode=err.status_code, Error=err.message)
+                        for name in blob_names]
+
+    async def _mark_blob_deleted(self, blob_name: str) -> BlobDeleteResult:
+        """
+        Sets the soft delete metadata on a blob. Existing blob metadata is replaced.
+        """
+        async with self._semaphore:
+            try:
+                blob_client = self._container_client.get_blob_client(blob_name)
+                await blob_client.set_blob_metadata(metadata=SOFT_DELETE_METADATA)
+                return BlobDeleteResult(Name=blob_name, Status=True, StatusCode=200)
+            except HttpResponseError as err:
+                return BlobDeleteResult(Name=blob_name, Status=False, StatusCode=err.status_code, Error=err.message)
+
+    async def close(self) -> None:
+        """
+        Closes the container client and the credential, releasing the connection pool.
+        """
+        if self._container_client is not None:
+            await self._container_client.close()
+            self._container_client = None
+            self._container_ready = False
+        if isinstance(self._credential, DefaultAzureCredential):
+            await self._credential.close()
+            self._credential = None
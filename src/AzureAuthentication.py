@@ -3,6 +3,8 @@ from azure.core.credentials import AccessToken, AzureKeyCredential, AzureNamedKe
 from azure.identity import DefaultAzureCredential
 from dotenv import load_dotenv
 
+from src.Telemetry import traced
+
 
 class AzureAuthenticate:
     """
@@ -18,6 +20,7 @@ class AzureAuthenticate:
         self.search_credential = self.get_search_credential()
         self.storage_credential = self.get_storage_credental()
 
+    @traced("aad.openai_token", peer_service="azure-ad")
     def get_openai_token(self) -> AccessToken:
         """
         Retrieves an access token for the OpenAI service.
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterator, Awaitable
+
+from openai import AsyncAzureOpenAI
+
+from src.AsyncSearchHandler import AsyncSearchHandler
+from src.SemanticCache import SemanticCache
+from src.Telemetry import meter, traced, set_span_attributes
+from src.model.common import ChatMessage, SearchDocument
+from src.model.config import ChatConfig, SearchConfig
+
+SYSTEM_PROMPT = (
+    "You are an assistant answering the questions of the employees about the documents of their SharePoint sites. "
+    "Answer only from the sources below, in the language of the question, and cite the sources you use with their "
+    "number in square brackets, e.g. [1]. If the sources do not contain the answer, say that you do not know."
+)
+
+chat_time_to_first_token = meter.create_histogram(
+    name="chat.time_to_first_token",
+    unit="ms",
+    description="Time from the chat request to the first token of the answer, by cache outcome (hit or miss)"
+)
+chat_duration = meter.create_histogram(
+    name="chat.duration",
+    unit="ms",
+    description="Time from the chat request to the end of the answer, by cache outcome (hit or miss)"
+)
+
+
+def sse_event(event: str, data) -> str:
+    """
+    Formats a server-sent event.
+
+    Args:
+        event (str): The event type.
+        data: The payload, serialized as JSON on a single line.
+
+    Returns:
+        str: The event, terminated by a blank line.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class ChatHandler:
+    """
+    Answers questions about the SharePoint documents of a user with Azure OpenAI, streaming the answer.
+
+    The search of the sources, the security-trimmed hybrid search of AsyncSearchHandler, starts as soon as the
+    request comes in and runs while the prompt is assembled, then the completion is streamed as server-sent
+    events: a "sources" event with the retrieved chunks, a "token" event per chunk of the answer, then a "done"
+    event with the timings, or an "error" event. When the search handler has a SemanticCache, the answers to
+    questions asked without history are cached and reused for similar questions of users with the same sites.
+
+    Args:
+        config (SearchConfig): The search configuration, with the Azure OpenAI endpoint.
+        chat_config (ChatConfig): The chat configuration.
+        search_handler (AsyncSearchHandler): The handler searching the sources.
+    """
+
+    def __init__(self, config: SearchConfig, chat_config: ChatConfig, search_handler: AsyncSearchHandler) -> None:
+        self.config = config
+        self.chat_config = chat_config
+        self.search_handler = search_handler
+        self.semantic_cache = search_handler.semantic_cache
+        self._client = None
+        self._credential = None
+
+    def _init_client(self) -> AsyncAzureOpenAI:
+        if self._client is not None:
+            return self._client
+        if self.config.AoaiKey:
+            self._client = AsyncAzureOpenAI(azure_endpoint=self.config.AoaiEndpoint, api_key=self.config.AoaiKey,
+                                            api_version=self.chat_config.ApiVersion)
+        else:
+            from azure.identity.aio import DefaultAzureCredential, get_bearer_token_provider
+            self._credential = DefaultAzureCredential()
+            token_provider = get_bearer_token_provider(self._credential,
+                                                       "https://cognitiveservices.azure.com/.default")
+            self._client = AsyncAzureOpenAI(azure_endpoint=self.config.AoaiEndpoint,
+                                            azure_ad_token_provider=token_provider,
+                                            api_version=self.chat_config.ApiVersion)
+        return self._client
+
+    async def stream(self, query: str, history: list[ChatMessage], site_ids: Awaitable[list[str]],
+                     top: int = 5) -> AsyncIterator[str]:
+        """
+        Answers a question from the documents of the sites of a user, as server-sent events.
+
+        Args:
+            query (str): The question.
+            history (list[ChatMessage]): The previous messages of the conversation, oldest first.
+            site_ids (Awaitable[list[str]]): Resolves to the full ids of the sites the user can access.
+            top (int, optional): The number of sources. Defaults to 5.
+
+        Yields:
+            str: The server-sent events.
+        """
+        start = time.perf_counter()
+        cacheable = self.semantic_cache is not None and not history
+        retrieval = asyncio.create_task(self._retrieve(query, site_ids, top, cacheable))
+        try:
+            # let the retrieval send its first request before assembling the prompt
+            await asyncio.sleep(0)
+            messages = self._assemble(history)
+            documents, cached, cache_entry = await retrieval
+            yield sse_event("sources", [{"Id": doc.Id, "Title": doc.Title, "Location": doc.Location}
+                                        for doc in documents])
+            if cached is not None:
+                ttft = (time.perf_counter() - start) * 1000
+                chat_time_to_first_token.record(ttft, {"cache": "hit"})
+                yield sse_event("token", {"content": cached})
+                total = (time.perf_counter() - start) * 1000
+                chat_duration.record(total, {"cache": "hit"})
+                yield sse_event("done", {"cached": True, "timeToFirstTokenMs": round(ttft, 1),
+                                         "durationMs": round(total, 1)})
+                return
+
+            messages.append({"role": "user", "content": self._question(query, documents)})
+            ttft, answer = None, []
+            async for content in self._complete(messages):
+                if ttft is None:
+                    ttft = (time.perf_counter() - start) * 1000
+                    chat_time_to_first_token.record(ttft, {"cache": "miss"})
+                answer.append(content)
+                yield sse_event("token", {"content": content})
+            total = (time.perf_counter() - start) * 1000
+            chat_duration.record(total, {"cache": "miss"})
+            if cache_entry is not None and answer and documents:
+                scope, ids, vector, version = cache_entry
+                self.semantic_cache.put(scope, ids, vector, ("".join(answer), documents), version)
+            yield sse_event("done", {"cached": False, "timeToFirstTokenMs": None if ttft is None else round(ttft, 1),
+                                     "durationMs": round(total, 1)})
+        except Exception as err:
+            logging.error(f"Chat failed: {err}")
+            yield sse_event("error", {"message": str(err)})
+        finally:
+            retrieval.cancel()
+
+    @traced("chat.retrieve")
+    async def _retrieve(self, query: str, site_ids: Awaitable[list[str]], top: int, cacheable: bool):
+        # returns the sources, the cached answer on a hit, and what to cache the answer under on a miss
+        site_ids = await site_ids
+        set_span_attributes({"search.sites.count": len(site_ids)})
+        if not site_ids:
+            return [], None, None
+        cache_entry = None
+        if cacheable:
+            cache = self.semantic_cache
+            if cache.refresh_due:
+                await asyncio.to_thread(cache.refresh)
+            version = cache.version
+            scope = SemanticCache.scope_key(f"chat:{top}", site_ids)
+            vector = await self.search_handler.embedder.embed(query)
+            cached = cache.lookup(scope, vector)
+            set_span_attributes({"chat.semantic_cache_hit": cached is not None})
+            if cached is not None:
+                answer, documents = cached
+                return documents, answer, None
+            cache_entry = (scope, site_ids, vector, version)
+        result = await self.search_handler.search(query, site_ids, top)
+        return result.Value, None, cache_entry
+
+    def _assemble(self, history: list[ChatMessage]) -> list[dict]:
+        # the most recent messages that fit in MaxHistoryChars, in order
+        kept, size = [], 0
+        for message in reversed(history):
+            size += len(message.content)
+            if size > self.chat_config.MaxHistoryChars:
+                break
+            kept.append({"role": message.role, "content": message.content})
+        return [{"role": "system", "content": SYSTEM_PROMPT}, *reversed(kept)]
+
+    @staticmethod
+    def _question(query: str, documents: list[SearchDocument]) -> str:
+        sources = "\n\n".join(f"[{i}] {doc.Title or ''} ({doc.Location or ''})\n{doc.Chunk or ''}"
+                              for i, doc in enumerate(documents, start=1))
+        return f"Sources:\n{sources or 'No source found.'}\n\nQuestion: {query}"
+
+    @traced("openai.chat_completion", peer_service="azure-openai")
+    async def _complete(self, messages: list[dict]) -> AsyncIterator[str]:
+        response = await self._init_client().chat.completions.create(
+            model=self.chat_config.Deployment, messages=messages, max_tokens=self.chat_config.MaxTokens,
+            temperature=self.chat_config.Temperature, stream=True)
+        try:
+            async for chunk in response:
+                # Azure sends the prompt filter results in a first chunk without choices
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await response.close()
+
+    async def close(self) -> None:
+        """
+        Closes the Azure OpenAI client and the credential.
+        """
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        if self._credential is not None:
+            await self._credential.close()
+            self._credential = None
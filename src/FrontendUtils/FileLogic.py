@@ -4,6 +4,8 @@ import requests
 import streamlit as st
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 
+from src.FrontendUtils.common import get_json
+
 
 def click_uploadbtn():
     if not st.session_state.uploadbtn_state:
@@ -25,20 +27,19 @@ def upload_files(backend_url: str, file_list: list[UploadedFile]) -> list[reques
 def list_files(backend_url: str):
     list_files_url = f"{backend_url}/api/files/"
     try:
-        res_raw = requests.get(url=list_files_url)
-        res_raw.raise_for_status()
-        return json.loads(res_raw.content)["Value"]
+        return get_json(list_files_url)["Value"]
     except requests.HTTPError as err:
         raise err
 
 
-def delete_files(backend_url: str, list_files: list):
+def delete_files(backend_url: str, list_files: list, soft_delete: bool = False):
     delete_files_url = f"{backend_url}/api/files/"
     body = {"Value": list_files}
     try:
-        res_raw = requests.delete(url=delete_files_url, json=body)
+        res_raw = requests.delete(url=delete_files_url, json=body, params={"soft_delete": soft_delete})
         res_raw.raise_for_status()
-        return True
+        failed = [res for res in json.loads(res_raw.content)["Value"] if not res["Status"]]
+        return len(failed) == 0
     except requests.HTTPError as err:
         raise err
 
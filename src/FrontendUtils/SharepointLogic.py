@@ -1,14 +1,13 @@
-import json
-
 import requests
 import streamlit as st
 
+from src.FrontendUtils.common import get_json
+
 
 @st.cache_data
 def get_sharepoint_list(backend_url: str):
     url = f"{backend_url}/api/sharepoint/sites"
-    res_raw = requests.get(url=url)
-    res = json.loads(res_raw.content)["Value"]
+    res = get_json(url)["Value"]
     return res
 
 
@@ -38,8 +37,6 @@ def delete_sharepoint_indexer(backend_url: str, site_list: list):
 def list_indexer(backend_url: str):
     url = f"{backend_url}/api/sharepoint/list-indexer"
     try:
-        res_raw = requests.get(url=url)
-        res_raw.raise_for_status()
-        return json.loads(res_raw.content)["Value"]
+        return get_json(url)["Value"]
     except requests.HTTPError as err:
         raise err
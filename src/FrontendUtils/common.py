@@ -1,3 +1,4 @@
+import requests
 import streamlit as st
 from pandas import DataFrame
 
@@ -18,4 +19,44 @@ def dataframe_with_selections(df: DataFrame) -> DataFrame:
 
 def clear_cache_reload():
     st.cache_data.clear()
-    st.rerun()
\ No newline at end of file
+    st.rerun()
+
+
+@st.cache_resource
+def _http_session() -> requests.Session:
+    return requests.Session()
+
+
+@st.cache_resource
+def _validated_responses() -> dict:
+    # url -> (ETag, decoded body), kept across clear_cache_reload() which only clears st.cache_data
+    return {}
+
+
+def get_json(url: str):
+    """
+    GETs a JSON resource with a conditional request.
+
+    The last body and ETag of each url are kept, the backend answers 304 Not Modified without a body when the
+    resource did not change and the kept body is returned.
+
+    Args:
+        url (str): The url of the resource.
+
+    Returns:
+        The decoded JSON body.
+
+    Raises:
+        requests.HTTPError: If the backend returns an error.
+    """
+    validated = _validated_responses()
+    cached = validated.get(url)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    res_raw = _http_session().get(url=url, headers=headers)
+    if res_raw.status_code == 304 and cached:
+        return cached[1]
+    res_raw.raise_for_status()
+    body = res_raw.json()
+    if "ETag" in res_raw.headers:
+        validated[url] = (res_raw.headers["ETag"], body)
+    return body
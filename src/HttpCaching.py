@@ -0,0 +1,130 @@
+import hashlib
+
+from pydantic import BaseModel
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware, IdentityResponder
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is used instead
+    brotli = None
+
+CODING_SUFFIXES = ("-gzip", "-br")
+
+
+def etag_for(body: bytes) -> str:
+    """
+    Computes the strong entity tag of a response body.
+
+    Args:
+        body (bytes): The uncompressed response body.
+
+    Returns:
+        str: The quoted entity tag.
+    """
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def matching_etag(if_none_match: str, etag: str) -> str | None:
+    """
+    Finds the entity tag of an If-None-Match header that matches the current one.
+
+    If-None-Match uses the weak comparison, and the content coding suffix added by the CompressionMiddleware is
+    ignored, so a client holding the gzip representation also revalidates.
+
+    Args:
+        if_none_match (str): The value of the If-None-Match header.
+        etag (str): The quoted entity tag of the current representation.
+
+    Returns:
+        str | None: The matching tag as sent by the client, None if nothing matches.
+    """
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return etag
+        opaque = candidate.removeprefix("W/").strip('"')
+        for suffix in CODING_SUFFIXES:
+            opaque = opaque.removesuffix(suffix)
+        if f'"{opaque}"' == etag:
+            return candidate
+    return None
+
+
+def conditional_response(request: Request, content: BaseModel) -> Response:
+    """
+    Serializes a response model with its ETag, or answers 304 Not Modified when the client already has it.
+
+    Args:
+        request (Request): The incoming request.
+        content (BaseModel): The response model.
+
+    Returns:
+        Response: The JSON response, or an empty 304 response.
+    """
+    body = content.model_dump_json(by_alias=True).encode()
+    etag = etag_for(body)
+    # clients may keep the response but must revalidate it before every use
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    matched = matching_etag(request.headers.get("if-none-match", ""), etag)
+    if matched is not None:
+        headers["ETag"] = matched
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int = 4, **kwargs) -> None:
+        super().__init__(app, minimum_size, **kwargs)
+        self.quality = quality
+        self._compressor = None
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if self._compressor is None:
+            self._compressor = brotli.Compressor(quality=self.quality)
+        if more_body:
+            return self._compressor.process(body) + self._compressor.flush()
+        return self._compressor.process(body) + self._compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compresses the responses with brotli or gzip, as negotiated by the Accept-Encoding header.
+
+    Brotli is preferred when the brotli package is installed. The strong ETag of a compressed response gets the
+    content coding as suffix, the compressed bytes being another representation than the identity one.
+
+    Args:
+        app (ASGIApp): The application.
+        minimum_size (int, optional): Responses smaller than this are sent uncompressed. Defaults to 1000.
+        brotli_quality (int, optional): The brotli quality, 4 compresses about as fast as gzip. Defaults to 4.
+        **kwargs: The other GZipMiddleware arguments.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1000, brotli_quality: int = 4, **kwargs) -> None:
+        super().__init__(app, minimum_size=minimum_size, **kwargs)
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_etag(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                coding, etag = headers.get("content-encoding"), headers.get("etag")
+                if coding in ("gzip", "br") and etag and not etag.startswith("W/") \
+                        and not etag.endswith(f'-{coding}"'):
+                    headers["ETag"] = f'{etag[:-1]}-{coding}"'
+            await send(message)
+
+        if brotli is not None and "br" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = BrotliResponder(self.app, self.minimum_size, quality=self.brotli_quality,
+                                        exclude_content_types=self.exclude_content_types)
+            return await responder(scope, receive, send_with_etag)
+        await super().__call__(scope, receive, send_with_etag)
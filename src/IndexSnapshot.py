@@ -0,0 +1,294 @@
+import json
+import logging
+import os
+import struct
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from azure.core.exceptions import HttpResponseError
+from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+from azure.search.documents.indexes.models import SearchIndex
+
+from src.SearchHandler import SearchHandler
+from src.SearchRequests import merge_or_upload
+from src.Telemetry import traced, set_span_attributes
+from src.model.common import IndexSnapshotImport, IndexSnapshotManifest
+
+MANIFEST_FILE = "manifest.json"
+DOCUMENTS_FILE = "documents.parquet"
+# every .npy header is padded to this size, so the row count can be written once the export is over
+NPY_HEADER_SIZE = 128
+# per-document upload failures worth retrying: conflicts with a concurrent write and throttling
+RETRIED_STATUS_CODES = {409, 422, 429, 503}
+ARROW_TYPES = {
+    "Edm.String": pa.string(),
+    "Edm.Int32": pa.int32(),
+    "Edm.Int64": pa.int64(),
+    "Edm.Double": pa.float64(),
+    "Edm.Boolean": pa.bool_(),
+    # kept as the ISO 8601 text of the service, which is what the upload expects
+    "Edm.DateTimeOffset": pa.string(),
+}
+
+
+def _arrow_type(field_type: str) -> pa.DataType | None:
+    # None for the types stored as JSON text: complex types and geography points
+    if field_type.startswith("Collection(") and field_type.endswith(")"):
+        item_type = _arrow_type(field_type[len("Collection("):-1])
+        return None if item_type is None else pa.list_(item_type)
+    return ARROW_TYPES.get(field_type)
+
+
+def _without_secrets(value):
+    if isinstance(value, dict):
+        return {key: None if key == "apiKey" else _without_secrets(item) for key, item in value.items()
+                if key != "@odata.etag"}
+    if isinstance(value, list):
+        return [_without_secrets(item) for item in value]
+    return value
+
+
+def _npy_header(rows: int, dims: int) -> bytes:
+    header = f"{{'descr': '<f4', 'fortran_order': False, 'shape': ({rows}, {dims}), }}"
+    header = header.ljust(NPY_HEADER_SIZE - 11) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class _VectorWriter:
+    """
+    Appends float32 rows to a .npy file whose row count is only known at the end.
+    """
+
+    def __init__(self, path: str, dims: int) -> None:
+        self.dims = dims
+        self.rows = 0
+        self._file = open(path, "wb")
+        self._file.write(_npy_header(0, dims))
+
+    def write(self, vectors: list) -> None:
+        block = np.full((len(vectors), self.dims), np.nan, dtype="<f4")
+        for i, vector in enumerate(vectors):
+            # a document without vector gets a row of NaN
+            if vector:
+                block[i] = vector
+        self._file.write(block.tobytes())
+        self.rows += len(vectors)
+
+    def close(self) -> None:
+        self._file.seek(0)
+        self._file.write(_npy_header(self.rows, self.dims))
+        self._file.close()
+
+
+class IndexSnapshotHandler(SearchHandler):
+    """
+    Exports the documents of a search index to a compact snapshot, and imports a snapshot into an index, so an index
+    can be rebuilt without running the indexers again, which would crack and embed every document again.
+
+    A snapshot is a directory with:
+        - manifest.json: the IndexSnapshotManifest, with the definition of the index.
+        - documents.parquet: every retrievable field but the vectors, one row per document, in key order.
+        - <field>.npy: the float32 matrix of each vector field, row i being the vector of the document of row i,
+          NaN when the document has none. It can be memory-mapped with numpy.load(path, mmap_mode="r").
+
+    Documents are read by pages of the key order, each page starting after the last key of the previous one, so
+    the export streams any number of documents. Fields that are not retrievable cannot be exported.
+
+    Args:
+        config (SearchConfig): The search configuration, IndexName being the exported index and the default target.
+    """
+
+    def _clients(self, index_name: str) -> tuple[SearchIndexClient, SearchClient]:
+        return (SearchIndexClient(endpoint=self.config.Endpoint, credential=self.search_credential),
+                SearchClient(endpoint=self.config.Endpoint, index_name=index_name, credential=self.search_credential))
+
+    @traced("search.export_snapshot", peer_service="azure-search")
+    def export_snapshot(self, path: str, page_size: int = 1000, row_group_size: int = 10000,
+                        search_filter: str = None) -> IndexSnapshotManifest:
+        """
+        Exports every document of the index, or the documents matching a filter, to a snapshot directory.
+
+        Args:
+            path (str): The snapshot directory, created if needed. Its snapshot files are overwritten.
+            page_size (int, optional): The documents read by each search request, at most 1000. Defaults to 1000.
+            row_group_size (int, optional): The rows of each Parquet row group. Defaults to 10000.
+            search_filter (str, optional): An OData filter selecting the exported documents. Defaults to None.
+
+        Returns:
+            IndexSnapshotManifest: The manifest of the snapshot.
+        """
+        os.makedirs(path, exist_ok=True)
+        index_client, search_client = self._clients(self.config.IndexName)
+        try:
+            index = index_client.get_index(self.config.IndexName)
+        except HttpResponseError as genericErr:
+            raise genericErr
+        key_field = next(field.name for field in index.fields if field.key)
+        vector_fields = {field.name: field.vector_search_dimensions for field in index.fields
+                         if field.vector_search_dimensions}
+        hidden = [field.name for field in index.fields if field.hidden]
+        if hidden:
+            logging.warning(f"Fields {hidden} of index {index.name} are not retrievable and are not exported")
+        fields = [field for field in index.fields if not field.hidden and field.name not in vector_fields]
+        json_fields = [field.name for field in fields if _arrow_type(field.type) is None]
+        schema = pa.schema([(field.name, _arrow_type(field.type) or pa.string()) for field in fields])
+        manifest = IndexSnapshotManifest(IndexName=index.name, CreatedAt=datetime.now(timezone.utc),
+                                         KeyField=key_field, VectorFields=vector_fields, JsonFields=json_fields,
+                                         Index=_without_secrets(index.serialize()))
+
+        select = [field.name for field in fields] + list(vector_fields)
+        writers = {name: _VectorWriter(os.path.join(path, f"{name}.npy"), dims)
+                   for name, dims in vector_fields.items()}
+        rows, last_key = [], None
+        try:
+            with pq.ParquetWriter(os.path.join(path, DOCUMENTS_FILE), schema, compression="zstd") as parquet:
+                while True:
+                    page = self._export_page(search_client, key_field, select, last_key, page_size, search_filter)
+                    if page:
+                        for name, writer in writers.items():
+                            writer.write([doc.pop(name, None) for doc in page])
+                        for doc in page:
+                            for name in json_fields:
+                                doc[name] = None if doc.get(name) is None else json.dumps(doc[name])
+                        rows.extend(page)
+                        manifest.DocumentCount += len(page)
+                        last_key = page[-1][key_field]
+                    if rows and (len(rows) >= row_group_size or len(page) < page_size):
+                        parquet.write_table(pa.Table.from_pylist(rows, schema=schema))
+                        rows = []
+                    if len(page) < page_size:
+                        break
+        finally:
+            for writer in writers.values():
+                writer.close()
+        with open(os.path.join(path, MANIFEST_FILE), "w") as file:
+            file.write(manifest.model_dump_json(indent=2))
+        set_span_attributes({"snapshot.documents": manifest.DocumentCount})
+        logging.info(f"Exported {manifest.DocumentCount} documents of index {index.name} to {path}")
+        return manifest
+
+    @staticmethod
+    def _export_page(search_client: SearchClient, key_field: str, select: list[str], last_key: str | None,
+                     page_size: int, search_filter: str = None) -> list[dict]:
+        if last_key is not None:
+            after = f"{key_field} gt '{last_key.replace(chr(39), chr(39) * 2)}'"
+            search_filter = after if search_filter is None else f"({search_filter}) and {after}"
+        try:
+            results = search_client.search(search_text="*", filter=search_filter, order_by=[f"{key_field} asc"],
+                                           select=select, top=page_size)
+            return [{name: value for name, value in doc.items() if not name.startswith("@search.")}
+                    for doc in results]
+        except HttpResponseError as genericErr:
+            raise genericErr
+
+    @traced("search.import_snapshot", peer_service="azure-search")
+    def import_snapshot(self, path: str, index_name: str = None, create_index: bool = True, batch_size: int = 200,
+                        max_workers: int = 8, max_attempts: int = 3, overrides: dict = None) -> IndexSnapshotImport:
+        """
+        Uploads the documents of a snapshot into an index, by batches uploaded in parallel.
+
+        Documents are merged or uploaded, so an interrupted import can be run again.
+
+        Args:
+            path (str): The snapshot directory.
+            index_name (str, optional): The target index. Defaults to the IndexName of the configuration.
+            create_index (bool, optional): Creates or updates the target index with the definition of the snapshot
+                first. The Azure OpenAI key of its vectorizers is taken from the configuration. Defaults to True.
+            batch_size (int, optional): The documents of each upload request. Defaults to 200.
+            max_workers (int, optional): The upload requests in flight. Defaults to 8.
+            max_attempts (int, optional): The attempts to upload a document refused by throttling or a conflict.
+                Defaults to 3.
+            overrides (dict, optional): Field values set in every imported document, a None clearing the field.
+                Defaults to None.
+
+        Returns:
+            IndexSnapshotImport: The number of uploaded documents and the keys of the failed ones.
+        """
+        start = time.perf_counter()
+        with open(os.path.join(path, MANIFEST_FILE)) as file:
+            manifest = IndexSnapshotManifest.model_validate_json(file.read())
+        index_name = index_name or self.config.IndexName
+        index_client, search_client = self._clients(index_name)
+        if create_index:
+            definition = json.loads(json.dumps(manifest.Index))
+            for vectorizer in (definition.get("vectorSearch") or {}).get("vectorizers") or []:
+                if vectorizer.get("azureOpenAIParameters") is not None and self.config.AoaiKey:
+                    vectorizer["azureOpenAIParameters"]["apiKey"] = self.config.AoaiKey
+            index = SearchIndex.deserialize(definition)
+            index.name = index_name
+            try:
+                index_client.create_or_update_index(index)
+            except HttpResponseError as genericErr:
+                raise genericErr
+
+        result = IndexSnapshotImport(IndexName=index_name)
+        vectors = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+                   for name in manifest.VectorFields}
+        parquet = pq.ParquetFile(os.path.join(path, DOCUMENTS_FILE))
+        offset, in_flight = 0, set()
+
+        def collect(done) -> None:
+            for future in done:
+                uploaded, failed = future.result()
+                result.Uploaded += uploaded
+                result.Failed.extend(failed)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for batch in parquet.iter_batches(batch_size=batch_size):
+                docs = batch.to_pylist()
+                for name, matrix in vectors.items():
+                    block = np.asarray(matrix[offset:offset + len(docs)])
+                    missing = np.isnan(block[:, 0])
+                    for doc, vector, skip in zip(docs, block.tolist(), missing):
+                        if not skip:
+                            doc[name] = vector
+                for doc in docs:
+                    for name in manifest.JsonFields:
+                        if doc.get(name) is not None:
+                            doc[name] = json.loads(doc[name])
+                    # absent values would be uploaded as nulls, which collections refuse
+                    for name in [name for name, value in doc.items() if value is None]:
+                        del doc[name]
+                    doc.update(overrides or {})
+                offset += len(docs)
+                in_flight.add(executor.submit(self._upload, search_client, manifest.KeyField, docs, max_attempts))
+                # bounded, so the snapshot is read at the pace of the uploads
+                if len(in_flight) >= 2 * max_workers:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+            collect(wait(in_flight).done)
+
+        result.Seconds = round(time.perf_counter() - start, 2)
+        set_span_attributes({"snapshot.documents": result.Uploaded, "snapshot.failed": len(result.Failed)})
+        logging.info(f"Imported {result.Uploaded} documents into index {index_name} in {result.Seconds}s, "
+                     f"{len(result.Failed)} failed")
+        return result
+
+    def _upload(self, search_client: SearchClient, key_field: str, docs: list[dict],
+                max_attempts: int) -> tuple[int, list[str]]:
+        # returns the number of uploaded documents and the keys of the failed ones
+        uploaded, failed = 0, []
+        for attempt in range(max_attempts):
+            try:
+                results = merge_or_upload(search_client, docs)
+            except HttpResponseError as genericErr:
+                if genericErr.status_code == 413 and len(docs) > 1:
+                    half = len(docs) // 2
+                    first = self._upload(search_client, key_field, docs[:half], max_attempts)
+                    second = self._upload(search_client, key_field, docs[half:], max_attempts)
+                    return first[0] + second[0], first[1] + second[1]
+                raise genericErr
+            uploaded += sum(item.succeeded for item in results)
+            retried = {item.key for item in results
+                       if not item.succeeded and item.status_code in RETRIED_STATUS_CODES}
+            failed += [item.key for item in results if not item.succeeded and item.key not in retried]
+            docs = [doc for doc in docs if doc[key_field] in retried]
+            if not docs or attempt == max_attempts - 1:
+                break
+            time.sleep(2 ** attempt)
+        return uploaded, failed + [doc[key_field] for doc in docs]
@@ -1,4 +1,8 @@
+import asyncio
+import logging
 import os
+import shutil
+import tempfile
 
 from fastapi import UploadFile
 
@@ -18,7 +22,7 @@ def _ensure_temp_dir():
             try:
                 os.makedirs(abs_temp_dir)
             except Exception as err:
-                print(err)
+                logging.error(err)
     except Exception as err:
         raise err
     return abs_temp_dir
@@ -26,7 +30,10 @@ def _ensure_temp_dir():
 
 def write_to_file(file_name, file_bytes: UploadFile):
     """
-    Writes the uploaded file to a temporary directory.
+    Streams the uploaded file to a new file of the temporary directory.
+
+    Every upload gets a file of its own, so concurrent uploads of the same name never share one, and only the
+    extension of the client file name is kept, so the name cannot reach outside the temporary directory.
 
     Args:
         file_name (str): The name of the file to be written.
@@ -35,15 +42,14 @@ def write_to_file(file_name, file_bytes: UploadFile):
     Returns:
         str: The path of the written file.
     """
+    temp_path = _ensure_temp_dir()
+    extension = os.path.splitext(os.path.basename(file_name or ""))[1]
+    fd, file_path = tempfile.mkstemp(suffix=extension, dir=temp_path)
     try:
-        temp_path = _ensure_temp_dir()
-        file_path = os.path.join(temp_path, file_name)
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        with open(file_path, 'wb') as file:
-            file.write(file_bytes.file.read())
-            file.close()
+        with os.fdopen(fd, 'wb') as file:
+            shutil.copyfileobj(file_bytes.file, file)
     except Exception as err:
+        os.remove(file_path)
         raise err
     return file_path
 
@@ -66,3 +72,40 @@ def get_size(file_path, unit='bytes'):
     else:
         size = file_size / 1024 ** exponents_map[unit]
         return round(size, 3)
+
+
+async def iter_upload_file(file_bytes: UploadFile, chunk_size: int = 4 * 1024 * 1024):
+    """
+    Reads an uploaded file in chunks without loading it fully in memory.
+
+    Args:
+        file_bytes (UploadFile): The uploaded file object.
+        chunk_size (int, optional): The size of each chunk in bytes. Defaults to 4 MiB.
+
+    Yields:
+        bytes: The next chunk of the file.
+    """
+    while True:
+        chunk = await file_bytes.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def iter_local_file(file_path: str, chunk_size: int = 4 * 1024 * 1024):
+    """
+    Reads a local file in chunks, off the event loop.
+
+    Args:
+        file_path (str): The path of the file.
+        chunk_size (int, optional): The size of each chunk in bytes. Defaults to 4 MiB.
+
+    Yields:
+        bytes: The next chunk of the file.
+    """
+    with open(file_path, 'rb') as file:
+        while True:
+            chunk = await asyncio.to_thread(file.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
@@ -0,0 +1,283 @@
+import hashlib
+import logging
+import os
+import shutil
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from azure.search.documents import SearchClient
+
+from src.AsyncSearchHandler import SELECT_FIELDS, search_document, site_filter
+from src.IndexSnapshot import DOCUMENTS_FILE, IndexSnapshotHandler
+from src.SemanticCache import SiteGenerations
+from src.StateBackend import StateBackend
+from src.Telemetry import meter, traced, set_span_attributes
+from src.model.common import LocalVectorSite, SearchDocument
+from src.model.config import LocalVectorTierConfig, SearchConfig
+from src.sharepoint.ChunkDeduplicator import SOURCES_FIELD
+
+if TYPE_CHECKING:
+    from src.sharepoint.SiteShards import SiteShardMap
+
+VECTOR_FIELD = "chunkVector"
+VECTORS_FILE = "vectors.npy"
+# rows converted to float32 at a time when scoring float16 vectors, small enough to stay in the CPU cache
+FLOAT16_BLOCK_ROWS = 1024
+# rows normalized at a time when fetching a site
+FETCH_BLOCK_ROWS = 8192
+
+local_vector_queries = meter.create_counter(
+    name="local_vectors.queries",
+    description="Searches offered to the local vector tier, by outcome (hit when every site of the user is local)"
+)
+local_vector_duration = meter.create_histogram(
+    name="local_vectors.query.duration",
+    unit="ms",
+    description="Time to score the local vectors of the sites of a user and select the top results"
+)
+
+
+@dataclass
+class _LoadedSite:
+    entry: LocalVectorSite
+    vectors: np.ndarray
+    documents: pa.Table
+
+
+class LocalVectorTier:
+    """
+    Answers the vector searches of the most queried SharePoint sites in process, from memory-mapped copies of their
+    chunk vectors, instead of a round trip to the search service.
+
+    Every search records the sites of the user, every worker adds its counts to the counts of the state backend
+    every RefreshInterval seconds, and the worker holding the refresh lease keeps the MaxSites sites queried the
+    most by all workers, within MaxVectors vectors. A kept site is exported from the index (see
+    IndexSnapshotHandler) into a directory of Path with its normalized vectors, float16 with Float16, and the fields
+    of its chunks, when it is new, when its generation changed (see SiteGenerations: a run of the indexer scheduler
+    processed changes) or after MaxAge seconds, the only refresh without the scheduler. The list of local sites is
+    kept in the state backend and every worker memory-maps the same files, so the operating system shares their
+    pages.
+
+    A search is answered locally when every site of the user is local: the cosine similarity of the query with
+    every vector of these sites, the top results first. It ranks by vector similarity only, without the keyword
+    part and the semantic reranking of the search service. Other searches go to the service. With a sharded index,
+    every site is exported from the shard holding it.
+
+    Args:
+        config (LocalVectorTierConfig): The tier configuration.
+        search_config (SearchConfig): The search configuration of the index.
+        state (StateBackend): The state shared by the workers.
+        generations (SiteGenerations): The generations of the sites.
+        shards (SiteShardMap, optional): The shards of the index holding the sites, when the index is sharded.
+            Defaults to None.
+    """
+
+    def __init__(self, config: LocalVectorTierConfig, search_config: SearchConfig, state: StateBackend,
+                 generations: SiteGenerations, shards: "SiteShardMap" = None) -> None:
+        self.config = config
+        self.search_config = search_config
+        self.state = state
+        self.generations = generations
+        self.shards = shards
+        self._key = f"local-vectors:{search_config.IndexName}"
+        self._counts_key = f"local-vectors:{search_config.IndexName}:counts"
+        # the searches recorded by this worker since its last flush
+        self._counts: Counter[str] = Counter()
+        self._sites: dict[str, _LoadedSite] = {}
+        # the snapshot handlers by (endpoint, index), one per shard
+        self._snapshots: dict[tuple[str, str], IndexSnapshotHandler] = {}
+
+    def record(self, site_ids: list[str]) -> None:
+        """
+        Counts a search of the sites of a user, to find the most queried sites.
+
+        Args:
+            site_ids (list[str]): The full ids of the sites of the user.
+        """
+        self._counts.update(site_ids)
+
+    def flush(self) -> None:
+        """
+        Adds the searches recorded by this worker to the query counts of all workers, in the state backend.
+
+        Meant to run in every worker at every refresh, before the update.
+        """
+        counts, self._counts = self._counts, Counter()
+        if not counts:
+            return
+        with self.state.lock(self._counts_key):
+            shared = Counter(self.state.get(self._counts_key) or {})
+            shared.update(counts)
+            self.state.set(self._counts_key, dict(shared))
+
+    def search(self, embedding: list[float], site_ids: list[str], top: int) -> list[SearchDocument] | None:
+        """
+        Finds the chunks of some sites closest to a query, when every site is local. CPU bound, to be run in a
+        thread: numpy releases the GIL while scoring.
+
+        Args:
+            embedding (list[float]): The embedding of the query.
+            site_ids (list[str]): The full ids of the sites of the user.
+            top (int): The number of results.
+
+        Returns:
+            list[SearchDocument] | None: The closest chunks, best first, None if a site is not local.
+        """
+        start = time.perf_counter()
+        sites = self._sites
+        loaded = [sites.get(site_id) for site_id in set(site_ids)]
+        if not loaded or any(site is None for site in loaded):
+            local_vector_queries.add(1, {"outcome": "miss"})
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        scores = [self._scores(site.vectors, query) for site in loaded]
+        offsets = np.cumsum([0] + [len(site_scores) for site_scores in scores])
+        flat = np.concatenate(scores)
+        # a shared chunk is local in each of its sites, enough candidates are kept to skip its other copies
+        k = min(top * len(loaded) if self.search_config.SharedChunks else top, len(flat))
+        best = np.argpartition(-flat, k - 1)[:k] if k else np.array([], dtype=np.int64)
+        best = best[np.argsort(-flat[best])]
+        documents, seen = [], set()
+        for i in best.tolist():
+            site = int(np.searchsorted(offsets, i, side="right")) - 1
+            doc = loaded[site].documents.slice(i - int(offsets[site]), 1).to_pylist()[0]
+            if doc["id"] in seen:
+                continue
+            seen.add(doc["id"])
+            documents.append(search_document(doc, site_ids, Score=float(flat[i])))
+            if len(documents) == top:
+                break
+        local_vector_queries.add(1, {"outcome": "hit"})
+        local_vector_duration.record((time.perf_counter() - start) * 1000)
+        return documents
+
+    @staticmethod
+    def _scores(vectors: np.ndarray, query: np.ndarray) -> np.ndarray:
+        if vectors.dtype == np.float32:
+            return vectors @ query
+        # numpy has no fast float16 matrix product, blocks are converted to float32 first, which costs several
+        # times the float32 product: float16 halves the memory, not the latency
+        return np.concatenate([np.asarray(vectors[i:i + FLOAT16_BLOCK_ROWS], dtype=np.float32) @ query
+                               for i in range(0, len(vectors), FLOAT16_BLOCK_ROWS)] or [np.zeros(0, np.float32)])
+
+    def load(self) -> None:
+        """
+        Memory-maps the local sites listed in the state backend and releases the others.
+        """
+        entries = [LocalVectorSite(**entry) for entry in (self.state.get(self._key) or {}).values()]
+        current, sites = self._sites, {}
+        for entry in entries:
+            loaded = current.get(entry.SiteId)
+            if loaded is not None and loaded.entry.Path == entry.Path:
+                sites[entry.SiteId] = loaded
+                continue
+            try:
+                sites[entry.SiteId] = _LoadedSite(entry, np.load(os.path.join(entry.Path, VECTORS_FILE), mmap_mode="r"),
+                                                  pq.read_table(os.path.join(entry.Path, DOCUMENTS_FILE)))
+            except OSError as err:
+                logging.warning(f"Local vectors of site {entry.SiteId} not loaded: {err}")
+        self._sites = sites
+
+    @traced("local_vectors.update")
+    def update(self) -> list[LocalVectorSite]:
+        """
+        Selects the sites most queried by all workers and fetches the new, changed and expired ones from the index.
+
+        Meant to run in a single worker at a time, after every worker flushed its counts. The query counts are halved
+        at every update, so the selection follows the recent traffic, and the local sites not queried lately fill the
+        remaining places.
+
+        Returns:
+            list[LocalVectorSite]: The local sites.
+        """
+        manifest = {site_id: LocalVectorSite(**entry) for site_id, entry in (self.state.get(self._key) or {}).items()}
+        generations = self.generations.generations()
+        # the local sites stay until more queried sites displace them
+        with self.state.lock(self._counts_key):
+            counts = Counter(self.state.get(self._counts_key) or {})
+            self.state.set(self._counts_key, {site_id: count // 2 for site_id, count in counts.items() if count > 1})
+        hot = [site_id for site_id, _ in counts.most_common(self.config.MaxSites)]
+        hot += [site_id for site_id in manifest if site_id not in hot][:self.config.MaxSites - len(hot)]
+
+        selected, vectors, fetched = {}, 0, 0
+        now = datetime.now(timezone.utc)
+        for site_id in hot:
+            entry = manifest.get(site_id)
+            rows = entry.Rows if entry is not None else self._count(site_id)
+            if vectors + rows > self.config.MaxVectors:
+                continue
+            if entry is None or entry.Generation != generations.get(site_id, 0) \
+                    or (now - entry.FetchedAt).total_seconds() > self.config.MaxAge:
+                try:
+                    entry = self._fetch(site_id, generations.get(site_id, 0))
+                    fetched += 1
+                except Exception as err:
+                    logging.warning(f"Local vectors of site {site_id} not fetched: {err}")
+                    if entry is None:
+                        continue
+            selected[site_id] = entry
+            vectors += entry.Rows
+        self.state.set(self._key, {site_id: entry.model_dump(mode="json") for site_id, entry in selected.items()})
+        # the workers still reading the previous files keep them until they unmap them
+        kept = {entry.Path for entry in selected.values()}
+        for entry in manifest.values():
+            if entry.Path not in kept:
+                shutil.rmtree(entry.Path, ignore_errors=True)
+        set_span_attributes({"local_vectors.sites": len(selected), "local_vectors.vectors": vectors,
+                             "local_vectors.fetched": fetched})
+        return list(selected.values())
+
+    def _site_config(self, site_id: str) -> SearchConfig:
+        # the configuration of the index holding the site, its shard when the index is sharded
+        if self.shards is None:
+            return self.search_config
+        return self.shards.shard_config(self.search_config, self.shards.shard_of(site_id))
+
+    def _snapshot_handler(self, site_config: SearchConfig) -> IndexSnapshotHandler:
+        key = (site_config.Endpoint, site_config.IndexName)
+        if key not in self._snapshots:
+            self._snapshots[key] = IndexSnapshotHandler(site_config)
+        return self._snapshots[key]
+
+    def _count(self, site_id: str) -> int:
+        site_config = self._site_config(site_id)
+        search_client = SearchClient(endpoint=site_config.Endpoint, index_name=site_config.IndexName,
+                                     credential=self._snapshot_handler(site_config).search_credential)
+        search_filter = site_filter([site_id], self.search_config.SharedChunks)
+        results = search_client.search(search_text="*", filter=search_filter, top=0, include_total_count=True)
+        return results.get_count() or 0
+
+    def _fetch(self, site_id: str, generation: int) -> LocalVectorSite:
+        digest = hashlib.blake2b(site_id.encode(), digest_size=8).hexdigest()
+        directory = os.path.join(self.config.Path, f"{digest}-{time.time_ns()}")
+        raw = os.path.join(directory, "export")
+        self._snapshot_handler(self._site_config(site_id)).export_snapshot(
+            raw, search_filter=site_filter([site_id], self.search_config.SharedChunks))
+
+        source = np.load(os.path.join(raw, f"{VECTOR_FIELD}.npy"), mmap_mode="r")
+        valid = ~np.isnan(source[:, 0])
+        vectors = np.lib.format.open_memmap(os.path.join(directory, VECTORS_FILE), mode="w+",
+                                            dtype=np.float16 if self.config.Float16 else np.float32,
+                                            shape=(int(valid.sum()), source.shape[1]))
+        row = 0
+        for i in range(0, len(source), FETCH_BLOCK_ROWS):
+            block = np.asarray(source[i:i + FETCH_BLOCK_ROWS])[valid[i:i + FETCH_BLOCK_ROWS]]
+            block /= np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+            vectors[row:row + len(block)] = block
+            row += len(block)
+        vectors.flush()
+        columns = SELECT_FIELDS + [SOURCES_FIELD] if self.search_config.SharedChunks else SELECT_FIELDS
+        documents = pq.read_table(os.path.join(raw, DOCUMENTS_FILE), columns=columns)
+        pq.write_table(documents.filter(pa.array(valid)), os.path.join(directory, DOCUMENTS_FILE))
+        del source, vectors
+        shutil.rmtree(raw)
+        logging.info(f"Fetched {row} local vectors of site {site_id}")
+        return LocalVectorSite(SiteId=site_id, Path=directory, Generation=generation, Rows=row,
+                               FetchedAt=datetime.now(timezone.utc))
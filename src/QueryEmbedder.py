@@ -0,0 +1,139 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from openai import AsyncAzureOpenAI
+
+from src.Telemetry import meter, traced, set_span_attributes
+from src.model.config import QueryEmbeddingConfig, SearchConfig
+
+embedding_batch_size = meter.create_histogram(
+    name="embedding.batch.size",
+    description="Queries vectorized by each Azure OpenAI embeddings request of the micro-batcher"
+)
+embedding_batch_fill = meter.create_histogram(
+    name="embedding.batch.fill_rate",
+    description="Size of each embeddings batch relative to the maximum batch size, between 0 and 1"
+)
+embedding_duration = meter.create_histogram(
+    name="embedding.query.duration",
+    unit="ms",
+    description="Time to vectorize a query, including the wait for its batch, by cache outcome (hit or miss)"
+)
+
+
+class QueryEmbedder:
+    """
+    Vectorizes search queries with Azure OpenAI, with an LRU cache of the query embeddings and a micro-batcher.
+
+    Queries that miss the cache wait up to MaxWaitMs for other queries, and each batch of up to MaxBatchSize
+    distinct queries is vectorized by a single embeddings request. A query already waiting for its batch is not
+    queued twice. The embedder must be used from a single event loop.
+
+    Args:
+        config (SearchConfig): The search configuration, with the Azure OpenAI endpoint and embedding deployment.
+        embedding_config (QueryEmbeddingConfig): The cache and batching configuration.
+    """
+
+    def __init__(self, config: SearchConfig, embedding_config: QueryEmbeddingConfig) -> None:
+        self.config = config
+        self.embedding_config = embedding_config
+        self._client = None
+        self._credential = None
+        self._cache: OrderedDict[str, list[float]] = OrderedDict()
+        self._pending: dict[str, asyncio.Future] = {}
+        self._batch: list[str] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def _init_client(self) -> AsyncAzureOpenAI:
+        if self._client is not None:
+            return self._client
+        if self.config.AoaiKey:
+            self._client = AsyncAzureOpenAI(azure_endpoint=self.config.AoaiEndpoint, api_key=self.config.AoaiKey,
+                                            api_version=self.embedding_config.ApiVersion)
+        else:
+            from azure.identity.aio import DefaultAzureCredential, get_bearer_token_provider
+            self._credential = DefaultAzureCredential()
+            token_provider = get_bearer_token_provider(self._credential,
+                                                       "https://cognitiveservices.azure.com/.default")
+            self._client = AsyncAzureOpenAI(azure_endpoint=self.config.AoaiEndpoint,
+                                            azure_ad_token_provider=token_provider,
+                                            api_version=self.embedding_config.ApiVersion)
+        return self._client
+
+    async def embed(self, text: str) -> list[float]:
+        """
+        Returns the embedding of a query, from the cache or from the next embeddings batch.
+
+        Args:
+            text (str): The query text, whitespace is normalized.
+
+        Returns:
+            list[float]: The embedding, shared with the cache and not to be mutated.
+        """
+        start = time.perf_counter()
+        text = " ".join(text.split())
+        embedding = self._cache.get(text)
+        if embedding is not None:
+            self._cache.move_to_end(text)
+            embedding_duration.record((time.perf_counter() - start) * 1000, {"cache": "hit"})
+            return embedding
+
+        future = self._pending.get(text)
+        if future is None:
+            future = self._pending[text] = asyncio.get_running_loop().create_future()
+            self._batch.append(text)
+            if len(self._batch) >= self.embedding_config.MaxBatchSize:
+                self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.embedding_config.MaxWaitMs / 1000,
+                                                                    self._flush)
+        # shield the shared result from the cancellation of one of its waiters
+        embedding = await asyncio.shield(future)
+        embedding_duration.record((time.perf_counter() - start) * 1000, {"cache": "miss"})
+        return embedding
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._batch = self._batch, []
+        if batch:
+            task = asyncio.create_task(self._embed_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    @traced("openai.embed_queries", peer_service="azure-openai")
+    async def _embed_batch(self, batch: list[str]) -> None:
+        embedding_batch_size.record(len(batch))
+        embedding_batch_fill.record(len(batch) / self.embedding_config.MaxBatchSize)
+        set_span_attributes({"embedding.batch.size": len(batch)})
+        try:
+            response = await self._init_client().embeddings.create(input=batch,
+                                                                   model=self.config.AoaiEmbedDeployment)
+            embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        except Exception as err:
+            for text in batch:
+                future = self._pending.pop(text)
+                if not future.done():
+                    future.set_exception(err)
+            return
+        for text, embedding in zip(batch, embeddings):
+            self._cache[text] = embedding
+            future = self._pending.pop(text)
+            if not future.done():
+                future.set_result(embedding)
+        while len(self._cache) > self.embedding_config.CacheSize:
+            self._cache.popitem(last=False)
+
+    async def close(self) -> None:
+        """
+        Closes the Azure OpenAI client and the credential.
+        """
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        if self._credential is not None:
+            await self._credential.close()
+            self._credential = None
@@ -1,3 +1,4 @@
+import logging
 from datetime import timedelta
 
 from azure.core.exceptions import HttpResponseError
@@ -16,10 +17,13 @@ from azure.search.documents.indexes.models import (
     VectorSearchAlgorithmKind, VectorSearchProfile, VectorSearchVectorizerKind,
     SemanticConfiguration, SemanticField, SemanticSettings, PrioritizedFields,
     SearchIndexerIndexProjections, SearchIndexerIndexProjectionSelector,
-    SearchIndexerIndexProjectionsParameters, IndexProjectionMode
+    SearchIndexerIndexProjectionsParameters, IndexProjectionMode, SearchIndexerStatus
 )
 
 from src.AzureAuthentication import AzureAuthenticate
+from src.SingleFlight import single_flight
+from src.Telemetry import traced, set_span_attributes
+from src.VectorProfiles import vector_profile
 from src.model.common import IndexerProp, IndexerList
 from src.model.config import SearchConfig
 
@@ -53,6 +57,7 @@ class SearchHandler(AzureAuthenticate):
         super().__init__()
         self.config = config
 
+    @traced("search.create_index", peer_service="azure-search")
     def create_index(self, add_fields: list[SearchField] = None) -> SearchIndex:
         """
         Creates a search index in Azure Cognitive Search.
@@ -73,12 +78,15 @@ class SearchHandler(AzureAuthenticate):
 
         Code Analysis: - Initializes a list of default fields for the search index. - If additional fields are
         provided, they are appended to the default fields list. - Creates a VectorSearch object with two vector
-        search algorithms, profiles, and an Azure OpenAI vectorizer. - Creates a SemanticConfiguration object with a
+        search algorithms, profiles, and an Azure OpenAI vectorizer; the HNSW parameters come from the
+        VectorProfile of the configuration, and chunkVector uses the exhaustive KNN profile when it is of that
+        kind. - Creates a SemanticConfiguration object with a
         prioritized field for chunk. - Creates a SemanticSettings object with the semantic configuration. - Creates a
         SearchIndex object with the specified name, default fields, vector search, and semantic settings. - Creates a
         SearchIndexClient object and calls the create_or_update_index method to create the search index. - Returns
         the created search index.
         """
+        profile = vector_profile(self.config.VectorProfile)
         default_fields = [
             SearchField(name="parent_id",
                         type=SearchFieldDataType.String,
@@ -100,8 +108,9 @@ class SearchHandler(AzureAuthenticate):
             SearchField(name="chunkVector",
                         type=SearchFieldDataType.Collection(
                             SearchFieldDataType.Single),
-                        vector_search_dimensions=1536,
-                        vector_search_profile="myHnswProfile")
+                        vector_search_dimensions=self.config.VectorDimensions,
+                        vector_search_profile="myHnswProfile" if profile.Kind == "hnsw"
+                        else "myExhaustiveKnnProfile")
         ]
         if add_fields:
             default_fields = default_fields + add_fields
@@ -112,16 +121,16 @@ class SearchHandler(AzureAuthenticate):
                     name="myHnsw",
                     kind=VectorSearchAlgorithmKind.HNSW,
                     parameters=HnswParameters(
-                        m=4,
-                        ef_construction=400,
-                        ef_search=500,
-                        metric="cosine",
+                        m=profile.M,
+                        ef_construction=profile.EfConstruction,
+                        ef_search=profile.EfSearch,
+                        metric=profile.Metric,
                     ),
                 ),
                 ExhaustiveKnnVectorSearchAlgorithmConfiguration(
                     name="myExhaustiveKnn",
                     kind=VectorSearchAlgorithmKind.EXHAUSTIVE_KNN,
-                    parameters=ExhaustiveKnnParameters(metric="cosine"),
+                    parameters=ExhaustiveKnnParameters(metric=profile.Metric),
                 ),
             ],
             profiles=[
@@ -172,11 +181,12 @@ class SearchHandler(AzureAuthenticate):
             result = index_client.create_or_update_index(index)
             return result
         except HttpResponseError as generic_err:
-            print(generic_err.message)
+            logging.warning(generic_err.message)
             if generic_err.message.__contains__("Existing field(s)"):
                 return index_client.get_index(self.config.IndexName)
             raise generic_err
 
+    @traced("search.create_datasource", peer_service="azure-search")
     def create_datasource(self, ds_name: str, container_name: str, ds_type: str,
                           conn_str: str = None,
                           identity: DefaultAzureCredential = None) -> SearchIndexerDataSourceConnection:
@@ -240,12 +250,13 @@ class SearchHandler(AzureAuthenticate):
             data_source = ds_client.create_data_source_connection(data_source_connection)
             return data_source
         except HttpResponseError as genericErr:
-            print(genericErr)
+            logging.warning(genericErr.message)
             if genericErr.status_code == 400:
                 if genericErr.message.__contains__("data source with that name already exists"):
                     return ds_client.get_data_source_connection(datasource_name)
             raise genericErr
 
+    @traced("search.create_skillset", peer_service="azure-search")
     def create_skillset(self, add_projection_mapping: list[InputFieldMappingEntry]) -> SearchIndexerSkillset:
         """
         Creates a search indexer skillset with two skills: a split skill and an Azure OpenAI embedding skill.
@@ -322,13 +333,15 @@ class SearchHandler(AzureAuthenticate):
             result = client.create_or_update_skillset(skillset)
             return result
         except HttpResponseError as generic_err:
-            print(generic_err)
+            logging.warning(generic_err.message)
             if generic_err.status_code == 400:
                 if generic_err.message.__contains__("skillset with that name already exists"):
                     return client.get_skillset(skillset_name)
             raise generic_err
 
-    def create_indexer(self, indexer_name: str, ds_name: str,  skillset_name: str) -> SearchIndexer:
+    @traced("search.create_indexer", peer_service="azure-search")
+    def create_indexer(self, indexer_name: str, ds_name: str,  skillset_name: str,
+                       schedule_interval: timedelta | None = timedelta(minutes=5)) -> SearchIndexer:
         """
         Creates a search indexer in Azure Cognitive Search with the specified data source, skillset, and indexing
         parameters.
@@ -337,6 +350,8 @@ class SearchHandler(AzureAuthenticate):
             indexer_name (str): The name of the indexer.
             ds_name (str): The name of the data source
             skillset_name (str): The name of the skillset.
+            schedule_interval (timedelta | None, optional): The interval the service runs the indexer at, None for
+                an indexer only run on demand. Defaults to 5 minutes.
 
         Returns:
             SearchIndexer: The created or updated search indexer.
@@ -351,19 +366,150 @@ class SearchHandler(AzureAuthenticate):
             target_index_name=self.config.IndexName,
             skillset_name=skillset_name,
             parameters=parameters,
-            schedule=IndexingSchedule(interval=timedelta(minutes=5)),
+            schedule=IndexingSchedule(interval=schedule_interval) if schedule_interval else None,
         )
         indexer_client = SearchIndexerClient(endpoint=self.config.Endpoint, credential=self.search_credential)
         try:
             result = indexer_client.create_indexer(indexer)
             return result
         except HttpResponseError as genericErr:
-            print(genericErr)
+            logging.warning(genericErr.message)
             if genericErr.status_code == 400:
                 if genericErr.message.__contains__("indexer with that name already exists"):
                     return indexer_client.get_indexer(indexer_name)
             raise genericErr
 
+    @traced("search.run_indexer", peer_service="azure-search")
+    def run_indexer(self, indexer_name: str) -> bool:
+        """
+        Starts a run of an indexer.
+
+        Args:
+            indexer_name (str): The name of the indexer.
+
+        Returns:
+            bool: True if the run started, False if a run of the indexer was already in progress.
+        """
+        indexer_client = SearchIndexerClient(endpoint=self.config.Endpoint, credential=self.search_credential)
+        try:
+            indexer_client.run_indexer(indexer_name)
+            return True
+        except HttpResponseError as genericErr:
+            if genericErr.status_code == 409:
+                return False
+            raise genericErr
+
+    @traced("search.indexer_status", peer_service="azure-search")
+    def get_indexer_status(self, indexer_name: str) -> SearchIndexerStatus:
+        """
+        Retrieves the status and the last execution result of an indexer.
+
+        Args:
+            indexer_name (str): The name of the indexer.
+
+        Returns:
+            SearchIndexerStatus: The status of the indexer.
+        """
+        indexer_client = SearchIndexerClient(endpoint=self.config.Endpoint, credential=self.search_credential)
+        try:
+            return indexer_client.get_indexer_status(indexer_name)
+        except HttpResponseError as genericErr:
+            raise genericErr
+
+    @traced("search.unschedule_indexer", peer_service="azure-search")
+    def unschedule_indexer(self, indexer_name: str) -> None:
+        """
+        Removes the schedule of an indexer, so it only runs on demand.
+
+        Args:
+            indexer_name (str): The name of the indexer.
+        """
+        indexer_client = SearchIndexerClient(endpoint=self.config.Endpoint, credential=self.search_credential)
+        try:
+            indexer = indexer_client.get_indexer(indexer_name)
+            if indexer.schedule is not None:
+                indexer.schedule = None
+                indexer_client.create_or_update_indexer(indexer)
+        except HttpResponseError as genericErr:
+            raise genericErr
+
+    @traced("search.schedule_indexers", peer_service="azure-search")
+    def schedule_indexers(self, schedule_interval: timedelta, ds_type: str = None) -> list[str]:
+        """
+        Gives a schedule to the indexers without one, undoing unschedule_indexer.
+
+        Args:
+            schedule_interval (timedelta): The interval the service runs the indexers at.
+            ds_type (str, optional): Only the indexers whose data source name contains it. Defaults to None.
+
+        Returns:
+            list[str]: The names of the indexers scheduled again.
+        """
+        indexer_client = SearchIndexerClient(endpoint=self.config.Endpoint, credential=self.search_credential)
+        scheduled = []
+        try:
+            for indexer in indexer_client.get_indexers():
+                if indexer.schedule is not None or (ds_type and ds_type not in indexer.data_source_name):
+                    continue
+                indexer.schedule = IndexingSchedule(interval=schedule_interval)
+                indexer_client.create_or_update_indexer(indexer)
+                scheduled.append(indexer.name)
+        except HttpResponseError as genericErr:
+            raise genericErr
+        set_span_attributes({"search.indexers.scheduled": len(scheduled)})
+        return scheduled
+
+    @traced("search.delete_datasource", peer_service="azure-search")
+    def delete_datasource(self, ds_name: str) -> None:
+        """
+        Deletes a data source connection, if it exists.
+
+        Args:
+            ds_name (str): The name of the data source.
+        """
+        indexer_client = SearchIndexerClient(endpoint=self.config.Endpoint, credential=self.search_credential)
+        try:
+            indexer_client.delete_data_source_connection(ds_name)
+        except HttpResponseError as genericErr:
+            raise genericErr
+
+    @traced("search.delete_indexer", peer_service="azure-search")
+    def delete_indexer(self, indexer_name: str) -> None:
+        """
+        Deletes an indexer, if it exists. The documents it indexed stay in the index.
+
+        Args:
+            indexer_name (str): The name of the indexer.
+        """
+        indexer_client = SearchIndexerClient(endpoint=self.config.Endpoint, credential=self.search_credential)
+        try:
+            indexer_client.delete_indexer(indexer_name)
+        except HttpResponseError as genericErr:
+            raise genericErr
+
+    @traced("search.list_resource_names", peer_service="azure-search")
+    def list_resource_names(self) -> tuple[list[str], list[str]]:
+        """
+        Lists the names of the data sources and of the indexers of the search service.
+
+        Returns:
+            tuple[list[str], list[str]]: The data source names and the indexer names.
+
+        Raises:
+            HttpResponseError: If an error occurs while listing the resources.
+        """
+        indexer_client = SearchIndexerClient(endpoint=self.config.Endpoint, credential=self.search_credential)
+        try:
+            datasource_names = indexer_client.get_data_source_connection_names()
+            indexer_names = indexer_client.get_indexer_names()
+            set_span_attributes({"search.datasources.count": len(datasource_names),
+                                 "search.indexers.count": len(indexer_names)})
+            return datasource_names, indexer_names
+        except HttpResponseError as genericErr:
+            raise genericErr
+
+    @single_flight("search.list_indexer")
+    @traced("search.list_indexer", peer_service="azure-search")
     def list_indexer(self, ds_type: str = None) -> IndexerList:
         """
         Retrieves a list of indexers from Azure Cognitive Search.
@@ -398,6 +544,7 @@ class SearchHandler(AzureAuthenticate):
                     SkillSetName=indexer.skillset_name,
                     IndexName=indexer.target_index_name)
                 indexers_prop_list.append(indexer_prop)
+            set_span_attributes({"search.indexers.count": len(indexers_prop_list)})
             return IndexerList(Value=indexers_prop_list)
         except HttpResponseError as genericErr:
             raise genericErr
@@ -0,0 +1,85 @@
+import json
+import logging
+
+from azure.core.exceptions import HttpResponseError
+from azure.search.documents import SearchClient, __version__ as SDK_VERSION
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
+from azure.search.documents.models import RawVectorQuery, VectorQuery
+
+# The SDK model serializer checks every float of a vector, about 20 ms of event loop time for a 1536-dimension
+# query and seconds for an import batch, so on the SDK versions below the search and index requests are sent as
+# plain JSON through the generated client of the SDK. That client is private: any other version falls back to the
+# public SearchClient.search and SearchClient.merge_or_upload_documents, slower but correct.
+RAW_JSON_SDK_VERSIONS = ("11.4.0b12",)
+RAW_JSON = SDK_VERSION in RAW_JSON_SDK_VERSIONS
+
+if not RAW_JSON:
+    logging.warning(f"azure-search-documents {SDK_VERSION} is not one of {RAW_JSON_SDK_VERSIONS}, search and "
+                    f"index requests use the SDK model serializer")
+else:
+    from azure.search.documents._generated.models import SearchRequest
+
+
+async def search_documents(search_client: AsyncSearchClient, search_text: str, vector_query: VectorQuery,
+                           vector: list[float] | None, filter: str, select: list[str], top: int,
+                           semantic_configuration: str | None = None) -> list[dict]:
+    """
+    Runs a search request, with the vector of the vector query sent as plain JSON when the SDK allows it.
+
+    Args:
+        search_client (AsyncSearchClient): The client of the index.
+        search_text (str): The keyword query.
+        vector_query (VectorQuery): The vector query, a RawVectorQuery without its vector when vector is set.
+        vector (list[float] | None): The vector of the RawVectorQuery, None for a VectorizableTextQuery.
+        filter (str): The OData filter.
+        select (list[str]): The fields returned.
+        top (int): The number of results.
+        semantic_configuration (str | None): The semantic configuration reranking the results, None for none.
+
+    Returns:
+        list[dict]: The selected fields of each result with its @search.score and @search.reranker_score.
+    """
+    semantic = {"query_type": "semantic"} if semantic_configuration else {}
+    if not RAW_JSON:
+        if vector is not None:
+            vector_query = RawVectorQuery(vector=vector, k=vector_query.k, fields=vector_query.fields)
+        try:
+            results = await search_client.search(search_text=search_text, vector_queries=[vector_query],
+                                                 filter=filter, select=select, top=top,
+                                                 semantic_configuration_name=semantic_configuration, **semantic)
+            return [item async for item in results]
+        except HttpResponseError as genericErr:
+            raise genericErr
+
+    request = SearchRequest(search_text=search_text, vector_queries=[vector_query], filter=filter,
+                            select=",".join(select), top=top, semantic_configuration=semantic_configuration,
+                            **semantic)
+    body = search_client._client._serialize.body(request, "SearchRequest")
+    if vector is not None:
+        body["vectorQueries"][0]["vector"] = vector
+    try:
+        result = await search_client._client.documents.search_post(search_request=json.dumps(body).encode())
+    except HttpResponseError as genericErr:
+        raise genericErr
+    return [{**item.additional_properties, "@search.score": item.score, "@search.reranker_score": item.reranker_score}
+            for item in result.results]
+
+
+def merge_or_upload(search_client: SearchClient, docs: list[dict]) -> list:
+    """
+    Merges or uploads a batch of documents, sent as plain JSON when the SDK allows it.
+
+    A batch too large for the service raises an HttpResponseError with the status code 413 on the plain JSON path,
+    the public SDK path splits it itself.
+
+    Args:
+        search_client (SearchClient): The client of the index.
+        docs (list[dict]): The documents.
+
+    Returns:
+        list: The IndexingResult of each document, with its key, succeeded and status_code.
+    """
+    if not RAW_JSON:
+        return search_client.merge_or_upload_documents(docs)
+    body = json.dumps({"value": [{"@search.action": "mergeOrUpload", **doc} for doc in docs]}).encode()
+    return search_client._client.documents.index(batch=body).results
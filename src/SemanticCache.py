@@ -0,0 +1,226 @@
+import hashlib
+import threading
+import time
+from typing import Any, Iterable
+
+import numpy as np
+
+from src.StateBackend import StateBackend
+from src.Telemetry import meter
+from src.model.config import SemanticCacheConfig
+
+semantic_cache_lookups = meter.create_counter(
+    name="semantic_cache.lookups",
+    description="Semantic cache lookups, by outcome (hit or miss)"
+)
+
+
+class SiteGenerations:
+    """
+    Generation counters of the indexed sites, shared by the workers through the state backend.
+
+    The generation of a site is bumped when its documents change, e.g. after an indexer run that processed
+    items, so the cached answers built from its documents can be dropped by every worker.
+
+    Args:
+        state (StateBackend): The state shared by the workers.
+        index_name (str): The name of the search index.
+    """
+
+    def __init__(self, state: StateBackend, index_name: str) -> None:
+        self.state = state
+        self._key = f"site-generations:{index_name}"
+        self._version_key = f"{self._key}:version"
+
+    def version(self) -> int:
+        """
+        int: The version of the generations, incremented by every bump.
+        """
+        return self.state.get(self._version_key) or 0
+
+    def generations(self) -> dict[str, int]:
+        """
+        Returns the generation of every site that changed at least once.
+
+        Returns:
+            dict[str, int]: The generations by site id.
+        """
+        return self.state.get(self._key) or {}
+
+    def bump(self, site_ids: Iterable[str]) -> None:
+        """
+        Records that the documents of some sites changed.
+
+        Args:
+            site_ids (Iterable[str]): The full ids of the sites.
+        """
+        site_ids = list(site_ids)
+        if not site_ids:
+            return
+        with self.state.lock(self._key):
+            generations = self.generations()
+            for site_id in site_ids:
+                generations[site_id] = generations.get(site_id, 0) + 1
+            self.state.set(self._key, generations)
+            self.state.set(self._version_key, self.version() + 1)
+
+
+class SemanticCache:
+    """
+    Cache of answers keyed by the meaning of the question: a lookup hits when the embedding of a query is close
+    enough, by cosine similarity, to the embedding of a cached query asked by users with the same access.
+
+    Entries are scoped by the set of sites the answer was retrieved from, so a user only gets answers built from
+    documents they can access, and are dropped when the documents of one of their sites change (see
+    SiteGenerations) or after Ttl seconds. The normalized embeddings are rows of a single float32 matrix of
+    MaxEntries rows, so a lookup is one matrix-vector product, and an expired entry, or else the least recently
+    used one, is evicted when the matrix is full. A scope is forgotten with its last entry, so the memory of the
+    cache stays bounded however many site sets it sees. The cache lives in the process, every worker has its own.
+
+    The generations of the sites are only bumped by the indexer scheduler, which sees the indexer runs that
+    processed changes: without it, the entries are only invalidated after Ttl seconds.
+
+    Args:
+        config (SemanticCacheConfig): The cache configuration.
+        generations (SiteGenerations): The generations of the sites, invalidating the entries.
+    """
+
+    def __init__(self, config: SemanticCacheConfig, generations: SiteGenerations) -> None:
+        self.config = config
+        self.generations = generations
+        self._mutex = threading.Lock()
+        self._vectors: np.ndarray | None = None
+        self._scopes = np.full(config.MaxEntries, -1, dtype=np.int64)
+        self._last_used = np.zeros(config.MaxEntries, dtype=np.int64)
+        self._expires = np.zeros(config.MaxEntries, dtype=np.float64)
+        self._entries: list[Any] = [None] * config.MaxEntries
+        self._scope_ids: dict[str, int] = {}
+        self._scope_keys: dict[int, str] = {}
+        self._scope_sites: dict[int, frozenset[str]] = {}
+        self._next_scope_id = 0
+        self._tick = 0
+        self._version = None
+        self._site_generations: dict[str, int] = {}
+        self._checked_at = 0.0
+
+    @property
+    def version(self) -> int | None:
+        """
+        int | None: The version of the site generations the cache is in sync with.
+        """
+        return self._version
+
+    @staticmethod
+    def scope_key(kind: str, site_ids: Iterable[str]) -> str:
+        """
+        Computes the scope of a query: the kind of cached answer and the set of sites it is retrieved from.
+
+        Args:
+            kind (str): The kind of answer, e.g. "search:5" or "chat".
+            site_ids (Iterable[str]): The full ids of the sites of the user.
+
+        Returns:
+            str: The scope key.
+        """
+        return kind + ":" + hashlib.blake2b("\n".join(sorted(set(site_ids))).encode(), digest_size=16).hexdigest()
+
+    @property
+    def refresh_due(self) -> bool:
+        """
+        bool: Whether the generations of the sites were last read more than a second ago.
+        """
+        return time.monotonic() - self._checked_at >= 1
+
+    def refresh(self) -> None:
+        """
+        Drops the entries of the sites whose generation changed since the last refresh.
+        """
+        self._checked_at = time.monotonic()
+        version = self.generations.version()
+        if version == self._version:
+            return
+        generations = self.generations.generations()
+        with self._mutex:
+            if self._version is not None:
+                changed = {site_id for site_id in generations.keys() | self._site_generations.keys()
+                           if generations.get(site_id) != self._site_generations.get(site_id)}
+                stale = [scope_id for scope_id, sites in self._scope_sites.items() if sites & changed]
+                if stale:
+                    self._scopes[np.isin(self._scopes, stale)] = -1
+                    self._release(stale)
+            self._version, self._site_generations = version, generations
+
+    def lookup(self, scope: str, embedding: list[float]) -> Any | None:
+        """
+        Finds the cached answer of the closest query of a scope.
+
+        Args:
+            scope (str): The scope key of the query.
+            embedding (list[float]): The embedding of the query.
+
+        Returns:
+            Any | None: The cached answer, None if no query of the scope is similar enough.
+        """
+        with self._mutex:
+            scope_id = self._scope_ids.get(scope)
+            if scope_id is None or self._vectors is None:
+                semantic_cache_lookups.add(1, {"outcome": "miss"})
+                return None
+            similarities = self._vectors @ self._normalize(embedding)
+            similarities[(self._scopes != scope_id) | (self._expires < time.time())] = -1
+            row = int(np.argmax(similarities))
+            if similarities[row] < self.config.Threshold:
+                semantic_cache_lookups.add(1, {"outcome": "miss"})
+                return None
+            self._tick += 1
+            self._last_used[row] = self._tick
+            semantic_cache_lookups.add(1, {"outcome": "hit"})
+            return self._entries[row]
+
+    def put(self, scope: str, site_ids: Iterable[str], embedding: list[float], answer: Any,
+            version: int | None) -> None:
+        """
+        Caches the answer of a query.
+
+        Args:
+            scope (str): The scope key of the query.
+            site_ids (Iterable[str]): The full ids of the sites of the scope.
+            embedding (list[float]): The embedding of the query.
+            answer (Any): The answer, shared by every hit and not to be mutated.
+            version (int | None): The version of the cache when the answer was retrieved, the answer is not
+                cached if sites changed since.
+        """
+        vector = self._normalize(embedding)
+        with self._mutex:
+            if version != self._version:
+                return
+            if self._vectors is None:
+                self._vectors = np.zeros((self.config.MaxEntries, len(vector)), dtype=np.float32)
+            free = np.flatnonzero((self._scopes < 0) | (self._expires < time.time()))
+            row = int(free[0]) if len(free) else int(np.argmin(self._last_used))
+            scope_id = self._scope_ids.get(scope)
+            if scope_id is None:
+                scope_id, self._next_scope_id = self._next_scope_id, self._next_scope_id + 1
+                self._scope_ids[scope], self._scope_keys[scope_id] = scope_id, scope
+                self._scope_sites[scope_id] = frozenset(site_ids)
+            evicted = int(self._scopes[row])
+            self._tick += 1
+            self._vectors[row] = vector
+            self._scopes[row] = scope_id
+            self._last_used[row] = self._tick
+            self._expires[row] = time.time() + self.config.Ttl
+            self._entries[row] = answer
+            if evicted >= 0 and evicted != scope_id:
+                self._release([evicted])
+
+    def _release(self, scope_ids: Iterable[int]) -> None:
+        # forgets the scopes left without entries, called with the mutex held
+        for scope_id in scope_ids:
+            if scope_id in self._scope_keys and not np.any(self._scopes == scope_id):
+                del self._scope_ids[self._scope_keys.pop(scope_id)]
+                del self._scope_sites[scope_id]
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
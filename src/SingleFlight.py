@@ -0,0 +1,120 @@
+import asyncio
+import functools
+import inspect
+import threading
+from typing import Callable, Hashable
+
+from src.Telemetry import meter, set_span_attributes
+from src.model.config import SingleFlightConfig
+
+single_flight_calls = meter.create_counter(
+    name="singleflight.calls",
+    description="Calls to the single-flight wrapped operations, by outcome: leader calls reached upstream, "
+                "coalesced calls waited for the result of a concurrent identical call"
+)
+_config = SingleFlightConfig()
+
+
+def configure_single_flight(config: SingleFlightConfig) -> None:
+    """
+    Sets which operations coalesce their concurrent calls.
+
+    Args:
+        config (SingleFlightConfig): The single-flight configuration.
+    """
+    global _config
+    _config = config
+
+
+def _default_key(*args, **kwargs) -> Hashable:
+    return args, tuple(sorted(kwargs.items()))
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+def single_flight(name: str, key: Callable[..., Hashable] = None) -> Callable:
+    """
+    Decorator merging the identical concurrent calls of a function into one: the first call runs, the calls made
+    with the same key while it is in flight wait for it and get its result or exception.
+
+    Works with both regular functions, coalesced across threads, and coroutine functions, coalesced within the
+    event loop. The result is shared by every waiter and must not be mutated. Calls are only merged while in
+    flight, caching is left to the state backend.
+
+    Args:
+        name (str): The name of the operation, e.g. "graph.list_sites". Calls of different operations never merge.
+        key (Callable[..., Hashable], optional): Computes the key of a call from its arguments, calls with equal
+            keys are identical. Defaults to all the arguments, self included.
+
+    Returns:
+        Callable: The decorator.
+    """
+    key = key or _default_key
+
+    def record(outcome: str) -> None:
+        single_flight_calls.add(1, {"operation": name, "outcome": outcome})
+        if outcome == "coalesced":
+            set_span_attributes({"singleflight.coalesced": name})
+
+    def enabled() -> bool:
+        return _config.Enabled and name not in _config.Disabled
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            in_flight: dict[Hashable, asyncio.Future] = {}
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not enabled():
+                    return await func(*args, **kwargs)
+                call_key = (asyncio.get_running_loop(), key(*args, **kwargs))
+                future = in_flight.get(call_key)
+                if future is not None:
+                    record("coalesced")
+                    # shield the shared call from the cancellation of a waiter
+                    return await asyncio.shield(future)
+                future = asyncio.ensure_future(func(*args, **kwargs))
+                in_flight[call_key] = future
+                future.add_done_callback(lambda _: in_flight.pop(call_key, None))
+                record("leader")
+                return await asyncio.shield(future)
+            return async_wrapper
+
+        calls: dict[Hashable, _Call] = {}
+        mutex = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            call_key = key(*args, **kwargs)
+            with mutex:
+                call = calls.get(call_key)
+                leader = call is None
+                if leader:
+                    call = calls[call_key] = _Call()
+            if not leader:
+                record("coalesced")
+                call.done.wait()
+                if call.error is not None:
+                    raise call.error
+                return call.result
+
+            record("leader")
+            try:
+                call.result = func(*args, **kwargs)
+                return call.result
+            except BaseException as err:
+                call.error = err
+                raise err
+            finally:
+                with mutex:
+                    del calls[call_key]
+                call.done.set()
+        return wrapper
+    return decorator
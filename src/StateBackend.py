@@ -0,0 +1,210 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from src.model.config import StateConfig
+
+
+class StateBackend(ABC):
+    """
+    Key/value store for the state shared by the API workers: tokens, site catalog and membership caches.
+
+    Values must be JSON serializable. Implementations are safe to use from several threads, and the
+    cross-process implementations from several worker processes.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Any | None:
+        """
+        Returns the value stored under key, or None if it is missing or expired.
+        """
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float = None) -> None:
+        """
+        Stores value under key, expiring after ttl seconds when given.
+        """
+
+    @abstractmethod
+    def add(self, key: str, value: Any, ttl: float = None) -> bool:
+        """
+        Stores value under key only if the key is missing or expired.
+
+        Returns:
+            bool: True if the value was stored, False if the key already holds a live value.
+        """
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        Removes key from the store.
+        """
+
+    @contextmanager
+    def lock(self, name: str, timeout: float = 30, lease: float = 60) -> Iterator[None]:
+        """
+        Holds an exclusive lock shared by every user of the backend.
+
+        Args:
+            name (str): The name of the lock.
+            timeout (float, optional): Seconds to wait for the lock before raising TimeoutError. Defaults to 30.
+            lease (float, optional): Seconds after which a lock left by a crashed holder expires. Defaults to 60.
+        """
+        lock_key = f"lock:{name}"
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        while not self.add(lock_key, owner, ttl=lease):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Could not acquire lock {name}")
+            time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if self.get(lock_key) == owner:
+                self.delete(lock_key)
+
+    def get_or_set(self, key: str, factory: Callable[[], Any], ttl: float = None, timeout: float = 30,
+                   lease: float = 60) -> Any:
+        """
+        Returns the value stored under key, computing and storing it with factory on a miss.
+
+        Concurrent misses are serialized by a lock on the key, so factory runs once for all workers.
+
+        Args:
+            key (str): The key.
+            factory (Callable[[], Any]): Computes the value, must return a JSON serializable value.
+            ttl (float, optional): The time to live of the computed value in seconds.
+            timeout (float, optional): Seconds to wait for the worker computing the value. Defaults to 30.
+            lease (float, optional): Seconds after which the lock of a crashed worker expires, longer than factory
+                may run. Defaults to 60.
+
+        Returns:
+            Any: The stored or computed value.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self.lock(key, timeout=timeout, lease=lease):
+            value = self.get(key)
+            if value is None:
+                value = factory()
+                self.set(key, value, ttl=ttl)
+        return value
+
+
+class MemoryStateBackend(StateBackend):
+    """
+    In-process state backend. State is not shared between worker processes.
+    """
+
+    def __init__(self) -> None:
+        self._data: dict[str, tuple[Any, float | None]] = {}
+        self._mutex = threading.Lock()
+
+    def _live(self, key: str) -> tuple[Any, float | None] | None:
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key: str) -> Any | None:
+        with self._mutex:
+            entry = self._live(key)
+            return None if entry is None else entry[0]
+
+    def set(self, key: str, value: Any, ttl: float = None) -> None:
+        with self._mutex:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def add(self, key: str, value: Any, ttl: float = None) -> bool:
+        with self._mutex:
+            if self._live(key) is not None:
+                return False
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._mutex:
+            self._data.pop(key, None)
+
+
+class SqliteStateBackend(StateBackend):
+    """
+    State backend stored in a local SQLite database, shared by every worker process of the host.
+
+    The database runs in WAL mode so readers never block the writer, and each thread uses its own connection. A new
+    database file is only readable by its owner, SQLite gives its journal files the same permissions.
+
+    Args:
+        path (str): The path of the SQLite database file. Its directory is created if needed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(path):
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS state "
+                         "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Any | None:
+        row = self._connection().execute(
+            "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: float = None) -> None:
+        self._connection().execute(
+            "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl if ttl else None))
+
+    def add(self, key: str, value: Any, ttl: float = None) -> bool:
+        now = time.time()
+        cursor = self._connection().execute(
+            "INSERT INTO state (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE state.expires_at IS NOT NULL AND state.expires_at <= ?",
+            (key, json.dumps(value), now + ttl if ttl else None, now))
+        return cursor.rowcount > 0
+
+    def delete(self, key: str) -> None:
+        self._connection().execute("DELETE FROM state WHERE key = ?", (key,))
+
+
+def create_state_backend(config: StateConfig) -> StateBackend:
+    """
+    Creates the state backend selected by the configuration.
+
+    Args:
+        config (StateConfig): The state configuration.
+
+    Returns:
+        StateBackend: The state backend.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    if config.Backend == "memory":
+        return MemoryStateBackend()
+    if config.Backend == "sqlite":
+        return SqliteStateBackend(config.SqlitePath)
+    raise ValueError(f"Unknown state backend: {config.Backend}")
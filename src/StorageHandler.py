@@ -1,15 +1,40 @@
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 
 from azure.storage.blob import ContainerClient
 from azure.core.exceptions import HttpResponseError
 
 from src.AzureAuthentication import AzureAuthenticate
+from src.Telemetry import traced, set_span_attributes
 from src.model.common import (
     BlobHandlerUploadBlob,
-    BlobProperties
+    BlobProperties,
+    BlobDeleteResult
 )
 from src.model.config import StorageConfig
-from src.model.output import BlobPropertiesApiOut
+from src.model.output import BlobPropertiesApiOut, BlobDeleteApiOut
+
+# Maximum number of sub-requests accepted by a single Blob Batch call
+BLOB_BATCH_MAX_SIZE = 256
+# Metadata used by the soft delete detection policy configured in SearchHandler.create_datasource
+SOFT_DELETE_METADATA = {"IsDeleted": "true"}
+
+
+def blob_url(container_url: str, blob_name: str) -> str:
+    """
+    Builds the URL of a blob like BlobClient.url does, without creating a client per blob.
+
+    Args:
+        container_url (str): The URL of the container, with its SAS token if any.
+        blob_name (str): The name of the blob.
+
+    Returns:
+        str: The URL of the blob.
+    """
+    base, separator, query = container_url.partition("?")
+    return f"{base.rstrip('/')}/{quote(blob_name, safe='~/')}{separator}{query}"
 
 
 class StorageHandler(AzureAuthenticate):
@@ -65,6 +90,7 @@ class StorageHandler(AzureAuthenticate):
         except Exception as err:
             raise err
 
+    @traced("blob.upload", peer_service="blob-storage")
     def upload_blob(self, file_path: str) -> BlobHandlerUploadBlob:
         """
         Uploads a file as a blob to the container.
@@ -80,7 +106,7 @@ class StorageHandler(AzureAuthenticate):
             "BlobUrl": None
         }
         if not os.path.exists(file_path):
-            print(f'file path not found: {file_path}')
+            logging.warning(f'file path not found: {file_path}')
         if not hasattr(self, '_container_client'):
             self._init_container_client()
         if not self._container_client.exists():
@@ -103,6 +129,7 @@ class StorageHandler(AzureAuthenticate):
         )
         return res
 
+    @traced("blob.list", peer_service="blob-storage")
     def list_blobs(self) -> BlobPropertiesApiOut:
         """
         Lists all blobs in the container.
@@ -112,11 +139,12 @@ class StorageHandler(AzureAuthenticate):
             with a list of BlobProperties objects containing the blob name and URL.
         """
         blobs = self._container_client.list_blobs()
-        result: list[BlobProperties] = []
-        for b in blobs:
-            self._init_blob_client(b.name)
-            result.append(BlobProperties(Name=b.name, BlobUrl=self._blob_client.url))
-        parsed_result = BlobPropertiesApiOut(Value=result)
+        container_url = self._container_client.url
+        # names and URLs are strings from the SDK, no need to validate each record
+        result = [BlobProperties.model_construct(Name=b.name, BlobUrl=blob_url(container_url, b.name))
+                  for b in blobs]
+        parsed_result = BlobPropertiesApiOut.model_construct(Value=result)
+        set_span_attributes({"blob.count": len(result)})
         return parsed_result
 
     def delete_blob(self, blob_name: str) -> bool:
@@ -134,3 +162,83 @@ class StorageHandler(AzureAuthenticate):
             return True
         except HttpResponseError as err:
             raise err
+
+    @traced("blob.delete_batch", peer_service="blob-storage")
+    def delete_blobs(self, blob_names: list[str], soft_delete: bool = False,
+                     max_concurrency: int = 4) -> BlobDeleteApiOut:
+        """
+        Deletes multiple blobs from the container using Blob Batch requests.
+
+        Blobs are split into batches of at most BLOB_BATCH_MAX_SIZE sub-requests and the batches are sent
+        concurrently. A failing blob does not abort the others, every blob gets its own outcome.
+
+        Args:
+            blob_names (list[str]): The names of the blobs to be deleted.
+            soft_delete (bool, optional): Instead of deleting, mark the blobs with the IsDeleted metadata so the
+            indexer removes their documents from the index on its next run. Defaults to False.
+            max_concurrency (int, optional): The number of batches sent in parallel. Defaults to 4.
+
+        Returns:
+            BlobDeleteApiOut: A BlobDeleteApiOut object with one BlobDeleteResult per blob, in request order.
+        """
+        if not blob_names:
+            return BlobDeleteApiOut(Value=[])
+        if soft_delete:
+            operation = self._mark_blobs_deleted
+        else:
+            operation = self._delete_blob_batch
+        batches = [blob_names[i:i + BLOB_BATCH_MAX_SIZE] for i in range(0, len(blob_names), BLOB_BATCH_MAX_SIZE)]
+        result: list[BlobDeleteResult] = []
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(batches)))) as executor:
+            for batch_result in executor.map(operation, batches):
+                result.extend(batch_result)
+        set_span_attributes({"blob.count": len(result), "blob.deleted": sum(1 for r in result if r.Status)})
+        return BlobDeleteApiOut(Value=result)
+
+    def _delete_blob_batch(self, blob_names: list[str]) -> list[BlobDeleteResult]:
+        """
+        Deletes up to BLOB_BATCH_MAX_SIZE blobs with a single Blob Batch request.
+
+        Args:
+            blob_names (list[str]): The names of the blobs to be deleted.
+
+        Returns:
+            list[BlobDeleteResult]: The outcome of each sub-request.
+        """
+        try:
+            responses = self._container_client.delete_blobs(*blob_names, raise_on_any_failure=False)
+            return [
+                BlobDeleteResult(
+                    Name=name,
+                    Status=200 <= response.status_code < 300,
+                    StatusCode=response.status_code,
+                    Error=None if 200 <= response.status_code < 300 else response.reason
+                )
+                for name, response in zip(blob_names, responses)
+            ]
+        except HttpResponseError as err:
+            return [BlobDeleteResult(Name=name, Status=False, StatusCode=err.status_code, Error=err.message)
+                    for name in blob_names]
+
+    def _mark_blobs_deleted(self, blob_names: list[str]) -> list[BlobDeleteResult]:
+        """
+        Sets the soft delete metadata on each blob of a batch.
+
+        Blob Batch does not support metadata updates, so each blob is updated with its own request.
+        Existing blob metadata is replaced.
+
+        Args:
+            blob_names (list[str]): The names of the blobs to be marked as deleted.
+
+        Returns:
+            list[BlobDeleteResult]: The outcome of each metadata update.
+        """
+        result: list[BlobDeleteResult] = []
+        for name in blob_names:
+            try:
+                self._container_client.get_blob_client(name).set_blob_metadata(metadata=SOFT_DELETE_METADATA)
+                result.append(BlobDeleteResult(Name=name, Status=True, StatusCode=200))
+            except HttpResponseError as err:
+                result.append(BlobDeleteResult(Name=name, Status=False, StatusCode=err.status_code,
+                                               Error=err.message))
+        return result
@@ -7,6 +7,7 @@ from azure.search.documents.indexes.models import (
 )
 
 from src.SearchHandler import SearchHandler
+from src.Telemetry import traced
 from src.model.config import StorageSearchConfig, SearchConfig
 
 
@@ -43,6 +44,7 @@ class StorageSearchHandler(SearchHandler):
         ]
         return self.create_skillset(projection_mapping)
 
+    @traced("search.storage_indexer_flow", peer_service="azure-search")
     def create_indexer_flow(self) -> SearchIndexer:
         index = self.create_storage_index()
         datasource = self.create_storage_datasource()
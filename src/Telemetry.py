@@ -0,0 +1,164 @@
+import functools
+import inspect
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Callable
+
+from opentelemetry import metrics, trace
+
+INSTRUMENTATION_NAME = "nvt-sharepoint-handler"
+
+tracer = trace.get_tracer(INSTRUMENTATION_NAME)
+meter = metrics.get_meter(INSTRUMENTATION_NAME)
+outbound_duration = meter.create_histogram(
+    name="outbound.call.duration",
+    unit="ms",
+    description="Latency of the calls made to Azure AI Search, Graph, Blob Storage and Azure OpenAI"
+)
+# The outbound calls of the current request, collected when traffic capture is enabled
+upstream_calls: ContextVar[list | None] = ContextVar("upstream_calls", default=None)
+
+
+def configure_telemetry(app=None) -> str:
+    """
+    Configures the OpenTelemetry exporters and instruments the FastAPI application.
+
+    The exporter is selected by the environment:
+        - APPLICATIONINSIGHTS_CONNECTION_STRING set: Azure Monitor (production).
+        - OTEL_EXPORTER=console: spans and metrics are printed to stdout (local runs and tests).
+        - OTEL_EXPORTER=otlp: OTLP over HTTP to OTEL_EXPORTER_OTLP_ENDPOINT (local collector).
+        - otherwise telemetry stays a no-op.
+
+    Args:
+        app (FastAPI, optional): The application to instrument, every endpoint then gets a server span and
+        the http.server.duration histogram. Defaults to None.
+
+    Returns:
+        str: The name of the configured exporter, "none" if telemetry is disabled.
+    """
+    exporter = os.environ.get("OTEL_EXPORTER", "none").lower()
+    if os.environ.get("APPLICATIONINSIGHTS_CONNECTION_STRING"):
+        exporter = "azuremonitor"
+    if exporter == "none":
+        return exporter
+
+    if exporter == "azuremonitor":
+        from azure.monitor.opentelemetry import configure_azure_monitor
+        configure_azure_monitor(connection_string=os.environ["APPLICATIONINSIGHTS_CONNECTION_STRING"])
+    elif exporter in ("console", "otlp"):
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+        if exporter == "console":
+            from opentelemetry.sdk.metrics.export import ConsoleMetricExporter
+            from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+            span_exporter, metric_exporter = ConsoleSpanExporter(), ConsoleMetricExporter()
+        else:
+            from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            span_exporter, metric_exporter = OTLPSpanExporter(), OTLPMetricExporter()
+
+        resource = Resource.create({"service.name": os.environ.get("OTEL_SERVICE_NAME", INSTRUMENTATION_NAME)})
+        tracer_provider = TracerProvider(resource=resource)
+        tracer_provider.add_span_processor(BatchSpanProcessor(span_exporter))
+        trace.set_tracer_provider(tracer_provider)
+        metrics.set_meter_provider(MeterProvider(resource=resource,
+                                                 metric_readers=[PeriodicExportingMetricReader(metric_exporter)]))
+    else:
+        raise ValueError(f"Unknown OTEL_EXPORTER: {exporter}")
+
+    if app is not None:
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+        FastAPIInstrumentor.instrument_app(app)
+    logging.info(f"Telemetry exported to {exporter}")
+    return exporter
+
+
+def set_span_attributes(attributes: dict[str, Any]) -> None:
+    """
+    Adds attributes, such as result counts, to the current span.
+
+    Args:
+        attributes (dict[str, Any]): The attributes to add.
+    """
+    span = trace.get_current_span()
+    if span.is_recording():
+        span.set_attributes(attributes)
+
+
+def traced(name: str, **attributes: Any) -> Callable:
+    """
+    Decorator wrapping a function in a span and recording its latency in the outbound.call.duration histogram.
+
+    Works with regular, coroutine and async generator functions. The span of an async generator covers its whole
+    iteration but is not made current, as the context cannot be kept across its yields.
+
+    Args:
+        name (str): The name of the operation, e.g. "graph.list_sites".
+        **attributes: Static attributes added to the span and the histogram, e.g. peer_service="graph".
+
+    Returns:
+        Callable: The decorator.
+    """
+    span_attributes = {key.replace("_", "."): value for key, value in attributes.items()}
+
+    def record(start: float, status: str) -> None:
+        duration_ms = (time.perf_counter() - start) * 1000
+        outbound_duration.record(duration_ms, {"operation": name, "status": status, **span_attributes})
+        calls = upstream_calls.get()
+        if calls is not None:
+            calls.append({"operation": name, "peer": span_attributes.get("peer.service"),
+                          "ms": round(duration_ms, 2), "status": status})
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                with tracer.start_as_current_span(name, attributes=span_attributes):
+                    try:
+                        result = await func(*args, **kwargs)
+                    except Exception as err:
+                        record(start, "error")
+                        raise err
+                    record(start, "ok")
+                    return result
+            return async_wrapper
+
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                span = tracer.start_span(name, attributes=span_attributes)
+                try:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                except Exception as err:
+                    record(start, "error")
+                    span.record_exception(err)
+                    raise err
+                else:
+                    record(start, "ok")
+                finally:
+                    span.end()
+            return async_gen_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            with tracer.start_as_current_span(name, attributes=span_attributes):
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as err:
+                    record(start, "error")
+                    raise err
+                record(start, "ok")
+                return result
+        return wrapper
+
+    return decorator
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Iterator
+
+from src.Telemetry import traced
+from src.model.common import TextExtractionResult
+
+PDF_EXTENSIONS = {".pdf"}
+# Office documents can only be opened by PyMuPDF when the pymupdf.pro add-on is installed
+OFFICE_EXTENSIONS = {".docx", ".doc", ".xlsx", ".xls", ".pptx", ".ppt"}
+# Extracted text is stored under this virtual folder next to the source blob
+EXTRACTED_TEXT_PREFIX = ".extracted/"
+
+
+@lru_cache(maxsize=1)
+def _office_supported() -> bool:
+    """
+    Checks whether the pymupdf.pro add-on is available to open Office documents.
+
+    Returns:
+        bool: True if Office documents can be extracted, False otherwise.
+    """
+    try:
+        import pymupdf.pro
+        pymupdf.pro.unlock()
+        return True
+    except Exception:
+        return False
+
+
+def _init_worker(include_office: bool) -> None:
+    # a worker process only inherits the pymupdf.pro unlock of the API process when it is forked, not with the
+    # spawn or forkserver start methods, so each worker unlocks it itself
+    if include_office:
+        _office_supported()
+
+
+def is_extractable(file_name: str, include_office: bool = False) -> bool:
+    """
+    Checks whether text can be extracted from a file based on its extension.
+
+    Args:
+        file_name (str): The name of the file.
+        include_office (bool, optional): Also accept Office documents. Defaults to False.
+
+    Returns:
+        bool: True if the file can be extracted, False otherwise.
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension in PDF_EXTENSIONS:
+        return True
+    return include_office and extension in OFFICE_EXTENSIONS and _office_supported()
+
+
+def extracted_text_blob_name(blob_name: str) -> str:
+    """
+    Returns the name of the blob holding the extracted text of a document blob.
+
+    Args:
+        blob_name (str): The name of the document blob.
+
+    Returns:
+        str: The name of the extracted text blob.
+    """
+    return f"{EXTRACTED_TEXT_PREFIX}{blob_name}.pages.jsonl"
+
+
+def iter_pages(file_path: str) -> Iterator[dict]:
+    """
+    Yields the text of a document one page at a time.
+
+    PyMuPDF loads pages lazily, so only the current page is held in memory.
+
+    Args:
+        file_path (str): The path of the document.
+
+    Yields:
+        dict: A record with the page number, the character offset of the page in the document and its text.
+    """
+    # imported here so that importing this module does not load PyMuPDF in the API process
+    import pymupdf
+
+    offset = 0
+    with pymupdf.open(file_path) as doc:
+        for page in doc:
+            text = page.get_text("text")
+            yield {"page": page.number + 1, "offset": offset, "text": text}
+            offset += len(text)
+
+
+def extract_to_file(file_path: str, output_path: str = None) -> TextExtractionResult:
+    """
+    Extracts the text of a document page by page into a JSON lines file.
+
+    Runs in the worker processes of TextExtractor, so it must stay a module level function.
+
+    Args:
+        file_path (str): The path of the document.
+        output_path (str, optional): The path of the output file. Defaults to the document path + ".pages.jsonl".
+
+    Returns:
+        TextExtractionResult: The number of pages and characters extracted and the output path.
+    """
+    start = time.perf_counter()
+    output_path = output_path or f"{file_path}.pages.jsonl"
+    pages = 0
+    characters = 0
+    with open(output_path, "w", encoding="utf-8") as output:
+        for record in iter_pages(file_path):
+            output.write(json.dumps(record, ensure_ascii=False))
+            output.write("\n")
+            pages += 1
+            characters += len(record["text"])
+    return TextExtractionResult(
+        Name=os.path.basename(file_path),
+        Pages=pages,
+        Characters=characters,
+        OutputPath=output_path,
+        Seconds=time.perf_counter() - start
+    )
+
+
+class TextExtractor:
+    """
+    Extracts text and page boundaries from documents on a process pool.
+
+    Text extraction is CPU bound, running it on a process pool sized to the cores keeps the event loop and the
+    GIL free for the API while several documents are cracked in parallel.
+
+    Args:
+        max_workers (int, optional): The number of worker processes. Defaults to the number of cores.
+        include_office (bool, optional): Also extract Office documents when pymupdf.pro is installed.
+        Defaults to False.
+    """
+
+    def __init__(self, max_workers: int = None, include_office: bool = False) -> None:
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.include_office = include_office
+        self._pool = None
+
+    def _init_pool(self) -> ProcessPoolExecutor:
+        """
+        Initializes the process pool on first use.
+        """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                             initargs=(self.include_office,))
+        return self._pool
+
+    def is_extractable(self, file_name: str) -> bool:
+        return is_extractable(file_name, include_office=self.include_office)
+
+    @traced("text.extract")
+    async def extract(self, file_path: str, output_path: str = None) -> TextExtractionResult:
+        """
+        Extracts the text of a document on the process pool.
+
+        Args:
+            file_path (str): The path of the document.
+            output_path (str, optional): The path of the output file.
+
+        Returns:
+            TextExtractionResult: The extraction result.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._init_pool(), extract_to_file, file_path, output_path)
+
+    def map(self, file_paths: list[str], output_dir: str = None) -> Iterator[TextExtractionResult]:
+        """
+        Extracts the text of many documents in parallel, yielding results in input order.
+
+        Args:
+            file_paths (list[str]): The paths of the documents.
+            output_dir (str, optional): The directory of the output files. Defaults to next to each document.
+
+        Yields:
+            TextExtractionResult: The extraction result of each document.
+        """
+        output_paths = [None] * len(file_paths)
+        if output_dir:
+            output_paths = [os.path.join(output_dir, f"{i}-{os.path.basename(f)}.pages.jsonl")
+                            for i, f in enumerate(file_paths)]
+        yield from self._init_pool().map(extract_to_file, file_paths, output_paths)
+
+    def shutdown(self) -> None:
+        """
+        Shuts the process pool down.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,179 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import time
+from urllib.parse import parse_qsl
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.Telemetry import upstream_calls
+from src.model.config import TrafficCaptureConfig
+
+FILENAME_PATTERN = re.compile(rb'filename="([^"]*)"')
+NUMBER_PATTERN = re.compile(r"^-?\d+(\.\d+)?$")
+
+
+def pseudonymize(value: str, salt: bytes) -> str:
+    """
+    Replaces a string by a stable pseudonym: equal values get equal pseudonyms within a capture, so the replay
+    keeps the repetition of users and sites that the caches depend on.
+
+    Args:
+        value (str): The value to hide.
+        salt (bytes): The key of the capture.
+
+    Returns:
+        str: The pseudonym.
+    """
+    return "anon-" + hmac.new(salt, value.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def sanitize(value, salt: bytes):
+    """
+    Keeps the shape of a JSON value and pseudonymizes every string in it. Numbers, booleans and nulls are kept.
+
+    Args:
+        value: The decoded JSON value.
+        salt (bytes): The key of the capture.
+
+    Returns:
+        The sanitized value.
+    """
+    if isinstance(value, dict):
+        return {key: sanitize(item, salt) for key, item in value.items()}
+    if isinstance(value, list):
+        return [sanitize(item, salt) for item in value]
+    if isinstance(value, str):
+        return pseudonymize(value, salt)
+    return value
+
+
+def _sanitize_query(query_string: bytes, salt: bytes) -> dict:
+    query = {}
+    for key, value in parse_qsl(query_string.decode("latin-1"), keep_blank_values=True):
+        keep = value.lower() in ("true", "false") or NUMBER_PATTERN.match(value)
+        query[key] = value if keep else pseudonymize(value, salt)
+    return query
+
+
+class TrafficWriter:
+    """
+    Appends the captured requests to a JSON lines file.
+
+    Every record is written with a single O_APPEND write, so several workers can share the file.
+
+    Args:
+        path (str): The path of the capture file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fd = None
+
+    def write(self, record: dict) -> None:
+        if self._fd is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        os.write(self._fd, (json.dumps(record, separators=(",", ":")) + "\n").encode())
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class TrafficCaptureMiddleware:
+    """
+    ASGI middleware recording sanitized traces of the API requests, for benchmarks/replay.py.
+
+    Each record holds the endpoint, the pseudonymized query and JSON body, the size and extension of uploaded
+    files, the status, the latency and the outbound calls made while serving the request. File contents,
+    headers and client addresses are never recorded.
+
+    Args:
+        app (ASGIApp): The application.
+        config (TrafficCaptureConfig): The capture configuration.
+    """
+
+    def __init__(self, app: ASGIApp, config: TrafficCaptureConfig) -> None:
+        self.app = app
+        self.config = config
+        self.writer = TrafficWriter(config.Path)
+        if config.Salt is None:
+            logging.warning("TRAFFIC_CAPTURE_SALT is not set, pseudonyms differ between workers and restarts")
+        self.salt = (config.Salt or secrets.token_hex(16)).encode()
+        self.random = random.Random()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith("/api/") \
+                or self.random.random() >= self.config.SampleRate:
+            return await self.app(scope, receive, send)
+
+        body = bytearray()
+        body_bytes = 0
+        status = None
+        response_end = None
+
+        async def receive_wrapper() -> Message:
+            nonlocal body_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                body_bytes += len(chunk)
+                if len(body) < self.config.MaxBodyBytes:
+                    body.extend(chunk[:self.config.MaxBodyBytes - len(body)])
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, response_end
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_end = time.perf_counter()
+            await send(message)
+
+        calls = []
+        token = upstream_calls.set(calls)
+        timestamp, start = time.time(), time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            upstream_calls.reset(token)
+            end = response_end or time.perf_counter()
+            try:
+                self.writer.write(self._record(scope, bytes(body), body_bytes, status, timestamp,
+                                               (end - start) * 1000, calls))
+            except Exception as err:
+                logging.error(f"Traffic capture failed: {err}")
+
+    def _record(self, scope: Scope, body: bytes, body_bytes: int, status: int, timestamp: float,
+                duration_ms: float, calls: list[dict]) -> dict:
+        headers = dict(scope["headers"])
+        content_type = headers.get(b"content-type", b"").decode("latin-1").split(";")[0]
+        record = {
+            "ts": round(timestamp, 6),
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": _sanitize_query(scope.get("query_string", b""), self.salt),
+            "content_type": content_type or None,
+            "body": None,
+            "body_bytes": body_bytes,
+            "files": [],
+            "status": status,
+            "duration_ms": round(duration_ms, 2),
+            "upstream": calls,
+        }
+        if content_type == "multipart/form-data":
+            record["files"] = [{"ext": os.path.splitext(name.decode("utf-8", "replace"))[1].lower()}
+                               for name in FILENAME_PATTERN.findall(body)]
+        elif body and body_bytes <= self.config.MaxBodyBytes:
+            try:
+                record["body"] = sanitize(json.loads(body), self.salt)
+            except ValueError:
+                pass
+        return record
@@ -0,0 +1,31 @@
+from src.model.config import VectorProfile
+
+# Azure AI Search accepts m in [4, 10], ef_construction and ef_search in [100, 1000]. "default" holds the
+# parameters of the existing indexes, the defaults of the service. benchmarks/vector_profiles.py measures the
+# recall, latency and memory of each profile on a sample of the vectors of an index.
+VECTOR_PROFILES: dict[str, VectorProfile] = {
+    "default": VectorProfile(Name="default", Kind="hnsw", M=4, EfConstruction=400, EfSearch=500),
+    "fast": VectorProfile(Name="fast", Kind="hnsw", M=4, EfConstruction=200, EfSearch=100),
+    "balanced": VectorProfile(Name="balanced", Kind="hnsw", M=8, EfConstruction=400, EfSearch=200),
+    "recall": VectorProfile(Name="recall", Kind="hnsw", M=10, EfConstruction=800, EfSearch=600),
+    "exhaustive": VectorProfile(Name="exhaustive", Kind="exhaustiveKnn"),
+}
+
+
+def vector_profile(name: str) -> VectorProfile:
+    """
+    Returns a named vector search profile.
+
+    Args:
+        name (str): The name of the profile, a key of VECTOR_PROFILES.
+
+    Returns:
+        VectorProfile: The profile.
+
+    Raises:
+        ValueError: If no profile has this name.
+    """
+    try:
+        return VECTOR_PROFILES[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown vector profile {name}, expected one of {', '.join(VECTOR_PROFILES)}")
@@ -1,3 +1,6 @@
+from datetime import datetime
+from typing import Literal
+
 from pydantic import BaseModel
 
 
@@ -73,6 +76,132 @@ class AzureADGroupList(BaseModel):
     Value: list[AzureADGroup]
 
 
+class IndexedSite(BaseModel):
+    """
+    Represents a SharePoint site integrated with the search index.
+
+    Attributes:
+        Site (SharepointSite): The SharePoint site.
+        IndexerName (str): The name of the indexer of the site.
+    """
+    Site: SharepointSite
+    IndexerName: str
+
+
+class IndexedSiteList(BaseModel):
+    """
+    Represents the indexed sites at a version of the indexed-site index.
+
+    Attributes:
+        Version (int): The version of the index, incremented by every change.
+        Value (list[IndexedSite]): The indexed sites.
+    """
+    Version: int
+    Value: list[IndexedSite]
+
+
+class SiteReconcilePlan(BaseModel):
+    """
+    Represents the changes that bring the integrated SharePoint sites to a desired set of sites.
+
+    Attributes:
+        DryRun (bool): Whether the changes were only planned, or also applied.
+        CreateDatasources (list[str]): The names of the data sources to create.
+        CreateIndexers (list[str]): The names of the indexers to create.
+        DeleteIndexers (list[str]): The names of the indexers to delete.
+        DeleteDatasources (list[str]): The names of the data sources to delete.
+        PurgeSiteIds (list[str]): The ids of the sites whose documents are removed from the index.
+        Errors (list[str]): The changes that failed to apply.
+    """
+    DryRun: bool
+    CreateDatasources: list[str] = []
+    CreateIndexers: list[str] = []
+    DeleteIndexers: list[str] = []
+    DeleteDatasources: list[str] = []
+    PurgeSiteIds: list[str] = []
+    Errors: list[str] = []
+
+
+class IndexerRunState(BaseModel):
+    """
+    Represents the scheduling state of a SharePoint indexer run by the indexer scheduler.
+
+    Attributes:
+        IndexerName (str): The name of the indexer.
+        Running (bool): Whether a run triggered by the scheduler is in progress.
+        TriggeredAt (datetime | None): When the scheduler last started a run.
+        LastStatus (str | None): The status of the last run, e.g. "success" or "transientFailure".
+        LastRunStart (datetime | None): The start of the last run.
+        LastSuccessStart (datetime | None): The start of the last successful run, the documents are at least as
+            fresh as this.
+        ChangeRate (float): The moving average of the items processed per run.
+        IdleRuns (int): The number of consecutive runs that processed no item.
+        FailedRuns (int): The number of consecutive failed runs.
+        NextRun (datetime | None): The earliest time of the next run, None to run as soon as possible.
+        FreshnessLag (float | None): The seconds since the start of the last successful run, None if the indexer
+            never succeeded.
+    """
+    IndexerName: str
+    Running: bool = False
+    TriggeredAt: datetime | None = None
+    LastStatus: str | None = None
+    LastRunStart: datetime | None = None
+    LastSuccessStart: datetime | None = None
+    ChangeRate: float = 0.0
+    IdleRuns: int = 0
+    FailedRuns: int = 0
+    NextRun: datetime | None = None
+    FreshnessLag: float | None = None
+
+
+class IndexerSchedule(BaseModel):
+    """
+    Represents the state of the indexer scheduler.
+
+    Attributes:
+        MaxConcurrentRuns (int): The number of runs the scheduler keeps in progress at most.
+        Running (int): The number of runs in progress.
+        Value (list[IndexerRunState]): The indexers, the least fresh first.
+    """
+    MaxConcurrentRuns: int
+    Running: int
+    Value: list[IndexerRunState]
+
+
+class SearchDocument(BaseModel):
+    """
+    Represents a chunk of a document returned by a search.
+
+    Attributes:
+        Id (str): The id of the chunk.
+        Title (str | None): The name of the document.
+        Location (str | None): The web URL of the document.
+        Chunk (str | None): The text of the chunk.
+        SiteId (str | None): The id of the SharePoint site of the document.
+        Score (float | None): The hybrid search score.
+        RerankerScore (float | None): The semantic reranker score, None without semantic ranking.
+    """
+    Id: str
+    Title: str | None = None
+    Location: str | None = None
+    Chunk: str | None = None
+    SiteId: str | None = None
+    Score: float | None = None
+    RerankerScore: float | None = None
+
+
+class ChatMessage(BaseModel):
+    """
+    Represents a message of a chat conversation.
+
+    Attributes:
+        role (str): "user" or "assistant".
+        content (str): The text of the message.
+    """
+    role: Literal["user", "assistant"]
+    content: str
+
+
 class IndexerProp(BaseModel):
     """
     Represents properties of an indexer.
@@ -121,3 +250,211 @@ class BlobProperties(BaseModel):
     """
     Name: str
     BlobUrl: str
+
+
+class BlobDeleteResult(BaseModel):
+    """
+    Represents the outcome of deleting a single blob.
+
+    Attributes:
+        Name (str): The name of the blob.
+        Status (bool): True if the blob was deleted (or marked as deleted), False otherwise.
+        StatusCode (int): The HTTP status code returned for the blob sub-request.
+        Error (str): The error reason when the operation failed.
+    """
+    Name: str
+    Status: bool
+    StatusCode: int | None = None
+    Error: str | None = None
+
+
+class TextExtractionResult(BaseModel):
+    """
+    Represents the result of extracting the text of a document.
+
+    Attributes:
+        Name (str): The name of the source document.
+        Pages (int): The number of pages extracted.
+        Characters (int): The number of characters extracted.
+        OutputPath (str): The path of the JSON lines file holding one record per page.
+        Seconds (float): The time spent extracting the document.
+    """
+    Name: str
+    Pages: int
+    Characters: int
+    OutputPath: str
+    Seconds: float
+
+
+class IndexSnapshotManifest(BaseModel):
+    """
+    Describes a snapshot of a search index, the manifest.json of the snapshot directory.
+
+    Attributes:
+        IndexName (str): The name of the exported index.
+        CreatedAt (datetime): The start of the export.
+        DocumentCount (int): The number of documents, the rows of documents.parquet and of every vector file.
+        KeyField (str): The key field of the index.
+        VectorFields (dict[str, int]): The dimensions of every vector field, stored in <field>.npy.
+        JsonFields (list[str]): The complex and geography fields, stored as JSON text.
+        Index (dict): The definition of the index, without its secrets.
+    """
+    IndexName: str
+    CreatedAt: datetime
+    DocumentCount: int = 0
+    KeyField: str
+    VectorFields: dict[str, int] = {}
+    JsonFields: list[str] = []
+    Index: dict
+
+
+class IndexSnapshotImport(BaseModel):
+    """
+    Represents the outcome of importing a snapshot into an index.
+
+    Attributes:
+        IndexName (str): The name of the target index.
+        Uploaded (int): The number of documents uploaded.
+        Failed (list[str]): The keys of the documents that could not be uploaded.
+        Seconds (float): The duration of the import.
+    """
+    IndexName: str
+    Uploaded: int = 0
+    Failed: list[str] = []
+    Seconds: float = 0.0
+
+
+class LocalVectorSite(BaseModel):
+    """
+    Represents the vectors of a SharePoint site held by the local vector tier.
+
+    Attributes:
+        SiteId (str): The full id of the site.
+        Path (str): The directory of its vectors.npy and documents.parquet.
+        Generation (int): The generation of the site when it was fetched.
+        Rows (int): The number of chunks with a vector.
+        FetchedAt (datetime): When the site was fetched from the index.
+    """
+    SiteId: str
+    Path: str
+    Generation: int = 0
+    Rows: int = 0
+    FetchedAt: datetime
+
+
+class ChunkDedupResult(BaseModel):
+    """
+    Represents a run of the chunk deduplicator.
+
+    Attributes:
+        Parents (int): The documents whose chunks were processed.
+        Chunks (int): The chunks of these documents.
+        DuplicatesRemoved (int): The documents removed from the index, net of the shared chunks created.
+        SharedChunksCreated (int): The shared chunks created for chunks seen a second time.
+        EstimatedBytesSaved (int): The vector and text bytes of the removed documents.
+        MembersRemoved (int): The members of shared chunks whose document is no longer in the index.
+        Seconds (float): The duration of the run.
+    """
+    Parents: int = 0
+    Chunks: int = 0
+    DuplicatesRemoved: int = 0
+    SharedChunksCreated: int = 0
+    EstimatedBytesSaved: int = 0
+    MembersRemoved: int = 0
+    Seconds: float = 0.0
+
+
+class ChunkDedupReport(BaseModel):
+    """
+    Represents the index space saved by the shared chunks.
+
+    Attributes:
+        SharedChunks (int): The shared chunks in the index.
+        ReplacedCopies (int): The copies of documents they stand for.
+        DocumentCount (int): The documents in the index.
+        StorageSize (int): The storage size of the index in bytes.
+        VectorIndexSize (int): The vector index size in bytes.
+        EstimatedBytesSaved (int): The copies replaced, net of the shared chunks, times the average size of a
+            document.
+    """
+    SharedChunks: int = 0
+    ReplacedCopies: int = 0
+    DocumentCount: int = 0
+    StorageSize: int = 0
+    VectorIndexSize: int = 0
+    EstimatedBytesSaved: int = 0
+
+
+class OrphanCollectionResult(BaseModel):
+    """
+    Represents a run of the orphaned-document collector.
+
+    Attributes:
+        DryRun (bool): Whether the orphaned documents were only listed, or also deleted.
+        IndexedSites (int): The sites that have documents in the index.
+        LiveSites (int): The sites that have an indexer and still exist in SharePoint.
+        Orphans (list[str]): The ids of the sites whose documents were deleted, or would be in a dry run.
+        Pending (list[str]): The ids of the orphaned sites still within the grace period.
+        OrphanedDocuments (int): The documents of the sites in Orphans, as counted by the facet query.
+        DocumentsDeleted (int): The documents deleted.
+        EstimatedBytesReclaimed (int): The documents deleted times the average size of a document in the index
+            statistics, vector index included.
+        Errors (list[str]): The sites whose documents failed to be deleted.
+        Seconds (float): The duration of the run.
+    """
+    DryRun: bool
+    IndexedSites: int = 0
+    LiveSites: int = 0
+    Orphans: list[str] = []
+    Pending: list[str] = []
+    OrphanedDocuments: int = 0
+    DocumentsDeleted: int = 0
+    EstimatedBytesReclaimed: int = 0
+    Errors: list[str] = []
+    Seconds: float = 0
+
+
+class SearchShardStatus(BaseModel):
+    """
+    Represents an index holding a part of the SharePoint sites.
+
+    Attributes:
+        Name (str): The name of the shard.
+        Endpoint (str): The endpoint of the search service.
+        IndexName (str): The name of the index.
+        PlacedSites (int): The sites placed on the shard.
+        IndexedSites (int): The sites with documents in the index.
+        DocumentCount (int): The documents in the index.
+        StorageSize (int): The storage size of the index in bytes.
+        VectorIndexSize (int): The vector index size in bytes.
+    """
+    Name: str
+    Endpoint: str
+    IndexName: str
+    PlacedSites: int = 0
+    IndexedSites: int = 0
+    DocumentCount: int = 0
+    StorageSize: int = 0
+    VectorIndexSize: int = 0
+
+
+class SiteShardMove(BaseModel):
+    """
+    Represents the move of a SharePoint site from a shard to another.
+
+    Attributes:
+        SiteId (str): The full id of the site.
+        Source (str): The name of the shard the site leaves.
+        Target (str): The name of the shard the site moves to.
+        EstimatedBytes (int): The estimated index size of the documents of the site.
+        DocumentsCopied (int): The documents copied to the target shard.
+        DocumentsPurged (int): The documents deleted from the source shard.
+        Seconds (float): The duration of the move.
+    """
+    SiteId: str
+    Source: str
+    Target: str
+    EstimatedBytes: int = 0
+    DocumentsCopied: int = 0
+    DocumentsPurged: int = 0
+    Seconds: float = 0
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import BaseModel
 
 
@@ -11,6 +13,17 @@ class SharepointHelperConfig(BaseModel):
     ClientId: str
     ClientSecret: str
     TenantId: str
+    GraphEndpoint: str = "https://graph.microsoft.com"
+    LoginEndpoint: str = "https://login.microsoftonline.com"
+
+
+class VectorProfile(BaseModel):
+    Name: str
+    Kind: Literal["hnsw", "exhaustiveKnn"] = "hnsw"
+    M: int = 4
+    EfConstruction: int = 400
+    EfSearch: int = 500
+    Metric: Literal["cosine", "euclidean", "dotProduct"] = "cosine"
 
 
 class SearchConfig(BaseModel):
@@ -19,6 +32,9 @@ class SearchConfig(BaseModel):
     AoaiEndpoint: str
     AoaiKey: str
     AoaiEmbedDeployment: str
+    VectorProfile: str = "default"
+    VectorDimensions: int = 1536
+    SharedChunks: bool = False
 
 
 class SharepointSearchConfig(SearchConfig):
@@ -26,9 +42,155 @@ class SharepointSearchConfig(SearchConfig):
     SharepointClientSecret: str
     SharepointTenantId: str
     SharepointDomain: str
+    IndexerScheduleInterval: int | None = 300
 
 
 class StorageSearchConfig(SearchConfig):
     StorageName: str
     StorageConnStr: str = None
     ContainerName: str
+
+
+class TextExtractionConfig(BaseModel):
+    Enabled: bool = False
+    Workers: int | None = None
+    IncludeOffice: bool = False
+
+
+class StateConfig(BaseModel):
+    Backend: str = "memory"
+    SqlitePath: str = ".state/state.sqlite3"
+    SiteCatalogTtl: int = 300
+    MembershipTtl: int = 300
+    IndexedSitesReconcileInterval: int = 600
+
+
+class SiteAccessMapConfig(BaseModel):
+    Enabled: bool = False
+    SqlitePath: str = ".state/site-access.sqlite3"
+    Interval: int = 300
+    MaxAge: int = 86400
+    Concurrency: int = 8
+
+
+class IndexerSchedulerConfig(BaseModel):
+    Enabled: bool = False
+    Interval: int = 30
+    MaxConcurrentRuns: int = 3
+    MinInterval: int = 300
+    MaxInterval: int = 21600
+    StatusConcurrency: int = 8
+
+
+class SearchApiConfig(BaseModel):
+    CacheTtl: int = 30
+    Semantic: bool = True
+    VectorK: int = 50
+    MaxTop: int = 50
+
+
+class QueryEmbeddingConfig(BaseModel):
+    ClientSide: bool = True
+    CacheSize: int = 4096
+    MaxBatchSize: int = 16
+    MaxWaitMs: float = 5.0
+    ApiVersion: str = "2023-05-15"
+
+
+class ChatConfig(BaseModel):
+    Deployment: str
+    MaxTokens: int = 800
+    Temperature: float = 0.0
+    MaxHistoryChars: int = 8000
+    ApiVersion: str = "2023-05-15"
+
+
+class LocalVectorTierConfig(BaseModel):
+    Enabled: bool = False
+    Path: str = ".state/vectors"
+    MaxSites: int = 10
+    MaxVectors: int = 200000
+    Float16: bool = False
+    RefreshInterval: int = 60
+    MaxAge: int = 3600
+
+
+class ChunkDedupConfig(BaseModel):
+    Enabled: bool = False
+    Interval: int = 300
+    MaxParents: int = 200
+
+
+class OrphanCollectorConfig(BaseModel):
+    Enabled: bool = False
+    Interval: int = 3600
+    GracePeriod: int = 86400
+    MaxWorkers: int = 4
+    BatchesPerSecond: float = 2.0
+
+
+class SearchShard(BaseModel):
+    Name: str
+    Endpoint: str
+    IndexName: str
+
+
+class ShardingConfig(BaseModel):
+    Shards: list[SearchShard] = []
+    Placement: Literal["hash", "size"] = "hash"
+
+    @property
+    def Enabled(self) -> bool:
+        return len(self.Shards) > 1
+
+
+class SemanticCacheConfig(BaseModel):
+    Enabled: bool = False
+    Threshold: float = 0.95
+    MaxEntries: int = 2000
+    Ttl: int = 3600
+
+
+class TrafficCaptureConfig(BaseModel):
+    Enabled: bool = False
+    Path: str = ".traffic/requests.jsonl"
+    SampleRate: float = 1.0
+    Salt: str | None = None
+    MaxBodyBytes: int = 65536
+
+
+class SingleFlightConfig(BaseModel):
+    Enabled: bool = True
+    Disabled: list[str] = []
+
+
+class AppConfig(BaseModel):
+    Storage: StorageConfig | None = None
+    StorageSearch: StorageSearchConfig | None = None
+    StorageMaxConcurrency: int = 16
+    SharepointHelper: SharepointHelperConfig | None = None
+    SharepointSearch: SharepointSearchConfig | None = None
+    Search: SearchConfig | None = None
+    TextExtraction: TextExtractionConfig = TextExtractionConfig()
+    StartupWarmup: bool = False
+    State: StateConfig = StateConfig()
+    SiteAccessMap: SiteAccessMapConfig = SiteAccessMapConfig()
+    IndexerScheduler: IndexerSchedulerConfig = IndexerSchedulerConfig()
+    SearchApi: SearchApiConfig = SearchApiConfig()
+    QueryEmbedding: QueryEmbeddingConfig = QueryEmbeddingConfig()
+    SemanticCache: SemanticCacheConfig = SemanticCacheConfig()
+    LocalVectorTier: LocalVectorTierConfig = LocalVectorTierConfig()
+    ChunkDedup: ChunkDedupConfig = ChunkDedupConfig()
+    OrphanCollector: OrphanCollectorConfig = OrphanCollectorConfig()
+    Sharding: ShardingConfig = ShardingConfig()
+    Chat: ChatConfig | None = None
+    TrafficCapture: TrafficCaptureConfig = TrafficCaptureConfig()
+    SingleFlight: SingleFlightConfig = SingleFlightConfig()
+
+    @property
+    def StorageEnabled(self) -> bool:
+        return self.Storage is not None
+
+    @property
+    def SharepointEnabled(self) -> bool:
+        return self.SharepointHelper is not None
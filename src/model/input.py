@@ -1,12 +1,25 @@
 from pydantic import BaseModel
 
-from common import BlobProperties
+from src.model.common import BlobProperties, ChatMessage
 
 
 class ListUserSiteApiIn(BaseModel):
     userId: str
 
 
+class SearchApiIn(BaseModel):
+    userId: str
+    query: str
+    top: int = 5
+
+
+class ChatApiIn(BaseModel):
+    userId: str
+    query: str
+    history: list[ChatMessage] = []
+    top: int = 5
+
+
 class StorageDeleteApiIn(BaseModel):
     Files: list[str]
 
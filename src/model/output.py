@@ -1,8 +1,15 @@
 from pydantic import BaseModel
 
+from src.model.common import BlobDeleteResult, BlobProperties, SearchDocument
+
 
 class BlobPropertiesApiOut(BaseModel):
-    Value: any
+    Value: list[BlobProperties]
+
+
+class BlobDeleteApiOut(BaseModel):
+    Value: list[BlobDeleteResult]
+
 
-    class Config:
-        arbitrary_types_allowed = True
+class SearchApiOut(BaseModel):
+    Value: list[SearchDocument]
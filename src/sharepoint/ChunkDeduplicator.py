@@ -0,0 +1,463 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from azure.search.documents import IndexDocumentsBatch, SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+
+from ..model.common import ChunkDedupReport, ChunkDedupResult
+from ..Telemetry import meter, traced, set_span_attributes
+
+if TYPE_CHECKING:
+    from .SharepointSearchHandler import SharepointSearchHandler
+
+SITE_IDS_FIELD = "metadata_spo_site_ids"
+HASH_FIELD = "chunk_hash"
+MEMBERS_FIELD = "dedup_members"
+SOURCES_FIELD = "dedup_sources"
+SHARED_PREFIX = "dedup-"
+# fields read to hash and move the chunks of a document, the vector is only copied into new shared chunks
+CHUNK_FIELDS = ["id", "parent_id", "title", "location", "chunk", "metadata_spo_site_id", HASH_FIELD]
+SHARED_FIELDS = ["id", "metadata_spo_site_id", HASH_FIELD, MEMBERS_FIELD, SOURCES_FIELD]
+PAGE_SIZE = 1000
+# documents whose chunks are counted by a single facet query, bounding the length of its filter
+PARENTS_PER_QUERY = 100
+# a release reads and rewrites the members of shared chunks other sites hold as well, the releases of a process
+# run one after the other so that none overwrites the members another one removed
+_release_mutex = threading.Lock()
+
+dedup_duplicates = meter.create_counter(
+    name="chunk_dedup.duplicates",
+    description="Duplicate chunks removed from the index by the chunk deduplicator"
+)
+
+
+def content_hash(text: str | None) -> str:
+    """
+    Hashes the text of a chunk: chunks with the same words in the same order are duplicates.
+
+    Args:
+        text (str | None): The text of the chunk.
+
+    Returns:
+        str: The 32 hex digits of the hash.
+    """
+    normalized = re.sub(r"\s+", " ", text or "").strip()
+    return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+
+def dedup_member(site_id: str, parent_id: str) -> str:
+    """
+    Identifies a document holding a copy of a shared chunk, as stored in dedup_members.
+
+    Args:
+        site_id (str): The full id of the site of the document.
+        parent_id (str): The parent_id of the chunks of the document.
+
+    Returns:
+        str: The member, '<site id>|<parent id>'.
+    """
+    return f"{site_id}|{parent_id}"
+
+
+def shared_chunk_source(doc: dict, site_ids: list[str]) -> dict | None:
+    """
+    Picks the copy of a shared chunk a user can access, for its title and location.
+
+    Args:
+        doc (dict): A chunk with its dedup_sources.
+        site_ids (list[str]): The full ids of the sites of the user.
+
+    Returns:
+        dict | None: The site_id, title and location of the first copy in a site of the user, None if the chunk
+            is not shared.
+    """
+    if not doc.get(SOURCES_FIELD):
+        return None
+    sites = set(site_ids)
+    for member, source in sorted(json.loads(doc[SOURCES_FIELD]).items()):
+        site_id = member.split("|", 1)[0]
+        if site_id in sites:
+            return {"site_id": site_id, **source}
+    return None
+
+
+def shared_chunk_action(doc: dict, members: dict[str, dict]) -> dict:
+    """
+    Builds the index action giving a shared chunk its members, the site ids derived from them, or deleting it
+    when no member is left.
+
+    Args:
+        doc (dict): The shared chunk, at least its id.
+        members (dict[str, dict]): The title and location of each member, keyed by dedup_member().
+
+    Returns:
+        dict: A merge action, or a delete action.
+    """
+    if not members:
+        return {"@search.action": "delete", "id": doc["id"]}
+    site_ids = sorted({member.split("|", 1)[0] for member in members})
+    return {"@search.action": "merge", "id": doc["id"], "metadata_spo_site_id": site_ids[0],
+            SITE_IDS_FIELD: site_ids, MEMBERS_FIELD: sorted(members),
+            SOURCES_FIELD: json.dumps(members, sort_keys=True)}
+
+
+def _quote(value: str) -> str:
+    return value.replace("'", "''")
+
+
+class ChunkDeduplicator:
+    """
+    Stores the chunks copied across SharePoint sites once.
+
+    The indexers chunk and embed every copy of a document, so the same policy PDF in ten sites takes ten times its
+    chunks and vectors. After the indexers ran, the deduplicator hashes the text of the chunks they uploaded,
+    found by their empty chunk_hash, a document (parent_id) at a time. A chunk seen for the first time only gets
+    its hash and metadata_spo_site_ids. A chunk whose hash another chunk has is moved into a shared chunk, id
+    'dedup-<hash>', that the indexers never write: the copies are deleted and the shared chunk lists them in
+    dedup_members, with the title and location of each copy in dedup_sources, and their sites in
+    metadata_spo_site_ids. The index itself is the dedup table, looked up by chunk_hash.
+
+    Security trimming filters on metadata_spo_site_ids as well (see site_filter), so a shared chunk is returned
+    to the users of any site holding a copy, with the title and location of the copy of their site. When an
+    indexer processes a changed document again, its new chunks are deduplicated again and the document leaves
+    the shared chunks of its previous version; a shared chunk without members is deleted. Purging a site
+    removes it from the shared chunks (see SharepointSearchHandler.purge_site_documents).
+
+    A document all of whose chunks move into shared chunks keeps one of them as its anchor: hashed, with no
+    metadata_spo_site_ids, so the searches skip it. The indexers delete the anchor with the document, when it is
+    deleted in SharePoint or its chunks are deleted by parent_id, and every run sweeps PAGE_SIZE shared chunks,
+    resuming after the last one, dropping the members whose document has no chunk left in the index.
+
+    The embeddings of the copies are still computed by the skillset: the savings are index storage and vector
+    memory.
+
+    Args:
+        search_handler (SharepointSearchHandler): The search handler of the SharePoint index.
+    """
+
+    def __init__(self, search_handler: "SharepointSearchHandler") -> None:
+        self.search_handler = search_handler
+        self.config = search_handler.config
+        self._index_ready = False
+        # the id of the last shared chunk swept, None to start over
+        self._sweep_key = None
+
+    def _search_client(self) -> SearchClient:
+        return SearchClient(endpoint=self.config.Endpoint, index_name=self.config.IndexName,
+                            credential=self.search_handler.search_credential)
+
+    def _chunk_bytes(self, chunk: str | None) -> int:
+        # estimated index size of a chunk: its float32 vector and its text
+        return self.config.VectorDimensions * 4 + len((chunk or "").encode())
+
+    @traced("search.chunk_dedup", peer_service="azure-search")
+    def run(self, max_parents: int = 200) -> ChunkDedupResult:
+        """
+        Deduplicates the chunks of the documents the indexers uploaded since the last run.
+
+        Args:
+            max_parents (int, optional): The maximum number of documents processed. Defaults to 200.
+
+        Returns:
+            ChunkDedupResult: The processed documents, the removed duplicates and the estimated bytes saved.
+        """
+        start = time.perf_counter()
+        if not self._index_ready:
+            # adds the dedup fields to an index created without them
+            self.search_handler.create_spo_index()
+            self._index_ready = True
+        search_client = self._search_client()
+        result = ChunkDedupResult()
+        try:
+            # the documents with chunks not hashed yet, in a single facet query; asking for more than processed
+            # lets the next documents keep their chunks until their turn
+            facets = search_client.search("", filter=f"{HASH_FIELD} eq null", top=0,
+                                          facets=[f"parent_id,count:{max_parents * 10}"]).get_facets()
+        except HttpResponseError as genericErr:
+            raise genericErr
+        pending = [facet["value"] for facet in facets["parent_id"]]
+        waiting = set(pending)
+        for parent_id in pending[:max_parents]:
+            waiting.discard(parent_id)
+            self._process_parent(search_client, parent_id, waiting, result)
+            result.Parents += 1
+        self._sweep(search_client, result)
+        result.Seconds = round(time.perf_counter() - start, 2)
+        dedup_duplicates.add(result.DuplicatesRemoved)
+        set_span_attributes({"chunk_dedup.parents": result.Parents,
+                             "chunk_dedup.duplicates": result.DuplicatesRemoved,
+                             "chunk_dedup.members_removed": result.MembersRemoved,
+                             "chunk_dedup.bytes_saved": result.EstimatedBytesSaved})
+        if result.DuplicatesRemoved:
+            logging.info(f"Chunk dedup: {result.DuplicatesRemoved} duplicates of {result.Chunks} chunks removed, "
+                         f"about {result.EstimatedBytesSaved} bytes")
+        return result
+
+    def _process_parent(self, search_client: SearchClient, parent_id: str, waiting: set[str],
+                        result: ChunkDedupResult) -> None:
+        chunks = self._find(search_client, f"parent_id eq '{_quote(parent_id)}'", CHUNK_FIELDS)
+        chunks = [chunk for chunk in chunks if not chunk["id"].startswith(SHARED_PREFIX)]
+        if not chunks:
+            return
+        site_id = chunks[0]["metadata_spo_site_id"]
+        member = dedup_member(site_id, parent_id)
+        hashes = {chunk["id"]: content_hash(chunk.get("chunk")) for chunk in chunks}
+        changed = [chunk for chunk in chunks if chunk.get(HASH_FIELD) != hashes[chunk["id"]]]
+        result.Chunks += len(chunks)
+        if not changed:
+            return
+
+        # the document was indexed again: it leaves the shared chunks of its previous version and joins the ones
+        # of its current chunks below
+        shared: dict[str, dict] = {}
+        members: dict[str, dict[str, dict]] = {}
+        previous = self._find(search_client, f"{MEMBERS_FIELD}/any(m: m eq '{_quote(member)}')", SHARED_FIELDS)
+        changed_hashes = "|".join(sorted({hashes[chunk["id"]] for chunk in changed}))
+        candidates = self._find(search_client, f"search.in({HASH_FIELD}, '{changed_hashes}', '|')",
+                                CHUNK_FIELDS + [SOURCES_FIELD])
+        for doc in previous + [doc for doc in candidates if doc["id"].startswith(SHARED_PREFIX)]:
+            shared[doc["id"]] = doc
+            members[doc["id"]] = {key: value for key, value in json.loads(doc.get(SOURCES_FIELD) or "{}").items()
+                                  if key != member}
+        # unique chunks of other documents, except the documents still waiting for their turn
+        others = {doc[HASH_FIELD]: doc for doc in candidates
+                  if not doc["id"].startswith(SHARED_PREFIX) and doc.get("parent_id") not in waiting
+                  and doc.get("parent_id") != parent_id}
+
+        deleted: list[dict] = []
+        created: dict[str, dict] = {}
+        first_by_hash: dict[str, dict] = {}
+        for chunk in changed:
+            h = hashes[chunk["id"]]
+            shared_id = f"{SHARED_PREFIX}{h}"
+            if shared_id not in members and (h in others or h in first_by_hash):
+                existing = self._shared_chunk(search_client, shared_id)
+                if existing is not None:
+                    # a shared chunk the searches did not return yet: the copies join its members
+                    shared[shared_id] = existing
+                    members[shared_id] = {key: value for key, value
+                                          in json.loads(existing.get(SOURCES_FIELD) or "{}").items() if key != member}
+                else:
+                    # a second copy: the chunk becomes shared, with the vector of this copy
+                    created[shared_id] = {"id": shared_id, "parent_id": shared_id, "title": chunk.get("title"),
+                                          "location": chunk.get("location"), "chunk": chunk.get("chunk"),
+                                          "chunkVector": self._vector_of(search_client, chunk["id"]), HASH_FIELD: h}
+                    shared[shared_id], members[shared_id] = created[shared_id], {}
+                for other in [others.pop(h, None), first_by_hash.pop(h, None)]:
+                    if other is not None:
+                        members[shared_id][dedup_member(other["metadata_spo_site_id"], other["parent_id"])] = \
+                            {"title": other.get("title"), "location": other.get("location")}
+                        deleted.append(other)
+            if shared_id in members:
+                members[shared_id][member] = {"title": chunk.get("title"), "location": chunk.get("location")}
+                deleted.append(chunk)
+            else:
+                first_by_hash[h] = chunk
+
+        anchors = self._anchors(search_client, deleted)
+        deleted = [doc for doc in deleted if doc["id"] not in anchors]
+        batch = IndexDocumentsBatch()
+        for chunk in first_by_hash.values():
+            batch.add_merge_actions([{"id": chunk["id"], HASH_FIELD: hashes[chunk["id"]],
+                                      SITE_IDS_FIELD: [chunk["metadata_spo_site_id"]]}])
+        for chunk in anchors.values():
+            batch.add_merge_actions([{"id": chunk["id"], HASH_FIELD: content_hash(chunk.get("chunk")),
+                                      SITE_IDS_FIELD: []}])
+        for shared_id, doc in shared.items():
+            action = shared_chunk_action(doc, members[shared_id])
+            kind = action.pop("@search.action")
+            if shared_id in created:
+                batch.add_upload_actions([{**created[shared_id], **action}])
+            elif kind == "delete":
+                batch.add_delete_actions([action])
+            else:
+                batch.add_merge_actions([action])
+        # the copies are deleted once the shared chunks holding them are written
+        deletes = IndexDocumentsBatch()
+        deletes.add_delete_actions([{"id": doc["id"]} for doc in deleted])
+        self._index(search_client, batch)
+        self._index(search_client, deletes)
+        result.SharedChunksCreated += len(created)
+        result.DuplicatesRemoved += len(deleted) - len(created)
+        result.EstimatedBytesSaved += sum(self._chunk_bytes(doc.get("chunk")) for doc in deleted) - \
+            sum(self._chunk_bytes(doc.get("chunk")) for doc in created.values())
+
+    def _anchors(self, search_client: SearchClient, deleted: list[dict]) -> dict[str, dict]:
+        # the chunk kept by each document that would have none left, the first one by id
+        by_parent: dict[str, list[dict]] = {}
+        for doc in deleted:
+            by_parent.setdefault(doc["parent_id"], []).append(doc)
+        counts = self._chunk_counts(search_client, list(by_parent))
+        anchors = {}
+        for parent_id, docs in by_parent.items():
+            if counts.get(parent_id, 0) <= len(docs):
+                anchor = min(docs, key=lambda doc: doc["id"])
+                anchors[anchor["id"]] = anchor
+        return anchors
+
+    def _sweep(self, search_client: SearchClient, result: ChunkDedupResult) -> None:
+        # drops the members of a page of shared chunks whose document is no longer in the index
+        search_filter = f"{MEMBERS_FIELD}/any()"
+        if self._sweep_key is not None:
+            search_filter += f" and id gt '{_quote(self._sweep_key)}'"
+        try:
+            docs = list(search_client.search("", filter=search_filter, select=SHARED_FIELDS, order_by=["id asc"],
+                                             top=PAGE_SIZE))
+        except HttpResponseError as genericErr:
+            raise genericErr
+        self._sweep_key = docs[-1]["id"] if len(docs) == PAGE_SIZE else None
+        parent_ids = {member.split("|", 1)[1] for doc in docs for member in doc.get(MEMBERS_FIELD) or []}
+        counts = self._chunk_counts(search_client, sorted(parent_ids))
+        batch = IndexDocumentsBatch()
+        for doc in docs:
+            sources = json.loads(doc.get(SOURCES_FIELD) or "{}")
+            members = {member: source for member, source in sources.items() if counts.get(member.split("|", 1)[1])}
+            if len(members) == len(sources):
+                continue
+            result.MembersRemoved += len(sources) - len(members)
+            action = shared_chunk_action(doc, members)
+            if action.pop("@search.action") == "delete":
+                batch.add_delete_actions([action])
+            else:
+                batch.add_merge_actions([action])
+        self._index(search_client, batch)
+
+    @staticmethod
+    def _chunk_counts(search_client: SearchClient, parent_ids: list[str]) -> dict[str, int]:
+        # the chunks of each document in the index, shared chunks aside, none for the deleted documents
+        counts = {}
+        for i in range(0, len(parent_ids), PARENTS_PER_QUERY):
+            group = parent_ids[i:i + PARENTS_PER_QUERY]
+            values = "|".join(_quote(parent_id) for parent_id in group)
+            try:
+                facets = search_client.search("", filter=f"search.in(parent_id, '{values}', '|')", top=0,
+                                              facets=[f"parent_id,count:{len(group)}"]).get_facets()
+            except HttpResponseError as genericErr:
+                raise genericErr
+            counts.update({facet["value"]: facet["count"] for facet in facets["parent_id"]})
+        return counts
+
+    @staticmethod
+    def _find(search_client: SearchClient, search_filter: str, select: list[str]) -> list[dict]:
+        # every match, PAGE_SIZE at a time in id order; select includes the id
+        docs, last_key = [], None
+        while True:
+            page_filter = search_filter if last_key is None else f"({search_filter}) and id gt '{_quote(last_key)}'"
+            try:
+                page = list(search_client.search("", filter=page_filter, select=select, order_by=["id asc"],
+                                                 top=PAGE_SIZE))
+            except HttpResponseError as genericErr:
+                raise genericErr
+            docs += page
+            if len(page) < PAGE_SIZE:
+                return docs
+            last_key = page[-1]["id"]
+
+    @staticmethod
+    def _shared_chunk(search_client: SearchClient, shared_id: str) -> dict | None:
+        # a shared chunk is only uploaded when it does not exist, an upload would replace its members
+        try:
+            return search_client.get_document(shared_id, selected_fields=SHARED_FIELDS)
+        except ResourceNotFoundError:
+            return None
+        except HttpResponseError as genericErr:
+            raise genericErr
+
+    @staticmethod
+    def _vector_of(search_client: SearchClient, key: str) -> list[float] | None:
+        try:
+            return search_client.get_document(key, selected_fields=["chunkVector"]).get("chunkVector")
+        except HttpResponseError as genericErr:
+            raise genericErr
+
+    @staticmethod
+    def _index(search_client: SearchClient, batch: IndexDocumentsBatch) -> None:
+        failed = []
+        # a request of the service takes up to 1000 actions
+        for i in range(0, len(batch.actions), PAGE_SIZE):
+            part = IndexDocumentsBatch()
+            part.enqueue_actions(batch.actions[i:i + PAGE_SIZE])
+            try:
+                failed += [r.key for r in search_client.index_documents(part) if not r.succeeded]
+            except HttpResponseError as genericErr:
+                raise genericErr
+        if failed:
+            # the callers delete copies and purge sites once these writes landed
+            raise RuntimeError(f"Chunk dedup could not write {len(failed)} documents: {', '.join(failed[:10])}")
+
+    @traced("search.chunk_dedup_release_site", peer_service="azure-search")
+    def release_site(self, site_id: str) -> int:
+        """
+        Removes a site from the shared chunks, deleting the ones it was the only member of. The releases run one
+        at a time, so the sites purged concurrently all leave the chunks they share.
+
+        Args:
+            site_id (str): The full id of the site.
+
+        Returns:
+            int: The number of shared chunks updated or deleted.
+
+        Raises:
+            RuntimeError: If a shared chunk could not be written, the site then still holds it.
+        """
+        search_client = self._search_client()
+        with _release_mutex:
+            docs = self._find(search_client, f"{SITE_IDS_FIELD}/any(s: s eq '{_quote(site_id)}') and "
+                                             f"{MEMBERS_FIELD}/any()", SHARED_FIELDS)
+            batch = IndexDocumentsBatch()
+            for doc in docs:
+                members = {member: source for member, source in json.loads(doc.get(SOURCES_FIELD) or "{}").items()
+                           if member.split("|", 1)[0] != site_id}
+                action = shared_chunk_action(doc, members)
+                if action.pop("@search.action") == "delete":
+                    batch.add_delete_actions([action])
+                else:
+                    batch.add_merge_actions([action])
+            self._index(search_client, batch)
+        return len(docs)
+
+    @traced("search.chunk_dedup_report", peer_service="azure-search")
+    def report(self) -> ChunkDedupReport:
+        """
+        Measures the index space saved by the shared chunks.
+
+        The saved bytes are the copies replaced by shared chunks times the average size of a document in the
+        index statistics, vector index included.
+
+        Returns:
+            ChunkDedupReport: The shared chunks, the copies they replace and the index statistics.
+        """
+        search_client = self._search_client()
+        index_client = SearchIndexClient(endpoint=self.config.Endpoint,
+                                         credential=self.search_handler.search_credential)
+        try:
+            stats = index_client.get_index_statistics(self.config.IndexName)
+        except HttpResponseError as genericErr:
+            raise genericErr
+        report = ChunkDedupReport(DocumentCount=stats["document_count"], StorageSize=stats["storage_size"],
+                                  VectorIndexSize=stats.get("vector_index_size") or 0)
+        last_key = None
+        while True:
+            search_filter = f"{MEMBERS_FIELD}/any()"
+            if last_key is not None:
+                search_filter += f" and id gt '{_quote(last_key)}'"
+            try:
+                page = list(search_client.search("", filter=search_filter, select=["id", MEMBERS_FIELD],
+                                                 order_by=["id asc"], top=PAGE_SIZE))
+            except HttpResponseError as genericErr:
+                raise genericErr
+            report.SharedChunks += len(page)
+            report.ReplacedCopies += sum(len(doc.get(MEMBERS_FIELD) or []) for doc in page)
+            if len(page) < PAGE_SIZE:
+                break
+            last_key = page[-1]["id"]
+        if report.DocumentCount:
+            per_document = (report.StorageSize + report.VectorIndexSize) / report.DocumentCount
+            report.EstimatedBytesSaved = int((report.ReplacedCopies - report.SharedChunks) * per_document)
+        return report
@@ -0,0 +1,197 @@
+import logging
+import threading
+from typing import Iterable
+
+from ..model.common import (AzureADGroupList, IndexedSite, IndexedSiteList, SharepointSite,
+                            SharepointSiteList)
+from ..SingleFlight import single_flight
+from ..StateBackend import StateBackend
+from ..Telemetry import traced, set_span_attributes
+from .SharepointHelpers import SharepointHelper
+from .SharepointSearchHandler import SharepointSearchHandler
+
+# Upper bound of a reconciliation, which resolves every indexed site through Graph
+RECONCILE_LEASE = 300
+
+
+class IndexedSiteIndex:
+    """
+    In-memory index of the SharePoint sites that have an indexer, by siteId1.
+
+    The index is kept in the state backend with a version, and each worker holds a copy that is reloaded when
+    the version changes, so checking the sites of a user costs one version read and a dictionary lookup.
+    The API updates the index when it creates or deletes an indexer, and reconcile() rebuilds it from the
+    indexers of the search service to catch the changes made elsewhere.
+
+    Args:
+        sharepoint_helper (SharepointHelper): The Graph helper, resolving the site of an indexer.
+        search_handler (SharepointSearchHandler): The search handler listing the SharePoint indexers.
+        state (StateBackend): The state shared by the workers.
+    """
+
+    def __init__(self, sharepoint_helper: SharepointHelper, search_handler: SharepointSearchHandler,
+                 state: StateBackend) -> None:
+        self.sharepoint_helper = sharepoint_helper
+        self.search_handler = search_handler
+        self.state = state
+        self._key = f"indexed-sites:{search_handler.config.Endpoint}:{search_handler.config.IndexName}"
+        self._version_key = f"{self._key}:version"
+        self._sites: dict[str, IndexedSite] = {}
+        self._version = None
+        self._mutex = threading.Lock()
+
+    @property
+    def version(self) -> int | None:
+        """
+        int | None: The version of the local copy, None before it is first loaded.
+        """
+        return self._version
+
+    def refresh(self) -> None:
+        """
+        Reloads the local copy if another worker changed the index, and builds the index if it does not exist.
+        """
+        version = self.state.get(self._version_key)
+        if version is not None and version == self._version:
+            return
+        snapshot = None if version is None else self.state.get(self._key)
+        if snapshot is None:
+            self._build()
+        else:
+            self._load(snapshot)
+
+    def sites(self) -> IndexedSiteList:
+        """
+        Returns the indexed sites.
+
+        Returns:
+            IndexedSiteList: The indexed sites and the version of the index.
+        """
+        self.refresh()
+        return IndexedSiteList.model_construct(Version=self._version, Value=list(self._sites.values()))
+
+    def sites_of_user(self, user_group_list: AzureADGroupList) -> SharepointSiteList:
+        """
+        Returns the indexed sites that a user belongs to.
+
+        Args:
+            user_group_list (AzureADGroupList): The groups of the user, with their proxy addresses.
+
+        Returns:
+            SharepointSiteList: The indexed sites of the user.
+        """
+        return self.sites_with_ids(SharepointHelper.user_site_ids(user_group_list))
+
+    def sites_with_ids(self, site_ids: Iterable[str]) -> SharepointSiteList:
+        """
+        Returns the indexed sites among the given site ids.
+
+        Args:
+            site_ids (Iterable[str]): Lowercase siteId1 values.
+
+        Returns:
+            SharepointSiteList: The indexed sites, in the order of site_ids.
+        """
+        self.refresh()
+        sites = self._sites
+        user_sites = [sites[site_id].Site for site_id in site_ids if site_id in sites]
+        set_span_attributes({"sites.indexed.count": len(sites), "sites.user.count": len(user_sites)})
+        return SharepointSiteList.model_construct(Value=user_sites)
+
+    def add(self, site: SharepointSite, indexer_name: str) -> None:
+        """
+        Adds a site, or replaces its entry, after its indexer was created.
+
+        Args:
+            site (SharepointSite): The site.
+            indexer_name (str): The name of the indexer of the site.
+        """
+        entry = IndexedSite(Site=site, IndexerName=indexer_name)
+        self._update(lambda sites: sites.__setitem__(site.siteId1.lower(), entry))
+
+    def remove(self, site: SharepointSite) -> None:
+        """
+        Removes a site after its indexer was deleted.
+
+        Args:
+            site (SharepointSite): The site.
+        """
+        self._update(lambda sites: sites.pop(site.siteId1.lower(), None))
+
+    def apply_changes(self, added: Iterable[IndexedSite], removed_indexers: Iterable[str]) -> None:
+        """
+        Adds and removes many sites in a single update, after a reconciliation of the site set.
+
+        Args:
+            added (Iterable[IndexedSite]): The sites whose indexer was created.
+            removed_indexers (Iterable[str]): The names of the deleted indexers.
+        """
+        removed_indexers = set(removed_indexers)
+
+        def change(sites: dict[str, IndexedSite]) -> None:
+            for site_id in [site_id for site_id, entry in sites.items() if entry.IndexerName in removed_indexers]:
+                del sites[site_id]
+            sites.update((entry.Site.siteId1.lower(), entry) for entry in added)
+        self._update(change)
+
+    @single_flight("sites.reconcile")
+    @traced("sites.reconcile")
+    def reconcile(self) -> IndexedSiteList:
+        """
+        Rebuilds the index from the SharePoint indexers of the search service.
+
+        The site of each indexer is found by the name of its datasource, `<site name>-sharepoint-datasource`,
+        and sites that Graph does not return anymore are left out.
+
+        Returns:
+            IndexedSiteList: The rebuilt index.
+        """
+        with self.state.lock(self._key, timeout=RECONCILE_LEASE, lease=RECONCILE_LEASE):
+            snapshot = self._write(self._fetch())
+        logging.info(f"Indexed sites reconciled: {len(snapshot.Value)} sites, version {snapshot.Version}")
+        return snapshot
+
+    def _build(self) -> None:
+        with self.state.lock(self._key, timeout=RECONCILE_LEASE, lease=RECONCILE_LEASE):
+            snapshot = self.state.get(self._key)
+            if snapshot is None:
+                self._write(self._fetch())
+            else:
+                self._load(snapshot)
+
+    def _fetch(self) -> dict[str, IndexedSite]:
+        sites = {}
+        for indexer in self.search_handler.list_indexer(ds_type="sharepoint").Value:
+            site_name = indexer.DataSourceName.removesuffix("-datasource").removesuffix("-sharepoint")
+            site = self.sharepoint_helper.get_site_by_name(site_name=site_name)
+            if site is None:
+                logging.warning(f"Indexer {indexer.Name} has no SharePoint site named {site_name}")
+                continue
+            sites[site.siteId1.lower()] = IndexedSite(Site=site, IndexerName=indexer.Name)
+        set_span_attributes({"sites.indexed.count": len(sites)})
+        return sites
+
+    def _update(self, change) -> None:
+        with self.state.lock(self._key, timeout=RECONCILE_LEASE):
+            snapshot = self.state.get(self._key)
+            # a change made before the index was first built starts from a full build
+            sites = self._fetch() if snapshot is None else \
+                {entry["Site"]["siteId1"].lower(): IndexedSite(**entry) for entry in snapshot["Value"]}
+            change(sites)
+            self._write(sites)
+
+    def _write(self, sites: dict[str, IndexedSite]) -> IndexedSiteList:
+        # called under the lock of the index
+        version = (self.state.get(self._version_key) or 0) + 1
+        snapshot = IndexedSiteList(Version=version, Value=list(sites.values()))
+        self.state.set(self._key, snapshot.model_dump())
+        self.state.set(self._version_key, version)
+        with self._mutex:
+            self._sites, self._version = sites, version
+        return snapshot
+
+    def _load(self, snapshot: dict) -> None:
+        snapshot = IndexedSiteList(**snapshot)
+        sites = {entry.Site.siteId1.lower(): entry for entry in snapshot.Value}
+        with self._mutex:
+            self._sites, self._version = sites, snapshot.Version
@@ -0,0 +1,218 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from azure.search.documents.indexes.models import SearchIndexerStatus
+
+from ..model.common import IndexerRunState, IndexerSchedule
+from ..model.config import IndexerSchedulerConfig, SearchConfig
+from ..StateBackend import StateBackend
+from ..Telemetry import meter, traced, set_span_attributes
+from .SharepointSearchHandler import SharepointSearchHandler
+
+# weight of the last run in the change rate of an indexer
+CHANGE_RATE_WEIGHT = 0.5
+# seconds a tick holds the tick lock, after which a tick left by a crashed worker no longer blocks the others
+TICK_LEASE = 1800
+
+indexer_runs = meter.create_counter(
+    name="indexer.runs",
+    description="SharePoint indexer runs started by the indexer scheduler"
+)
+indexer_freshness_lag = meter.create_histogram(
+    name="indexer.freshness_lag",
+    unit="s",
+    description="Seconds since the start of the last successful run of each SharePoint indexer, sampled at every "
+                "scheduler tick"
+)
+
+
+def schedule_state_key(config: SearchConfig) -> str:
+    """
+    Returns the key of the scheduling state of the SharePoint indexers of an index in the state backend.
+
+    Args:
+        config (SearchConfig): The search configuration of the index.
+
+    Returns:
+        str: The key.
+    """
+    return f"indexer-schedule:{config.Endpoint}:{config.IndexName}"
+
+
+def restore_schedules(search_handler: SharepointSearchHandler, state: StateBackend) -> list[str]:
+    """
+    Gives their service schedule back to the SharePoint indexers the scheduler removed it from, and forgets the
+    scheduling state, so enabling the scheduler again removes the schedules again.
+
+    Args:
+        search_handler (SharepointSearchHandler): The search handler of the SharePoint indexers, configured with
+            the schedule interval.
+        state (StateBackend): The state shared by the workers.
+
+    Returns:
+        list[str]: The names of the indexers scheduled again.
+    """
+    scheduled = search_handler.schedule_indexers(search_handler.spo_schedule_interval, ds_type="sharepoint")
+    state.delete(schedule_state_key(search_handler.config))
+    if scheduled:
+        logging.info(f"Service schedule restored for {len(scheduled)} SharePoint indexers")
+    return scheduled
+
+
+class IndexerScheduler:
+    """
+    Runs the SharePoint indexers on demand instead of on a fixed schedule, within the concurrency budget of the
+    search service.
+
+    The search service only runs a few indexers at a time, so with a fixed schedule for every site the busy sites
+    wait behind the dormant ones. At every tick the scheduler collects the results of the runs it started, then
+    starts the due indexers by priority until MaxConcurrentRuns runs are in progress. The priority of an indexer
+    grows with its change rate, the moving average of the items its runs processed, and with the time since its
+    last successful run. After a run that found nothing the next one is postponed twice as long, up to
+    MaxInterval, and a run that finds changes brings the indexer back to MinInterval; failed runs back off alike.
+
+    Only the runs in progress and the newly seen indexers are polled, so a tick costs a few calls whatever the
+    number of sites. Newly seen indexers get their service schedule removed and their last result taken as
+    history. The state is kept in the state backend, so any worker can report it. Once the scheduler is disabled,
+    restore_schedules gives the indexers their service schedule back.
+
+    Args:
+        config (IndexerSchedulerConfig): The scheduler configuration.
+        search_handler (SharepointSearchHandler): The search handler of the SharePoint indexers.
+        state (StateBackend): The state shared by the workers.
+        on_changes (Callable[[list[str]], None], optional): Called at the end of a tick with the names of the
+            indexers whose runs processed items. Defaults to None.
+    """
+
+    def __init__(self, config: IndexerSchedulerConfig, search_handler: SharepointSearchHandler,
+                 state: StateBackend, on_changes: Callable[[list[str]], None] = None) -> None:
+        self.config = config
+        self.search_handler = search_handler
+        self.state = state
+        self.on_changes = on_changes
+        self._key = schedule_state_key(search_handler.config)
+
+    def schedule(self) -> IndexerSchedule:
+        """
+        Returns the scheduling state and the freshness lag of every SharePoint indexer.
+
+        Returns:
+            IndexerSchedule: The indexers, the least fresh first.
+        """
+        return self._report(self._load(), datetime.now(timezone.utc))
+
+    @traced("indexers.schedule_tick")
+    def tick(self) -> IndexerSchedule:
+        """
+        Collects the results of the runs in progress and starts the due indexers by priority within the budget.
+
+        Returns:
+            IndexerSchedule: The scheduling state after the tick.
+        """
+        now = datetime.now(timezone.utc)
+        known = self._load()
+        names = [indexer.Name for indexer in self.search_handler.list_indexer(ds_type="sharepoint").Value]
+        states = {name: known.get(name) or IndexerRunState(IndexerName=name) for name in names}
+        new = [name for name in names if name not in known]
+        polled = [state for state in states.values() if state.Running or state.IndexerName in new]
+
+        with ThreadPoolExecutor(max_workers=self.config.StatusConcurrency) as executor:
+            list(executor.map(self._unschedule, new))
+            statuses = list(executor.map(self._status, [state.IndexerName for state in polled]))
+        changed = [state.IndexerName for state, status in zip(polled, statuses)
+                   if status is not None and self._record(state, status, now)]
+
+        running = sum(state.Running for state in states.values())
+        due = [state for state in states.values()
+               if not state.Running and (state.NextRun is None or state.NextRun <= now)]
+        due.sort(key=lambda state: self._priority(state, now), reverse=True)
+        started = 0
+        for state in due[:max(0, self.config.MaxConcurrentRuns - running)]:
+            if self.search_handler.run_indexer(state.IndexerName):
+                started += 1
+                indexer_runs.add(1)
+            # a run refused because one is in progress is followed like ours
+            state.Running, state.TriggeredAt = True, now
+        self.state.set(self._key, {name: state.model_dump(mode="json") for name, state in states.items()})
+        if changed and self.on_changes is not None:
+            try:
+                self.on_changes(changed)
+            except Exception as err:
+                logging.warning(f"Changes of indexers {changed} not reported: {err}")
+
+        schedule = self._report(states, now)
+        for state in schedule.Value:
+            if state.FreshnessLag is not None:
+                indexer_freshness_lag.record(state.FreshnessLag)
+        set_span_attributes({"indexers.count": len(states), "indexers.due": len(due),
+                             "indexers.started": started, "indexers.running": schedule.Running})
+        logging.info(f"Indexer scheduler: {started} runs started, {schedule.Running} in progress, "
+                     f"{len(due) - started} due indexers waiting")
+        return schedule
+
+    def _unschedule(self, indexer_name: str) -> None:
+        try:
+            self.search_handler.unschedule_indexer(indexer_name)
+        except Exception as err:
+            logging.warning(f"Schedule of indexer {indexer_name} not removed: {err}")
+
+    def _status(self, indexer_name: str) -> SearchIndexerStatus | None:
+        try:
+            return self.search_handler.get_indexer_status(indexer_name)
+        except Exception as err:
+            logging.warning(f"Status of indexer {indexer_name} unavailable: {err}")
+            return None
+
+    def _record(self, state: IndexerRunState, status: SearchIndexerStatus, now: datetime) -> bool:
+        # returns whether a finished run processed items
+        result = status.last_result
+        if result is not None and result.status == "inProgress":
+            state.Running = True
+            return False
+        if result is None or result.start_time == state.LastRunStart:
+            # the run we started has not begun yet
+            state.Running = state.Running and not self._lost(state, now)
+            return False
+
+        state.Running = False
+        state.LastRunStart, state.LastStatus = result.start_time, result.status
+        items = 0
+        if result.status == "success":
+            items = result.item_count or 0
+            state.LastSuccessStart = result.start_time
+            state.ChangeRate = CHANGE_RATE_WEIGHT * items + (1 - CHANGE_RATE_WEIGHT) * state.ChangeRate
+            state.IdleRuns = 0 if items else state.IdleRuns + 1
+            state.FailedRuns = 0
+            backoff = state.IdleRuns
+        else:
+            state.FailedRuns += 1
+            backoff = state.FailedRuns
+        interval = min(self.config.MinInterval * 2 ** backoff, self.config.MaxInterval)
+        state.NextRun = (result.end_time or now) + timedelta(seconds=interval)
+        return items > 0
+
+    def _lost(self, state: IndexerRunState, now: datetime) -> bool:
+        # a run that never showed up in the status is started again
+        return state.TriggeredAt is None or now - state.TriggeredAt > timedelta(seconds=self.config.MinInterval)
+
+    def _priority(self, state: IndexerRunState, now: datetime) -> float:
+        if state.LastSuccessStart is None:
+            staleness = 2 * self.config.MaxInterval
+        else:
+            staleness = (now - state.LastSuccessStart).total_seconds()
+        return (1 + state.ChangeRate) * staleness / self.config.MinInterval / (1 + state.FailedRuns)
+
+    def _report(self, states: dict[str, IndexerRunState], now: datetime) -> IndexerSchedule:
+        for state in states.values():
+            state.FreshnessLag = None if state.LastSuccessStart is None else \
+                (now - state.LastSuccessStart).total_seconds()
+        # never refreshed first, then by decreasing lag
+        value = sorted(states.values(), key=lambda state: (state.FreshnessLag is not None, -(state.FreshnessLag or 0)))
+        return IndexerSchedule(MaxConcurrentRuns=self.config.MaxConcurrentRuns,
+                               Running=sum(state.Running for state in states.values()), Value=value)
+
+    def _load(self) -> dict[str, IndexerRunState]:
+        snapshot = self.state.get(self._key) or {}
+        return {name: IndexerRunState(**state) for name, state in snapshot.items()}
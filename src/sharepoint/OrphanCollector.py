@@ -0,0 +1,211 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+
+from ..model.common import OrphanCollectionResult
+from ..model.config import OrphanCollectorConfig
+from ..StateBackend import StateBackend
+from ..Telemetry import meter, traced, set_span_attributes
+from .ChunkDeduplicator import ChunkDeduplicator, MEMBERS_FIELD
+from .IndexedSites import IndexedSiteIndex
+from .SharepointSearchHandler import SharepointSearchHandler
+
+# documents deleted per batch, the maximum of a search page
+BATCH_SIZE = 1000
+
+orphan_documents_deleted = meter.create_counter(
+    name="orphan_gc.documents.deleted",
+    description="Documents of orphaned SharePoint sites deleted from the index by the orphan collector"
+)
+
+
+def _quote(value: str) -> str:
+    return value.replace("'", "''")
+
+
+class _BatchRateLimiter:
+    # spaces the delete batches of every thread by 1 / rate seconds
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = time.monotonic()
+        self._mutex = threading.Lock()
+
+    def wait(self) -> None:
+        with self._mutex:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class OrphanedDocumentCollector:
+    """
+    Deletes the documents of the SharePoint sites that are no longer integrated with the search index.
+
+    Documents outlive their site when the deletion of an indexer is interrupted before its documents are purged,
+    or when the site is deleted in SharePoint while its indexer stays. A run lists the site ids present in the
+    index with a single facet query (see SharepointSearchHandler.list_indexed_site_ids) and compares them with the
+    live sites, rebuilt from the SharePoint indexers and Graph (see IndexedSiteIndex.reconcile). A site that is not
+    live is first marked in the state backend, and its documents are deleted by the first run after GracePeriod
+    seconds, so an indexer created while the run lists the sites, or a site Graph briefly fails to return, costs
+    nothing.
+
+    The sites are purged concurrently, MaxWorkers at a time, their documents found page by page in id order and
+    deleted in batches of BATCH_SIZE, at most BatchesPerSecond batches across the workers so the deletes leave
+    room for the queries and the indexers. With shared chunks, the site first leaves the chunks it shares, one
+    site at a time (see ChunkDeduplicator.release_site), and the shared chunks are never deleted. With a sharded
+    index, the site is purged from every shard, where an interrupted move may also have left its documents.
+
+    Args:
+        search_handler (SharepointSearchHandler): The search handler of the SharePoint index.
+        indexed_sites (IndexedSiteIndex): The index of the live sites.
+        state (StateBackend): The state shared by the workers, keeping the marked orphans.
+        config (OrphanCollectorConfig): The collector configuration.
+    """
+
+    def __init__(self, search_handler: SharepointSearchHandler, indexed_sites: IndexedSiteIndex,
+                 state: StateBackend, config: OrphanCollectorConfig) -> None:
+        self.search_handler = search_handler
+        self.indexed_sites = indexed_sites
+        self.state = state
+        self.config = config
+        self._key = f"orphan-gc:{search_handler.config.Endpoint}:{search_handler.config.IndexName}"
+
+    @staticmethod
+    def _search_client(handler: SharepointSearchHandler) -> SearchClient:
+        return SearchClient(endpoint=handler.config.Endpoint, index_name=handler.config.IndexName,
+                            credential=handler.search_credential)
+
+    @traced("sites.orphan_gc")
+    def collect(self, dry_run: bool = False, grace_period: int | None = None) -> OrphanCollectionResult:
+        """
+        Finds the orphaned sites and deletes the documents of the ones marked for longer than the grace period.
+
+        Args:
+            dry_run (bool, optional): Whether to only list the orphaned sites, without marking them nor deleting
+                their documents. Defaults to False.
+            grace_period (int | None, optional): The seconds a site stays marked before its documents are deleted,
+                GracePeriod if None.
+
+        Returns:
+            OrphanCollectionResult: The orphaned sites, the deleted documents and the estimated bytes reclaimed.
+        """
+        start = time.perf_counter()
+        grace_period = self.config.GracePeriod if grace_period is None else grace_period
+        result = OrphanCollectionResult(DryRun=dry_run)
+        indexed_site_ids = self.search_handler.list_indexed_site_ids()
+        if indexed_site_ids is None:
+            result.Errors.append("metadata_spo_site_id is not facetable, the orphaned documents are not listed")
+            return result
+        live_site_ids = {entry.Site.id for entry in self.indexed_sites.reconcile().Value}
+        result.IndexedSites, result.LiveSites = len(indexed_site_ids), len(live_site_ids)
+
+        now = datetime.now(timezone.utc)
+        marks = {site_id: datetime.fromisoformat(marked_at) for site_id, marked_at in
+                 (self.state.get(self._key) or {}).items() if site_id in indexed_site_ids
+                 and site_id not in live_site_ids}
+        for site_id in indexed_site_ids:
+            if site_id not in live_site_ids:
+                marks.setdefault(site_id, now)
+        for site_id, marked_at in sorted(marks.items()):
+            if (now - marked_at).total_seconds() >= grace_period:
+                result.Orphans.append(site_id)
+            else:
+                result.Pending.append(site_id)
+        result.OrphanedDocuments = sum(indexed_site_ids[site_id] for site_id in result.Orphans)
+
+        if not dry_run:
+            if result.Orphans:
+                per_document = self._bytes_per_document()
+                deleted = self._purge(result)
+                result.DocumentsDeleted = sum(deleted.values())
+                result.EstimatedBytesReclaimed = int(result.DocumentsDeleted * per_document)
+                for site_id in deleted:
+                    marks.pop(site_id)
+                orphan_documents_deleted.add(result.DocumentsDeleted)
+            self.state.set(self._key, {site_id: marked_at.isoformat() for site_id, marked_at in marks.items()})
+        result.Seconds = round(time.perf_counter() - start, 2)
+        set_span_attributes({"orphan_gc.orphans": len(result.Orphans), "orphan_gc.pending": len(result.Pending),
+                             "orphan_gc.deleted": result.DocumentsDeleted,
+                             "orphan_gc.bytes_reclaimed": result.EstimatedBytesReclaimed})
+        if result.Orphans:
+            logging.info(f"Orphan collection: {len(result.Orphans)} orphaned sites, {result.DocumentsDeleted} "
+                         f"documents deleted, about {result.EstimatedBytesReclaimed} bytes reclaimed, "
+                         f"{len(result.Errors)} errors")
+        return result
+
+    def _bytes_per_document(self) -> float:
+        # the average size of a document, vector index included, across the shards; read before the deletes, as
+        # the statistics of the service lag behind them
+        documents, size = 0, 0
+        for handler in self.search_handler.shard_handlers():
+            index_client = SearchIndexClient(endpoint=handler.config.Endpoint, credential=handler.search_credential)
+            try:
+                stats = index_client.get_index_statistics(handler.config.IndexName)
+            except ResourceNotFoundError:
+                continue
+            except HttpResponseError as genericErr:
+                raise genericErr
+            documents += stats["document_count"]
+            size += stats["storage_size"] + (stats.get("vector_index_size") or 0)
+        return size / documents if documents else 0
+
+    def _purge(self, result: OrphanCollectionResult) -> dict[str, int]:
+        # purges the orphaned sites concurrently, the failed ones move to the errors
+        limiter = _BatchRateLimiter(self.config.BatchesPerSecond)
+        with ThreadPoolExecutor(max_workers=self.config.MaxWorkers) as executor:
+            futures = [(site_id, executor.submit(self._purge_site, site_id, limiter))
+                       for site_id in result.Orphans]
+        deleted = {}
+        for site_id, future in futures:
+            if future.exception() is not None:
+                logging.error(f"Orphaned documents of site {site_id} not deleted: {future.exception()}")
+                result.Errors.append(f"{site_id}: {future.exception()}")
+            else:
+                deleted[site_id] = future.result()
+        return deleted
+
+    def _purge_site(self, site_id: str, limiter: _BatchRateLimiter) -> int:
+        deleted = 0
+        for handler in self.search_handler.shard_handlers():
+            try:
+                deleted += self._purge_index(handler, site_id, limiter)
+            except ResourceNotFoundError:
+                # a shard whose index is not created yet holds nothing
+                continue
+        return deleted
+
+    def _purge_index(self, handler: SharepointSearchHandler, site_id: str, limiter: _BatchRateLimiter) -> int:
+        site_filter = f"metadata_spo_site_id eq '{_quote(site_id)}'"
+        if handler.config.SharedChunks:
+            # raises when a shared chunk could not be written, the site is then purged by a later run
+            ChunkDeduplicator(handler).release_site(site_id)
+            # a shared chunk keeps the first of its sites in metadata_spo_site_id, other sites may still need it
+            site_filter += f" and not {MEMBERS_FIELD}/any()"
+        search_client = self._search_client(handler)
+        deleted, last_key = 0, None
+        while True:
+            # pages in id order, so the deleted documents the index still returns for a moment are not read again
+            search_filter = site_filter
+            if last_key is not None:
+                search_filter += f" and id gt '{_quote(last_key)}'"
+            try:
+                keys = [doc["id"] for doc in search_client.search("", filter=search_filter, select=["id"],
+                                                                  order_by=["id asc"], top=BATCH_SIZE)]
+                if not keys:
+                    return deleted
+                limiter.wait()
+                results = search_client.delete_documents(documents=[{"id": key} for key in keys])
+            except HttpResponseError as genericErr:
+                raise genericErr
+            deleted += sum(1 for r in results if r.succeeded)
+            if len(keys) < BATCH_SIZE:
+                return deleted
+            last_key = keys[-1]
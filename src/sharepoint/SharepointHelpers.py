@@ -1,38 +1,50 @@
 import json
+import re
+import threading
+import time
 
 import requests
 import logging
 
-import time
-from datetime import datetime
+from ..model.common import (SharepointToken, AzureADGroupList, SharepointSite,
+                            SharepointSiteList)
+from ..model.config import SharepointHelperConfig, StateConfig
+from ..SingleFlight import single_flight
+from ..StateBackend import StateBackend, MemoryStateBackend
+from ..Telemetry import traced, set_span_attributes
 
-from model.common import (SharepointToken, AzureADGroupList, SharepointSite,
-                          SharepointSiteList)
-from ..model.config import SharepointHelperConfig
+# Refresh the token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 300
+# Seconds a Graph request may wait for the service
+GRAPH_REQUEST_TIMEOUT = 30
+# A worker filling a Graph cache entry makes up to a token request and a Graph request, the other workers wait for it
+GRAPH_LOCK_TIMEOUT = 3 * GRAPH_REQUEST_TIMEOUT
+SPO_PROXY_ADDRESS = re.compile(r"^SPO:SPO_([0-9a-fA-F-]+)@", re.IGNORECASE)
 
 
 class SharepointHelper:
 
-    def __init__(self, config: SharepointHelperConfig) -> None:
+    def __init__(self, config: SharepointHelperConfig, state: StateBackend = None,
+                 state_config: StateConfig = None) -> None:
         self.config = config
         self.token = None
-        self._token_start_timestamp = None
-        self._get_token()
+        self._token_expires_at = 0.0
+        self._token_mutex = threading.Lock()
+        # The Graph caches live in the state backend so that they are shared by all workers, the token is kept in
+        # the memory of the process and never written to the backend
+        self.state = state or MemoryStateBackend()
+        self.state_config = state_config or StateConfig()
+        self._key_prefix = f"graph:{self.config.TenantId}:{self.config.ClientId}"
 
     def _get_token(self) -> None:
-        if self._token_start_timestamp is None:
-            self._token_start_timestamp = time.time()
-            self._request_token()
-            print("Initial:", self._token_start_timestamp)
-        else:
-            now = time.time()
-            if now - self._token_start_timestamp > 3500:
-                self._token_start_timestamp = now
-                self._request_token()
-                print("Updated:", self._token_start_timestamp)
-            else:
-                print("- SKIP -")
-        
+        if self.token is not None and time.time() < self._token_expires_at:
+            return
+        with self._token_mutex:
+            if self.token is None or time.time() >= self._token_expires_at:
+                token = self._request_token()
+                self._token_expires_at = time.time() + max(token.expires_in - TOKEN_REFRESH_MARGIN, 60)
+
+    @traced("graph.token", peer_service="graph")
     def _request_token(self) -> SharepointToken:
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
         body = {
@@ -41,12 +53,11 @@ class SharepointHelper:
             "client_secret": self.config.ClientSecret,
             "scope": "https://graph.microsoft.com/.default"
         }
-        url = f"https://login.microsoftonline.com/{self.config.TenantId}/oauth2/v2.0/token"
+        url = f"{self.config.LoginEndpoint}/{self.config.TenantId}/oauth2/v2.0/token"
         try:
-            req = requests.get(url=url, headers=headers, data=body)
+            req = requests.get(url=url, headers=headers, data=body, timeout=GRAPH_REQUEST_TIMEOUT)
             req.raise_for_status()
             token = json.loads(req.content)
-            print(token)
             self.token = SharepointToken(
                 token_type=token["token_type"],
                 expires_in=token["expires_in"],
@@ -55,18 +66,30 @@ class SharepointHelper:
             )
             return self.token
         except Exception as err:
-            print(err)
+            logging.error(err)
             raise err
 
+    @single_flight("graph.user_group_membership")
     def get_user_group_membership(self, user_id: str) -> AzureADGroupList:
+        group_list = self.state.get_or_set(
+            f"{self._key_prefix}:membership:{user_id}",
+            lambda: self._fetch_user_group_membership(user_id).model_dump(),
+            ttl=self.state_config.MembershipTtl,
+            timeout=GRAPH_LOCK_TIMEOUT,
+            lease=GRAPH_LOCK_TIMEOUT
+        )
+        return AzureADGroupList(**group_list)
+
+    @traced("graph.user_group_membership", peer_service="graph")
+    def _fetch_user_group_membership(self, user_id: str) -> AzureADGroupList:
         self._get_token()
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.token.access_token}"
         }
-        url = f"https://graph.microsoft.com/v1.0/users/{user_id}/transitiveMemberOf?$select=displayName,id,proxyAddresses"
+        url = f"{self.config.GraphEndpoint}/v1.0/users/{user_id}/transitiveMemberOf?$select=displayName,id,proxyAddresses"
         try:
-            req = requests.get(url=url, headers=headers)
+            req = requests.get(url=url, headers=headers, timeout=GRAPH_REQUEST_TIMEOUT)
             req.raise_for_status()
             content = json.loads(req.content)
             group_list_raw: list = content["value"]
@@ -77,12 +100,25 @@ class SharepointHelper:
                     group_list_raw_parsed.append(group)
 
             group_list = AzureADGroupList(Value=group_list_raw_parsed)
+            set_span_attributes({"graph.groups.count": len(group_list_raw_parsed)})
             return group_list
         except requests.HTTPError as err:
-            print(err)
+            logging.error(err)
             raise err
 
+    @single_flight("graph.list_sites")
     def list_sites(self) -> SharepointSiteList:
+        site_list = self.state.get_or_set(
+            f"{self._key_prefix}:site-catalog",
+            lambda: self._fetch_sites().model_dump(),
+            ttl=self.state_config.SiteCatalogTtl,
+            timeout=GRAPH_LOCK_TIMEOUT,
+            lease=GRAPH_LOCK_TIMEOUT
+        )
+        return SharepointSiteList(**site_list)
+
+    @traced("graph.list_sites", peer_service="graph")
+    def _fetch_sites(self) -> SharepointSiteList:
         self._get_token()
         headers = {
             "Content-Type": "application/json",
@@ -90,10 +126,9 @@ class SharepointHelper:
         }
         # TODO: https://graph.microsoft.com/v1.0/sites?$select=displayName,id,name,webUrl should work better
         # https://graph.microsoft.com/v1.0/sites?search=*&$select=displayName,id,name,webUrl has longer caching
-        url = f"https://graph.microsoft.com/v1.0/sites?search=*&$select=displayName,id,name,webUrl"
-        print(url)
+        url = f"{self.config.GraphEndpoint}/v1.0/sites?search=*&$select=displayName,id,name,webUrl"
         try:
-            req = requests.get(url=url, headers=headers)
+            req = requests.get(url=url, headers=headers, timeout=GRAPH_REQUEST_TIMEOUT)
             req.raise_for_status()
             content = json.loads(req.content)
             site_list_raw = content["value"]
@@ -105,23 +140,40 @@ class SharepointHelper:
                     site["siteId1"] = site_ids[1]
                     site["siteId2"] = site_ids[2]
                     site_list_parsed.append(site)
-                    print(f"[DEBUG: {datetime.now()}]", site)
 
             site_list = SharepointSiteList(Value=site_list_parsed)
+            set_span_attributes({"graph.sites.count": len(site_list_parsed)})
             return site_list
         except requests.HTTPError as err:
-            print(err)
+            logging.error(err)
             raise err
 
+    @single_flight("graph.site_by_name")
     def get_site_by_name(self, site_name: str) -> SharepointSite:
+        def fetch_site():
+            site_parsed = self._fetch_site_by_name(site_name)
+            # sites that are not found are not cached
+            return None if site_parsed is None else site_parsed.model_dump()
+
+        site = self.state.get_or_set(
+            f"{self._key_prefix}:site:{site_name}",
+            fetch_site,
+            ttl=self.state_config.SiteCatalogTtl,
+            timeout=GRAPH_LOCK_TIMEOUT,
+            lease=GRAPH_LOCK_TIMEOUT
+        )
+        return None if site is None else SharepointSite(**site)
+
+    @traced("graph.site_by_name", peer_service="graph")
+    def _fetch_site_by_name(self, site_name: str) -> SharepointSite:
         self._get_token()
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.token.access_token}"
         }
-        url = f"https://graph.microsoft.com/v1.0/sites?search={site_name}&$select=displayName,id,name,webUrl"
+        url = f"{self.config.GraphEndpoint}/v1.0/sites?search={site_name}&$select=displayName,id,name,webUrl"
         try:
-            req = requests.get(url=url, headers=headers)
+            req = requests.get(url=url, headers=headers, timeout=GRAPH_REQUEST_TIMEOUT)
             req.raise_for_status()
             content = json.loads(req.content)
             try:
@@ -137,21 +189,86 @@ class SharepointHelper:
             site_parsed = SharepointSite(**site_raw)
             return site_parsed
         except requests.HTTPError as err:
-            print(err)
+            logging.error(err)
+            raise err
+
+    def _get_pages(self, url: str) -> tuple[list[dict], dict]:
+        # follows @odata.nextLink, returns the items of every page and the last page
+        self._get_token()
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.token.access_token}"
+        }
+        items = []
+        while True:
+            req = requests.get(url=url, headers=headers, timeout=GRAPH_REQUEST_TIMEOUT)
+            req.raise_for_status()
+            content = json.loads(req.content)
+            items.extend(content["value"])
+            if "@odata.nextLink" not in content:
+                return items, content
+            url = content["@odata.nextLink"]
+
+    @traced("graph.groups_delta", peer_service="graph")
+    def get_group_changes(self, delta_link: str = None) -> tuple[list[dict], str]:
+        """
+        Lists the groups changed since a previous call, or every group on the first call, with the Graph delta query.
+
+        Args:
+            delta_link (str, optional): The delta link returned by the previous call. Defaults to None.
+
+        Returns:
+            tuple[list[dict], str]: The changed groups with their id and proxyAddresses, removed groups carrying
+                "@removed", and the delta link of the next call.
+
+        Raises:
+            requests.HTTPError: If the request fails, with 410 Gone when the delta link expired.
+        """
+        url = delta_link or f"{self.config.GraphEndpoint}/v1.0/groups/delta?$select=id,proxyAddresses,members"
+        try:
+            groups, last_page = self._get_pages(url)
+            set_span_attributes({"graph.groups.count": len(groups)})
+            return groups, last_page["@odata.deltaLink"]
+        except requests.HTTPError as err:
+            logging.error(err)
+            raise err
+
+    @traced("graph.group_members", peer_service="graph")
+    def list_group_members(self, group_id: str) -> list[dict]:
+        """
+        Lists the users that are members of a group, directly or through nested groups.
+
+        Args:
+            group_id (str): The id of the group.
+
+        Returns:
+            list[dict]: The users, with their id and userPrincipalName.
+        """
+        url = f"{self.config.GraphEndpoint}/v1.0/groups/{group_id}/transitiveMembers/microsoft.graph.user" \
+              f"?$select=id,userPrincipalName&$top=999"
+        try:
+            members, _ = self._get_pages(url)
+            set_span_attributes({"graph.members.count": len(members)})
+            return members
+        except requests.HTTPError as err:
+            logging.error(err)
             raise err
 
+    @classmethod
+    def user_site_ids(cls, user_group_list: AzureADGroupList) -> dict[str, None]:
+        # SharePoint backed groups carry the site id in a proxy address like SPO:SPO_<siteId1>@SPO_<tenantId>,
+        # the lowercase ids are returned once each, in the order of the groups
+        return dict.fromkeys(match.group(1).lower() for group in user_group_list.Value for g in group.proxyAddresses
+                             if (match := SPO_PROXY_ADDRESS.match(g)))
+
     @classmethod
     def check_user_belong_to_site(cls, user_group_list: AzureADGroupList,
                                   site_list_to_check: SharepointSiteList) -> SharepointSiteList:
-        user_site_belong_list = []
-        for site in site_list_to_check.Value:
-            for group in user_group_list.Value:
-                for g in group.proxyAddresses:
-                    if g.__contains__("SPO") and site.siteId1 in g:
-                        user_site_belong_list.append(site)
-
-        return SharepointSiteList(Value=user_site_belong_list)
+        user_site_ids = cls.user_site_ids(user_group_list)
+        user_site_belong_list = [site for site in site_list_to_check.Value if site.siteId1.lower() in user_site_ids]
+        return SharepointSiteList.model_construct(Value=user_site_belong_list)
 
+    @traced("graph.user_site_access")
     def check_user_belong_to_site_flow(self, user_id: str, list_site_name: list[str]) -> SharepointSiteList:
         user_group_membership = self.get_user_group_membership(user_id=user_id)
         sites_to_check = []
@@ -160,4 +277,5 @@ class SharepointHelper:
             if site_info is not None:
                 sites_to_check.append(site_info)
         sites_to_check = SharepointSiteList(Value=sites_to_check)
+        set_span_attributes({"graph.sites.resolved": len(sites_to_check.Value)})
         return self.check_user_belong_to_site(user_group_list=user_group_membership, site_list_to_check=sites_to_check)
@@ -1,8 +1,10 @@
+import logging
+from datetime import timedelta
 from time import sleep
 
-from azure.core.exceptions import HttpResponseError
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 from azure.search.documents import SearchClient
-from azure.search.documents.indexes import SearchIndexerClient
+from azure.search.documents.indexes import SearchIndexClient, SearchIndexerClient
 from azure.search.documents.indexes.models import (
     SearchIndex,
     SearchFieldDataType,
@@ -10,10 +12,15 @@ from azure.search.documents.indexes.models import (
     SearchIndexerSkillset,
     SearchIndexer,
     SearchableField,
+    SearchField,
+    SimpleField,
     SearchIndexerDataSourceConnection
 )
 
 from src.SearchHandler import SearchHandler
+from src.sharepoint.ChunkDeduplicator import (ChunkDeduplicator, HASH_FIELD, MEMBERS_FIELD, SITE_IDS_FIELD,
+                                              SOURCES_FIELD)
+from src.Telemetry import traced, set_span_attributes
 from src.model.common import SharepointSite
 from src.model.config import SharepointSearchConfig, SearchConfig
 
@@ -32,10 +39,86 @@ class SharepointSearchHandler(SearchHandler):
 
     def create_spo_index(self) -> SearchIndex:
         fields = [
-            SearchableField(name="metadata_spo_site_id", type=SearchFieldDataType.String, filterable=True),
+            SearchableField(name="metadata_spo_site_id", type=SearchFieldDataType.String, filterable=True,
+                            facetable=True),
         ]
+        if self.config.SharedChunks:
+            # see ChunkDeduplicator
+            fields += [
+                SearchField(name=SITE_IDS_FIELD, type=SearchFieldDataType.Collection(SearchFieldDataType.String),
+                            filterable=True, facetable=True),
+                SimpleField(name=HASH_FIELD, type=SearchFieldDataType.String, filterable=True),
+                SearchField(name=MEMBERS_FIELD, type=SearchFieldDataType.Collection(SearchFieldDataType.String),
+                            filterable=True),
+                SimpleField(name=SOURCES_FIELD, type=SearchFieldDataType.String),
+            ]
         return self.create_index(fields)
 
+    @traced("search.has_shared_chunks", peer_service="azure-search")
+    def has_shared_chunks(self) -> bool:
+        """
+        Tells whether the index has the fields of the shared chunks, added when the chunk deduplicator first ran.
+        The shared chunks stay in the index when CHUNK_DEDUP_ENABLED is turned off, and only the filters of the
+        shared chunks return them to the users of all their sites.
+
+        Returns:
+            bool: True if the index has dedup_members, False if it does not or does not exist yet.
+        """
+        index_client = SearchIndexClient(endpoint=self.config.Endpoint, credential=self.search_credential)
+        try:
+            index = index_client.get_index(self.config.IndexName)
+        except ResourceNotFoundError:
+            return False
+        except HttpResponseError as genericErr:
+            raise genericErr
+        return any(field.name == MEMBERS_FIELD for field in index.fields)
+
+    def for_site(self, site_id: str, place: bool = True) -> "SharepointSearchHandler":
+        """
+        Returns the handler of the index holding the documents of a site, which provisions its data source and
+        indexer: this handler, unless the index is sharded (see ShardedSharepointSearchHandler).
+
+        Args:
+            site_id (str): The full id of the site.
+            place (bool, optional): Places a site that has no shard yet. Defaults to True.
+
+        Returns:
+            SharepointSearchHandler: The handler of the index of the site.
+        """
+        return self
+
+    def shard_handlers(self) -> list["SharepointSearchHandler"]:
+        """
+        Returns the handlers of every index holding SharePoint documents: this handler, unless the index is sharded.
+
+        Returns:
+            list[SharepointSearchHandler]: The handlers of the indexes.
+        """
+        return [self]
+
+    @property
+    def spo_skillset_name(self) -> str:
+        """
+        str: The name of the skillset of the index.
+        """
+        return f"{self.config.IndexName}-skillset"
+
+    @property
+    def spo_schedule_interval(self) -> timedelta | None:
+        """
+        timedelta | None: The schedule of the SharePoint indexers, None when the indexer scheduler runs them.
+        """
+        interval = self.config.IndexerScheduleInterval
+        return None if interval is None else timedelta(seconds=interval)
+
+    @classmethod
+    def spo_datasource_name(cls, spo_name: str) -> str:
+        return f"{spo_name.lower()}-sharepoint-datasource"
+
+    @classmethod
+    def spo_indexer_name(cls, spo_name: str) -> str:
+        return f"{spo_name.lower()}-sharepoint-indexer"
+
     def create_spo_datasource(self, spo_name: str, domain: str) -> SearchIndexerDataSourceConnection:
         container_name = "allSiteLibraries"
         conn_str = f"SharePointOnlineEndpoint=https://{domain}.sharepoint.com/sites/{spo_name}/;ApplicationId={self.config.SharepointClientId};ApplicationSecret={self.config.SharepointClientSecret};TenantId={self.config.SharepointTenantId}"
@@ -51,28 +134,83 @@ class SharepointSearchHandler(SearchHandler):
         ]
         return self.create_skillset(projection_mapping)
 
+    @traced("search.sharepoint_indexer_flow", peer_service="azure-search")
     def create_indexer_flow(self, spo_name: str) -> SearchIndexer:
         index = self.create_spo_index()
         datasource = self.create_spo_datasource(spo_name, self.config.SharepointDomain)
         skillset = self.create_spo_skillset()
         indexer_name = datasource.name.lower().removesuffix("-datasource")
-        return self.create_indexer(indexer_name, datasource.name, skillset.name)
+        return self.create_indexer(indexer_name, datasource.name, skillset.name, self.spo_schedule_interval)
 
+    @traced("search.delete_sharepoint_indexer", peer_service="azure-search")
     def delete_indexer_and_stuff(self, sharepointsite: SharepointSite):
-        indexer_name = f"{sharepointsite.name.lower()}-sharepoint-indexer"
-        datasource_name = f"{sharepointsite.name.lower()}-sharepoint-datasource"
-        indexer_client = SearchIndexerClient(endpoint=self.config.Endpoint, credential=self.credential)
-        search_client = SearchClient(endpoint=self.config.Endpoint, credential=self.credential,
+        indexer_client = SearchIndexerClient(endpoint=self.config.Endpoint, credential=self.search_credential)
+        try:
+            indexer_client.delete_data_source_connection(self.spo_datasource_name(sharepointsite.name))
+            indexer_client.delete_indexer(self.spo_indexer_name(sharepointsite.name))
+            self.purge_site_documents(sharepointsite.id)
+        except HttpResponseError as genericErr:
+            raise genericErr
+
+    @traced("search.purge_site_documents", peer_service="azure-search")
+    def purge_site_documents(self, site_id: str) -> int:
+        """
+        Deletes the documents of a SharePoint site from the index. With shared chunks, the site first leaves the
+        chunks it shares with other sites, and the shared chunks are never deleted by the purge.
+
+        Args:
+            site_id (str): The id of the site, as stored in metadata_spo_site_id.
+
+        Returns:
+            int: The number of deleted documents.
+        """
+        search_client = SearchClient(endpoint=self.config.Endpoint, credential=self.search_credential,
                                      index_name=self.config.IndexName)
+        index_filter = f"metadata_spo_site_id eq '{site_id}'"
+        deleted = 0
+        if self.config.SharedChunks:
+            ChunkDeduplicator(self).release_site(site_id)
+            # a shared chunk keeps the first of its sites in metadata_spo_site_id, other sites may still need it
+            index_filter += f" and not {MEMBERS_FIELD}/any()"
         try:
-            indexer_client.delete_data_source_connection(datasource_name)
-            indexer_client.delete_indexer(indexer_name)
-            index_filter = f"metadata_spo_site_id eq '{sharepointsite.id}'"
             while True:
                 r = search_client.search("", filter=index_filter, top=1000, include_total_count=True)
                 if r.get_count() == 0:
                     break
                 r = search_client.delete_documents(documents=[{"id": d["id"]} for d in r])
+                deleted += len(r)
                 sleep(5)
+            set_span_attributes({"search.documents.deleted": deleted})
+            return deleted
+        except HttpResponseError as genericErr:
+            raise genericErr
+
+    @traced("search.indexed_site_ids", peer_service="azure-search")
+    def list_indexed_site_ids(self, limit: int = 10000) -> dict[str, int] | None:
+        """
+        Counts the documents of each SharePoint site in the index with a single facet query. With shared chunks,
+        the sites of the shared chunks are counted as well.
+
+        Args:
+            limit (int, optional): The maximum number of sites returned. Defaults to 10000.
+
+        Returns:
+            dict[str, int] | None: The number of documents by metadata_spo_site_id, None if the field is not
+                facetable, as in indexes created before it was.
+        """
+        search_client = SearchClient(endpoint=self.config.Endpoint, credential=self.search_credential,
+                                     index_name=self.config.IndexName)
+        try:
+            fields = ["metadata_spo_site_id", SITE_IDS_FIELD] if self.config.SharedChunks else ["metadata_spo_site_id"]
+            facets = search_client.search("", facets=[f"{field},count:{limit}" for field in fields], top=0).get_facets()
+            site_ids = {}
+            for field in fields:
+                for facet in facets[field]:
+                    site_ids[facet["value"]] = max(site_ids.get(facet["value"], 0), facet["count"])
+            set_span_attributes({"search.sites.count": len(site_ids)})
+            return site_ids
         except HttpResponseError as genericErr:
+            if genericErr.status_code == 400 and "facetable" in str(genericErr.message):
+                logging.warning("metadata_spo_site_id is not facetable, the indexed documents are not listed")
+                return None
             raise genericErr
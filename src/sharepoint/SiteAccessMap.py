@@ -0,0 +1,197 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from ..model.common import IndexedSiteList
+from ..model.config import SiteAccessMapConfig
+from ..Telemetry import traced, set_span_attributes
+from .SharepointHelpers import SharepointHelper, SPO_PROXY_ADDRESS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS site_group (site_id TEXT PRIMARY KEY, group_id TEXT NOT NULL) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS site_group_by_group ON site_group (group_id);
+CREATE TABLE IF NOT EXISTS site (site_id TEXT PRIMARY KEY, refreshed_at REAL NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_site (principal TEXT NOT NULL, site_id TEXT NOT NULL,
+                                      PRIMARY KEY (principal, site_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS user_site_by_site ON user_site (site_id);
+CREATE TABLE IF NOT EXISTS pending_site (site_id TEXT PRIMARY KEY) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+"""
+
+
+class SiteAccessMap:
+    """
+    Materialized map of the indexed sites each user can access, stored in a SQLite database.
+
+    Every SharePoint site has a Microsoft 365 group whose proxyAddresses hold its site id. sync() expands the
+    members of the groups of the indexed sites into an inverted user -> site id table, keyed by both the object
+    id and the user principal name of the user, so finding the sites of a user is a single local read.
+
+    Updates are incremental: the Graph groups delta query tells which groups changed since the previous sync,
+    and only the sites whose group changed, that were added to the index, or whose members are older than
+    MaxAge are expanded again. Sites removed from the index are dropped. The sites whose group changed are stored
+    as pending with the delta link, and stay pending until their members are expanded again, so a sync failing
+    half way loses no change; until a sync succeeds, the map is not used. The delta query does not report the
+    changes of the groups nested in a site group: they are only seen when the site is expanded again after MaxAge.
+
+    Args:
+        config (SiteAccessMapConfig): The map configuration.
+        sharepoint_helper (SharepointHelper): The Graph helper.
+    """
+
+    def __init__(self, config: SiteAccessMapConfig, sharepoint_helper: SharepointHelper) -> None:
+        self.config = config
+        self.sharepoint_helper = sharepoint_helper
+        os.makedirs(os.path.dirname(os.path.abspath(config.SqlitePath)), exist_ok=True)
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.config.SqlitePath, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _get_meta(self, key: str) -> str | None:
+        row = self._connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def site_ids_of_user(self, user_id: str, index_version: int) -> list[str] | None:
+        """
+        Returns the ids of the indexed sites that a user can access.
+
+        Args:
+            user_id (str): The object id or the user principal name of the user.
+            index_version (int): The current version of the indexed-site index.
+
+        Returns:
+            list[str] | None: The lowercase siteId1 of the sites, or None if the map was not synced with this
+                version of the index yet and the membership of the user must be queried.
+        """
+        if self._get_meta("index_version") != str(index_version):
+            return None
+        rows = self._connection().execute("SELECT site_id FROM user_site WHERE principal = ?",
+                                          (user_id.lower(),)).fetchall()
+        return [row[0] for row in rows]
+
+    @traced("sites.access_map_sync")
+    def sync(self, indexed_sites: IndexedSiteList) -> None:
+        """
+        Brings the map up to date with the indexed sites and the group changes since the previous sync.
+
+        Args:
+            indexed_sites (IndexedSiteList): The current indexed-site index.
+        """
+        conn = self._connection()
+        try:
+            self._sync_groups()
+            changed_sites = {site_id for (site_id,) in conn.execute("SELECT site_id FROM pending_site")}
+            indexed = {entry.Site.siteId1.lower() for entry in indexed_sites.Value}
+            materialized = dict(conn.execute("SELECT site_id, refreshed_at FROM site").fetchall())
+            site_groups = dict(conn.execute("SELECT site_id, group_id FROM site_group").fetchall())
+            stale_before = time.time() - self.config.MaxAge
+
+            removed = materialized.keys() - indexed
+            to_refresh = [site_id for site_id in indexed
+                          if site_id not in materialized or site_id in changed_sites
+                          or materialized[site_id] < stale_before]
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("DELETE FROM user_site WHERE site_id = ?", [(site_id,) for site_id in removed])
+                conn.executemany("DELETE FROM site WHERE site_id = ?", [(site_id,) for site_id in removed])
+                conn.executemany("DELETE FROM pending_site WHERE site_id = ?",
+                                 [(site_id,) for site_id in changed_sites - indexed])
+                conn.execute("COMMIT")
+            except Exception as err:
+                conn.execute("ROLLBACK")
+                raise err
+
+            with ThreadPoolExecutor(max_workers=self.config.Concurrency) as executor:
+                for site_id, principals in zip(to_refresh, executor.map(self._group_members,
+                                                                        [site_groups.get(s) for s in to_refresh])):
+                    self._replace_site(site_id, principals)
+        except Exception as err:
+            # the pending sites may have lost members: users are looked up through Graph until a sync succeeds
+            if conn.execute("SELECT 1 FROM pending_site LIMIT 1").fetchone() is not None:
+                conn.execute("DELETE FROM meta WHERE key = 'index_version'")
+            raise err
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('index_version', ?)",
+                     (str(indexed_sites.Version),))
+        set_span_attributes({"sites.refreshed": len(to_refresh), "sites.removed": len(removed)})
+        logging.info(f"Site access map synced: {len(to_refresh)} sites refreshed, {len(removed)} removed")
+
+    def _sync_groups(self) -> None:
+        # applies the group changes since the previous sync, the sites whose group changed become pending along
+        # with the new delta link
+        conn = self._connection()
+        delta_link = self._get_meta("delta_link")
+        try:
+            groups, next_delta_link = self.sharepoint_helper.get_group_changes(delta_link)
+        except requests.HTTPError as err:
+            if delta_link is None or err.response is None or err.response.status_code != 410:
+                raise err
+            logging.warning("Groups delta link expired, listing every group again")
+            groups, next_delta_link = self.sharepoint_helper.get_group_changes()
+            delta_link = None
+
+        changed_sites = set()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if delta_link is None:
+                changed_sites.update(site_id for (site_id,) in conn.execute("SELECT site_id FROM site_group"))
+                conn.execute("DELETE FROM site_group")
+            for group in groups:
+                changed_sites.update(site_id for (site_id,) in conn.execute(
+                    "SELECT site_id FROM site_group WHERE group_id = ?", (group["id"],)))
+                if "@removed" not in group and "proxyAddresses" not in group:
+                    # incremental rounds only carry the changed properties, here the members
+                    continue
+                conn.execute("DELETE FROM site_group WHERE group_id = ?", (group["id"],))
+                if "@removed" in group:
+                    continue
+                for address in group["proxyAddresses"] or []:
+                    if match := SPO_PROXY_ADDRESS.match(address):
+                        site_id = match.group(1).lower()
+                        changed_sites.add(site_id)
+                        conn.execute("INSERT OR REPLACE INTO site_group (site_id, group_id) VALUES (?, ?)",
+                                     (site_id, group["id"]))
+            conn.executemany("INSERT OR IGNORE INTO pending_site (site_id) VALUES (?)",
+                             [(site_id,) for site_id in changed_sites])
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('delta_link', ?)", (next_delta_link,))
+            conn.execute("COMMIT")
+        except Exception as err:
+            conn.execute("ROLLBACK")
+            raise err
+
+    def _group_members(self, group_id: str | None) -> set[str]:
+        if group_id is None:
+            # sites without a Microsoft 365 group are not reachable through group membership either
+            return set()
+        principals = set()
+        for member in self.sharepoint_helper.list_group_members(group_id):
+            principals.add(member["id"].lower())
+            if member.get("userPrincipalName"):
+                principals.add(member["userPrincipalName"].lower())
+        return principals
+
+    def _replace_site(self, site_id: str, principals: set[str]) -> None:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM user_site WHERE site_id = ?", (site_id,))
+            conn.executemany("INSERT INTO user_site (principal, site_id) VALUES (?, ?)",
+                             [(principal, site_id) for principal in principals])
+            conn.execute("INSERT OR REPLACE INTO site (site_id, refreshed_at) VALUES (?, ?)", (site_id, time.time()))
+            conn.execute("DELETE FROM pending_site WHERE site_id = ?", (site_id,))
+            conn.execute("COMMIT")
+        except Exception as err:
+            conn.execute("ROLLBACK")
+            raise err
@@ -0,0 +1,124 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from ..model.common import SharepointSite, SharepointSiteList, SiteReconcilePlan
+from ..Telemetry import traced, set_span_attributes
+from .SharepointSearchHandler import SharepointSearchHandler
+
+DATASOURCE_SUFFIX = "-sharepoint-datasource"
+INDEXER_SUFFIX = "-sharepoint-indexer"
+
+
+class SiteSetReconciler:
+    """
+    Brings the SharePoint sites integrated with the search index to a desired set of sites.
+
+    The data sources, the indexers and the site ids of the indexed documents are listed once, with a facet query
+    for the latter, and compared with the desired sites: only the missing data sources and indexers are created,
+    and only the ones of the sites left out are deleted, along with their documents. Sites that are already
+    integrated cost nothing.
+
+    Args:
+        search_handler (SharepointSearchHandler): The search handler of the SharePoint index.
+        max_workers (int, optional): The number of changes applied concurrently. Defaults to 8.
+    """
+
+    def __init__(self, search_handler: SharepointSearchHandler, max_workers: int = 8) -> None:
+        self.search_handler = search_handler
+        self.max_workers = max_workers
+
+    @traced("sites.reconcile_plan")
+    def plan(self, desired: SharepointSiteList) -> SiteReconcilePlan:
+        """
+        Computes the changes that bring the integrated sites to the desired ones, without applying them.
+
+        Args:
+            desired (SharepointSiteList): The sites that should be integrated.
+
+        Returns:
+            SiteReconcilePlan: The planned changes, as a dry run.
+        """
+        datasource_names, indexer_names = self.search_handler.list_resource_names()
+        indexed_site_ids = self.search_handler.list_indexed_site_ids()
+        datasources = {name for name in datasource_names if name.endswith(DATASOURCE_SUFFIX)}
+        indexers = {name for name in indexer_names if name.endswith(INDEXER_SUFFIX)}
+        desired_datasources = {self.search_handler.spo_datasource_name(site.name) for site in desired.Value}
+        desired_indexers = {self.search_handler.spo_indexer_name(site.name) for site in desired.Value}
+
+        plan = SiteReconcilePlan(
+            DryRun=True,
+            CreateDatasources=sorted(desired_datasources - datasources),
+            CreateIndexers=sorted(desired_indexers - indexers),
+            DeleteIndexers=sorted(indexers - desired_indexers),
+            DeleteDatasources=sorted(datasources - desired_datasources),
+        )
+        if indexed_site_ids is None:
+            plan.Errors.append("metadata_spo_site_id is not facetable, the documents of removed sites are kept")
+        else:
+            desired_ids = {site.id for site in desired.Value}
+            plan.PurgeSiteIds = sorted(site_id for site_id in indexed_site_ids if site_id not in desired_ids)
+        set_span_attributes({"sites.desired.count": len(desired.Value),
+                             "sites.create.count": len(plan.CreateIndexers),
+                             "sites.delete.count": len(plan.DeleteIndexers),
+                             "sites.purge.count": len(plan.PurgeSiteIds)})
+        return plan
+
+    @traced("sites.reconcile_apply")
+    def apply(self, desired: SharepointSiteList, plan: SiteReconcilePlan) -> SiteReconcilePlan:
+        """
+        Applies a plan computed for the desired sites.
+
+        Data sources are created and indexers deleted first, then indexers are created, data sources deleted and
+        the documents of the removed sites purged, each step running its changes concurrently. A failed change
+        is moved to the Errors of the returned plan and does not stop the others.
+
+        Args:
+            desired (SharepointSiteList): The sites that should be integrated, as given to plan().
+            plan (SiteReconcilePlan): The changes to apply.
+
+        Returns:
+            SiteReconcilePlan: The applied changes, and the failed ones in Errors.
+        """
+        handler = self.search_handler
+        sites: dict[str, SharepointSite] = {}
+        for site in desired.Value:
+            sites[handler.spo_datasource_name(site.name)] = site
+            sites[handler.spo_indexer_name(site.name)] = site
+        plan = plan.model_copy(deep=True, update={"DryRun": False})
+
+        if plan.CreateDatasources or plan.CreateIndexers:
+            handler.create_spo_index()
+            handler.create_spo_skillset()
+
+        # the data source and the indexer of a site go to the index of the site, when the index is sharded
+        def create_datasource(name: str) -> None:
+            site_handler = handler.for_site(sites[name].id)
+            site_handler.create_spo_datasource(sites[name].name.lower(), site_handler.config.SharepointDomain)
+
+        def create_indexer(name: str) -> None:
+            site_handler = handler.for_site(sites[name].id)
+            site_handler.create_indexer(name.removesuffix("-indexer"),
+                                        site_handler.spo_datasource_name(sites[name].name),
+                                        site_handler.spo_skillset_name, site_handler.spo_schedule_interval)
+
+        self._run(plan, [(create_datasource, plan.CreateDatasources), (handler.delete_indexer, plan.DeleteIndexers)])
+        self._run(plan, [(create_indexer, plan.CreateIndexers), (handler.delete_datasource, plan.DeleteDatasources),
+                         (handler.purge_site_documents, plan.PurgeSiteIds)])
+        set_span_attributes({"sites.reconcile.errors": len(plan.Errors)})
+        logging.info(f"Sites reconciled: {len(plan.CreateIndexers)} indexers created, "
+                     f"{len(plan.DeleteIndexers)} deleted, {len(plan.PurgeSiteIds)} sites purged, "
+                     f"{len(plan.Errors)} errors")
+        return plan
+
+    def _run(self, plan: SiteReconcilePlan, steps: list[tuple[Callable[[str], object], list[str]]]) -> None:
+        # runs every change of the steps concurrently, the failed ones move from their list to the errors
+        if not any(names for _, names in steps):
+            return
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(func, names, name, executor.submit(func, name)) for func, names in steps for name in names]
+        for func, names, name, future in futures:
+            if future.exception() is not None:
+                logging.error(f"Reconciliation of {name} failed: {future.exception()}")
+                plan.Errors.append(f"{func.__name__} {name}: {future.exception()}")
+                names.remove(name)
@@ -0,0 +1,572 @@
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, Iterable, TypeVar
+
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from azure.search.documents.indexes import SearchIndexClient
+from azure.search.documents.indexes.models import SearchIndex, SearchIndexerSkillset, SearchIndexerStatus
+
+from ..IndexSnapshot import IndexSnapshotHandler
+from ..model.common import IndexerList, SearchShardStatus, SharepointSite, SiteShardMove
+from ..model.config import SearchConfig, ShardingConfig, SharepointSearchConfig
+from ..StateBackend import StateBackend
+from ..Telemetry import traced, set_span_attributes
+from .ChunkDeduplicator import HASH_FIELD, MEMBERS_FIELD, SITE_IDS_FIELD
+from .SharepointSearchHandler import SharepointSearchHandler
+
+# upper bound of a rebuild of the placements, a facet query per shard
+RECONCILE_LEASE = 60
+# the sizes of the shards used by the size-aware placement are measured again after this many seconds
+SIZE_TTL = 60
+
+ConfigT = TypeVar("ConfigT", bound=SearchConfig)
+
+
+def _quote(value: str) -> str:
+    return value.replace("'", "''")
+
+
+def _indexed_site_ids(handler: SharepointSearchHandler) -> dict[str, int] | None:
+    # the index of a shard is created with the first site placed on it
+    try:
+        return handler.list_indexed_site_ids()
+    except ResourceNotFoundError:
+        return {}
+
+
+class SiteShardMap:
+    """
+    Places the SharePoint sites on the indexes, or shards, sharing the documents of the sites.
+
+    A single index caps the documents and the vectors of every site together, so the sites can be spread over the
+    shards of ShardingConfig: the index of AZURE_SEARCH_INDEX, always the first shard, and other indexes of its
+    search service or of other services. A site is placed when its indexer is first created, by the Placement
+    policy:
+        hash    the shard with the highest hash of the shard name and the site id (rendezvous hashing), so
+                adding a shard only takes its share of the new sites
+        size    the shard with the smallest index, vector index included, where the sites placed but not
+                indexed yet count for the average size of a site
+
+    The placements are kept in the state backend with a version, and each worker holds a copy reloaded when the
+    version changes, like IndexedSiteIndex. The sites that have no placement, like the ones indexed before the
+    index was sharded, are on the first shard. When the state backend holds no placements, they are rebuilt from
+    a facet query on every shard (see reconcile).
+
+    Args:
+        config (ShardingConfig): The shards and the placement policy.
+        search_config (SharepointSearchConfig): The search configuration of the first shard.
+        state (StateBackend): The state shared by the workers.
+    """
+
+    def __init__(self, config: ShardingConfig, search_config: SharepointSearchConfig, state: StateBackend) -> None:
+        self.config = config
+        self.search_config = search_config
+        self.state = state
+        self.shards = {shard.Name: shard for shard in config.Shards}
+        self.default = config.Shards[0].Name
+        self._key = f"site-shards:{search_config.Endpoint}:{search_config.IndexName}"
+        self._version_key = f"{self._key}:version"
+        self._placements: dict[str, str] = {}
+        self._version = None
+        self._handlers: dict[str, SharepointSearchHandler] = {}
+        self._sizes = None
+        self._mutex = threading.Lock()
+
+    def shard_config(self, config: ConfigT, shard_name: str) -> ConfigT:
+        """
+        Returns a search configuration pointing to a shard.
+
+        Args:
+            config (SearchConfig): The search configuration of the first shard, or a subclass of it.
+            shard_name (str): The name of the shard.
+
+        Returns:
+            SearchConfig: A copy of the configuration with the endpoint and the index of the shard.
+        """
+        shard = self.shards[shard_name]
+        return config.model_copy(update={"Endpoint": shard.Endpoint, "IndexName": shard.IndexName})
+
+    def handler(self, shard_name: str) -> SharepointSearchHandler:
+        """
+        Returns the search handler of a shard, created on first use.
+
+        Args:
+            shard_name (str): The name of the shard.
+
+        Returns:
+            SharepointSearchHandler: The search handler of the index of the shard.
+        """
+        handler = self._handlers.get(shard_name)
+        if handler is None:
+            with self._mutex:
+                handler = self._handlers.get(shard_name)
+                if handler is None:
+                    handler = SharepointSearchHandler(self.shard_config(self.search_config, shard_name))
+                    self._handlers[shard_name] = handler
+        return handler
+
+    def refresh(self) -> None:
+        """
+        Reloads the local copy if another worker changed the placements, and rebuilds them if they do not exist.
+        """
+        version = self.state.get(self._version_key)
+        if version is not None and version == self._version:
+            return
+        snapshot = None if version is None else self.state.get(self._key)
+        if snapshot is None:
+            self.reconcile()
+        else:
+            with self._mutex:
+                self._placements, self._version = snapshot, version
+
+    def placements(self) -> dict[str, str]:
+        """
+        Returns the placed sites.
+
+        Returns:
+            dict[str, str]: The shard name by site id.
+        """
+        self.refresh()
+        return dict(self._placements)
+
+    def shard_of(self, site_id: str) -> str:
+        """
+        Returns the shard holding the documents of a site.
+
+        Args:
+            site_id (str): The full id of the site.
+
+        Returns:
+            str: The name of the shard, the first one for a site without placement.
+        """
+        self.refresh()
+        return self._shard(self._placements, site_id)
+
+    def group(self, site_ids: Iterable[str]) -> dict[str, list[str]]:
+        """
+        Groups sites by the shard holding their documents, to search every shard for its sites only.
+
+        Args:
+            site_ids (Iterable[str]): The full ids of the sites.
+
+        Returns:
+            dict[str, list[str]]: The site ids by shard name, for the shards holding some of the sites.
+        """
+        self.refresh()
+        placements, groups = self._placements, {}
+        for site_id in site_ids:
+            groups.setdefault(self._shard(placements, site_id), []).append(site_id)
+        return groups
+
+    def place(self, site_id: str) -> str:
+        """
+        Places a site by the placement policy, unless it already has a shard.
+
+        Args:
+            site_id (str): The full id of the site.
+
+        Returns:
+            str: The name of the shard of the site.
+        """
+        self.refresh()
+        shard_name = self._placements.get(site_id)
+        if shard_name is not None:
+            return shard_name
+        placements = self._update(lambda current: current.setdefault(site_id, self._choose(site_id, current)))
+        logging.info(f"Site {site_id} placed on shard {placements[site_id]}")
+        return placements[site_id]
+
+    def assign(self, site_id: str, shard_name: str) -> None:
+        """
+        Places a site on a given shard, when it moves.
+
+        Args:
+            site_id (str): The full id of the site.
+            shard_name (str): The name of the shard.
+        """
+        if shard_name not in self.shards:
+            raise ValueError(f"Unknown shard {shard_name}, the shards are {', '.join(self.shards)}")
+        self._update(lambda current: current.__setitem__(site_id, shard_name))
+
+    def remove(self, site_id: str) -> None:
+        """
+        Forgets the placement of a site after its documents were purged.
+
+        Args:
+            site_id (str): The full id of the site.
+        """
+        self.refresh()
+        if site_id in self._placements:
+            self._update(lambda current: current.pop(site_id, None))
+
+    @traced("shards.reconcile")
+    def reconcile(self) -> dict[str, str]:
+        """
+        Places the sites found in the shards without a placement, on the shard holding most of their documents.
+
+        Placements are never changed, so a site copied to its new shard during a move keeps the shard it was
+        given; this rebuilds the placements lost with the state backend.
+
+        Returns:
+            dict[str, str]: The shard name by site id.
+        """
+        indexed = self._indexed_site_ids()
+        with self.state.lock(self._key, timeout=RECONCILE_LEASE, lease=RECONCILE_LEASE):
+            placements = self.state.get(self._key) or {}
+            found = {}
+            for shard_name, site_ids in indexed.items():
+                for site_id, count in site_ids.items():
+                    if site_id not in placements and count > found.get(site_id, (None, 0))[1]:
+                        found[site_id] = (shard_name, count)
+            placements.update((site_id, shard_name) for site_id, (shard_name, _) in found.items())
+            self._write(placements)
+        set_span_attributes({"shards.sites.count": len(placements), "shards.sites.found": len(found)})
+        if found:
+            logging.info(f"Site shards reconciled: {len(found)} sites placed, {len(placements)} in total")
+        return dict(placements)
+
+    def status(self) -> list[SearchShardStatus]:
+        """
+        Measures the shards.
+
+        Returns:
+            list[SearchShardStatus]: The sites, documents and index sizes of every shard.
+        """
+        placements = self.placements()
+        statuses = self._measure()
+        for site_id in placements:
+            statuses[self._shard(placements, site_id)].PlacedSites += 1
+        return list(statuses.values())
+
+    def plan_rebalance(self, max_moves: int = 10) -> list[SiteShardMove]:
+        """
+        Plans the moves that even the sizes of the shards out, without applying them.
+
+        The largest site of the largest shard that narrows the gap with the smallest shard moves there, until
+        max_moves moves are planned or no site narrows the gap. The size of a site is its documents times the
+        average size of a document of its shard.
+
+        Args:
+            max_moves (int, optional): The maximum number of moves. Defaults to 10.
+
+        Returns:
+            list[SiteShardMove]: The planned moves, in order.
+        """
+        placements = self.placements()
+        indexed = self._indexed_site_ids()
+        statuses = self._measure()
+        sizes, site_sizes = {}, {}
+        for shard_name, shard_status in statuses.items():
+            sizes[shard_name] = shard_status.StorageSize + shard_status.VectorIndexSize
+            per_document = sizes[shard_name] / shard_status.DocumentCount if shard_status.DocumentCount else 0
+            site_sizes[shard_name] = {site_id: count * per_document for site_id, count in indexed[shard_name].items()
+                                      if self._shard(placements, site_id) == shard_name}
+        moves = []
+        while len(moves) < max_moves and len(sizes) > 1:
+            source, target = max(sizes, key=sizes.get), min(sizes, key=sizes.get)
+            gap = sizes[source] - sizes[target]
+            candidates = [(size, site_id) for site_id, size in site_sizes[source].items() if 0 < size <= gap / 2]
+            if not candidates:
+                break
+            size, site_id = max(candidates)
+            moves.append(SiteShardMove(SiteId=site_id, Source=source, Target=target, EstimatedBytes=int(size)))
+            sizes[source] -= size
+            sizes[target] += size
+            del site_sizes[source][site_id]
+        return moves
+
+    def _shard(self, placements: dict[str, str], site_id: str) -> str:
+        # a site placed on a shard removed from the configuration is looked for on the first one
+        shard_name = placements.get(site_id)
+        return shard_name if shard_name in self.shards else self.default
+
+    def _choose(self, site_id: str, placements: dict[str, str]) -> str:
+        if self.config.Placement == "size":
+            return self._smallest(placements)
+        return max(self.shards, key=lambda shard_name: hashlib.blake2b(f"{shard_name}|{site_id}".encode(),
+                                                                      digest_size=8).digest())
+
+    def _smallest(self, placements: dict[str, str]) -> str:
+        # the statistics of the service lag behind the indexers, and sites placed in a row are not indexed yet:
+        # they count for the average size of a site
+        if self._sizes is None or time.monotonic() - self._sizes[0] > SIZE_TTL:
+            self._sizes = (time.monotonic(), self._measure(), self._indexed_site_ids())
+        _, statuses, indexed = self._sizes
+        sizes = {shard_name: shard_status.StorageSize + shard_status.VectorIndexSize
+                 for shard_name, shard_status in statuses.items()}
+        indexed_count = sum(len(site_ids) for site_ids in indexed.values())
+        average = sum(sizes.values()) / indexed_count if indexed_count else 0
+        for site_id, shard_name in placements.items():
+            if shard_name in sizes and site_id not in indexed[shard_name]:
+                sizes[shard_name] += average
+        return min(self.shards, key=lambda shard_name: (sizes[shard_name], shard_name))
+
+    def _each_shard(self, func: Callable[[str], object]) -> dict:
+        with ThreadPoolExecutor(max_workers=len(self.shards)) as executor:
+            futures = {shard_name: executor.submit(func, shard_name) for shard_name in self.shards}
+        return {shard_name: future.result() for shard_name, future in futures.items()}
+
+    def _indexed_site_ids(self) -> dict[str, dict[str, int]]:
+        return self._each_shard(lambda shard_name: _indexed_site_ids(self.handler(shard_name)) or {})
+
+    def _measure(self) -> dict[str, SearchShardStatus]:
+        def measure(shard_name: str) -> SearchShardStatus:
+            shard, handler = self.shards[shard_name], self.handler(shard_name)
+            index_client = SearchIndexClient(endpoint=shard.Endpoint, credential=handler.search_credential)
+            try:
+                stats = index_client.get_index_statistics(shard.IndexName)
+            except ResourceNotFoundError:
+                stats = {"document_count": 0, "storage_size": 0}
+            except HttpResponseError as genericErr:
+                raise genericErr
+            indexed = (_indexed_site_ids(handler) or {}) if stats["document_count"] else {}
+            return SearchShardStatus(Name=shard_name, Endpoint=shard.Endpoint, IndexName=shard.IndexName,
+                                     IndexedSites=len(indexed), DocumentCount=stats["document_count"],
+                                     StorageSize=stats["storage_size"],
+                                     VectorIndexSize=stats.get("vector_index_size") or 0)
+        return self._each_shard(measure)
+
+    def _update(self, change: Callable[[dict[str, str]], object]) -> dict[str, str]:
+        with self.state.lock(self._key, timeout=RECONCILE_LEASE):
+            placements = self.state.get(self._key)
+            if placements is None:
+                placements = {}
+                # placements are only created from scratch by a rebuild from the shards
+                for shard_name, site_ids in self._indexed_site_ids().items():
+                    for site_id in site_ids:
+                        placements.setdefault(site_id, shard_name)
+            change(placements)
+            self._write(placements)
+        return placements
+
+    def _write(self, placements: dict[str, str]) -> None:
+        # called under the lock of the placements
+        version = (self.state.get(self._version_key) or 0) + 1
+        self.state.set(self._key, placements)
+        self.state.set(self._version_key, version)
+        with self._mutex:
+            self._placements, self._version = dict(placements), version
+
+
+class ShardedSharepointSearchHandler(SharepointSearchHandler):
+    """
+    The SharePoint search handler of an index sharded by site (see SiteShardMap).
+
+    The site-level provisioning goes to the shard of the site: for_site places a new site and returns the
+    handler of its shard, which creates its data source and indexer in the service of the shard, writing to the
+    index of the shard. The service-level calls are spread over the services of the shards: the indexers and
+    data sources are listed from every service, and an indexer or a data source is run, deleted or read in the
+    service that holds it. The index-level calls apply to every shard: the index and the skillset are created in
+    every shard, the indexed sites are counted in every shard and a site is purged from every shard.
+
+    Args:
+        config (SharepointSearchConfig): The search configuration of the first shard.
+        shards (SiteShardMap): The placement of the sites.
+    """
+
+    def __init__(self, config: SharepointSearchConfig, shards: SiteShardMap) -> None:
+        super().__init__(config)
+        self.shards = shards
+        # the shard of the service holding each data source and indexer, by name
+        self._resources: dict[str, str] = {}
+
+    def for_site(self, site_id: str, place: bool = True) -> SharepointSearchHandler:
+        shard_name = self.shards.place(site_id) if place else self.shards.shard_of(site_id)
+        return self.shards.handler(shard_name)
+
+    def shard_handlers(self) -> list[SharepointSearchHandler]:
+        return [self.shards.handler(shard_name) for shard_name in self.shards.shards]
+
+    def _service_shards(self) -> list[str]:
+        # a shard of every search service
+        services = {}
+        for shard in self.shards.shards.values():
+            services.setdefault(shard.Endpoint, shard.Name)
+        return list(services.values())
+
+    def create_spo_index(self) -> SearchIndex:
+        return [handler.create_spo_index() for handler in self.shard_handlers()][0]
+
+    def create_spo_skillset(self) -> SearchIndexerSkillset:
+        return [handler.create_spo_skillset() for handler in self.shard_handlers()][0]
+
+    def delete_indexer_and_stuff(self, sharepointsite: SharepointSite):
+        self.delete_datasource(self.spo_datasource_name(sharepointsite.name))
+        self.delete_indexer(self.spo_indexer_name(sharepointsite.name))
+        self.purge_site_documents(sharepointsite.id)
+
+    @traced("shards.purge_site_documents")
+    def purge_site_documents(self, site_id: str) -> int:
+        deleted = 0
+        for handler in self.shard_handlers():
+            try:
+                deleted += handler.purge_site_documents(site_id)
+            except ResourceNotFoundError:
+                pass
+        self.shards.remove(site_id)
+        return deleted
+
+    def list_indexed_site_ids(self, limit: int = 10000) -> dict[str, int] | None:
+        site_ids = {}
+        for handler in self.shard_handlers():
+            shard_site_ids = _indexed_site_ids(handler)
+            if shard_site_ids is None:
+                return None
+            for site_id, count in shard_site_ids.items():
+                site_ids[site_id] = site_ids.get(site_id, 0) + count
+        return site_ids
+
+    def list_resource_names(self) -> tuple[list[str], list[str]]:
+        datasource_names, indexer_names, resources = [], [], {}
+        for shard_name in self._service_shards():
+            service_datasources, service_indexers = self.shards.handler(shard_name).list_resource_names()
+            datasource_names += service_datasources
+            indexer_names += service_indexers
+            resources.update((name, shard_name) for name in service_datasources + service_indexers)
+        self._resources = resources
+        return datasource_names, indexer_names
+
+    def list_indexer(self, ds_type: str = None) -> IndexerList:
+        indexers = []
+        for shard_name in self._service_shards():
+            indexers += self.shards.handler(shard_name).list_indexer(ds_type=ds_type).Value
+        return IndexerList(Value=indexers)
+
+    def run_indexer(self, indexer_name: str) -> bool:
+        return self._in_service(indexer_name, lambda handler: handler.run_indexer(indexer_name))
+
+    def get_indexer_status(self, indexer_name: str) -> SearchIndexerStatus:
+        return self._in_service(indexer_name, lambda handler: handler.get_indexer_status(indexer_name))
+
+    def unschedule_indexer(self, indexer_name: str) -> None:
+        return self._in_service(indexer_name, lambda handler: handler.unschedule_indexer(indexer_name))
+
+    def schedule_indexers(self, schedule_interval: timedelta, ds_type: str = None) -> list[str]:
+        return [name for shard_name in self._service_shards()
+                for name in self.shards.handler(shard_name).schedule_indexers(schedule_interval, ds_type)]
+
+    def delete_indexer(self, indexer_name: str) -> None:
+        self._in_every_service(indexer_name, lambda handler: handler.delete_indexer(indexer_name))
+
+    def delete_datasource(self, ds_name: str) -> None:
+        self._in_every_service(ds_name, lambda handler: handler.delete_datasource(ds_name))
+
+    def _in_every_service(self, name: str, delete: Callable[[SharepointSearchHandler], object]) -> None:
+        # a delete succeeds when there is nothing to delete, so it cannot tell a stale list of the resources, left
+        # by a move in another worker, from a deleted resource: it runs in every service
+        for shard_name in self._service_shards():
+            delete(self.shards.handler(shard_name))
+        self._resources.pop(name, None)
+
+    def _in_service(self, name: str, call: Callable[[SharepointSearchHandler], object]):
+        # runs a call in the service holding a data source or an indexer, listed again when it is not found
+        # where it was, as a move changes its service
+        service_shards = self._service_shards()
+        if len(service_shards) == 1:
+            return call(self.shards.handler(service_shards[0]))
+        if name not in self._resources:
+            self.list_resource_names()
+        shard_name = self._resources.get(name, self.shards.default)
+        try:
+            return call(self.shards.handler(shard_name))
+        except ResourceNotFoundError:
+            self.list_resource_names()
+            if self._resources.get(name, shard_name) == shard_name:
+                raise
+            return call(self.shards.handler(self._resources[name]))
+
+    @traced("shards.move_site")
+    def move_site(self, site: SharepointSite, target: str) -> SiteShardMove:
+        """
+        Moves a site to another shard.
+
+        The documents of the site are copied to the target shard and its indexer and data source move to the service
+        of the target before the site is placed on it, so its searches keep their results during the move, and
+        then its documents are purged from the source shard. The new indexer indexes the site again from scratch.
+        If the indexer cannot be moved, the site keeps its shard and its indexer on the source service, and the
+        copied documents are purged from the target shard.
+        With shared chunks, the chunks the site shares with other sites are not copied, they come back with the
+        first run of the new indexer, and the copied chunks lose their hashes, so the target deduplicates them
+        again.
+
+        Args:
+            site (SharepointSite): The site.
+            target (str): The name of the target shard.
+
+        Returns:
+            SiteShardMove: The copied and purged documents.
+
+        Raises:
+            ValueError: If the target shard does not exist.
+            RuntimeError: If some documents could not be copied, the site is then left on its shard.
+        """
+        start = time.perf_counter()
+        if target not in self.shards.shards:
+            raise ValueError(f"Unknown shard {target}, the shards are {', '.join(self.shards.shards)}")
+        source = self.shards.shard_of(site.id)
+        move = SiteShardMove(SiteId=site.id, Source=source, Target=target)
+        if source == target:
+            return move
+        source_handler, target_handler = self.shards.handler(source), self.shards.handler(target)
+        target_handler.create_spo_index()
+        search_filter = f"metadata_spo_site_id eq '{_quote(site.id)}'"
+        overrides = None
+        if self.config.SharedChunks:
+            search_filter += f" and not {MEMBERS_FIELD}/any()"
+            # the copies leave their hashes behind: on the target an anchor has no shared chunk and the chunks of
+            # the site are deduplicated again, until then the searches return them
+            overrides = {HASH_FIELD: None, SITE_IDS_FIELD: []}
+        with tempfile.TemporaryDirectory() as directory:
+            IndexSnapshotHandler(source_handler.config).export_snapshot(directory, search_filter=search_filter)
+            copied = IndexSnapshotHandler(target_handler.config).import_snapshot(directory, create_index=False,
+                                                                                 overrides=overrides)
+        if copied.Failed:
+            raise RuntimeError(f"{len(copied.Failed)} documents of site {site.id} not copied to shard {target}, "
+                               f"the site stays on shard {source}")
+        move.DocumentsCopied = copied.Uploaded
+
+        # the names of the data source and the indexer of a site are unique in a service only: in another service
+        # the indexer of the target is created before the one of the source is deleted
+        same_service = source_handler.config.Endpoint == target_handler.config.Endpoint
+        try:
+            if not same_service:
+                target_handler.create_indexer_flow(spo_name=site.name.lower())
+            self._delete_site_indexer(source_handler, site)
+            if same_service:
+                target_handler.create_indexer_flow(spo_name=site.name.lower())
+        except Exception:
+            self._restore_site_indexer(site, source_handler, target_handler)
+            raise
+        finally:
+            self._resources.clear()
+        self.shards.assign(site.id, target)
+        move.DocumentsPurged = source_handler.purge_site_documents(site.id)
+        move.Seconds = round(time.perf_counter() - start, 2)
+        set_span_attributes({"shards.move.copied": move.DocumentsCopied, "shards.move.purged": move.DocumentsPurged})
+        logging.info(f"Site {site.id} moved from shard {source} to {target}: {move.DocumentsCopied} documents "
+                     f"copied, {move.DocumentsPurged} purged")
+        return move
+
+    @staticmethod
+    def _delete_site_indexer(handler: SharepointSearchHandler, site: SharepointSite) -> None:
+        handler.delete_indexer(handler.spo_indexer_name(site.name))
+        handler.delete_datasource(handler.spo_datasource_name(site.name))
+
+    def _restore_site_indexer(self, site: SharepointSite, source_handler: SharepointSearchHandler,
+                              target_handler: SharepointSearchHandler) -> None:
+        # puts the indexer of a site back on its source service after a failed move, without one the site would
+        # look orphaned (see OrphanedDocumentCollector); in the same service the indexer of the target has the
+        # name of the one of the source, it is deleted first
+        logging.error(f"Moving site {site.id} failed, its indexer goes back to {source_handler.config.IndexName}")
+        for restore in (lambda: self._delete_site_indexer(target_handler, site),
+                        lambda: source_handler.create_indexer_flow(spo_name=site.name.lower()),
+                        lambda: target_handler.purge_site_documents(site.id)):
+            try:
+                restore()
+            except Exception as err:
+                logging.error(f"Restoring site {site.id} after a failed move: {err}")
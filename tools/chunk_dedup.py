@@ -0,0 +1,61 @@
+"""
+Deduplicates the chunks copied across SharePoint sites, or reports the space saved (see
+src/sharepoint/ChunkDeduplicator.py).
+
+The index and the credentials are read from the environment like the backend (.env): AZURE_SEARCH_ENDPOINT,
+AZURE_SEARCH_INDEX, AZURE_SEARCH_KEY or the default Azure credential, and the SHAREPOINT_* settings. The index
+gets the dedup fields on the first run; set CHUNK_DEDUP_ENABLED=true for the backend to search them. With
+SEARCH_SHARDS, every shard is deduplicated, or reported, in turn: chunks are only shared within a shard.
+
+Usage:
+    python tools/chunk_dedup.py run --max-parents 1000
+    python tools/chunk_dedup.py report
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+from src.AppServices import load_app_config
+from src.sharepoint.ChunkDeduplicator import ChunkDeduplicator
+from src.sharepoint.SharepointSearchHandler import SharepointSearchHandler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="deduplicates the chunks not processed yet")
+    run.add_argument("--max-parents", type=int, default=1000, help="documents processed by this run")
+    commands.add_parser("report", help="reports the shared chunks and the index space they save")
+    args = parser.parse_args()
+
+    load_dotenv()
+    app_config = load_app_config()
+    config = app_config.SharepointSearch
+    if config is None:
+        raise SystemExit("AZURE_SEARCH_* and SHAREPOINT_* are required")
+    config = config.model_copy(update={"SharedChunks": True})
+    shards = app_config.Sharding.Shards if app_config.Sharding.Enabled else []
+    configs = [config.model_copy(update={"Endpoint": shard.Endpoint, "IndexName": shard.IndexName})
+               for shard in shards] or [config]
+    for index_config in configs:
+        if len(configs) > 1:
+            print(f"{index_config.IndexName} ({index_config.Endpoint}):")
+        deduplicator = ChunkDeduplicator(SharepointSearchHandler(index_config))
+        if args.command == "run":
+            result = deduplicator.run(args.max_parents)
+            print(f"{result.Parents} documents, {result.Chunks} chunks: {result.DuplicatesRemoved} duplicates "
+                  f"removed, {result.SharedChunksCreated} shared chunks created, about {result.EstimatedBytesSaved} "
+                  f"bytes saved, {result.MembersRemoved} members of deleted documents removed in {result.Seconds}s")
+        else:
+            report = deduplicator.report()
+            print(f"{report.SharedChunks} shared chunks stand for {report.ReplacedCopies} copies, about "
+                  f"{report.EstimatedBytesSaved} bytes saved; the index holds {report.DocumentCount} documents, "
+                  f"{report.StorageSize} bytes of storage and {report.VectorIndexSize} bytes of vectors")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Exports the search index to a snapshot directory, or imports a snapshot into an index (see src/IndexSnapshot.py).
+
+The index and the credentials are read from the environment like the backend (.env): AZURE_SEARCH_ENDPOINT,
+AZURE_SEARCH_INDEX, AZURE_SEARCH_KEY or the default Azure credential, and AZURE_OPENAI_* for the vectorizer of a
+created index.
+
+Usage:
+    python tools/index_snapshot.py export snapshots/2024-06-01
+    python tools/index_snapshot.py import snapshots/2024-06-01 --index my-index-v2 --workers 16
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+from src.AppServices import load_app_config
+from src.IndexSnapshot import IndexSnapshotHandler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="exports AZURE_SEARCH_INDEX (or --index) to a snapshot")
+    export.add_argument("path", help="the snapshot directory")
+    export.add_argument("--index", help="the exported index, AZURE_SEARCH_INDEX by default")
+    export.add_argument("--page-size", type=int, default=1000)
+    restore = commands.add_parser("import", help="uploads a snapshot into AZURE_SEARCH_INDEX (or --index)")
+    restore.add_argument("path", help="the snapshot directory")
+    restore.add_argument("--index", help="the target index, AZURE_SEARCH_INDEX by default")
+    restore.add_argument("--no-create-index", action="store_true",
+                         help="uploads into an existing index instead of creating it from the snapshot definition")
+    restore.add_argument("--batch-size", type=int, default=200)
+    restore.add_argument("--workers", type=int, default=8, help="upload requests in flight")
+    args = parser.parse_args()
+
+    load_dotenv()
+    config = load_app_config().Search
+    if config is None:
+        raise SystemExit("AZURE_SEARCH_ENDPOINT and AZURE_SEARCH_INDEX are required")
+    if args.index:
+        config = config.model_copy(update={"IndexName": args.index})
+    handler = IndexSnapshotHandler(config)
+    if args.command == "export":
+        manifest = handler.export_snapshot(args.path, page_size=args.page_size)
+        print(f"Exported {manifest.DocumentCount} documents of {manifest.IndexName} to {args.path}")
+    else:
+        result = handler.import_snapshot(args.path, create_index=not args.no_create_index,
+                                         batch_size=args.batch_size, max_workers=args.workers)
+        print(f"Imported {result.Uploaded} documents into {result.IndexName} in {result.Seconds}s, "
+              f"{len(result.Failed)} failed")
+        if result.Failed:
+            raise SystemExit(f"Failed documents: {', '.join(result.Failed[:20])}")
+
+
+if __name__ == '__main__':
+    main()
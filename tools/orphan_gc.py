@@ -0,0 +1,56 @@
+"""
+Lists the SharePoint sites whose documents are still in the index without a live indexer, and deletes these
+documents with --delete (see src/sharepoint/OrphanCollector.py).
+
+The index, the credentials and the state backend are read from the environment like the backend (.env):
+AZURE_SEARCH_*, SHAREPOINT_*, STATE_BACKEND and ORPHAN_GC_*. The orphaned sites are marked in the state backend and
+only purged after ORPHAN_GC_GRACE_PERIOD seconds; --grace-period 0 purges them right away, which is also needed
+with STATE_BACKEND=memory as the marks do not outlive the tool.
+
+Usage:
+    python tools/orphan_gc.py
+    python tools/orphan_gc.py --delete --grace-period 0
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+from src.AppServices import AppServices, load_app_config
+from src.sharepoint.OrphanCollector import OrphanedDocumentCollector
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delete", action="store_true", help="deletes the documents of the orphaned sites")
+    parser.add_argument("--grace-period", type=int, default=None,
+                        help="seconds a site stays marked before its documents are deleted")
+    args = parser.parse_args()
+
+    load_dotenv()
+    config = load_app_config()
+    if not config.SharepointEnabled:
+        raise SystemExit("AZURE_SEARCH_* and SHAREPOINT_* are required")
+    services = AppServices(config)
+    collector = OrphanedDocumentCollector(services.sharepoint_search_handler, services.indexed_sites, services.state,
+                                          config.OrphanCollector)
+    result = collector.collect(dry_run=not args.delete, grace_period=args.grace_period)
+    print(f"{result.IndexedSites} sites in the index, {result.LiveSites} live sites")
+    for label, site_ids in (("orphaned", result.Orphans), ("within the grace period", result.Pending)):
+        for site_id in site_ids:
+            print(f"  {label}: {site_id}")
+    if result.DryRun:
+        print(f"{len(result.Orphans)} orphaned sites hold {result.OrphanedDocuments} documents, "
+              f"add --delete to delete them")
+    else:
+        print(f"{result.DocumentsDeleted} documents deleted, about {result.EstimatedBytesReclaimed} bytes "
+              f"reclaimed in {result.Seconds}s")
+    for error in result.Errors:
+        print(f"  error: {error}")
+
+
+if __name__ == '__main__':
+    main()
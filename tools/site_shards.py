@@ -0,0 +1,86 @@
+"""
+Shows the shards of the SharePoint index, moves a site to another shard, or evens the shards out (see
+src/sharepoint/SiteShards.py).
+
+The shards, the credentials and the state backend are read from the environment like the backend (.env):
+AZURE_SEARCH_*, SHAREPOINT_*, STATE_BACKEND and SEARCH_SHARDS. The placements are kept in the state backend, so
+STATE_BACKEND must be the one of the backend for a move to reach its workers. rebalance only prints the planned
+moves, --apply runs them one after the other.
+
+Usage:
+    python tools/site_shards.py status
+    python tools/site_shards.py move SITE_ID --to SHARD
+    python tools/site_shards.py rebalance --max-moves 5 --apply
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+from src.AppServices import AppServices, load_app_config
+from src.model.common import SiteShardMove
+
+
+def print_move(move: SiteShardMove) -> None:
+    print(f"  {move.SiteId}: {move.Source} -> {move.Target}, about {move.EstimatedBytes} bytes"
+          + (f", {move.DocumentsCopied} documents copied, {move.DocumentsPurged} purged in {move.Seconds}s"
+             if move.Seconds else ""))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="lists the sites, documents and sizes of the shards")
+    move = commands.add_parser("move", help="moves a site to another shard")
+    move.add_argument("site_id", help="the full id of the site")
+    move.add_argument("--to", required=True, help="the name of the target shard")
+    rebalance = commands.add_parser("rebalance", help="plans the moves that even the sizes of the shards out")
+    rebalance.add_argument("--max-moves", type=int, default=10, help="moves planned by this run")
+    rebalance.add_argument("--apply", action="store_true", help="runs the planned moves")
+    args = parser.parse_args()
+
+    load_dotenv()
+    config = load_app_config()
+    if not config.SharepointEnabled:
+        raise SystemExit("AZURE_SEARCH_* and SHAREPOINT_* are required")
+    if not config.Sharding.Enabled:
+        raise SystemExit("SEARCH_SHARDS must list at least two shards")
+    services = AppServices(config)
+    shards, handler = services.site_shards, services.sharepoint_search_handler
+    shards.reconcile()
+
+    if args.command == "status":
+        for shard_status in shards.status():
+            print(f"{shard_status.Name} ({shard_status.Endpoint}, index {shard_status.IndexName}): "
+                  f"{shard_status.PlacedSites} sites placed, {shard_status.IndexedSites} indexed, "
+                  f"{shard_status.DocumentCount} documents, {shard_status.StorageSize} bytes of storage and "
+                  f"{shard_status.VectorIndexSize} bytes of vectors")
+        return
+
+    sites = {entry.Site.id: entry.Site for entry in services.indexed_sites.sites().Value}
+    if args.command == "move":
+        if args.site_id not in sites:
+            raise SystemExit(f"{args.site_id} is not an indexed site")
+        print_move(handler.move_site(sites[args.site_id], args.to))
+        return
+
+    moves = shards.plan_rebalance(args.max_moves)
+    if not moves:
+        print("the shards are balanced")
+    for planned in moves:
+        if not args.apply:
+            print_move(planned)
+        elif planned.SiteId not in sites:
+            print(f"  {planned.SiteId}: skipped, no live indexer")
+        else:
+            moved = handler.move_site(sites[planned.SiteId], planned.Target)
+            print_move(moved.model_copy(update={"EstimatedBytes": planned.EstimatedBytes}))
+    if moves and not args.apply:
+        print(f"{len(moves)} moves planned, add --apply to run them")
+
+
+if __name__ == '__main__':
+    main()